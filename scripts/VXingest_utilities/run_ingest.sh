@@ -95,6 +95,21 @@ validate_tar_paths() {
 	return 0
 }
 
+# Decompresses a JSON.ZST file (ingest --output_compression zstd) next to itself, vximporter only reads JSON and JSON.GZ.
+decompress_zstd_file() {
+	local zstd_file="$1"
+
+	if ! command -v zstd >/dev/null 2>&1; then
+		echo "Error: zstd is required to import ${zstd_file}" >&2
+		return 1
+	fi
+	if ! zstd -q -d -f --rm "${zstd_file}" -o "${zstd_file%.zst}"; then
+		echo "Error: failed to decompress ${zstd_file}" >&2
+		return 1
+	fi
+	return 0
+}
+
 # Imports one JSON or JSON.GZ file into Couchbase using vximporter.
 run_vximporter() {
 	local import_file="$1"
@@ -281,6 +296,7 @@ run_this_job() {
 	local vxingest_docker_user
 	local container_data_path
 	local -a ingest_args
+	local -a import_files
 	local found_tar_file=false
 	local found_import_file=false
 
@@ -383,13 +399,22 @@ run_this_job() {
 	fi
 
 	if [[ "${this_job_failed}" -eq 0 ]]; then
-		while IFS= read -r -d '' import_file; do
+		# list the files before any JSON.ZST is decompressed, so a decompressed file is not found (and imported) twice
+		mapfile -d '' import_files < <(find "${tmp_xfer}" -type f \( -name '*.json' -o -name '*.json.gz' -o -name '*.json.zst' \) ! -path '*/.*' -print0)
+		for import_file in "${import_files[@]}"; do
 			found_import_file=true
+			if [[ "${import_file}" == *.json.zst ]]; then
+				if ! decompress_zstd_file "${import_file}"; then
+					this_job_failed=1
+					break
+				fi
+				import_file="${import_file%.zst}"
+			fi
 			if ! run_vximporter "${import_file}" "${import_log_file}"; then
 				this_job_failed=1
 				break
 			fi
-		done < <(find "${tmp_xfer}" -type f \( -name '*.json' -o -name '*.json.gz' \) ! -path '*/.*' -print0)
+		done
 
 		if [ "${found_import_file}" != "true" ]; then
 			echo "No JSON input found in ${tmp_xfer}; skipping import step."
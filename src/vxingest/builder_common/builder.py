@@ -5,6 +5,8 @@ Builder - Parent class for all Builders
 import logging
 from pathlib import Path
 
+from vxingest.builder_common.template_plan import TemplatePlan
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,12 +22,27 @@ class Builder:
         self.load_spec = load_spec
         self.an_id = None
         self.document_map = {}
+        self.template_plan = None
         # self.do_profiling = True  # set to True to enable build_document profiling
         self.do_profiling = False
 
     def initialize_document_map(self):
         pass
 
+    def get_template_plan(self):
+        """Return the compiled TemplatePlan for the builder's template.
+        The plan is compiled the first time it is needed and again only if the template is replaced
+        (CTC and partial sums builders set their template in build_document).
+        Returns:
+            TemplatePlan: the plan for self.template
+        """
+        if (
+            self.template_plan is None
+            or self.template_plan.template is not self.template
+        ):
+            self.template_plan = TemplatePlan(self.template, self)
+        return self.template_plan
+
     def get_document_map(self):
         pass
 
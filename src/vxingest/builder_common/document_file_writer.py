@@ -0,0 +1,211 @@
+"""
+DocumentFileWriter - streams documents into an import file, one document at a time, optionally compressed
+read_document_file, iter_document_file - read the documents of such a file back
+
+The optional packages are not in the project dependencies, install them into the environment to use them:
+    orjson - a faster json encoder (pip install orjson)
+    zstandard - the zstd compression before python 3.14 (pip install zstandard)
+"""
+
+import gzip
+import io
+import json
+import logging
+from pathlib import Path
+
+# orjson is optional, it is a faster encoder than json when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# zstd is optional, it is in the standard library from python 3.14 and in the zstandard package before that
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+logger = logging.getLogger(__name__)
+
+# "list" is a json array of documents (cbimport -f list), "lines" is one document per line (cbimport -f lines)
+OUTPUT_FORMATS = ["list", "lines"]
+# the compressions of the output files and the suffixes that they add to the file name
+OUTPUT_COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+# the gzip level, the default of 9 costs a lot more cpu for a little smaller file
+GZIP_COMPRESS_LEVEL = 6
+# the characters that iter_document_file reads at a time
+READ_CHUNK_CHARS = 1024 * 1024
+# the characters between the documents of a list or a lines file
+DOCUMENT_SEPARATORS = " \t\r\n,"
+
+
+def encode_document(document):
+    """Encode a document as json bytes, with orjson when it is available.
+    The two encoders decode to the same documents but they do not write the same bytes:
+    json.dumps writes ", " and ": " separators, escapes the non ascii characters and writes
+    NaN (which is not valid json), orjson writes compact utf-8 json, writes NaN as null and
+    encodes the numpy arrays and scalars. A document that orjson can not encode is encoded with json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(document, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+    return json.dumps(document).encode("utf-8")
+
+
+class DocumentFileWriter:
+    """Writes documents to an output file as they are given, so the whole file is never held
+    in memory as one string. The file is compressed while it is written (gzip, or zstd when
+    it is available) so that it does not need to be compressed again.
+    Usage:
+        with DocumentFileWriter(path, "list", "gzip") as writer:
+            for document in document_map.values():
+                writer.write(document)
+    """
+
+    def __init__(self, path, output_format="list", compression="none"):
+        """
+        Args:
+            path (str): the file name without the ".json" suffix
+            output_format (str, optional): one of OUTPUT_FORMATS. Defaults to "list".
+            compression (str, optional): one of OUTPUT_COMPRESSIONS. Defaults to "none".
+        Raises:
+            ValueError: for an unknown format or compression
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {output_format}")
+        compression = compression or "none"
+        if compression not in OUTPUT_COMPRESSIONS:
+            raise ValueError(f"unknown output compression {compression}")
+        if compression == "zstd" and zstd is None:
+            logger.warning(
+                "DocumentFileWriter: zstd is not available, using gzip for %s", path
+            )
+            compression = "gzip"
+        self.output_format = output_format
+        self.compression = compression
+        self.path = Path(f"{path}.json{OUTPUT_COMPRESSIONS[compression]}")
+        self.document_count = 0
+        self.file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_file(self):
+        """return the binary file object for the path, compressing if required"""
+        if self.compression == "gzip":
+            return gzip.open(self.path, "wb", compresslevel=GZIP_COMPRESS_LEVEL)
+        if self.compression == "zstd":
+            return zstd.open(self.path, "wb")
+        return self.path.open("wb")
+
+    def open(self):
+        """open the output file"""
+        self.file = self.open_file()
+        if self.output_format == "list":
+            self.file.write(b"[")
+
+    def write(self, document):
+        """encode a document and write it to the file"""
+        if self.output_format == "list":
+            if self.document_count:
+                self.file.write(b", ")
+            self.file.write(encode_document(document))
+        else:
+            self.file.write(encode_document(document))
+            self.file.write(b"\n")
+        self.document_count += 1
+
+    def close(self):
+        """finish and close the output file"""
+        if self.file is None:
+            return
+        try:
+            if self.output_format == "list":
+                self.file.write(b"]")
+        finally:
+            self.file.close()
+            self.file = None
+
+
+def open_document_file(path):
+    """Open an output file that was written by a DocumentFileWriter for reading (binary)
+    Args:
+        path (Path): a .json, .json.gz or .json.zst file
+    Raises:
+        ValueError: for a zstd file when zstd is not available
+    """
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstd is None:
+            raise ValueError(f"zstd is not available to read {path}")
+        return zstd.open(path, "rb")
+    return path.open("rb")
+
+
+def iter_document_file(path):
+    """Read the documents of an output file that was written by a DocumentFileWriter one at a time,
+    the file is read in READ_CHUNK_CHARS chunks so it is never held in memory as a whole.
+    Args:
+        path (str): a .json, .json.gz or .json.zst file in the list or the lines format
+    Yields:
+        dict: the documents
+    Raises:
+        ValueError: for a zstd file when zstd is not available, json.JSONDecodeError for a file that is not json
+    """
+    decoder = json.JSONDecoder()
+    with open_document_file(Path(path)) as file:
+        stream = io.TextIOWrapper(file, encoding="utf-8")
+        buffer = ""
+        position = 0
+        started = False
+        at_end = False
+        while True:
+            while position < len(buffer) and buffer[position] in DOCUMENT_SEPARATORS:
+                position += 1
+            if position < len(buffer):
+                if not started:
+                    started = True
+                    if buffer[position] == "[":
+                        # the list format
+                        position += 1
+                        continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    document, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the document is not all in the buffer yet
+                    if at_end:
+                        raise
+                else:
+                    position = end
+                    yield document
+                    continue
+            elif at_end:
+                return
+            chunk = stream.read(READ_CHUNK_CHARS)
+            at_end = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def read_document_file(path):
+    """Read the documents of an output file that was written by a DocumentFileWriter
+    Args:
+        path (str): a .json, .json.gz or .json.zst file in the list or the lines format
+    Returns:
+        list: the documents
+    Raises:
+        ValueError: for a zstd file when zstd is not available
+    """
+    return list(iter_document_file(path))
@@ -0,0 +1,153 @@
+"""
+DocumentPrefetcher - reads documents by id in batches, ahead of the builder that uses them
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# the number of unique document ids in each get_multi
+PREFETCH_BATCH_SIZE = 50
+# the number of batches that are fetched ahead of the batch that is being used
+PREFETCH_LOOKAHEAD = 1
+# the number of used documents that are kept for repeated gets (i.e. an obs document for every fcstLen)
+PREFETCH_CACHE_SIZE = 32
+
+
+class DocumentPrefetcher:
+    """Gets documents with collection.get_multi in batches, in the order that they will be used,
+    while the builder works on the documents that have already arrived.
+    The ids are given up front (in the order they will be requested - repeats are allowed) and
+    are split into batches of unique ids. Requesting a document waits for its batch and starts
+    fetching the following batches in a background thread. Documents that have been used are
+    kept in a bounded LRU so that documents that are requested many times (i.e. an obs document
+    that is shared by every fcstLen of a fcstValidEpoch) are fetched only once.
+    get() behaves like collection.get - it returns the GetResult or raises the exception
+    (i.e. DocumentNotFoundException) for the id. Ids that were not given up front, documents that have
+    been evicted, missing documents that are requested again, and batches whose get_multi failed
+    are read with collection.get.
+    """
+
+    def __init__(
+        self,
+        collection,
+        ids,
+        batch_size=PREFETCH_BATCH_SIZE,
+        lookahead=PREFETCH_LOOKAHEAD,
+        cache_size=PREFETCH_CACHE_SIZE,
+    ):
+        """
+        Args:
+            collection (Collection): the couchbase collection
+            ids (list): the document ids in the order that they will be requested
+            batch_size (int, optional): unique ids per get_multi. Defaults to PREFETCH_BATCH_SIZE.
+            lookahead (int, optional): batches to fetch ahead. Defaults to PREFETCH_LOOKAHEAD.
+            cache_size (int, optional): used documents to keep. Defaults to PREFETCH_CACHE_SIZE.
+        """
+        self.collection = collection
+        self.lookahead = lookahead
+        self.cache_size = cache_size
+        self.batches = []
+        self.batch_index = {}
+        for an_id in ids:
+            if an_id in self.batch_index:
+                continue
+            if not self.batches or len(self.batches[-1]) >= batch_size:
+                self.batches.append([])
+            self.batch_index[an_id] = len(self.batches) - 1
+            self.batches[-1].append(an_id)
+        self.futures = {}
+        # documents that have arrived but have not been used yet
+        self.prefetched = {}
+        # documents that have been used, least recently used first
+        self.cache = OrderedDict()
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """stop fetching and release the documents"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.futures = {}
+        self.prefetched = {}
+        self.cache.clear()
+
+    def _fetch(self, batch):
+        """get_multi a batch of ids - returns {id: GetResult or exception}"""
+        try:
+            result = self.collection.get_multi(batch)
+        except Exception as _e:
+            # the documents in this batch will be read one at a time
+            logger.warning(
+                "DocumentPrefetcher: get_multi of %d documents failed: %s",
+                len(batch),
+                str(_e),
+            )
+            return {}
+        documents = dict(result.exceptions)
+        documents.update(result.results)
+        return documents
+
+    def _start(self, index):
+        """start fetching batch index (if it exists and has not been started)"""
+        if index >= len(self.batches) or index in self.futures:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="DocumentPrefetcher"
+            )
+        self.futures[index] = self.executor.submit(self._fetch, self.batches[index])
+
+    def _wait(self, index):
+        """wait for batch index and move its documents to prefetched"""
+        for ahead in range(index, index + self.lookahead + 1):
+            self._start(ahead)
+        future = self.futures[index]
+        if future is None:
+            # already arrived
+            return
+        self.futures[index] = None
+        documents = future.result()
+        # documents from older batches that were never used are dropped (they would be read again)
+        for an_id in list(self.prefetched):
+            if self.batch_index[an_id] < index - 1:
+                del self.prefetched[an_id]
+        for an_id in self.batches[index]:
+            if an_id in documents:
+                self.prefetched[an_id] = documents[an_id]
+
+    def get(self, an_id):
+        """Get a document like collection.get does
+        Args:
+            an_id (str): the document id
+        Returns:
+            GetResult: the result for the document
+        Raises:
+            the exception that collection.get would raise i.e. DocumentNotFoundException
+        """
+        if an_id in self.cache:
+            self.cache.move_to_end(an_id)
+            document = self.cache[an_id]
+        else:
+            index = self.batch_index.get(an_id)
+            if index is not None:
+                self._wait(index)
+            if an_id in self.prefetched:
+                document = self.prefetched.pop(an_id)
+                if isinstance(document, Exception):
+                    raise document
+            else:
+                document = self.collection.get(an_id)
+            # only documents are kept, a missing document is read again if it is requested again
+            self.cache[an_id] = document
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return document
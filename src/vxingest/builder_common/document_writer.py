@@ -0,0 +1,193 @@
+"""
+DocumentWriter - upserts a document map into couchbase in bounded batches, retrying the documents that failed
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from couchbase.exceptions import (
+    AmbiguousTimeoutException,
+    TemporaryFailException,
+    TimeoutException,
+    UnAmbiguousTimeoutException,
+)
+
+logger = logging.getLogger(__name__)
+
+# the most documents in each upsert_multi
+WRITE_BATCH_SIZE = 500
+# the most (json) bytes in each upsert_multi, a larger document is written in a batch of its own
+WRITE_BATCH_BYTES = 8 * 1024 * 1024
+# the most batches that are being written at the same time
+WRITE_CONCURRENCY = 4
+# the retries of a document that failed with a transient error
+WRITE_MAX_RETRIES = 5
+# the first retry waits this long, every following retry waits twice as long (up to WRITE_MAX_BACKOFF_SECONDS)
+WRITE_BACKOFF_SECONDS = 0.5
+WRITE_MAX_BACKOFF_SECONDS = 30
+# the errors that are worth retrying
+RETRYABLE_EXCEPTIONS = (
+    AmbiguousTimeoutException,
+    UnAmbiguousTimeoutException,
+    TimeoutException,
+    TemporaryFailException,
+)
+
+
+class DocumentWriter:
+    """Upserts the documents of a document map with collection.upsert_multi.
+    The map is split into batches of at most batch_size documents and batch_bytes json bytes and
+    at most concurrency batches are written at the same time, the next batch is only serialized
+    and submitted when a batch has finished (so a large map is not all in flight at once).
+    The per document results of each upsert_multi are inspected and only the documents that failed
+    with a transient error (RETRYABLE_EXCEPTIONS) are upserted again, with an exponential backoff.
+    The documents that still fail are returned (and logged) instead of being dropped silently.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size=WRITE_BATCH_SIZE,
+        batch_bytes=WRITE_BATCH_BYTES,
+        concurrency=WRITE_CONCURRENCY,
+        max_retries=WRITE_MAX_RETRIES,
+        backoff_seconds=WRITE_BACKOFF_SECONDS,
+    ):
+        """
+        Args:
+            collection (Collection): the couchbase collection
+            batch_size (int, optional): documents per upsert_multi. Defaults to WRITE_BATCH_SIZE.
+            batch_bytes (int, optional): json bytes per upsert_multi. Defaults to WRITE_BATCH_BYTES.
+            concurrency (int, optional): batches in flight. Defaults to WRITE_CONCURRENCY.
+            max_retries (int, optional): retries of a failed document. Defaults to WRITE_MAX_RETRIES.
+            backoff_seconds (float, optional): the first retry delay. Defaults to WRITE_BACKOFF_SECONDS.
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def get_batches(self, document_map):
+        """Split the document map into batches
+        Args:
+            document_map (dict): id -> document
+        Returns:
+            generator: (batch dict, json bytes) tuples
+        """
+        batch = {}
+        batch_bytes = 0
+        for an_id, document in document_map.items():
+            document_bytes = len(
+                json.dumps(document, separators=(",", ":"), default=str)
+            )
+            if batch and (
+                len(batch) >= self.batch_size
+                or batch_bytes + document_bytes > self.batch_bytes
+            ):
+                yield batch, batch_bytes
+                batch = {}
+                batch_bytes = 0
+            batch[an_id] = document
+            batch_bytes += document_bytes
+        if batch:
+            yield batch, batch_bytes
+
+    def upsert_batch(self, batch):
+        """upsert_multi a batch - returns {id: exception} for the documents that failed"""
+        try:
+            result = self.collection.upsert_multi(batch)
+        except Exception as _e:
+            return dict.fromkeys(batch, _e)
+        return dict(result.exceptions) if result.exceptions else {}
+
+    def write_batch(self, batch):
+        """Upsert a batch, retrying the documents that failed with a transient error
+        Args:
+            batch (dict): id -> document
+        Returns:
+            (dict, int): {id: exception} of the documents that were not written and the number of retries
+        """
+        pending = batch
+        failed_documents = {}
+        retries = 0
+        for attempt in range(self.max_retries + 1):
+            retryable = {}
+            for an_id, exception in self.upsert_batch(pending).items():
+                if (
+                    isinstance(exception, RETRYABLE_EXCEPTIONS)
+                    and attempt < self.max_retries
+                ):
+                    retryable[an_id] = pending[an_id]
+                else:
+                    failed_documents[an_id] = exception
+            if not retryable:
+                break
+            time.sleep(
+                min(self.backoff_seconds * 2**attempt, WRITE_MAX_BACKOFF_SECONDS)
+            )
+            pending = retryable
+            retries += len(retryable)
+        return failed_documents, retries
+
+    def upsert(self, document_map):
+        """Upsert all the documents of a document map
+        Args:
+            document_map (dict): id -> document
+        Returns:
+            dict: the statistics of the write - documents, bytes, batches, retries, elapsed seconds
+            and failed ({id: exception} of the documents that were not written)
+        """
+        start_time = time.perf_counter()
+        stats = {
+            "documents": len(document_map),
+            "bytes": 0,
+            "batches": 0,
+            "retries": 0,
+            "elapsed": 0.0,
+            "failed": {},
+        }
+
+        def collect(futures):
+            for future in futures:
+                failed_documents, retries = future.result()
+                stats["failed"].update(failed_documents)
+                stats["retries"] += retries
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="DocumentWriter"
+        ) as executor:
+            running = set()
+            for batch, batch_bytes in self.get_batches(document_map):
+                # back pressure - wait for a batch to finish before another one is serialized
+                if len(running) >= self.concurrency:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+                running.add(executor.submit(self.write_batch, batch))
+                stats["batches"] += 1
+                stats["bytes"] += batch_bytes
+            collect(wait(running).done)
+        stats["elapsed"] = time.perf_counter() - start_time
+        elapsed = max(stats["elapsed"], 1e-9)
+        logger.info(
+            "DocumentWriter: upserted %d documents (%d bytes) in %d batches in %.3f seconds "
+            "(%.1f documents/s, %.3f MB/s) with %d retries",
+            stats["documents"] - len(stats["failed"]),
+            stats["bytes"],
+            stats["batches"],
+            stats["elapsed"],
+            (stats["documents"] - len(stats["failed"])) / elapsed,
+            stats["bytes"] / elapsed / 1e6,
+            stats["retries"],
+        )
+        if stats["failed"]:
+            logger.error(
+                "DocumentWriter: %d documents were not written i.e. %s: %s",
+                len(stats["failed"]),
+                next(iter(stats["failed"])),
+                str(next(iter(stats["failed"].values()))),
+            )
+        return stats
@@ -0,0 +1,128 @@
+"""
+FileManifest - a local record of the input files that an ingest job has already seen, for incremental file discovery
+"""
+
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# the seconds after which a file that was queued but never got a DataFile document is offered again
+MANIFEST_RETRY_SECONDS = 6 * 3600
+
+
+class FileManifest:
+    """A small SQLite database that lets get_file_list skip the work it has already done.
+    It keeps:
+    - a local copy of the DataFile (DF) url -> mtime records, with a watermark (the largest DF mtime seen)
+      so that the next DF query only needs the records at or after the watermark, and the records of
+      the queued files that do not have a DF record yet (see get_df_condition)
+    - the files that get_file_list has handed out (queued) and that do not have a DF record yet, so they
+      are not queued again while their documents are still waiting to be imported. A queued file that never
+      gets a DF record (i.e. the ingest failed) is offered again after retry_seconds.
+    A known file (one with a DF record, or queued within retry_seconds) is skipped by the directory scan
+    without a stat, so a file that is changed after it was ingested is not noticed in incremental mode.
+    Removing the manifest file makes the next run a full discovery.
+    The manifest belongs to the VxIngest main process, it is not shared with the VxIngestManager processes.
+    """
+
+    def __init__(self, path, retry_seconds=MANIFEST_RETRY_SECONDS):
+        """
+        Args:
+            path (str): the manifest file, it is created if it does not exist
+            retry_seconds (int, optional): see MANIFEST_RETRY_SECONDS
+        """
+        self.path = str(path)
+        self.retry_seconds = retry_seconds
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(url TEXT PRIMARY KEY, mtime REAL, ingested INTEGER, queued_time REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value REAL)"
+            )
+
+    def get_df_watermark(self):
+        """Return the largest DF mtime in the manifest (0 for a new manifest).
+        The DF query of an incremental run should select the records with mtime >= the watermark,
+        records with the same mtime as the watermark are read again, which is harmless.
+        """
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE name='df_watermark'"
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def get_pending_files(self):
+        """Return the urls that were queued and do not have a DF record yet"""
+        rows = self.connection.execute("SELECT url FROM files WHERE ingested=0")
+        return sorted(row[0] for row in rows)
+
+    def get_df_condition(self):
+        """Return the condition for the DF query of an incremental run.
+        The mtime of a DF record is the mtime of its input file, not the time it was written,
+        so the DF of a file that arrived late (or was retried) can be below the watermark.
+        The records of the queued files that do not have a DF record yet are therefore
+        always selected, whatever their mtime.
+        Returns:
+            str: an "AND ..." condition on the mtime and url of the DF records
+        """
+        watermark = self.get_df_watermark()
+        pending_files = self.get_pending_files()
+        if not pending_files:
+            return f"AND mtime >= {watermark}"
+        return f"AND (mtime >= {watermark} OR url IN {json.dumps(pending_files)})"
+
+    def update_ingested(self, df_rows):
+        """Merge DF query rows into the manifest and advance the watermark
+        Args:
+            df_rows (iterable): {url:file_url, mtime:mtime} records
+        Returns:
+            int: the number of rows
+        """
+        rows = [(row["url"], row["mtime"]) for row in df_rows]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO files (url, mtime, ingested) VALUES (?, ?, 1) "
+                "ON CONFLICT(url) DO UPDATE SET mtime=max(mtime, excluded.mtime), ingested=1",
+                rows,
+            )
+            if rows:
+                self.connection.execute(
+                    "INSERT INTO state (name, value) VALUES ('df_watermark', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value=max(value, excluded.value)",
+                    (max(mtime for _url, mtime in rows),),
+                )
+        return len(rows)
+
+    def get_known_files(self):
+        """Return the urls that do not need to be looked at again
+        Returns:
+            set: the urls with a DF record and the urls that were queued less than retry_seconds ago
+        """
+        rows = self.connection.execute(
+            "SELECT url FROM files WHERE ingested=1 OR queued_time >= ?",
+            (time.time() - self.retry_seconds,),
+        )
+        return {row[0] for row in rows}
+
+    def add_queued(self, files):
+        """Record the files that are handed out for ingest
+        Args:
+            files (dict): url -> file mtime
+        """
+        queued_time = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO files (url, mtime, ingested, queued_time) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT(url) DO UPDATE SET mtime=excluded.mtime, ingested=0, "
+                "queued_time=excluded.queued_time",
+                [(url, mtime, queued_time) for url, mtime in files.items()],
+            )
+
+    def close(self):
+        """close the database connection"""
+        self.connection.close()
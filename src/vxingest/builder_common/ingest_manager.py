@@ -2,10 +2,8 @@
 CommonVxIngestManager - Parent class for all VxIngestManager classes
 """
 
-import json
 import logging
 import os
-import queue
 import time
 from datetime import timedelta
 from multiprocessing import Process
@@ -13,11 +11,17 @@ from pathlib import Path
 
 from couchbase.auth import PasswordAuthenticator
 from couchbase.cluster import Cluster
-from couchbase.exceptions import CouchbaseException, TimeoutException
+from couchbase.exceptions import CouchbaseException
 from couchbase.options import ClusterOptions, ClusterTimeoutOptions
 
+from vxingest.builder_common.document_file_writer import DocumentFileWriter
+from vxingest.builder_common.document_writer import DocumentWriter
+
 logger = logging.getLogger(__name__)
 
+# the element that tells an IngestManager that the queue is finished, there is one for each IngestManager
+END_OF_QUEUE = None
+
 
 class CommonVxIngestManager(Process):
     """
@@ -27,6 +31,7 @@ class CommonVxIngestManager(Process):
 
     It will read queue_elements, one by one,
     from the element_queue.  Elements might be file names or they might be ingest_document_ids.
+    The queue ends with one END_OF_QUEUE for each IngestManager, see CommonVxIngest.fill_queue.
     The builders use the template to create documents for
     each filename and put them into the document map.
 
@@ -35,8 +40,9 @@ class CommonVxIngestManager(Process):
     the queue and starts over.
 
     Each builder is kept in an object pool so that they do not need to be re instantiated.
-    When the queue has been emptied the IngestManager closes its connections
-    and dies.
+    When it gets an END_OF_QUEUE the IngestManager closes its connections,
+    puts (thread_name, processed count, failed elements, error) on its result_queue
+    (if it has one) and dies.
     """
 
     def __init__(
@@ -68,6 +74,8 @@ class CommonVxIngestManager(Process):
         self.output_dir = output_dir
         self.logging_queue = logging_queue
         self.logging_configurer = logging_configurer
+        # the runit sets the queue for the completion message, see CommonVxIngest.wait_for_ingest_managers
+        self.result_queue = None
 
         if not Path(self.output_dir).exists():
             Path(self.output_dir).mkdir(parents=True, exist_ok=True)
@@ -79,6 +87,25 @@ class CommonVxIngestManager(Process):
     def process_queue_element(self, queue_element):
         pass
 
+    def get_builders(self):
+        """return the builders that this manager has made"""
+        return list(self.builder_map.values())
+
+    def set_job(self, load_spec, output_dir):
+        """Reuse this manager, and its builders with their caches, for another job with the
+        same ingest documents (see WorkerPool). Only the per job state, the load_spec and
+        the output_dir, is replaced, connect_cb must be called again to stash the
+        database connection in the new load_spec.
+        Args:
+            load_spec (dict): the load_spec of the job
+            output_dir (str): the output directory of the job
+        """
+        self.load_spec = load_spec
+        self.cb_credentials = load_spec["cb_connection"]
+        self.output_dir = output_dir
+        for builder in self.get_builders():
+            builder.load_spec = load_spec
+
     def close_cb(self):
         """
         close couchbase connection
@@ -88,37 +115,46 @@ class CommonVxIngestManager(Process):
         self.cluster = None
         self.collection = None
 
-    def connect_cb(self):
+    def get_cluster(self):
+        """
+        connect to the couchbase cluster of the cb_credentials, with up to 3 attempts
+        Returns:
+            Cluster: the cluster
+        """
+        timeout_options = ClusterTimeoutOptions(
+            kv_timeout=timedelta(seconds=25),
+            query_timeout=timedelta(seconds=120),
+        )
+        options = ClusterOptions(
+            PasswordAuthenticator(
+                self.cb_credentials["user"], self.cb_credentials["password"]
+            ),
+            timeout_options=timeout_options,
+        )
+        _attempts = 0
+        while _attempts < 3:
+            try:
+                return Cluster(self.cb_credentials["host"], options)
+            except CouchbaseException:
+                time.sleep(5)
+                _attempts = _attempts + 1
+        raise CouchbaseException("Could not connect to couchbase after 3 attempts")
+
+    def connect_cb(self, cluster=None):
         """
         create a couchbase connection and maintain the collection and cluster objects.
         See the note at the top of vx_ingest.py for an explanation of why this seems redundant.
+        Args:
+            cluster (Cluster, optional): an open cluster to reuse instead of connecting again
         """
         logger.info("data_type_manager - Connecting to couchbase")
         # get a reference to our cluster
 
         try:
-            timeout_options = ClusterTimeoutOptions(
-                kv_timeout=timedelta(seconds=25),
-                query_timeout=timedelta(seconds=120),
-            )
-            options = ClusterOptions(
-                PasswordAuthenticator(
-                    self.cb_credentials["user"], self.cb_credentials["password"]
-                ),
-                timeout_options=timeout_options,
-            )
-            _attempts = 0
-            while _attempts < 3:
-                try:
-                    self.cluster = Cluster(self.cb_credentials["host"], options)
-                    break
-                except CouchbaseException as _e:
-                    time.sleep(5)
-                    _attempts = _attempts + 1
-            if _attempts == 3:
-                raise CouchbaseException(
-                    "Could not connect to couchbase after 3 attempts"
-                )
+            if cluster is not None:
+                self.cluster = cluster
+            else:
+                self.cluster = self.get_cluster()
             self.collection = self.cluster.bucket(
                 self.cb_credentials["bucket"]
             ).collection(self.cb_credentials["collection"])
@@ -147,64 +183,72 @@ class CommonVxIngestManager(Process):
 
     def run(self):
         """
-        This is the entry point for the IngestManager thread. It runs an
-        infinite loop that only terminates when the element_queue is
-        empty. For each enqueued element it calls
+        This is the entry point for the IngestManager thread. It runs a
+        loop that blocks on the element_queue and only terminates when it gets
+        an END_OF_QUEUE. For each enqueued element it calls
         process_queue_element with the queue_element and the couchbase
-        connection to process the file.
+        connection to process the file. An element that fails is logged and
+        reported in the completion message, the IngestManager goes on with the next one.
         """
         # Configure this Process's logger
         self.logging_configurer(self.logging_queue)
         logger.info(f"Registered new process: {self.thread_name}")
-
+        processed = 0
+        failed = []
+        error = None
         try:
             self.cb_credentials = self.load_spec["cb_connection"]
             # get a connection
             self.connect_cb()
-            # infinite loop terminates when the file_name_queue is empty
-            empty_count = 0
             while True:
+                queue_element = self.queue.get()
                 try:
-                    queue_element = self.queue.get_nowait()
+                    if queue_element is END_OF_QUEUE:
+                        logger.info(
+                            "%s: IngestManager - Queue finished - disconnecting couchbase",
+                            self.thread_name,
+                        )
+                        break
                     logger.info(
-                        self.thread_name
-                        + ": IngestManager - processing "
-                        + queue_element
+                        "%s: IngestManager - processing %s",
+                        self.thread_name,
+                        queue_element,
                     )
-                    if queue_element is not None:
-                        # it seems it is possible to have an empty queue_element
-                        # but we cannot process one so skip it
+                    try:
                         self.process_queue_element(queue_element)
+                        processed += 1
                         logger.info(
-                            self.thread_name
-                            + ": IngestManager - finished processing "
-                            + queue_element
+                            "%s: IngestManager - finished processing %s",
+                            self.thread_name,
+                            queue_element,
                         )
-                    self.queue.task_done()
-                except queue.Empty:
-                    # three strikes and your out! finished! kaput!
-                    if empty_count < 3:
-                        empty_count += 1
-                        time.sleep(1)
-                        continue
-                    else:
-                        logger.info(
-                            "%s: IngestManager - Queue empty - disconnecting couchbase",
+                    except Exception:
+                        logger.exception(
+                            "%s: IngestManager - error processing %s",
                             self.thread_name,
+                            queue_element,
                         )
-                        break
+                        failed.append(queue_element)
+                finally:
+                    self.queue.task_done()
         except Exception as _e:
             logger.exception("%s: *** Error in IngestManager run ***", self.thread_name)
+            error = str(_e)
             raise _e
         finally:
+            if self.result_queue is not None:
+                self.result_queue.put((self.thread_name, processed, failed, error))
             logger.info("%s: IngestManager finished", self.thread_name)
 
     def write_document_to_cb(self, queue_element, document_map):
-        """This method writes the current document directly to couchbase
+        """This method writes the current document directly to couchbase.
+        The DataFile (DF) documents are written last, and only when all the other documents were
+        written, so that an element whose documents were not all persisted is not recorded as ingested.
         Args:
             queue_element
             document_map (object): this object contains the output documents that will be upserted into couchbase
         Raises:
+            RuntimeError: some documents were not written, after all the retries
             _e: generic exception
         """
         # The document_map is all built now so write all the
@@ -230,12 +274,27 @@ class CommonVxIngestManager(Process):
                     self.thread_name,
                 )
             else:
-                try:
-                    self.collection.upsert_multi(document_map)
-                except TimeoutException:
-                    logger.info(
-                        "process_element - trying upsert: Got TimeOutException -  Document may not be persisted."
-                    )
+                data_file_map = {
+                    an_id: document
+                    for an_id, document in document_map.items()
+                    if an_id.startswith("DF:")
+                }
+                data_map = {
+                    an_id: document
+                    for an_id, document in document_map.items()
+                    if not an_id.startswith("DF:")
+                }
+                # batched, with the transient failures retried, see DocumentWriter
+                writer = DocumentWriter(self.collection)
+                for a_map in (data_map, data_file_map):
+                    if not a_map:
+                        continue
+                    stats = writer.upsert(a_map)
+                    if stats["failed"]:
+                        raise RuntimeError(
+                            f"{len(stats['failed'])} of {stats['documents']} documents for "
+                            f"{queue_element} were not persisted i.e. {next(iter(stats['failed']))}"
+                        )
             upsert_stop_time = int(time.time())
             logger.info(
                 "process_element - executing upsert: stop time: %s",
@@ -276,20 +335,23 @@ class CommonVxIngestManager(Process):
                 try:
                     # replace any os separator in the file name with an underscore to avoid directory issues
                     # but still keep the original file name structure as much as possible
-                    file_name = file_name.replace(os.sep, "__") + ".json"
-                    complete_file_name = Path(self.output_dir) / file_name
+                    file_name = file_name.replace(os.sep, "__")
                     # how many documents are we writing? Log it for alert
-                    num_documents = len(list(document_map.values()))
-                    logger.info(
-                        "%s: write_document_to_files writing %s documents into %s",
-                        self.thread_name,
-                        num_documents,
-                        complete_file_name,
-                    )
-                    with Path(complete_file_name).open("w", encoding="utf-8") as _f:
-                        # we need to write out a list of the values of the _document_map for cbimport
-                        json_data = json.dumps(list(document_map.values()))
-                        _f.write(json_data)
+                    num_documents = len(document_map)
+                    # the documents are encoded one at a time so that the file is never one string in memory
+                    with DocumentFileWriter(
+                        Path(self.output_dir) / file_name,
+                        self.load_spec.get("output_format", "list"),
+                        self.load_spec.get("output_compression", "none"),
+                    ) as writer:
+                        logger.info(
+                            "%s: write_document_to_files writing %s documents into %s",
+                            self.thread_name,
+                            num_documents,
+                            writer.path,
+                        )
+                        for document in document_map.values():
+                            writer.write(document)
                         return
                 except Exception as _e1:
                     logger.exception(
@@ -0,0 +1,171 @@
+"""
+RegionStationCache - the stations in a region for a valid epoch, without querying for every epoch
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+
+from vxingest.builder_common.builder_utilities import get_geo_index
+
+logger = logging.getLogger(__name__)
+
+
+class RegionStationCache:
+    """The station names within a region's bounding box for a valid epoch.
+    The region bounding boxes and the station documents are queried once (per region and
+    per subset) instead of for every fcstValidEpoch. Which geo of a station is used for an epoch
+    (see builder_utilities.get_geo_index) only changes when the epoch crosses one of the geo
+    firstTime/lastTime boundaries, so the station list is derived once for each interval
+    between boundaries and is reused for every epoch in that interval.
+    """
+
+    def __init__(self, cluster, bucket, scope, collection, require_elevation=False):
+        """
+        Args:
+            cluster (Cluster): the couchbase cluster used for the queries
+            bucket (str): the bucket
+            scope (str): the scope
+            collection (str): the collection
+            require_elevation (bool, optional): only include stations that have a valid elevation
+                (partial sums need it for normalized pressure). Defaults to False.
+        """
+        self.cluster = cluster
+        self.bucket = bucket
+        self.scope = scope
+        self.collection = collection
+        self.require_elevation = require_elevation
+        # region name -> bounding box row
+        self.bounding_boxes = {}
+        # subset -> (station rows, sorted firstTimes, sorted lastTimes)
+        self.stations = {}
+        # (region name, subset, interval) -> sorted station names
+        self.region_stations = {}
+        # (region names, subset, interval) -> station name -> region bitmask
+        self.region_masks = {}
+
+    def get_bounding_box(self, region_name):
+        """query the bounding box of a region (once)"""
+        if region_name not in self.bounding_boxes:
+            stmnt = f"""SELECT  geo.bottom_right.lat as br_lat,
+                    geo.bottom_right.lon as br_lon,
+                    geo.top_left.lat as tl_lat,
+                    geo.top_left.lon as tl_lon
+                    FROM `{self.bucket}`.{self.scope}.{self.collection}
+                    WHERE type='MD'
+                    and docType='region'
+                    and subset='COMMON'
+                    and version='V01'
+                    and name='{region_name}'"""
+            result = self.cluster.query(stmnt, read_only=True)
+            self.bounding_boxes[region_name] = list(result)[0]
+        return self.bounding_boxes[region_name]
+
+    def get_station_rows(self, subset):
+        """query the station geos and names for a subset (once), with the sorted geo time boundaries"""
+        if subset not in self.stations:
+            stmnt = f"""SELECT
+                    geo, name
+                    from `{self.bucket}`.{self.scope}.{self.collection}
+                    where type='MD'
+                    and docType='station'
+                    and subset='{subset}'
+                    and version='V01'"""
+            rows = list(self.cluster.query(stmnt, read_only=True))
+            try:
+                first_times = sorted(
+                    geo["firstTime"] for row in rows for geo in row["geo"]
+                )
+                last_times = sorted(
+                    geo["lastTime"] for row in rows for geo in row["geo"]
+                )
+            except Exception as _e:
+                # without the boundaries the stations are derived for every epoch
+                logger.warning(
+                    "RegionStationCache: station geos without a time range: %s", str(_e)
+                )
+                first_times = last_times = None
+            self.stations[subset] = (rows, first_times, last_times)
+        return self.stations[subset]
+
+    def get_stations(self, region_name, subset, valid_epoch):
+        """Return the sorted names of the stations that are within the region at the valid epoch.
+        Args:
+            region_name (str): the region name
+            subset (str): the station subset i.e. METAR
+            valid_epoch (int): the fcstValidEpoch
+        Returns:
+            list: the station names (a new list that the caller may keep)
+        """
+        rows = self.get_station_rows(subset)[0]
+        key = (region_name, subset, self.get_interval(subset, valid_epoch))
+        if key not in self.region_stations:
+            self.region_stations[key] = self.derive_stations(
+                self.get_bounding_box(region_name), rows, valid_epoch
+            )
+        return list(self.region_stations[key])
+
+    def get_region_masks(self, region_names, subset, valid_epoch):
+        """Return the regions that each station is in at the valid epoch as a bitmask,
+        bit i is set when the station is in region_names[i].
+        Args:
+            region_names (list): the region names
+            subset (str): the station subset i.e. METAR
+            valid_epoch (int): the fcstValidEpoch
+        Returns:
+            dict: station name -> bitmask, for the stations that are in at least one of the regions
+            (shared by the callers, it must not be changed)
+        """
+        key = (tuple(region_names), subset, self.get_interval(subset, valid_epoch))
+        if key not in self.region_masks:
+            masks = {}
+            for index, region_name in enumerate(region_names):
+                for name in self.get_stations(region_name, subset, valid_epoch):
+                    masks[name] = masks.get(name, 0) | (1 << index)
+            self.region_masks[key] = masks
+        return self.region_masks[key]
+
+    def get_interval(self, subset, valid_epoch):
+        """the interval between the geo time boundaries that the valid epoch is in"""
+        first_times, last_times = self.get_station_rows(subset)[1:]
+        if first_times is None:
+            return valid_epoch
+        # every geo has the same firstTime <= epoch <= lastTime result anywhere in this interval
+        return (
+            bisect_right(first_times, valid_epoch),
+            bisect_left(last_times, valid_epoch),
+        )
+
+    def derive_stations(self, bounding_box, rows, valid_epoch):
+        """filter the station rows with the bounding box, using each station's geo for the valid epoch"""
+        domain_stations = []
+        bb_br_lat = bounding_box["br_lat"]
+        bb_tl_lat = bounding_box["tl_lat"]
+        bb_br_lon = (
+            bounding_box["br_lon"]
+            if bounding_box["br_lon"] <= 180
+            else bounding_box["br_lon"] - 360
+        )
+        bb_tl_lon = (
+            bounding_box["tl_lon"]
+            if bounding_box["tl_lon"] <= 180
+            else bounding_box["tl_lon"] - 360
+        )
+        for row in rows:
+            geo = row["geo"][get_geo_index(valid_epoch, row["geo"])]
+            rlat = geo["lat"]
+            rlon = geo["lon"] if geo["lon"] <= 180 else geo["lon"] - 360
+            if not (
+                rlat >= bb_br_lat
+                and rlat <= bb_tl_lat
+                and rlon >= bb_tl_lon
+                and rlon <= bb_br_lon
+            ):
+                continue
+            # If there is an invalid elevation we won't be able to calculate normalized pressure
+            if self.require_elevation and (
+                "elev" not in geo or geo["elev"] is None or geo["elev"] == 9999
+            ):
+                continue
+            domain_stations.append(row["name"])
+        domain_stations.sort()
+        return domain_stations
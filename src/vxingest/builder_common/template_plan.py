@@ -0,0 +1,206 @@
+"""
+TemplatePlan - a compiled form of an ingest document template that is shared by all builders
+"""
+
+import json
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+
+class NamedFunction:
+    """A compiled '&named_function|*param1,*param2...' template entry.
+    The handler is the builder method, resolved once. The params are (key, param) pairs where
+    the key is the param without its leading '*' or '&', and json_params is the dict for
+    '&named_function|{...}' entries (partial sums). A definition that cannot be parsed keeps
+    its error, which is raised when it is called (just as it was when templates were parsed on use).
+    """
+
+    __slots__ = ("name", "handler", "params", "json_params", "error")
+
+    def __init__(self, name, handler, params, json_params=None, error=None):
+        self.name = name
+        self.handler = handler
+        self.params = params
+        self.json_params = json_params
+        self.error = error
+
+    def __call__(self, dict_params):
+        if self.error is not None:
+            raise self.error
+        if self.handler is None:
+            raise AttributeError(f"builder has no named function {self.name}")
+        return self.handler(dict_params)
+
+
+class TemplateItem:
+    """A compiled template string (a key, a value or a part of an id).
+    The kind is one of CONSTANT, REPLACEMENT ('*var', '*var1*var2', 'prefix*var')
+    or FUNCTION ('&named_function|params'). The replacements are the names after each '*'
+    (the same as text.split("*")[1:]).
+    """
+
+    CONSTANT = "constant"
+    REPLACEMENT = "replacement"
+    FUNCTION = "function"
+
+    __slots__ = ("text", "kind", "replacements", "function")
+
+    def __init__(self, text, kind, replacements=(), function=None):
+        self.text = text
+        self.kind = kind
+        self.replacements = replacements
+        self.function = function
+
+    def __repr__(self):
+        return f"TemplateItem({self.kind}, {self.text!r})"
+
+
+class TemplatePlan:
+    """The execution plan for an ingest document template.
+    Every string in the template (keys, values, and the id parts) is parsed once, when the
+    plan is built, into a TemplateItem with its replacements and named function (with the
+    handler already resolved on the builder). Document building then only looks up the
+    compiled items instead of splitting the template strings for every document or record.
+    The plan is immutable and belongs to a single builder, see Builder.get_template_plan.
+    """
+
+    def __init__(self, template, builder):
+        """
+        Args:
+            template (dict): the ingest document template
+            builder (Builder): the builder that the named functions are resolved on
+        """
+        self.template = template
+        self.builder = builder
+        items = {}
+        self._compile_strings(template, items)
+        id_parts = {}
+        template_id = template.get("id") if isinstance(template, dict) else None
+        if isinstance(template_id, str):
+            for part in template_id.split(":"):
+                self._compile_strings(part, items)
+            id_parts[template_id] = tuple(
+                items[part] for part in template_id.split(":")
+            )
+        self.items = MappingProxyType(items)
+        self.id_parts = MappingProxyType(id_parts)
+        # every replacement name that the builders translate - the replacement values, the id parts,
+        # and the named function params (the id template itself is translated by its parts)
+        replacements = set()
+        for text, item in self.items.items():
+            if item.kind == TemplateItem.REPLACEMENT and text != template_id:
+                replacements.update(item.replacements)
+            if item.function is not None:
+                for _key, param in item.function.params:
+                    replacements.update(param.replacements)
+        self.replacements = frozenset(replacements)
+
+    def _compile_strings(self, element, items):
+        """compile every string key and value in the template"""
+        if isinstance(element, dict):
+            for key, value in element.items():
+                self._compile_strings(key, items)
+                self._compile_strings(value, items)
+        elif isinstance(element, list):
+            for value in element:
+                self._compile_strings(value, items)
+        elif isinstance(element, str) and element not in items:
+            items[element] = self.compile_item(element)
+
+    def compile_item(self, text):
+        """Parse a single template string
+        Args:
+            text (string): a template key or value
+        Returns:
+            TemplateItem: the compiled item
+        """
+        if not isinstance(text, str):
+            return TemplateItem(text, TemplateItem.CONSTANT)
+        # skip the first replacement, it is never really a replacement. It is either '' or not a replacement
+        replacements = tuple(text.split("*")[1:])
+        if text.startswith("&"):
+            return TemplateItem(
+                text,
+                TemplateItem.FUNCTION,
+                replacements,
+                function=self.compile_function(text),
+            )
+        if replacements:
+            return TemplateItem(text, TemplateItem.REPLACEMENT, replacements)
+        return TemplateItem(text, TemplateItem.CONSTANT)
+
+    def compile_function(self, text):
+        """Parse a named function '&named_function|*field1,*field2' or '&named_function|{json}'
+        Args:
+            text (string): the named function definition
+        Returns:
+            NamedFunction: the compiled named function
+        """
+        parts = text.split("|")
+        name = parts[0].replace("&", "")
+        handler = getattr(self.builder, name, None)
+        params = ()
+        json_params = None
+        if len(parts) > 1:
+            if parts[1].startswith("{"):
+                try:
+                    # json loads requires double quotes around key/val strings
+                    json_params = json.loads(parts[1].replace("'", '"'))
+                except ValueError as _e:
+                    return NamedFunction(name, handler, params, error=_e)
+            else:
+                params = tuple(
+                    (_p[1:] if _p[:1] in ("*", "&") else _p, self.compile_item(_p))
+                    for _p in parts[1].split(",")
+                )
+        return NamedFunction(name, handler, params, json_params)
+
+    def get_item(self, text):
+        """Get the compiled item for a template string.
+        Strings that are not in the template are compiled (but not remembered).
+        Args:
+            text (string): a template key or value
+        Returns:
+            TemplateItem: the compiled item
+        """
+        try:
+            item = self.items.get(text)
+        except TypeError:
+            # unhashable values are constants
+            item = None
+        return item if item is not None else self.compile_item(text)
+
+    def get_function(self, text):
+        """Get the compiled named function for a '&named_function|params' string
+        Args:
+            text (string): the named function definition
+        Returns:
+            NamedFunction: the compiled named function
+        """
+        item = self.get_item(text)
+        if item.function is None:
+            return self.compile_function(text)
+        return item.function
+
+    def get_replacements(self, text):
+        """The replacement names in a template string i.e. ('subset', 'model') for '*subset:*model'
+        Args:
+            text (object): a template value
+        Returns:
+            tuple: the replacement names, empty for constants and non strings
+        """
+        return self.get_item(text).replacements
+
+    def get_id_parts(self, template_id):
+        """The compiled ':' separated parts of an id template
+        Args:
+            template_id (string): the id template i.e. 'DD:V01:*subset:&handle_time'
+        Returns:
+            tuple: a TemplateItem for each part
+        """
+        parts = self.id_parts.get(template_id)
+        if parts is None:
+            parts = tuple(self.get_item(part) for part in template_id.split(":"))
+        return parts
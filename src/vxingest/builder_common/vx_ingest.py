@@ -14,10 +14,12 @@ threading model.
 """
 
 import datetime as dt
+import fnmatch
 import json
 import logging
 import os
 import pathlib
+import queue
 import sys
 import threading
 import time
@@ -28,9 +30,14 @@ from couchbase.cluster import Cluster
 from couchbase.exceptions import CouchbaseException
 from couchbase.options import ClusterOptions, ClusterTimeoutOptions
 
+from vxingest.builder_common.ingest_manager import END_OF_QUEUE
+
 # Get a logger with this module's name to help with debugging
 logger = logging.getLogger(__name__)
 
+# the seconds between the checks that the ingest managers are still alive while waiting for them
+MANAGER_POLL_SECONDS = 5
+
 
 class CommonVxIngest:
     """
@@ -51,6 +58,8 @@ class CommonVxIngest:
         self.spec_file = ""
         self.credentials_file = ""
         self.thread_count = ""
+        # the WorkerPool of main, when it is None each runit starts its own processes
+        self.worker_pool = None
         self.first_last_params = None
         self.output_dir = None
         self.load_job_id = None
@@ -70,6 +79,99 @@ class CommonVxIngest:
     def runit(self, args):
         pass
 
+    def sort_by_file_size(self, file_names):
+        """
+        Returns the file names with the largest files first, so that the big files are not
+        started last and do not make a long tail. Files of the same size (or that can not be
+        read) keep their order.
+        """
+
+        def file_size(file_name):
+            try:
+                return pathlib.Path(file_name).stat().st_size
+            except OSError:
+                return 0
+
+        return sorted(file_names, key=file_size, reverse=True)
+
+    def fill_queue(self, element_queue, elements, manager_count):
+        """
+        Put the elements on the queue, followed by one END_OF_QUEUE for each ingest manager
+        Args:
+            element_queue (JoinableQueue): the queue of the ingest managers
+            elements (list): the queue elements (file names, ingest document ids or group names)
+            manager_count (int): the number of ingest managers that get from the queue
+        """
+        for element in elements:
+            element_queue.put(element)
+        for _i in range(int(manager_count)):
+            element_queue.put(END_OF_QUEUE)
+
+    def wait_for_ingest_managers(self, ingest_manager_list, result_queue):
+        """
+        Wait for the completion message of every started ingest manager on the result_queue
+        and join them. An ingest manager that exits without a completion message is logged.
+        Args:
+            ingest_manager_list (list): the ingest managers
+            result_queue (Queue): the result_queue of the ingest managers
+        Returns:
+            list: the elements that failed
+        """
+        failed = []
+        waiting = {
+            manager.thread_name: manager
+            for manager in ingest_manager_list
+            if manager.pid is not None
+        }
+
+        def receive(message):
+            name, processed, manager_failed, error = message
+            logger.info(
+                "%s finished: %d processed, %d failed",
+                name,
+                processed,
+                len(manager_failed),
+            )
+            if error is not None:
+                logger.error("%s stopped with an error: %s", name, error)
+            failed.extend(manager_failed)
+            waiting.pop(name, None)
+
+        while waiting:
+            try:
+                receive(result_queue.get(timeout=MANAGER_POLL_SECONDS))
+            except queue.Empty:
+                dead = [
+                    name for name, manager in waiting.items() if not manager.is_alive()
+                ]
+                # the message of a manager that has exited is already in the queue
+                try:
+                    while True:
+                        receive(result_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                for name in dead:
+                    if name in waiting:
+                        logger.error(
+                            "%s exited (exitcode %s) without finishing",
+                            name,
+                            waiting.pop(name).exitcode,
+                        )
+        for manager in ingest_manager_list:
+            if manager.pid is not None:
+                manager.join()
+        return failed
+
+    def exit_if_failed(self, failed):
+        """
+        Exit with status 1 when some elements failed, so that main counts the proc as failed
+        Args:
+            failed (list): the elements that failed
+        """
+        if failed:
+            logger.error("*** %d elements failed: %s", len(failed), failed)
+            sys.exit(1)
+
     def write_load_job_to_files(self):
         """
         write all the documents in the document_map into files in the output_dir
@@ -184,7 +286,13 @@ class CommonVxIngest:
             ) from _e
 
     def get_file_list(
-        self, df_query, directory, file_pattern, file_mask, first_last_params=None
+        self,
+        df_query,
+        directory,
+        file_pattern,
+        file_mask,
+        first_last_params=None,
+        manifest=None,
     ):
         """This method accepts a file path (directory), a query statement (df_query),
         a file pattern (file_pattern), and a file mask (file_mask). It uses the df_query statement to retrieve a
@@ -193,11 +301,17 @@ class CommonVxIngest:
         to the file url list that is returned from the df_query. The glob pattern matches the entire path.
         It uses the file_mask to filter the file names that represent string date times. Any file names that are not in the returned url list are added and any files
         that are in the list but have newer mtime entries are also added.
+        With a manifest (incremental discovery, see FileManifest) the df_query only needs to return the
+        DF records that match manifest.get_df_condition(), they are merged into the manifest, and the
+        files that the manifest already knows are skipped without a stat. The returned files are recorded
+        in the manifest as queued.
         Args:
             df_query (string): this is a query statement that should return a list of {url:file_url, mtime:mtime}
             directory (string): The full path to a directory that contains files to be ingested
             file_pattern (string): A file glob pattern that matches the files desired.
             file-mask (string): A date-time format string that is applied to the file name only (not the path)
+            first_last_params (dict, optional): the first_epoch and last_epoch of the files
+            manifest (FileManifest, optional): the manifest for incremental discovery
         Raises:
             Exception: general exception
         """
@@ -217,12 +331,25 @@ class CommonVxIngest:
             # Things like tests or special ingest operations may need to wait for consistency. In that case do another query with
             # scan consistency set outside of this operation.
             result = self.cluster.query(df_query)
-            df_elements = list(result)
-            df_full_names = [element["url"] for element in df_elements]
-            logger.debug(
-                "get_file_list: Found %d previously ingested files in database",
-                len(df_full_names),
-            )
+            # url -> mtime of the files that are already ingested (the first DF record of a url)
+            df_mtimes = {}
+            known_files = None
+            if manifest is None:
+                for element in result:
+                    df_mtimes.setdefault(element["url"], element["mtime"])
+                logger.debug(
+                    "get_file_list: Found %d previously ingested files in database",
+                    len(df_mtimes),
+                )
+            else:
+                logger.debug(
+                    "get_file_list: Found %d new DF records in database",
+                    manifest.update_ingested(result),
+                )
+                known_files = manifest.get_known_files()
+                logger.debug(
+                    "get_file_list: The manifest knows %d files", len(known_files)
+                )
             # Handle if the directory is a URL or a local path
             if str(directory).startswith("http://") or str(directory).startswith(
                 "https://"
@@ -251,29 +378,31 @@ class CommonVxIngest:
                     "get_file_list: Directory path does not exist - no files can be found"
                 )
                 return []
-            if pathlib.Path(directory).exists() and pathlib.Path(directory).is_dir():
-                # the file list is sorted by getmtime so that the oldest files are processed first
-                sort_function = os.path.getmtime if file_mask else str
-                file_list = sorted(
-                    pathlib.Path(directory).glob(file_pattern), key=sort_function
-                )
+            if pathlib.Path(directory).is_dir():
+                file_list = self.scan_directory(directory, file_pattern, known_files)
+                # the file list is sorted by mtime so that the oldest files are processed first
+                if file_mask:
+                    file_list.sort(key=lambda file: file[1])
+                else:
+                    file_list.sort()
                 logger.debug(
                     "get_file_list: Globbed %d files from directory %s using pattern %s",
                     len(file_list),
                     directory,
                     file_pattern,
                 )
-                for filename in file_list:
+                for filename, mtime in file_list:
+                    name = pathlib.PurePath(filename).name
                     try:
                         try:
                             if file_mask:
                                 # if the file_mask is defined then try to parse the filename
                                 # according to the mask as a datetime
                                 # it will throw a ValueError if it doesn't match
-                                # the file_mask is applied to the filename only - not the pat
-                                _dt = dt.datetime.strptime(filename.name, file_mask)
+                                # the file_mask is applied to the filename only - not the path
+                                _dt = dt.datetime.strptime(name, file_mask)
                                 # if we get here then the file matched the mask
-                                # check to see if this file is in the first_latst_params range
+                                # check to see if this file is in the first_last_params range
                                 if first_last_params:
                                     first_epoch = first_last_params.get(
                                         "first_epoch", 0
@@ -288,57 +417,51 @@ class CommonVxIngest:
                                     ):
                                         logger.debug(
                                             "get_file_list: File %s (epoch %d) is outside range [%d, %d], skipping",
-                                            filename.name,
+                                            name,
                                             file_epoch,
                                             first_epoch,
                                             last_epoch,
                                         )
                                         continue
-                            else:
-                                # no file mask so just accept the file
-                                pass
                         except ValueError:
                             logger.debug(
                                 "get_file_list: File %s does not match mask %s, skipping",
-                                filename.name,
+                                name,
                                 file_mask,
                             )
                             continue
                         # check to see if this file has already been ingested
-                        # (if it is not in the df_full_names - add it)
-                        if str(filename) not in df_full_names:
+                        # (if it is not in the df_mtimes - add it)
+                        if filename not in df_mtimes:
                             logger.debug(
                                 "%s - File %s is added because it isn't in any datafile document",
                                 self.__class__.__name__,
                                 filename,
                             )
-                            file_names.append(str(filename))
+                            file_names.append(filename)
+                        # it was already processed so check to see if the mtime of the
+                        # file is greater than the mtime in the database entry, if so then add it
+                        elif int(mtime) > int(df_mtimes[filename]):
+                            logger.debug(
+                                "%s - File %s is added because file mtime %s is greater than df mtime %s",
+                                self.__class__.__name__,
+                                filename,
+                                int(mtime),
+                                int(df_mtimes[filename]),
+                            )
+                            file_names.append(filename)
                         else:
-                            # it was already processed so check to see if the mtime of the
-                            # file is greater than the mtime in the database entry, if so then add it
-                            df_entry = next(
-                                element
-                                for element in df_elements
-                                if element["url"] == str(filename)
+                            logger.debug(
+                                "%s - File %s has already been processed and mtime is not greater than DF.mtime - not adding",
+                                self.__class__.__name__,
+                                filename,
                             )
-                            if int(filename.stat().st_mtime) > int(df_entry["mtime"]):
-                                logger.debug(
-                                    "%s - File %s is added because file mtime %s is greater than df mtime %s",
-                                    self.__class__.__name__,
-                                    filename,
-                                    int(filename.stat().st_mtime),
-                                    int(df_entry["mtime"]),
-                                )
-                                file_names.append(str(filename))
-                            else:
-                                logger.debug(
-                                    "%s - File %s has already been processed and mtime is not greater than DF.mtime - not adding",
-                                    self.__class__.__name__,
-                                    filename,
-                                )
                     except Exception as _e:
                         # don't care, it just means it wasn't a properly formatted file per the mask
                         continue
+            if manifest is not None and file_names:
+                file_mtimes = dict(file_list)
+                manifest.add_queued({name: file_mtimes[name] for name in file_names})
             if len(file_names) == 0:
                 logger.info("get_file_list: No files to Process!")
             else:
@@ -356,6 +479,44 @@ class CommonVxIngest:
             )
             return file_names
 
+    def scan_directory(self, directory, file_pattern, skip_paths=None):
+        """Return the paths in the directory that match the glob file_pattern with their mtimes.
+        A pattern for the directory entries (no path separator and no "**") is matched with a
+        single os.scandir pass that reuses the stat result of each entry, other patterns use
+        pathlib glob.
+        Args:
+            directory (string): the directory path
+            file_pattern (string): a glob pattern, relative to the directory
+            skip_paths (set, optional): paths that are left out without a stat
+        Returns:
+            list: (path string, mtime) tuples in directory order, the paths are the same
+            strings that pathlib.Path(directory).glob(file_pattern) would give
+        """
+        files = []
+        directory = str(pathlib.Path(directory))
+        if os.sep in file_pattern or "/" in file_pattern or "**" in file_pattern:
+            for path in pathlib.Path(directory).glob(file_pattern):
+                if skip_paths and str(path) in skip_paths:
+                    continue
+                try:
+                    files.append((str(path), path.stat().st_mtime))
+                except OSError:
+                    logger.debug("scan_directory: can not stat %s, skipping", path)
+            return files
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not fnmatch.fnmatchcase(entry.name, file_pattern):
+                    continue
+                if skip_paths and entry.path in skip_paths:
+                    continue
+                try:
+                    files.append((entry.path, entry.stat().st_mtime))
+                except OSError:
+                    logger.debug(
+                        "scan_directory: can not stat %s, skipping", entry.path
+                    )
+        return files
+
     def get_credentials(self, load_spec):
         """get credentials from a credentials file and puts them into the load_spec
         Args:
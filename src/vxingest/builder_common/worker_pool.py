@@ -0,0 +1,487 @@
+"""
+WorkerPool - long lived ingest worker processes that are shared by all the procs of a run
+"""
+
+import logging
+import multiprocessing
+import threading
+import traceback
+from multiprocessing.connection import wait
+
+from vxingest.log_config import ProcNameFilter
+
+logger = logging.getLogger(__name__)
+
+# the workers are always spawned, a forked worker can inherit a lock that is held by another thread
+SPAWN_CONTEXT = multiprocessing.get_context("spawn")
+
+# the seconds between the checks that the workers are still alive while waiting for results
+WORKER_POLL_SECONDS = 5
+# the seconds that close waits for a worker to exit before it is terminated
+WORKER_CLOSE_SECONDS = 30
+
+
+class PoolWorker(SPAWN_CONTEXT.Process):
+    """A worker process of the WorkerPool.
+    It gets tasks from its own task queue until it gets None. A task is
+    (job_key, proc_name, manager_class, load_spec, output_dir, manager_kwargs, queue_element).
+    While the worker processes a task its log records are tagged with the proc_name of the task
+    (when it is not None) for the ProcLogFilter of the proc's logfile, see log_config.
+    The worker calls the process_queue_element of a manager (a VxIngestManager class) for the
+    queue elements of a job. The managers are kept for the life of the worker, one for each
+    manager class, ingest documents and manager arguments, so the builders (and their caches,
+    i.e. the station grid indexes) of the jobs of every run_priority and every proc that use the
+    same ingest documents are made only once. For another job a kept manager only gets the load_spec
+    and output_dir of that job, see CommonVxIngestManager.set_job. A manager is never started,
+    it is only used for its process_queue_element.
+    The couchbase clusters are kept for the life of the worker and are reused by the managers
+    of every job that uses the same host and user.
+    After each task the worker sends (index, job_key, queue_element, error) on its result
+    connection, error is None on success. The result is sent before the worker gets its next
+    task, so a worker that dies can not leave a half written result behind.
+    """
+
+    def __init__(
+        self, index, task_queue, result_connection, logging_queue, logging_configurer
+    ):
+        """
+        Args:
+            index (int): the index of the worker in the pool
+            task_queue (Queue): the task queue of this worker
+            result_connection (Connection): the sending end of the result pipe of this worker
+            logging_queue (Queue): the queue that passes log messages back to the main process
+            logging_configurer (Callable): sets up the logger in the worker process
+        """
+        super().__init__()
+        self.index = index
+        self.task_queue = task_queue
+        self.result_connection = result_connection
+        # the receiving end of the result pipe, it is only used by the pool
+        self.result_reader = None
+        self.logging_queue = logging_queue
+        self.logging_configurer = logging_configurer
+        # (host, user) -> Cluster
+        self.clusters = {}
+        # (manager_class, ingest document ids, kwargs) -> manager
+        self.managers = {}
+        # (manager_class, ingest document ids, kwargs) -> the job_key of the last job of the manager
+        self.manager_jobs = {}
+
+    @staticmethod
+    def get_manager_key(manager_class, load_spec, kwargs):
+        """the key of the managers that can be shared by jobs - the same class, ingest documents and arguments"""
+        ingest_document_ids = load_spec.get("ingest_document_ids") or sorted(
+            load_spec.get("ingest_documents", {})
+        )
+        return (
+            manager_class,
+            tuple(ingest_document_ids),
+            tuple(sorted(kwargs.items())),
+        )
+
+    def get_manager(self, job_key, manager_class, load_spec, output_dir, kwargs):
+        """return the manager for an element of a job, a kept manager is set up for the job when the job changes"""
+        manager_key = self.get_manager_key(manager_class, load_spec, kwargs)
+        manager = self.managers.get(manager_key)
+        if manager is not None and self.manager_jobs[manager_key] == job_key:
+            return manager
+        if manager is None:
+            manager = manager_class(
+                self.name,
+                load_spec,
+                None,
+                output_dir,
+                self.logging_queue,
+                self.logging_configurer,
+                **kwargs,
+            )
+        else:
+            manager.set_job(load_spec, output_dir)
+        manager.cb_credentials = load_spec["cb_connection"]
+        cluster_key = (
+            manager.cb_credentials["host"],
+            manager.cb_credentials["user"],
+        )
+        manager.connect_cb(self.clusters.get(cluster_key))
+        self.clusters[cluster_key] = manager.cluster
+        self.managers[manager_key] = manager
+        self.manager_jobs[manager_key] = job_key
+        return manager
+
+    def run(self):
+        self.logging_configurer(self.logging_queue)
+        # the handlers tag the records with the proc of the current task
+        proc_filter = ProcNameFilter(None)
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(proc_filter)
+        logger.info("%s: PoolWorker started", self.name)
+        try:
+            while True:
+                task = self.task_queue.get()
+                if task is None:
+                    break
+                (
+                    job_key,
+                    proc_name,
+                    manager_class,
+                    load_spec,
+                    output_dir,
+                    kwargs,
+                    element,
+                ) = task
+                proc_filter.proc_name = proc_name
+                error = None
+                try:
+                    manager = self.get_manager(
+                        job_key, manager_class, load_spec, output_dir, kwargs
+                    )
+                    manager.process_queue_element(element)
+                except Exception as _e:
+                    logger.exception(
+                        "%s: PoolWorker - error processing %s", self.name, element
+                    )
+                    error = "".join(traceback.format_exception_only(_e)).strip()
+                self.result_connection.send((self.index, job_key, element, error))
+                proc_filter.proc_name = None
+        finally:
+            for cluster in self.clusters.values():
+                try:
+                    cluster.close()
+                except Exception:
+                    logger.exception(
+                        "%s: PoolWorker - error closing cluster", self.name
+                    )
+            logger.info("%s: PoolWorker finished", self.name)
+
+
+class PoolJob:
+    """The state of a job (the queue elements of a proc) that the WorkerPool is running"""
+
+    def __init__(
+        self,
+        key,
+        proc_name,
+        manager_class,
+        load_spec,
+        output_dir,
+        elements,
+        max_workers,
+        kwargs,
+    ):
+        """
+        Args:
+            key (int): the job_key
+            proc_name (str): the name of the proc, for its logfile, or None
+            manager_class (class): the VxIngestManager class of the job
+            load_spec (dict): the load_spec of the job
+            output_dir (str): the output directory of the job
+            elements (list): the queue elements
+            max_workers (int): the most workers that process the elements of the job at the same time
+            kwargs (dict): other keyword arguments for the manager_class constructor
+        """
+        self.key = key
+        self.proc_name = proc_name
+        self.manager_class = manager_class
+        self.load_spec = load_spec
+        self.output_dir = output_dir
+        self.element_count = len(elements)
+        self.pending = list(reversed(elements))
+        self.max_workers = max_workers
+        self.kwargs = kwargs
+        # the number of elements that are being processed
+        self.running = 0
+        self.failed = []
+        self.done = threading.Event()
+
+    def get_task(self):
+        """return the task for the next pending element"""
+        element = self.pending.pop()
+        self.running += 1
+        return (
+            self.key,
+            self.proc_name,
+            self.manager_class,
+            self.load_spec,
+            self.output_dir,
+            self.kwargs,
+            element,
+        )
+
+    def is_finished(self):
+        """all the elements have been processed"""
+        return not self.pending and self.running == 0
+
+
+class ProcWorkerPool:
+    """The view of a WorkerPool that the runit of a proc is given, its jobs run with the proc's
+    share of the workers (the --threads of the proc) so the procs that run at the same time
+    share the pool instead of each one taking all the workers. The log records of the workers
+    are tagged with the proc_name while they process an element of the proc."""
+
+    def __init__(self, pool, max_workers, proc_name=None):
+        """
+        Args:
+            pool (WorkerPool): the pool
+            max_workers (int): the most workers that the jobs of the proc use at the same time
+            proc_name (str, optional): the name of the proc for its logfile. Defaults to None.
+        """
+        self.pool = pool
+        self.max_workers = max_workers
+        self.proc_name = proc_name
+
+    def run(self, manager_class, load_spec, output_dir, elements, **kwargs):
+        """see WorkerPool.run"""
+        return self.pool.run(
+            manager_class,
+            load_spec,
+            output_dir,
+            elements,
+            max_workers=self.max_workers,
+            proc_name=self.proc_name,
+            **kwargs,
+        )
+
+
+class WorkerPool:
+    """A pool of PoolWorker processes that main starts once and that processes the queue
+    elements of every proc of the run, so the worker processes are not started (and do not
+    import the builders and connect to couchbase) again for every proc.
+    run returns when all the elements of the job have been processed. The jobs of procs that
+    run at the same time (--concurrent_procs) are run together, a dispatcher thread gives each
+    idle worker the next element of the jobs in turn, with at most max_workers workers for a job.
+    Each worker is given one element at a time, so the pool always knows which element a worker
+    has. A worker that dies (its result pipe is closed, or it is no longer alive) is replaced and
+    its element is reported as failed.
+    Usage:
+        pool = WorkerPool(threads, log_queue, worker_log_configurer)
+        failed = pool.run(VxIngestManager, load_spec, output_dir, file_names)
+        ...
+        pool.close()
+    """
+
+    def __init__(self, size, logging_queue, logging_configurer):
+        """
+        Args:
+            size (int): the number of worker processes
+            logging_queue (Queue): the queue that passes log messages back to the main process
+            logging_configurer (Callable): sets up the logger in a worker process
+        """
+        self.logging_queue = logging_queue
+        self.logging_configurer = logging_configurer
+        self.job_count = 0
+        # the lock guards the jobs, everything else is only used by the dispatcher thread
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.closing = False
+        # worker index -> (job, element)
+        self.assigned = {}
+        self.workers = [self.start_worker(index) for index in range(max(1, int(size)))]
+        # run and close wake the dispatcher up while it waits for results
+        self.wakeup_reader, self.wakeup_writer = SPAWN_CONTEXT.Pipe(duplex=False)
+        self.dispatcher = threading.Thread(
+            target=self.dispatch, name="WorkerPoolDispatcher", daemon=True
+        )
+        self.dispatcher.start()
+
+    def start_worker(self, index):
+        """start and return a new PoolWorker"""
+        result_reader, result_connection = SPAWN_CONTEXT.Pipe(duplex=False)
+        worker = PoolWorker(
+            index,
+            SPAWN_CONTEXT.Queue(),
+            result_connection,
+            self.logging_queue,
+            self.logging_configurer,
+        )
+        worker.result_reader = result_reader
+        worker.start()
+        # only the worker writes to the pipe, so the reader gets EOF when the worker dies
+        result_connection.close()
+        return worker
+
+    def for_proc(self, max_workers, proc_name=None):
+        """return the view of the pool for a proc that uses at most max_workers workers"""
+        return ProcWorkerPool(self, max_workers, proc_name)
+
+    def wake_up(self):
+        """wake the dispatcher up, the lock must be held"""
+        self.wakeup_writer.send(None)
+
+    def replace_worker(self, index):
+        """Replace a dead worker, its element (if it had one) fails"""
+        worker = self.workers[index]
+        worker.join()
+        worker.result_reader.close()
+        job, element = self.assigned.pop(index, (None, None))
+        logger.error(
+            "WorkerPool: %s died (exitcode %s) while processing %s, starting a new worker",
+            worker.name,
+            worker.exitcode,
+            element,
+        )
+        self.workers[index] = self.start_worker(index)
+        if job is not None:
+            job.running -= 1
+            job.failed.append(element)
+
+    def replace_dead_workers(self):
+        """Replace the workers that are no longer alive"""
+        for index, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                self.replace_worker(index)
+
+    def assign_idle_workers(self):
+        """Give each idle worker an element, the jobs take turns and a job gets at most max_workers workers"""
+        idle = [
+            index for index in range(len(self.workers)) if index not in self.assigned
+        ]
+        while idle:
+            with self.lock:
+                jobs = [
+                    job
+                    for job in self.jobs
+                    if job.pending and job.running < job.max_workers
+                ]
+            if not jobs:
+                return
+            for job in jobs:
+                if not idle:
+                    return
+                index = idle.pop(0)
+                task = job.get_task()
+                self.assigned[index] = (job, task[-1])
+                self.workers[index].task_queue.put(task)
+
+    def receive(self, index):
+        """receive the result of a worker"""
+        reader = self.workers[index].result_reader
+        try:
+            _index, key, element, error = reader.recv()
+        except EOFError:
+            # the worker died
+            self.replace_worker(index)
+            return
+        job, assigned_element = self.assigned.get(index, (None, None))
+        if job is None or key != job.key or assigned_element != element:
+            # a result that does not belong to the element that the worker was given
+            return
+        del self.assigned[index]
+        job.running -= 1
+        if error is not None:
+            logger.error("WorkerPool: %s failed: %s", element, error)
+            job.failed.append(element)
+
+    def finish_jobs(self):
+        """end the jobs whose elements have all been processed"""
+        with self.lock:
+            finished = [job for job in self.jobs if job.is_finished()]
+            self.jobs = [job for job in self.jobs if not job.is_finished()]
+        for job in finished:
+            job.done.set()
+
+    def dispatch(self):
+        """The dispatcher thread - assigns the elements of the jobs to the workers and collects the results"""
+        try:
+            while True:
+                with self.lock:
+                    if self.closing:
+                        break
+                self.assign_idle_workers()
+                readers = {
+                    self.workers[index].result_reader: index for index in self.assigned
+                }
+                ready = wait(
+                    [*readers, self.wakeup_reader], timeout=WORKER_POLL_SECONDS
+                )
+                if self.wakeup_reader in ready:
+                    while self.wakeup_reader.poll():
+                        self.wakeup_reader.recv()
+                if not any(reader in readers for reader in ready):
+                    self.replace_dead_workers()
+                for reader in ready:
+                    if reader in readers:
+                        self.receive(readers[reader])
+                self.finish_jobs()
+        except Exception:
+            logger.exception("WorkerPool: the dispatcher failed")
+        finally:
+            # the elements of the jobs that are left fail, so that run does not wait forever
+            with self.lock:
+                self.closing = True
+                jobs = self.jobs
+                self.jobs = []
+            for job in jobs:
+                job.failed.extend(
+                    element
+                    for assigned_job, element in self.assigned.values()
+                    if assigned_job is job
+                )
+                job.failed.extend(reversed(job.pending))
+                job.done.set()
+
+    def run(
+        self,
+        manager_class,
+        load_spec,
+        output_dir,
+        elements,
+        max_workers=None,
+        proc_name=None,
+        **kwargs,
+    ):
+        """Process the elements of a job with the workers and wait for them to finish
+        Args:
+            manager_class (class): the VxIngestManager class of the job
+            load_spec (dict): the load_spec of the job
+            output_dir (str): the output directory of the job
+            elements (list): the queue elements (file names, ingest document ids or group names)
+            max_workers (int, optional): the most workers for the job. Defaults to None (all of them).
+            proc_name (str, optional): tags the log records of the job for the proc's logfile. Defaults to None.
+            kwargs: other keyword arguments for the manager_class constructor
+        Returns:
+            list: the elements that failed
+        The jobs of procs that run at the same time share the workers.
+        """
+        with self.lock:
+            if self.closing:
+                raise RuntimeError("WorkerPool: the pool is closed")
+            self.job_count += 1
+            job = PoolJob(
+                self.job_count,
+                proc_name,
+                manager_class,
+                load_spec,
+                output_dir,
+                elements,
+                max_workers or len(self.workers),
+                kwargs,
+            )
+            self.jobs.append(job)
+            self.wake_up()
+        job.done.wait()
+        logger.info(
+            "WorkerPool: job %d processed %d elements, %d failed",
+            job.key,
+            job.element_count,
+            len(job.failed),
+        )
+        return job.failed
+
+    def close(self):
+        """stop the dispatcher and the workers, a worker that does not stop is terminated"""
+        with self.lock:
+            self.closing = True
+            self.wake_up()
+        self.dispatcher.join()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+        for worker in self.workers:
+            worker.task_queue.put(None)
+        for worker in self.workers:
+            worker.join(WORKER_CLOSE_SECONDS)
+            if worker.is_alive():
+                logger.error("WorkerPool: terminating %s", worker.name)
+                worker.terminate()
+                worker.join()
+            worker.result_reader.close()
+        self.workers = []
@@ -0,0 +1,132 @@
+"""
+Program Name: contingency_table.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import logging
+
+import numpy as np
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+CONTINGENCY_KEYS = ["hits", "false_alarms", "misses", "correct_negatives"]
+
+
+def contingency_counts(model_values, obs_values, thresholds):
+    """Count the hits, false alarms, misses and correct negatives for every threshold at once.
+    A value is an event when it is less than the threshold, so for each threshold
+    hits: model and obs < threshold, false_alarms: only the model < threshold,
+    misses: only the obs < threshold, correct_negatives: neither < threshold.
+    Args:
+        model_values (list or ndarray): the model values for the stations
+        obs_values (list or ndarray): the obs values for the same stations (aligned with model_values)
+        thresholds (list): the thresholds
+    Returns:
+        dict: threshold -> {"hits", "false_alarms", "misses", "correct_negatives"} (ints)
+    """
+    model_values = np.asarray(model_values, dtype=np.float64)
+    obs_values = np.asarray(obs_values, dtype=np.float64)
+    threshold_values = np.asarray(thresholds, dtype=np.float64)[:, np.newaxis]
+    # (thresholds, stations) event matrices
+    model_events = model_values[np.newaxis, :] < threshold_values
+    obs_events = obs_values[np.newaxis, :] < threshold_values
+    counts = {
+        "hits": (model_events & obs_events).sum(axis=1),
+        "false_alarms": (model_events & ~obs_events).sum(axis=1),
+        "misses": (~model_events & obs_events).sum(axis=1),
+        "correct_negatives": (~model_events & ~obs_events).sum(axis=1),
+    }
+    counts = {key: value.tolist() for key, value in counts.items()}
+    return {
+        threshold: {key: counts[key][index] for key in CONTINGENCY_KEYS}
+        for index, threshold in enumerate(thresholds)
+    }
+
+
+class StationPairs:
+    """The model and obs values of one variable, aligned once for the stations of one or more regions.
+    Each station has a bitmask of the regions that it is in (bit i for region i), so the contingency
+    tables of every region are counted from the same arrays without another pass over the stations.
+    The stations are sorted into the same groups that handle_data counts differently:
+    pairs of numbers, pairs with a None, stations that are not in the obs and stations whose
+    values are not numbers (or missing), which are counted with the scalar rules.
+    """
+
+    # the masks are uint64 so there can be at most 64 regions
+    MAX_REGIONS = 64
+
+    def __init__(
+        self, model_stations, obs_data, obs_station_names, variable, station_regions
+    ):
+        """
+        Args:
+            model_stations (dict): station name -> model element (the model document's data section)
+            obs_data (dict): station name -> obs element
+            obs_station_names (set): the names of the stations that have obs
+            variable (str): the capitalized variable i.e. Ceiling
+            station_regions (dict): station name -> region bitmask (stations that are in no region are left out)
+        """
+        pair_masks = []
+        model_values = []
+        obs_values = []
+        none_masks = []
+        self.not_found_stations = []
+        self.other_stations = []
+        for model_station_name, model_station in model_stations.items():
+            mask = station_regions.get(model_station_name, 0)
+            # only the ones that are in one of the regions
+            if not mask:
+                continue
+            if model_station_name not in obs_station_names:
+                self.not_found_stations.append((model_station_name, mask))
+                continue
+            try:
+                model_value = model_station[variable]
+                obs_value = obs_data[model_station_name][variable]
+            except Exception:
+                self.other_stations.append((model_station_name, mask))
+                continue
+            if model_value is None or obs_value is None:
+                none_masks.append(mask)
+            elif isinstance(model_value, int | float) and isinstance(
+                obs_value, int | float
+            ):
+                pair_masks.append(mask)
+                model_values.append(model_value)
+                obs_values.append(obs_value)
+            else:
+                self.other_stations.append((model_station_name, mask))
+        self.pair_masks = np.array(pair_masks, dtype=np.uint64)
+        self.model_values = np.array(model_values, dtype=np.float64)
+        self.obs_values = np.array(obs_values, dtype=np.float64)
+        self.none_masks = np.array(none_masks, dtype=np.uint64)
+
+    def get_counts(self, region_index, thresholds):
+        """Count the contingency table of a region for every threshold
+        Args:
+            region_index (int): the region's bit
+            thresholds (list): the thresholds
+        Returns:
+            (dict, int): threshold -> {hits, false_alarms, misses, correct_negatives} and the none_count
+        """
+        bit = np.uint64(1 << region_index)
+        selected = (self.pair_masks & bit) != 0
+        counts = contingency_counts(
+            self.model_values[selected], self.obs_values[selected], thresholds
+        )
+        none_count = int(np.count_nonzero(self.none_masks & bit))
+        return counts, none_count
+
+    def get_not_found_stations(self, region_index):
+        """the region's stations that are not in the obs"""
+        return [
+            name for name, mask in self.not_found_stations if mask >> region_index & 1
+        ]
+
+    def get_other_stations(self, region_index):
+        """the region's stations that are counted with the scalar rules"""
+        return [name for name, mask in self.other_stations if mask >> region_index & 1]
@@ -0,0 +1,288 @@
+"""
+Program Name: Class DerivedStatisticsBuilder
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import logging
+
+from couchbase.exceptions import DocumentNotFoundException
+
+from vxingest.builder_common.builder import Builder
+from vxingest.builder_common.document_prefetcher import DocumentPrefetcher
+from vxingest.ctc_to_cb import ctc_builder
+from vxingest.ctc_to_cb.contingency_table import StationPairs
+from vxingest.partial_sums_to_cb import partial_sums_builder
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+# the modules that define the builders that derived statistics can be made with
+BUILDER_MODULES = [ctc_builder, partial_sums_builder]
+
+
+def group_ingest_documents(ingest_documents):
+    """Group the CTC and SUMS ingest documents by subset and model.
+    All the ingest documents of a group use the same model and obs documents, so
+    a group is built with one pass over the model and obs documents.
+    Args:
+        ingest_documents (dict): ingest document id -> ingest document
+    Returns:
+        dict: group name ("DERIVED:subset:model") -> list of ingest document ids
+    """
+    groups = {}
+    for ingest_document_id, ingest_document in ingest_documents.items():
+        group_name = f"DERIVED:{ingest_document['subset']}:{ingest_document['model']}"
+        groups.setdefault(group_name, []).append(ingest_document_id)
+    return groups
+
+
+class DerivedStatisticsBuilder(Builder):
+    """This builder creates the CTC and the partial sums (SUMS) documents for all the
+    ingest documents of a model with one pass over the model and obs documents.
+    The CTC and SUMS builders each query the epoch bounds and the model/obs fcstValidEpochs
+    and read every model and obs document for their own ingest document. This builder
+    uses one CTC or SUMS builder per ingest document for the parts that are specific to it
+    (the latest existing document epoch, the region stations and the document templates)
+    and shares the rest: the epoch bounds and fcstValidEpochs are queried once and
+    each model and obs document is read once and handed to every builder that needs it.
+    The builders that differ only by region (same kind of document and variable) also share
+    the alignment of the model and obs values, see handle_regions.
+    """
+
+    def __init__(self, load_spec, ingest_document=None):
+        """
+        Args:
+            load_spec (dict): the load_spec, with the ingest_documents and the derived_groups
+            ingest_document (dict, optional): not used, the ingest documents are in the load_spec
+        """
+        super().__init__(load_spec, ingest_document)
+        # ingest document id -> the CTC or SUMS builder for it
+        self.builders = {}
+
+    def initialize_document_map(self):
+        """
+        reset the document_map for a new group
+        """
+        self.document_map = {}
+
+    def get_document_map(self):
+        return self.document_map
+
+    def get_builder(self, ingest_document_id):
+        """Return the builder for an ingest document, instantiated on first use.
+        A builder is kept for each ingest document (not for each builderType) because
+        the builders keep state that is specific to the ingest document, i.e. the CTC thresholds.
+        Args:
+            ingest_document_id (str): the ingest document id
+        Returns:
+            the CTC or SUMS builder
+        """
+        if ingest_document_id not in self.builders:
+            ingest_document = self.load_spec["ingest_documents"][ingest_document_id]
+            builder_name = ingest_document["builderType"]
+            for module in BUILDER_MODULES:
+                builder_class = getattr(module, builder_name, None)
+                if builder_class is not None:
+                    break
+            else:
+                raise ValueError(f"no builder class for {builder_name}")
+            self.builders[ingest_document_id] = builder_class(
+                self.load_spec, ingest_document
+            )
+        return self.builders[ingest_document_id]
+
+    def build_document(self, queue_element):
+        """
+        This is the entry point for the DerivedStatisticsBuilder from the ingestManager.
+        1) set up a builder for each ingest document of the group
+        2) get the range of valid epochs (the same for all of them) and the latest existing
+        CTC or SUMS epoch for each ingest document
+        3) get the model/obs fcstValidEpochs after the earliest of those
+        4) read each model and obs document once and handle a document with each builder
+        that does not already have that fcstValidEpoch
+        Args:
+            queue_element (str): a group name, see group_ingest_documents
+        Returns:
+            dict: the CTC and SUMS documents of all the builders
+        """
+        try:
+            self.initialize_document_map()
+            ingest_document_ids = self.load_spec["derived_groups"][queue_element]
+            builders = []
+            for ingest_document_id in ingest_document_ids:
+                builder = self.get_builder(ingest_document_id)
+                builder.set_ingest_document(ingest_document_id)
+                builders.append(builder)
+            if not builders:
+                return self.get_document_map()
+            valid_epochs = builders[0].get_valid_epoch_range()
+            if valid_epochs is None:
+                return self.get_document_map()
+            min_valid_epochs, max_valid_epochs = valid_epochs
+            # builder -> the latest fcstValidEpoch that it already has documents for
+            latest_epochs = {}
+            for builder in builders:
+                latest_epoch = builder.get_latest_epoch(
+                    min_valid_epochs, max_valid_epochs
+                )
+                if latest_epoch is not None:
+                    latest_epochs[builder] = latest_epoch
+            if not latest_epochs:
+                return self.get_document_map()
+            model_obs_fves = builders[0].get_model_obs_fves(
+                min(latest_epochs.values()), max_valid_epochs
+            )
+            self.handle_fcstValidEpochs(model_obs_fves, latest_epochs)
+            for builder in latest_epochs:
+                logger.info(
+                    "%s %s: there were %s stations not found",
+                    self.__class__.__name__,
+                    builder.__class__.__name__,
+                    builder.not_found_station_count,
+                )
+                self.document_map.update(builder.get_document_map())
+            return self.get_document_map()
+        except Exception as _e:
+            logger.error(
+                "%s: Exception with builder build_document: error: %s for element %s",
+                self.__class__.__name__,
+                str(_e),
+                queue_element,
+            )
+            return {}
+
+    def handle_fcstValidEpochs(self, model_obs_fves, latest_epochs):
+        """Read each model and obs document once and handle the document for each builder
+        that needs the fcstValidEpoch.
+        Args:
+            model_obs_fves (list): the {fcstValidEpoch:fve, fcstLen:fl, id:an_id} rows that have obs
+            latest_epochs (dict): builder -> the latest fcstValidEpoch that it already has
+        """
+        builders = list(latest_epochs)
+        prefetch_ids = []
+        for fve in model_obs_fves:
+            prefetch_ids.append(fve["id"])
+            prefetch_ids.append(builders[0].get_obs_id(fve))
+        obs_id = None
+        obs_data = {}
+        obs_station_names = []
+        with DocumentPrefetcher(
+            self.load_spec["collection"], prefetch_ids
+        ) as prefetcher:
+            for fve in model_obs_fves:
+                fve_builders = [
+                    builder
+                    for builder in builders
+                    if fve["fcstValidEpoch"] > latest_epochs[builder]
+                ]
+                if not fve_builders:
+                    continue
+                try:
+                    model_data = prefetcher.get(fve["id"]).content_as[dict]
+                    if not model_data["data"]:
+                        logger.info(
+                            "%s handle_fcstValidEpochs: model document %s has no data! ",
+                            self.__class__.__name__,
+                            fve["id"],
+                        )
+                        continue
+                    # the obs documents are shared by the fcstLens of a fcstValidEpoch
+                    if obs_id != builders[0].get_obs_id(fve):
+                        obs_id = builders[0].get_obs_id(fve)
+                        obs_data = prefetcher.get(obs_id).content_as[dict]["data"]
+                        obs_station_names = sorted(obs_data)
+                    if not obs_data:
+                        logger.info(
+                            "%s handle_fcstValidEpochs: obs document %s has no data! ",
+                            self.__class__.__name__,
+                            obs_id,
+                        )
+                        continue
+                except DocumentNotFoundException:
+                    logger.info(
+                        "%s handle_fcstValidEpochs: model or obs document for %s was not found! ",
+                        self.__class__.__name__,
+                        fve["id"],
+                    )
+                    obs_id = None
+                    continue
+                # the builders of a variable align the stations of all their regions once
+                for region_builders in self.get_region_groups(fve_builders):
+                    self.handle_regions(
+                        region_builders, fve, model_data, obs_data, obs_station_names
+                    )
+
+    def get_region_groups(self, builders):
+        """Group the builders that build the same kind of document for the same variable,
+        with at most StationPairs.MAX_REGIONS regions in a group.
+        Args:
+            builders (list): the CTC and SUMS builders
+        Returns:
+            list: lists of builders
+        """
+        groups = {}
+        for builder in builders:
+            group = groups.setdefault((builder.__class__, builder.variable), [[]])
+            regions = {region_builder.region for region_builder in group[-1]}
+            if (
+                builder.region not in regions
+                and len(regions) == StationPairs.MAX_REGIONS
+            ):
+                group.append([])
+            group[-1].append(builder)
+        return [
+            region_builders for group in groups.values() for region_builders in group
+        ]
+
+    def handle_regions(
+        self, region_builders, fve, model_data, obs_data, obs_station_names
+    ):
+        """Handle the documents of builders that differ only by region. The stations of all
+        the regions are aligned once (each station has a bitmask of its regions) and each
+        builder counts its region from the shared arrays.
+        Args:
+            region_builders (list): builders of the same class and variable
+            fve (dict): the {fcstValidEpoch, fcstLen, id} model element
+            model_data (dict): the model document
+            obs_data (dict): station name -> obs element
+            obs_station_names (list): the sorted obs station names
+        """
+        region_names = list(
+            dict.fromkeys(builder.region for builder in region_builders)
+        )
+        for builder in region_builders:
+            builder.model_data = model_data
+            builder.obs_data = obs_data
+            builder.obs_station_names = obs_station_names
+        try:
+            aligned_stations = region_builders[0].align_regions(
+                region_names, fve["fcstValidEpoch"]
+            )
+        except Exception:
+            logger.exception(
+                "%s handle_regions: could not align the stations of %s for %s",
+                self.__class__.__name__,
+                region_names,
+                fve["id"],
+            )
+            return
+        for builder in region_builders:
+            try:
+                builder.domain_stations = builder.get_stations_for_region_by_sort(
+                    builder.region, fve["fcstValidEpoch"]
+                )
+                builder.aligned_stations = aligned_stations
+                builder.region_index = region_names.index(builder.region)
+                builder.handle_document()
+            except Exception:
+                logger.exception(
+                    "%s handle_regions: %s failed for %s",
+                    self.__class__.__name__,
+                    builder.__class__.__name__,
+                    fve["id"],
+                )
+            finally:
+                builder.aligned_stations = None
@@ -0,0 +1,229 @@
+"""
+Program Name: main script for VXingest
+Contact(s): Randy Pierce
+Abstract:
+
+History Log:  Initial version
+
+Usage:
+run_ingest_threads -j job_document_id -c credentials_file [-o output_dir -s start_epoch -e end_epoch -t thread_count]
+This script derives the CTC and the partial sums (SUMS) documents of a model in one pass.
+The ingest_document_ids of the job are the CTC and SUMS ingest documents that the
+CTC and SUMS jobs would process separately. They are grouped by subset and model
+(see derived_builder.group_ingest_documents) and the group names are put into a queue.
+The script maintains a pool of VxIngestManager worker processes, the number of
+workers is set to the -t n (or --threads n) argument. Each VxIngestManager pulls
+groups, one at a time, from the queue and reads the model and obs documents of the
+group once for all of its CTC and SUMS ingest documents.
+When the queue is empty each VxIngestManager will gracefully exit.
+
+The optional output_dir specifies the directory where output files will be written instead
+of writing them directly to couchbase. If start/end epochs are unspecified, a default
+window of now-30 days through now is used, and each ingest document is clamped to its
+latest existing CTC or SUMS fcstValidEpoch, as in the CTC and SUMS jobs.
+
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import logging
+import os
+import sys
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from multiprocessing import JoinableQueue, Queue, set_start_method
+from pathlib import Path
+
+from vxingest.builder_common.vx_ingest import CommonVxIngest
+from vxingest.derived_to_cb.derived_builder import group_ingest_documents
+from vxingest.derived_to_cb.vx_ingest_manager import VxIngestManager
+from vxingest.log_config import configure_logging, worker_log_configurer
+from vxingest.partial_sums_to_cb.run_ingest_threads import parse_args
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+
+class VXIngest(CommonVxIngest):
+    """
+    This class is the commandline mechanism for deriving the CTC and SUMS documents together.
+    This class will maintain the couchbase collection and cluster objects for all
+    the ingest managers that this thread will use. There will be VxIngestManagers started
+    to match the threadcount that is passed in. The default number of threads is one.
+    Args:
+        object ([dict]): [parsed cmdline arguments]
+    Raises:
+        _e: [general exception]
+    """
+
+    def __init__(self):
+        self.load_time_start = time.perf_counter()
+        self.credentials_file = ""
+        self.thread_count = ""
+        self.first_last_params = None
+        self.output_dir = None
+        self.load_job_id = None
+        self.load_spec = {}
+        self.cb_credentials = None
+        self.collection = None
+        self.cluster = None
+        self.ingest_document_id = None
+        self.ingest_document = None
+        super().__init__()
+
+    def runit(self, config, log_queue: Queue, log_configurer: Callable[[Queue], None]):
+        """
+        This is the entry point for run_ingest_threads.py
+        The config is the same as for the CTC and SUMS jobs, the ingest_document_ids
+        can be any mix of CTC and SUMS ingest documents.
+        """
+        begin_time = str(datetime.now())
+        logger.info("--- *** --- Start --- *** ---")
+        logger.info("Begin a_time: %s", begin_time)
+        self.credentials_file = config["credentials_file"].strip()
+        self.thread_count = config["threads"]
+        self.worker_pool = config.get("worker_pool", None)
+        _output_dir = config["output_dir"]
+        if _output_dir is not None:
+            self.output_dir = _output_dir.strip()
+        if (
+            "start_epoch" in config
+            and "end_epoch" in config
+            and config["start_epoch"] is not None
+            and config["end_epoch"] is not None
+        ):
+            self.first_last_params = {
+                "first_epoch": config["start_epoch"],
+                "last_epoch": config["end_epoch"],
+            }
+        else:
+            now_epoch = int(time.time())
+            self.first_last_params = {
+                "first_epoch": now_epoch - int(timedelta(days=30).total_seconds()),
+                "last_epoch": now_epoch,
+            }
+        # stash the first_last_params into the load spec
+        self.load_spec["first_last_params"] = self.first_last_params
+        logger.info(
+            "*** Using first_last_params: %s ***",
+            str(self.load_spec["first_last_params"]),
+        )
+        try:
+            # put the real credentials into the load_spec
+            logger.info("getting cb_credentials")
+            self.cb_credentials = self.get_credentials(self.load_spec)
+            # get the intended subset (collection from the job_id)
+            self.cb_credentials["collection"] = config["collection"]
+            # establish connections to cb, collection
+            self.connect_cb()
+            logger.info("connected to cb - collection is %s", self.collection.name)
+            self.load_spec["ingest_document_ids"] = config["ingest_document_ids"]
+            # put all the ingest documents into the load_spec too
+            self.load_spec["ingest_documents"] = {}
+            for _id in self.load_spec["ingest_document_ids"]:
+                self.load_spec["ingest_documents"][_id] = self.runtime_collection.get(
+                    _id
+                ).content_as[dict]
+            # the ingest documents that share model and obs documents are built together
+            self.load_spec["derived_groups"] = group_ingest_documents(
+                self.load_spec["ingest_documents"]
+            )
+            self.load_spec["fmask"] = config["file_mask"]
+            self.load_spec["input_data_path"] = config["input_data_path"]
+            # the format and compression of the output files, see DocumentFileWriter
+            self.load_spec["output_format"] = config.get("output_format", "list")
+            self.load_spec["output_compression"] = config.get(
+                "output_compression", "none"
+            )
+            # stash the load_job in the load_spec
+            self.load_spec["load_job_doc"] = self.build_load_job_doc(
+                self.load_spec["cb_connection"]["collection"]
+            )
+        except (RuntimeError, TypeError, NameError, KeyError) as err:
+            logger.error(
+                "*** Error occurred in Main reading load_spec: %s ***",
+                str(sys.exc_info()),
+            )
+            raise RuntimeError("*** Error reading load_spec:") from err
+
+        _q = JoinableQueue()
+        if self.worker_pool is not None:
+            # the long lived worker processes of main process the elements, see WorkerPool
+            finished = self.worker_pool.run(
+                VxIngestManager,
+                self.load_spec,
+                self.output_dir,
+                list(self.load_spec["derived_groups"]),
+            )
+        else:
+            # the queue ends with an END_OF_QUEUE for each ingest manager, and each
+            # ingest manager reports back on _results when it is finished
+            self.fill_queue(_q, self.load_spec["derived_groups"], self.thread_count)
+            _results = Queue()
+            ingest_manager_list = []
+            logger.info(
+                f"The ingest document groups in the queue are: {self.load_spec['derived_groups']}"
+            )
+            logger.info(f"Starting {self.thread_count} processes")
+            for thread_count in range(int(self.thread_count)):
+                try:
+                    ingest_manager_thread = VxIngestManager(
+                        f"VxIngestManager-{thread_count + 1}",  # Processes are 1 indexed in the logger
+                        self.load_spec,
+                        _q,
+                        self.output_dir,
+                        log_queue,  # Queue to pass logging messages back to the main process on
+                        log_configurer,  # Config function to set up the logger in the multiprocess Process
+                    )
+                    ingest_manager_thread.result_queue = _results
+                    ingest_manager_list.append(ingest_manager_thread)
+                    ingest_manager_thread.start()  # This calls a .run() method in the class
+                    logger.info(f"Started thread: VxIngestManager-{thread_count + 1}")
+                except Exception as _e:
+                    logger.error("*** Error in VXIngest %s***", str(_e))
+                    raise _e
+            # wait for the completion message of every ingest manager and join them
+            finished = self.wait_for_ingest_managers(ingest_manager_list, _results)
+        logger.info("Finished processes")
+        self.write_load_job_to_files()
+        logger.info("Finished writing files")
+        load_time_end = time.perf_counter()
+        load_time = timedelta(seconds=load_time_end - self.load_time_start)
+        logger.info(" finished %s", str(finished))
+        logger.info("    >>> Total load a_time: %s", str(load_time))
+        logger.info("End a_time: %s", str(datetime.now()))
+        logger.info("--- *** --- End  --- *** ---")
+        self.exit_if_failed(finished)
+        return
+
+    def main(self):
+        """
+        This is the entry for run_ingest_threads
+        """
+        # Force new processes to start with a clean environment
+        # "fork" is the default on Linux and can be unsafe
+        set_start_method("spawn")
+
+        # Setup logging for the main process so we can use the "logger"
+        log_queue = Queue()
+        runtime = datetime.now()
+        log_queue_listener = configure_logging(
+            log_queue, Path(f"all_logs-{runtime.strftime('%Y-%m-%dT%H:%M:%S%z')}.log")
+        )
+        try:
+            logger.info("PYTHONPATH: %s", os.environ["PYTHONPATH"])
+            args = parse_args(sys.argv[1:])
+            self.runit(vars(args), log_queue, worker_log_configurer)
+            logger.info("*** FINISHED ***")
+            # Tell the logging thread to finish up, too
+            log_queue_listener.stop()
+            return
+        except Exception as _e:
+            logger.info("*** FINISHED with exception %s***", str(_e))
+            # Tell the logging thread to finish up, too
+            log_queue_listener.stop()
+
+
+if __name__ == "__main__":
+    VXIngest().main()
@@ -0,0 +1,126 @@
+"""
+Program Name: Class IngestManager
+Contact(s): Randy Pierce
+Abstract:
+
+History Log:  Initial version
+
+Usage: The IngestManager extends Process - python multiprocess thread -
+and runs as a Process and pulls from a queue of derived statistics groups. It
+maintains its own connection to couchbase which it keeps open until it finishes.
+
+It finishes and closes its database connection when the queue is
+empty.
+
+Each queue element is the name of a group of CTC and SUMS ingest documents
+(see derived_builder.group_ingest_documents). The group is processed by a
+DerivedStatisticsBuilder which reads the model and obs documents once for all
+the ingest documents of the group. When the group is finished the IngestManager
+either "upserts" the document_map to the couchbase database or it writes the
+documents to an output directory.
+
+        Attributes:
+            queue - a shared queue of group names.
+            threadName - a threadName for logging and debugging purposes.
+            cb_credentials - a set of cb_credentials that
+            the DataTypeManager will use to connect to the database. This
+            connection will be maintained until the thread terminates.
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSD
+"""
+
+import logging
+import time
+
+from vxingest.builder_common.ingest_manager import CommonVxIngestManager
+from vxingest.derived_to_cb.derived_builder import DerivedStatisticsBuilder
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+
+class VxIngestManager(CommonVxIngestManager):
+    """
+    IngestManager is a Process Thread that uses a DerivedStatisticsBuilder to derive
+    the CTC and SUMS documents for the groups of ingest documents in the queue.
+    The builder is kept for the life of the IngestManager so that its CTC and SUMS
+    builders do not need to be re instantiated.
+    When the queue has been emptied the IngestManager closes its connections
+    and dies.
+    """
+
+    def __init__(
+        self,
+        name,
+        load_spec,
+        element_queue,
+        output_dir,
+        logging_queue,
+        logging_configurer,
+    ):
+        """constructor for VxIngestManager
+        Args:
+            name (string): the thread name for this IngestManager
+            load_spec (Object): contains Couchbase credentials
+            element_queue (Queue): reference to the element Queue
+            output_dir (string): output directory path
+        """
+        self.thread_name = name
+        self.load_spec = load_spec
+        self.cb_credentials = self.load_spec["cb_connection"]
+        self.queue = element_queue
+        self.builder = None
+        self.cluster = None
+        self.collection = None
+        self.output_dir = output_dir
+
+        super().__init__(
+            self.thread_name,
+            self.load_spec,
+            self.queue,
+            self.output_dir,
+            logging_queue,
+            logging_configurer,
+        )
+
+    def get_builders(self):
+        """return the builder, if it has been made"""
+        return [self.builder] if self.builder is not None else []
+
+    def process_queue_element(self, queue_element):
+        """Process this queue_element
+        Args:
+            queue_element (string): a group name
+        Raises:
+            _e: exception
+        """
+        start_process_time = int(time.time())
+        document_map = {}
+        try:
+            logger.info("process_element - : start time: %s", str(start_process_time))
+            if self.builder is None:
+                self.builder = DerivedStatisticsBuilder(self.load_spec)
+            logger.info("building document map for %s", queue_element)
+            document_map = self.builder.build_document(queue_element)
+            if self.output_dir:
+                logger.info(
+                    "writing document map for %s to %s", queue_element, self.output_dir
+                )
+                self.write_document_to_files(queue_element, document_map)
+            else:
+                logger.info("writing document map for %s to database", queue_element)
+                self.write_document_to_cb(queue_element, document_map)
+        except Exception as _e:
+            logger.exception(
+                "%s: Exception in builder: DerivedStatisticsBuilder",
+                self.thread_name,
+            )
+            raise _e
+        finally:
+            # reset the document map and record stop time
+            stop_process_time = int(time.time())
+            document_map = {}
+            logger.info(
+                "IngestManager.process_element: elapsed time: %s",
+                str(stop_process_time - start_process_time),
+            )
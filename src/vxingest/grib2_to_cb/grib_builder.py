@@ -8,7 +8,6 @@ Colorado, NOAA/OAR/ESRL/GSL
 
 import datetime as dt
 import logging
-import math
 import sys
 from pathlib import Path
 
@@ -16,7 +15,6 @@ import numpy as np
 from metpy.calc import virtual_temperature_from_dewpoint
 from metpy.units import units
 
-from vxingest.builder_common.builder_utilities import get_geo_index
 from vxingest.grib2_to_cb.grib_builder_parent import GribBuilder
 
 # Get a logger with this module's name to help with debugging
@@ -30,6 +28,26 @@ class GribModelBuilderV01(GribBuilder):
     for the model data.
     """
 
+    # the grib variables that these handlers read directly (not from their params)
+    handler_variables = {
+        "handle_ceiling": ["Orography", "Cloud ceiling"],
+        "handle_normalized_surface_pressure": [
+            "Surface pressure",
+            "2 metre temperature",
+            "2 metre dewpoint temperature",
+            "Orography",
+        ],
+        "handle_wind_speed": ["10 metre U wind component", "10 metre V wind component"],
+        "handle_wind_direction": [
+            "10 metre U wind component",
+            "10 metre V wind component",
+        ],
+        "handle_wind_dir_u": ["10 metre U wind component"],
+        "handle_wind_dir_v": ["10 metre V wind component"],
+        "handle_specific_humidity": ["2 metre specific humidity"],
+        "handle_vegetation_type": ["Vegetation Type"],
+    }
+
     def __init__(
         self,
         load_spec,
@@ -173,49 +191,34 @@ class GribModelBuilderV01(GribBuilder):
             surface_var_values = self.ds_translate_item_variables_map[
                 "Orography"
             ].values
-            surface_values = []
             if self.ds_translate_item_variables_map["Cloud ceiling"] is None:
                 return None
             ceil_var_values = self.ds_translate_item_variables_map[
                 "Cloud ceiling"
             ].values
-            ceil_msl_values = []
 
-            # get the initial surface values and ceil_msl values for each station
-            for station in self.domain_stations:
-                geo_index = get_geo_index(
-                    self.ds_translate_item_variables_map["fcst_valid_epoch"],
-                    station["geo"],
-                )
-                x_gridpoint = round(station["geo"][geo_index]["x_gridpoint"])
-                y_gridpoint = round(station["geo"][geo_index]["y_gridpoint"])
-                surface_values.append(surface_var_values[y_gridpoint, x_gridpoint])
-                if (
-                    np.isnan(ceil_var_values[int(y_gridpoint)][int(x_gridpoint)])
-                    is np.True_
-                ):
-                    ceil_msl_values.append(60000)
-                else:
-                    # convert to np.float64 because np.float32 is not json serializable
-                    ceil_msl_values.append(
-                        np.float64(ceil_var_values[y_gridpoint, x_gridpoint])
-                    )
-            ceil_agl = []
+            # get the initial surface values and ceil_msl values for all the stations at once
+            interpolator = self.get_grid_interpolator()
+            surface_values = interpolator.nearest(surface_var_values)
+            ceil_msl_values = interpolator.nearest(ceil_var_values).astype(np.float64)
+            ceil_msl_values[np.isnan(ceil_msl_values)] = 60000
             # determine the ceil_agl values for each station
-            for i, _station in enumerate(self.domain_stations):
-                ceil_msl = ceil_msl_values[i]
-                surface = surface_values[i]
-
-                if ceil_msl == 60000 or ceil_msl < -1000 or ceil_msl > 1e10:
+            forced_clear = (
+                (ceil_msl_values == 60000)
+                | (ceil_msl_values < -1000)
+                | (ceil_msl_values > 1e10)
+            )
+            # handle weird '-1's in the grib files??? (from legacy code)
+            zero_ceil = ~forced_clear & (ceil_msl_values < 0)
+            tmp_ceil = (ceil_msl_values - surface_values) * 3.281  # m -> ft
+            ceil_agl = []
+            for i, tmp in enumerate(tmp_ceil):
+                if forced_clear[i]:
                     ceil_agl.append(60000)
-                elif ceil_msl is None or surface is None:
-                    ceil_agl.append(None)
-                # handle weird '-1's in the grib files??? (from legacy code)
-                elif ceil_msl < 0:
+                elif zero_ceil[i] or tmp < 0:
                     ceil_agl.append(0)
                 else:
-                    tmp_ceil = (ceil_msl - surface) * 3.281  # m -> ft
-                    ceil_agl.append(0 if tmp_ceil < 0 else tmp_ceil)
+                    ceil_agl.append(tmp)
             return ceil_agl
         except Exception as _e:
             logger.error(
@@ -290,8 +293,6 @@ class GribModelBuilderV01(GribBuilder):
         Returns:
             List of pressure values in mb corresponding to stations list
         """
-        norm_pressure_list = []
-
         # For all the input vars, they could be pulled from multiple sources
         #  1. grab from what's already been added to the doc/template (this will already be inpterpolated,
         #       but units may want to be reverted) --- not sure how to retrieve this (and if currently possible
@@ -310,27 +311,14 @@ class GribModelBuilderV01(GribBuilder):
         z0_var = "Orography"  # in gpm in grib (gepotential height)
 
         vars = [P0_var, T_var, Td_var, z0_var]
-        values = {}
+        interpolator = self.get_grid_interpolator()
         interp_values = {}
-        station_elev_list = []
-
         for var in vars:
-            values[var] = self.ds_translate_item_variables_map[var].values
-            # just creating an empty list here for each var, will populate in next loop
-            interp_values[var] = []
-
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            for var in vars:
-                interp_values[var].append(
-                    (float)(self.interp_grid_box(values[var], y_gridpoint, x_gridpoint))
-                )
-            # get station elev
-            station_elev_list.append(station["geo"][geo_index]["elev"])
+            interp_values[var] = interpolator.bilinear(
+                self.ds_translate_item_variables_map[var].values
+            ).astype(np.float64)
+        # station elevations
+        z = interpolator.elevs
 
         # NOTE: z0 from model is geopotential height at surface, and z from station metadata is
         #   (presumably) geometric height. Converting model surface elevation from geopotential to
@@ -342,32 +330,26 @@ class GribModelBuilderV01(GribBuilder):
         inst_ht = 2  # height of instrument AGL at stations (m)
         gamma = 0.0065  # standard lapse rate (K/m)
 
-        for P0, T, Td, z, z0 in zip(
-            interp_values[P0_var],
-            interp_values[T_var],
-            interp_values[Td_var],
-            station_elev_list,
-            interp_values[z0_var],
-            strict=True,
-        ):
-            # don't compute if station elevation obviously bad
-            if z < -200 or z > 7000:
-                P_mb = None
-            else:
-                # get model 2m virtual temperature
-                Tv_z0 = virtual_temperature_from_dewpoint(
-                    pressure=P0 * units.Pa,
-                    temperature=T * units.degK,
-                    dewpoint=Td * units.degK,
-                ).magnitude
-                # approximate model virtual temperature for station elevation (hydrostatic)
-                Tv_z = Tv_z0 - ((z - z0) * gamma)
-                # approximate average virtual temperature of layer
-                Tv_layer = (Tv_z0 + Tv_z) / 2
-                P_Pa = P0 * math.exp(-(g * (z + inst_ht - z0)) / (R * Tv_layer))
-                P_mb = P_Pa / 100
-            norm_pressure_list.append(P_mb)
-
+        P0 = interp_values[P0_var]
+        z0 = interp_values[z0_var]
+        # get model 2m virtual temperature
+        Tv_z0 = virtual_temperature_from_dewpoint(
+            pressure=P0 * units.Pa,
+            temperature=interp_values[T_var] * units.degK,
+            dewpoint=interp_values[Td_var] * units.degK,
+        ).magnitude
+        # approximate model virtual temperature for station elevation (hydrostatic)
+        Tv_z = Tv_z0 - ((z - z0) * gamma)
+        # approximate average virtual temperature of layer
+        Tv_layer = (Tv_z0 + Tv_z) / 2
+        P_Pa = P0 * np.exp(-(g * (z + inst_ht - z0)) / (R * Tv_layer))
+        P_mb = P_Pa / 100
+        # don't compute if station elevation obviously bad
+        bad_elev = ~((z >= -200) & (z <= 7000))
+        norm_pressure_list = [
+            None if bad else p_mb
+            for bad, p_mb in zip(bad_elev.tolist(), P_mb.tolist(), strict=True)
+        ]
         return norm_pressure_list
 
     def handle_visibility(self, params_dict):
@@ -416,9 +398,8 @@ class GribModelBuilderV01(GribBuilder):
     def handle_wind_speed(self, params_dict):
         """The params_dict aren't used here since we need to
         select two messages (self.grbs.select is expensive since it scans the whole grib file).
-        Each message is selected once and the station location data saved in an array,
-        then all the domain_stations are iterated (in memory operation)
-        to make the wind speed calculations for each station location.
+        Each message is selected once and interpolated to all the domain_stations
+        in a single vectorized pass, then the wind speed is calculated for every station location.
         Args:
             params_dict unused
         Returns:
@@ -428,48 +409,24 @@ class GribModelBuilderV01(GribBuilder):
         if self.ds_translate_item_variables_map["10 metre U wind component"] is None:
             return None
 
-        values = self.ds_translate_item_variables_map[
-            "10 metre U wind component"
-        ].values
-        uwind_ms_values = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            uwind_ms_values.append(
-                (float)(self.interp_grid_box(values, y_gridpoint, x_gridpoint))
-            )
-
-        values = self.ds_translate_item_variables_map[
-            "10 metre V wind component"
-        ].values
-        vwind_ms_values = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            vwind_ms_values.append(
-                (float)(self.interp_grid_box(values, y_gridpoint, x_gridpoint))
-            )
+        interpolator = self.get_grid_interpolator()
+        uwind_ms = interpolator.bilinear(
+            self.ds_translate_item_variables_map["10 metre U wind component"].values
+        ).astype(np.float64)
+        vwind_ms = interpolator.bilinear(
+            self.ds_translate_item_variables_map["10 metre V wind component"].values
+        ).astype(np.float64)
         # Convert from U-V components to speed and direction (requires rotation if grid is not earth relative)
         # wind speed then convert to mph
-        ws_mph = []
-        for _i, uwind_ms in enumerate(uwind_ms_values):
-            vwind_ms = vwind_ms_values[_i]
-            ws_ms = math.sqrt((uwind_ms * uwind_ms) + (vwind_ms * vwind_ms))
-            ws_mph.append((float)((ws_ms / 0.447) + 0.5))
+        ws_ms = np.sqrt((uwind_ms * uwind_ms) + (vwind_ms * vwind_ms))
+        ws_mph = ((ws_ms / 0.447) + 0.5).tolist()
         return ws_mph
 
     def handle_wind_direction(self, params_dict):
         """The params_dict aren't used here since we need to
         select two messages (self.grbs.select is expensive since it scans the whole grib file).
-        Each message is selected once and the station location data saved in an array,
-        then all the domain_stations are iterated (in memory operation)
-        to make the wind direction calculations for each station location.
+        Each message is selected once and interpolated to all the domain_stations
+        in a single vectorized pass, then the wind direction is calculated for every station location.
         Each individual station longitude is used to rotate the wind direction.
         Args:
             params_dict unused
@@ -478,58 +435,28 @@ class GribModelBuilderV01(GribBuilder):
         """
         if self.ds_translate_item_variables_map["10 metre U wind component"] is None:
             return None
-        u_values = self.ds_translate_item_variables_map[
-            "10 metre U wind component"
-        ].values
-        uwind_ms = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            # interpolated value cannot use rounded grid points
-            uwind_ms.append(self.interp_grid_box(u_values, y_gridpoint, x_gridpoint))
-        # vwind_message = self.grbs.select(name="10 metre V wind component")[0]
-        v_values = self.ds_translate_item_variables_map[
-            "10 metre V wind component"
-        ].values
-        vwind_ms = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            vwind_ms.append(self.interp_grid_box(v_values, y_gridpoint, x_gridpoint))
-        _wd = []
-        for i, u_val in enumerate(uwind_ms):
-            # theta = gg.getWindTheta(vwind_message, station['lon'])
-            # radians = math.atan2(uwind_ms, vwind_ms)
-            # wd = (radians*57.2958) + theta + 180
-            v_val = vwind_ms[i]
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            longitude = self.domain_stations[i]["geo"][geo_index]["lon"]
-            lad_in_degrees = self.ds_translate_item_variables_map[
-                "10 metre V wind component"
-            ].attrs["GRIB_LaDInDegrees"]
-            lov_in_degrees = self.ds_translate_item_variables_map[
-                "10 metre V wind component"
-            ].attrs["GRIB_LoVInDegrees"]
-            proj_params = self.ds_translate_item_variables_map["proj_params"]
-            theta = self.get_wind_theta(
-                proj_params, lad_in_degrees, lov_in_degrees, longitude
-            )
-            radians = math.atan2(u_val, v_val)
-            wd_value = (radians * 57.2958) + theta + 180
-            # adjust for outliers
-            if wd_value < 0:
-                wd_value = wd_value + 360
-            if wd_value > 360:
-                wd_value = wd_value - 360
-            _wd.append((float)(wd_value))
+        # interpolated value cannot use rounded grid points
+        interpolator = self.get_grid_interpolator()
+        uwind_ms = interpolator.bilinear(
+            self.ds_translate_item_variables_map["10 metre U wind component"].values
+        )
+        v_wind = self.ds_translate_item_variables_map["10 metre V wind component"]
+        vwind_ms = interpolator.bilinear(v_wind.values)
+        # theta = gg.getWindTheta(vwind_message, station['lon'])
+        # radians = math.atan2(uwind_ms, vwind_ms)
+        # wd = (radians*57.2958) + theta + 180
+        theta = self.get_wind_thetas(
+            self.ds_translate_item_variables_map["proj_params"],
+            v_wind.attrs["GRIB_LaDInDegrees"],
+            v_wind.attrs["GRIB_LoVInDegrees"],
+            interpolator.lons,
+        )
+        radians = np.arctan2(uwind_ms.astype(np.float64), vwind_ms.astype(np.float64))
+        wd_values = (radians * 57.2958) + theta + 180
+        # adjust for outliers
+        wd_values = np.where(wd_values < 0, wd_values + 360, wd_values)
+        wd_values = np.where(wd_values > 360, wd_values - 360, wd_values)
+        _wd = wd_values.tolist()
         return _wd
 
     def handle_wind_dir_u(self, params_dict):
@@ -541,20 +468,14 @@ class GribModelBuilderV01(GribBuilder):
         """
         if self.ds_translate_item_variables_map["10 metre U wind component"] is None:
             return None
-        u_values = self.ds_translate_item_variables_map[
-            "10 metre U wind component"
-        ].values
-        uwind_ms = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            # interpolated value cannot use rounded grid points
-            uwind_ms.append(
-                (float)(self.interp_grid_box(u_values, y_gridpoint, x_gridpoint))
+        # interpolated value cannot use rounded grid points
+        uwind_ms = (
+            self.get_grid_interpolator()
+            .bilinear(
+                self.ds_translate_item_variables_map["10 metre U wind component"].values
             )
+            .tolist()
+        )
         return uwind_ms
 
     def handle_wind_dir_v(self, params_dict):
@@ -566,19 +487,13 @@ class GribModelBuilderV01(GribBuilder):
         """
         if self.ds_translate_item_variables_map["10 metre V wind component"] is None:
             return None
-        v_values = self.ds_translate_item_variables_map[
-            "10 metre V wind component"
-        ].values
-        vwind_ms = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            vwind_ms.append(
-                (float)(self.interp_grid_box(v_values, y_gridpoint, x_gridpoint))
+        vwind_ms = (
+            self.get_grid_interpolator()
+            .bilinear(
+                self.ds_translate_item_variables_map["10 metre V wind component"].values
             )
+            .tolist()
+        )
         return vwind_ms
 
     def handle_specific_humidity(self, params_dict):
@@ -591,17 +506,13 @@ class GribModelBuilderV01(GribBuilder):
         """
         if self.ds_translate_item_variables_map["2 metre specific humidity"] is None:
             return None
-        values = self.ds_translate_item_variables_map[
-            "2 metre specific humidity"
-        ].values
-        spfh = []
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
+        spfh = (
+            self.get_grid_interpolator()
+            .bilinear(
+                self.ds_translate_item_variables_map["2 metre specific humidity"].values
             )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            spfh.append((float)(self.interp_grid_box(values, y_gridpoint, x_gridpoint)))
+            .tolist()
+        )
         return spfh
 
     def handle_vegetation_type(self, params_dict):
@@ -638,17 +549,12 @@ class GribModelBuilderV01(GribBuilder):
                     str(_e),
                 )
                 self.land_use_types = {}
-        for station in self.domain_stations:
-            geo_index = get_geo_index(
-                self.ds_translate_item_variables_map["fcst_valid_epoch"], station["geo"]
-            )
-            x_gridpoint = station["geo"][geo_index]["x_gridpoint"]
-            y_gridpoint = station["geo"][geo_index]["y_gridpoint"]
-            vegetation_type_USGS_index = str(
-                round(self.interp_grid_box(values, y_gridpoint, x_gridpoint))
-            )
+        vegetation_type_USGS_indexes = np.rint(
+            self.get_grid_interpolator().bilinear(values)
+        ).astype(np.int64)
+        for vegetation_type_USGS_index in vegetation_type_USGS_indexes.tolist():
             vegetation_type_str = self.land_use_types.get(
-                vegetation_type_USGS_index, None
+                str(vegetation_type_USGS_index), None
             )
             vegetation_type.append(vegetation_type_str)
         return vegetation_type
@@ -12,18 +12,26 @@ import logging
 import math
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pstats import Stats
 
+import numpy as np
 import pyproj
-import xarray as xr
 
 from vxingest.builder_common.builder import Builder
 from vxingest.builder_common.builder_utilities import (
     convert_to_iso,
-    get_geo_index,
     initialize_data_array,
 )
+from vxingest.builder_common.template_plan import TemplateItem
+from vxingest.grib2_to_cb.grib_reader import GribReader, GribVariableMap
+from vxingest.grib2_to_cb.grid_cache import GridCache
+from vxingest.grib2_to_cb.grid_interpolator import GridInterpolator
+from vxingest.grib2_to_cb.station_grid_index import (
+    StationGridIndex,
+    StationGridIndexCache,
+)
 
 # Get a logger with this module's name to help with debugging
 logger = logging.getLogger(__name__)
@@ -34,6 +42,78 @@ class GribBuilder(Builder):
     common to all the grib builders. The entry point for every builder is the build_document(self, queue_element)
     which is common to all grib2 builders and is in this class."""
 
+    # The template variables (by their cfgrib long_name) and the keys that select their grib message.
+    # These are the cfgrib filter_by_keys that used to select a dataset plus the message name - the
+    # cloud ceiling is the only message on its level, so it is selected by the level alone.
+    grib_variables = {
+        "2 metre temperature": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 2,
+            "name": "2 metre temperature",
+        },
+        "2 metre dewpoint temperature": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 2,
+            "name": "2 metre dewpoint temperature",
+        },
+        "2 metre relative humidity": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 2,
+            "name": "2 metre relative humidity",
+        },
+        "2 metre specific humidity": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 2,
+            "name": "2 metre specific humidity",
+        },
+        "10 metre U wind component": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 10,
+            "name": "10 metre U wind component",
+        },
+        "10 metre V wind component": {
+            "typeOfLevel": "heightAboveGround",
+            "stepType": "instant",
+            "level": 10,
+            "name": "10 metre V wind component",
+        },
+        "Surface pressure": {
+            "typeOfLevel": "surface",
+            "stepType": "instant",
+            "name": "Surface pressure",
+        },
+        "MSLP (MAPS System Reduction)": {
+            "typeOfLevel": "meanSea",
+            "stepType": "instant",
+            "name": "MSLP (MAPS System Reduction)",
+        },
+        "Visibility": {
+            "typeOfLevel": "surface",
+            "stepType": "instant",
+            "name": "Visibility",
+        },
+        "Orography": {
+            "typeOfLevel": "surface",
+            "stepType": "instant",
+            "name": "Orography",
+        },
+        "Cloud ceiling": {"typeOfLevel": "cloudCeiling", "stepType": "instant"},
+        "Vegetation Type": {
+            "typeOfLevel": "surface",
+            "stepType": "instant",
+            "name": "Vegetation Type",
+        },
+    }
+    # The grib variables that a named function reads directly from ds_translate_item_variables_map
+    # rather than through its template parameters. Concrete builders add their handlers here so that
+    # get_template_variables can include them.
+    handler_variables = {}
+
     def __init__(
         self,
         load_spec,
@@ -49,7 +129,22 @@ class GribBuilder(Builder):
         # GribBuilder specific
         self.number_stations = number_stations
         self.domain_stations = []
+        self.grid_interpolator = None
+        # variable name -> (nearest values, interpolated values) of the domain_stations for the current file
+        self.station_values = {}
+        self.station_grid_index = None
+        self.station_update_time = None
+        # the station grid indexes live as long as the builder (i.e. the VxIngestManager)
+        # set STATION_GRID_CACHE_DIR to also persist them across runs
+        self.station_grid_cache = StationGridIndexCache(
+            os.getenv("STATION_GRID_CACHE_DIR")
+        )
+        # set GRIB_GRID_CACHE_DIR to share the decoded grids with the other builder processes
+        # that read the same files (i.e. the builders of other ingest documents for the same model)
+        self.grid_cache = GridCache(os.getenv("GRIB_GRID_CACHE_DIR"))
         self.ds_translate_item_variables_map = None
+        # the grib variables that the template uses - see get_template_variables
+        self.template_variables = None
 
         # self.do_profiling = False - in super
         self.do_profiling = os.getenv("PROFILE")
@@ -132,6 +227,21 @@ class GribBuilder(Builder):
             print(f"Projection {proj_params['proj']} not yet supported")
         return theta
 
+    def get_wind_thetas(self, proj_params, lad_in_degrees, lov_in_degrees, lons):
+        """
+        Calculate the rotation angle for the wind vector for an array of longitudes
+        (the vectorized form of get_wind_theta)
+        :param proj_params: the projection parameters
+        :param lons: the longitudes (ndarray)
+        :return: the rotation angles (ndarray)
+        """
+        lons = np.where(lons < 0, lons + 360, lons)
+        if proj_params["proj"] == "lcc":
+            rotation = math.sin(math.radians(lad_in_degrees))
+            return -rotation * (lov_in_degrees - lons)
+        logger.warning("Projection %s not yet supported", proj_params["proj"])
+        return np.zeros_like(lons)
+
     def interp_grid_box(self, values, _y, _x):
         """
         Interpolate the value at a given point in the grid
@@ -159,6 +269,202 @@ class GribBuilder(Builder):
         except Exception as _e:
             raise Exception(f"Error in get_grid.interpGridBox - {str(_e)}") from _e
 
+    def get_template_variables(self):
+        """Return the grib variables that the template (plan) uses, so that only
+        those grib messages are decoded. The variables are the '*variable' replacements
+        in the template keys and values, the '*param' parameters of the '&handler|*param,...'
+        named functions, and the handler_variables of those named functions.
+        Replacements that are template constants or are not grib variables (i.e. '*{ISO}fcstValidEpoch')
+        are ignored. The template doesn't change so this is only done once for the builder.
+        Returns:
+            dict: variable name -> the keys that select its grib message, in grib_variables order
+        """
+        if self.template_variables is not None:
+            return self.template_variables
+        template_plan = self.get_template_plan()
+        names = set(template_plan.replacements)
+        for item in template_plan.items.values():
+            if item.function is not None:
+                names.update(self.handler_variables.get(item.function.name, []))
+        self.template_variables = {
+            name: filter_keys
+            for name, filter_keys in self.grib_variables.items()
+            if name in names and self.template.get(name) is None
+        }
+        logger.info(
+            "%s: template grib variables %s",
+            self.__class__.__name__,
+            list(self.template_variables),
+        )
+        return self.template_variables
+
+    def get_grid_interpolator(self):
+        """Return the vectorized interpolator for the current domain_stations.
+        It is built lazily, once per file, from the station gridpoints for the
+        fcst_valid_epoch of the file. build_document resets it whenever the domain_stations change.
+        Returns:
+            GridInterpolator: the interpolator for the domain_stations
+        """
+        if self.grid_interpolator is None:
+            fcst_valid_epoch = self.ds_translate_item_variables_map["fcst_valid_epoch"]
+            if self.station_grid_index is not None:
+                self.grid_interpolator = self.station_grid_index.get_interpolator(
+                    fcst_valid_epoch
+                )
+            else:
+                self.grid_interpolator = GridInterpolator.from_stations(
+                    self.domain_stations, fcst_valid_epoch
+                )
+        return self.grid_interpolator
+
+    def get_station_values(self, name):
+        """Return the nearest gridpoint values and the interpolated values of a grib variable
+        for every domain station. They are extracted once per file (or by prefetch_station_values).
+        Args:
+            name (string): the template variable name
+        Returns:
+            tuple: (nearest values, interpolated values), ndarrays in domain_stations order
+        """
+        if name not in self.station_values:
+            values = self.ds_translate_item_variables_map[name].values
+            interpolator = self.get_grid_interpolator()
+            self.station_values[name] = (
+                interpolator.nearest(values),
+                interpolator.bilinear(values),
+            )
+        return self.station_values[name]
+
+    def prefetch_station_values(self, variable_threads):
+        """Decode the grib variables of the template and extract their station values with a
+        pool of threads, so that a file takes about as long as its slowest variable rather
+        than the sum of all of them (eccodes and numpy release the GIL for most of this work).
+        The handlers then only read the decoded variables and the station values.
+        Args:
+            variable_threads (int): the number of threads
+        """
+        # the interpolator is shared by the threads so it is built first
+        interpolator = self.get_grid_interpolator()
+        replacements = self.get_template_plan().replacements
+
+        def extract(name):
+            variable = self.ds_translate_item_variables_map[name]
+            if variable is None or name not in replacements:
+                return name, None
+            return name, (
+                interpolator.nearest(variable.values),
+                interpolator.bilinear(variable.values),
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=variable_threads, thread_name_prefix="GribVariable"
+        ) as executor:
+            for name, station_values in executor.map(
+                extract, self.get_template_variables()
+            ):
+                if station_values is not None:
+                    self.station_values[name] = station_values
+
+    def get_station_update_time(self):
+        """Return the identity of the station set for this subset - the latest station updateTime and
+        the number of stations. It is used in the station_grid_cache key so that a cached
+        station grid index is not used after the stations change. It is queried once per builder.
+        Returns:
+            dict: {"updateTime": latest station update time, "count": number of stations}
+        """
+        if self.station_update_time is None:
+            bucket = self.load_spec["cb_connection"]["bucket"]
+            scope = self.load_spec["cb_connection"]["scope"]
+            collection = self.load_spec["cb_connection"]["collection"]
+            stmnt = f"""SELECT MAX(updateTime) AS updateTime, COUNT(*) AS count
+                    from `{bucket}`.{scope}.{collection}
+                    where type='MD'
+                    and docType='station'
+                    and subset='{self.subset}'
+                    and version='V01';"""
+            result = self.load_spec["cluster"].query(stmnt)
+            self.station_update_time = next(iter(result), {})
+        return self.station_update_time
+
+    def build_station_grid_index(self, transformer, spacing, max_x, max_y):
+        """get stations from couchbase and filter them so
+        that we retain only the ones for this models domain which is derived from the projection.
+        Also fill in the gridpoints for each geo within each station. All the station geos
+        are transformed in one (vectorized) pyproj call.
+        Args:
+            transformer (pyproj.Transformer): latlon to grid projection transformer
+            spacing (float): the grid spacing in meters
+            max_x (int): the number of x gridpoints
+            max_y (int): the number of y gridpoints
+        Returns:
+            StationGridIndex: the domain stations
+        """
+        bucket = self.load_spec["cb_connection"]["bucket"]
+        scope = self.load_spec["cb_connection"]["scope"]
+        collection = self.load_spec["cb_connection"]["collection"]
+        limit_clause = ";"
+        if self.number_stations != sys.maxsize:
+            limit_clause = f" limit {self.number_stations};"
+        stmnt = f"""SELECT geo, name
+                from `{bucket}`.{scope}.{collection}
+                where type='MD'
+                and docType='station'
+                and subset='{self.subset}'
+                and version='V01'
+                {limit_clause}"""
+        rows = [row for row in self.load_spec["cluster"].query(stmnt) if row["geo"]]
+        lats = np.array(
+            [geo["lat"] for row in rows for geo in row["geo"]], dtype=np.float64
+        )
+        lons = np.array(
+            [geo["lon"] for row in rows for geo in row["geo"]], dtype=np.float64
+        )
+        # skip stations with bad lat/lon
+        # these are probably buoys or ships or mistakes.
+        bad_lat_lon = ((lats == -90) & (lons == 180)) | (lats == 0) | (lons == 0)
+        geo_names = [row["name"] for row in rows for _geo in row["geo"]]
+        for bad_index in np.flatnonzero(bad_lat_lon):
+            logger.info(
+                "%s: builder build_document skipping station with bad lat/lon: name: %s, lat: %s, lon: %s",
+                self.__class__.__name__,
+                geo_names[bad_index],
+                str(lats[bad_index]),
+                str(lons[bad_index]),
+            )
+        _x, _y = transformer.transform(lons, lats, radians=False)
+        x_gridpoints = np.asarray(_x, dtype=np.float64) / spacing
+        y_gridpoints = np.asarray(_y, dtype=np.float64) / spacing
+        # use for debugging if you must
+        # print (f"transform - lats: {lats}, lons: {lons}, x_gridpoints: {x_gridpoints}, y_gridpoints: {y_gridpoints}")
+        with np.errstate(invalid="ignore"):
+            in_domain = (
+                ~bad_lat_lon
+                & np.isfinite(x_gridpoints)
+                & np.isfinite(y_gridpoints)
+                & (np.floor(x_gridpoints) >= 0)
+                & (np.ceil(x_gridpoints) < max_x)
+                & (np.floor(y_gridpoints) >= 0)
+                & (np.ceil(y_gridpoints) < max_y)
+            )
+        # if we have gridpoints for all the geos in the station, add it to the list
+        domain_stations = []
+        geo_offset = 0
+        for row in rows:
+            num_geos = len(row["geo"])
+            if in_domain[geo_offset : geo_offset + num_geos].all():
+                station = {"name": row["name"], "geo": []}
+                for geo_index, geo in enumerate(row["geo"]):
+                    station_geo = dict(geo)
+                    station_geo["x_gridpoint"] = float(
+                        x_gridpoints[geo_offset + geo_index]
+                    )
+                    station_geo["y_gridpoint"] = float(
+                        y_gridpoints[geo_offset + geo_index]
+                    )
+                    station["geo"].append(station_geo)
+                domain_stations.append(station)
+            geo_offset += num_geos
+        return StationGridIndex.from_stations(domain_stations)
+
     def derive_id(self, **kwargs):
         """
         This is a private method to derive a document id from the current station,
@@ -173,17 +479,17 @@ class GribBuilder(Builder):
         """
         try:
             template_id = kwargs["template_id"]
-            parts = template_id.split(":")
             new_parts = []
-            for part in parts:
-                if part.startswith("&"):
-                    value = str(self.handle_named_function(part))
+            # the id parts are parsed once, in the template plan
+            for part in self.get_template_plan().get_id_parts(template_id):
+                if part.kind == TemplateItem.FUNCTION:
+                    value = str(self.handle_named_function(part.text))
                 else:
-                    if part.startswith("*"):
-                        _v, _interp_v = self.translate_template_item(part)
+                    if part.text.startswith("*"):
+                        _v, _interp_v = self.translate_template_item(part.text)
                         value = str(_v)
                     else:
-                        value = str(part)
+                        value = str(part.text)
                 new_parts.append(value)
             new_id = ":".join(new_parts)
             return new_id
@@ -222,11 +528,8 @@ class GribBuilder(Builder):
         try:
             if single_return:
                 return (variable, variable)
-            if isinstance(variable, str):
-                # skip the first replacement, its never
-                # really a replacement. It is either '' or not a
-                # replacement
-                replacements = variable.split("*")[1:]
+            # the replacements are parsed once, in the template plan
+            replacements = self.get_template_plan().get_replacements(variable)
             # pre assign these in case it isn't a replacement - makes it easier
             station_value = variable
             interpolated_value = variable
@@ -244,45 +547,32 @@ class GribBuilder(Builder):
                             "Variable %s has no values in ds_translate_item_variables_map",
                             _ri,
                         )
-                        values = None
-                    else:
-                        values = self.ds_translate_item_variables_map[_ri].values
-                    for station in self.domain_stations:
-                        # get the individual station value and interpolated value
-                        geo_index = get_geo_index(
-                            self.ds_translate_item_variables_map["fcst_valid_epoch"],
-                            station["geo"],
+                        station_values.extend(
+                            [(None, None)] * len(self.domain_stations)
                         )
-                        if values is None or geo_index is None:
-                            station_value = None
-                            interpolated_value = None
+                        continue
+                    # get all the station values and interpolated values in one pass
+                    # interpolated gridpoints cannot be rounded
+                    nearest_values, interpolated_values = self.get_station_values(_ri)
+                    for station_value, interpolated_value in zip(
+                        nearest_values, interpolated_values, strict=True
+                    ):
+                        # convert each station value to iso if necessary
+                        if _ri.startswith("{ISO}"):
+                            station_value = variable.replace(
+                                "*" + _ri, convert_to_iso(station_value)
+                            )
+                            interpolated_value = variable.replace(
+                                "*" + _ri, convert_to_iso(interpolated_value)
+                            )
                         else:
-                            station_value = values[
-                                round(station["geo"][geo_index]["y_gridpoint"]),
-                                round(station["geo"][geo_index]["x_gridpoint"]),
-                            ]
-                            # interpolated gridpoints cannot be rounded
-                            interpolated_value = self.interp_grid_box(
-                                values,
-                                station["geo"][geo_index]["y_gridpoint"],
-                                station["geo"][geo_index]["x_gridpoint"],
+                            station_value = variable.replace(
+                                "*" + _ri, str(station_value)
                             )
-                            # convert each station value to iso if necessary
-                            if _ri.startswith("{ISO}"):
-                                station_value = variable.replace(
-                                    "*" + _ri, convert_to_iso(station_value)
-                                )
-                                interpolated_value = variable.replace(
-                                    "*" + _ri, convert_to_iso(interpolated_value)
-                                )
-                            else:
-                                station_value = variable.replace(
-                                    "*" + _ri, str(station_value)
-                                )
-                                interpolated_value = variable.replace(
-                                    "*" + _ri, str(interpolated_value)
-                                )
-                            # add it onto the list of tupples
+                            interpolated_value = variable.replace(
+                                "*" + _ri, str(interpolated_value)
+                            )
+                        # add it onto the list of tupples
                         station_values.append((station_value, interpolated_value))
                 return station_values
             # it is a constant, no replacements but we still need a tuple for each station
@@ -407,21 +697,21 @@ class GribBuilder(Builder):
         """
 
         func = None
+        params = []
         replace_with = None
         try:
-            parts = named_function_def.split("|")
-            func = parts[0].replace("&", "")
-            params = []
-            if len(parts) > 1:
-                params = parts[1].split(",")
+            # the named function and its params are parsed once, in the template plan
+            named_function = self.get_template_plan().get_function(named_function_def)
+            func = named_function.name
+            params = [param.text for _key, param in named_function.params]
             dict_params = {}
-            for _p in params:
-                # be sure to slice the * off of the front of the param
+            for key, param in named_function.params:
+                # the key is the param without the * on the front
                 # translate_template_item returns an array of tuples - value,interp_value, one for each station
                 # ordered by domain_stations.
-                dict_params[_p[1:]] = self.translate_template_item(_p)
-            # call the named function using getattr
-            replace_with = getattr(self, func)(dict_params)
+                dict_params[key] = self.translate_template_item(param.text)
+            # call the named function (resolved when the plan was compiled)
+            replace_with = named_function(dict_params)
         except Exception as _e:
             logger.exception(
                 "%s handle_named_function: %s params %s: Exception instantiating builder:",
@@ -517,367 +807,119 @@ class GribBuilder(Builder):
         1) get the first epoch - if none was specified get the latest one from the db
         2) transform the projection from the grib file
         3) determine the stations for this domain, adding gridpoints to each station - build a station list
+           (the station grid index is cached by projection so this only queries and transforms for the first file)
         4) enable profiling if requested
         5) handle_document - iterate the template and process all the keys and values
         6) build a datafile document to record that this file has been processed
-        7) cfgrib leaves .idx files in the directory - delete the .idx file
+        7) delete any .idx file that cfgrib may have left in the directory
 
-        NOTE: For cfgrib variables are contained in datasets. Some variables are continuous,
+        NOTE: The grib file is read with a GribReader, which scans the message headers once and then
+        decodes only the messages of the grib_variables that the template uses (see get_template_variables),
+        each one the first time it is used, instead of opening a cfgrib dataset per level type. Some variables are continuous,
         like temperature, and some are non-continuous, like ceiling and visibility.
         The continuous variables must have their coordinates interpolated, but not the non-continuous
         variables.
-        For cfgrib the variables defined in the templates are to be defined by their long_name attribute.
-        for example there is a ds_height_above_ground_2m dataset and also a ds_height_above_ground_10m dataset.
-        Each of those datasets can have multiple variables, but only one variable with a given long_name.
-
-        A given dataset may have multiple variables with different long_names. For example "2 metre temperature"
-        and "2 metre dewpoint temperature" are both in the ds_height_above_ground_2m dataset.
+        The variables defined in the templates are to be defined by their cfgrib long_name attribute
+        (the grib message name). A message is selected by its level keys (like the cfgrib filter_by_keys)
+        and its name. For example "2 metre temperature" and "2 metre dewpoint temperature" are both
+        heightAboveGround level 2 messages.
         """
 
         try:
-            # get the bucket, scope, and collection from the load_spec
-            bucket = self.load_spec["cb_connection"]["bucket"]
-            scope = self.load_spec["cb_connection"]["scope"]
-            collection = self.load_spec["cb_connection"]["collection"]
-
+            # scan the grib file once - this indexes the message headers without decoding any data
+            grib_reader = GribReader(queue_element, self.grid_cache)
             # translate the projection from the grib file
             # The projection is the same for all the variables in the grib file,
             # so we only need to get it once and from one variable - we'll use heightAboveGround
             # for 2 meters.
-
-            # heightAboveGround variables
-            ds_height_above_ground_2m = xr.open_dataset(
-                queue_element,
-                engine="cfgrib",
-                backend_kwargs={
-                    "filter_by_keys": {
-                        "typeOfLevel": "heightAboveGround",
-                        "stepType": "instant",
-                        "level": 2,
-                    },
-                    "read_keys": ["projString"],
-                    "indexpath": "",
-                },
-            )
-            ds_height_above_ground_10m = xr.open_dataset(
-                queue_element,
-                engine="cfgrib",
-                backend_kwargs={
-                    "filter_by_keys": {
-                        "typeOfLevel": "heightAboveGround",
-                        "stepType": "instant",
-                        "level": 10,
-                    },
-                    "indexpath": "",
-                },
-            )
-            in_proj = pyproj.Proj(proj="latlon")
-            proj_string = ds_height_above_ground_2m.r2.attrs["GRIB_projString"]
-            max_x = ds_height_above_ground_2m.r2.attrs["GRIB_Nx"]
-            max_y = ds_height_above_ground_2m.r2.attrs["GRIB_Ny"]
-            spacing = ds_height_above_ground_2m.r2.attrs["GRIB_DxInMetres"]
-            latitude_of_first_grid_point_in_degrees = (
-                ds_height_above_ground_2m.r2.attrs[
-                    "GRIB_latitudeOfFirstGridPointInDegrees"
-                ]
-            )
-            longitude_of_first_grid_point_in_degrees = (
-                ds_height_above_ground_2m.r2.attrs[
-                    "GRIB_longitudeOfFirstGridPointInDegrees"
-                ]
+            grid_attrs = grib_reader.get_attrs(
+                typeOfLevel="heightAboveGround", stepType="instant", level=2
             )
+            if grid_attrs is None:
+                logger.error(
+                    "%s: build_document - no heightAboveGround 2 metre messages in %s",
+                    self.__class__.__name__,
+                    queue_element,
+                )
+                return {}
+            proj_string = grid_attrs["GRIB_projString"]
+            max_x = grid_attrs["GRIB_Nx"]
+            max_y = grid_attrs["GRIB_Ny"]
+            spacing = grid_attrs["GRIB_DxInMetres"]
+            latitude_of_first_grid_point_in_degrees = grid_attrs[
+                "GRIB_latitudeOfFirstGridPointInDegrees"
+            ]
+            longitude_of_first_grid_point_in_degrees = grid_attrs[
+                "GRIB_longitudeOfFirstGridPointInDegrees"
+            ]
             proj_params_dict = self.get_proj_params_from_string(proj_string)
-            in_proj = pyproj.Proj(proj="latlon")
-            out_proj = self.get_grid(
-                proj_params_dict,
-                latitude_of_first_grid_point_in_degrees,
-                longitude_of_first_grid_point_in_degrees,
-            )
-            transformer = pyproj.Transformer.from_proj(
-                proj_from=in_proj, proj_to=out_proj
-            )
             # use these if necessary to comare projections for debugging
             # print()
-            # print ('in_proj', in_proj, 'out_proj', out_proj, 'max_x', max_x, 'max_y', max_y, 'spacing', spacing)
+            # print ('proj_string', proj_string, 'max_x', max_x, 'max_y', max_y, 'spacing', spacing)
 
             # we get the fcst_valid_epoch and fcst_len once for the entire file, from the heightAboveGround
-            ds_fcst_valid_epoch = (
-                ds_height_above_ground_2m.valid_time.values.astype("uint64") / 10**9
-            ).astype("uint32")
-            ds_fcst_len = (int)((ds_height_above_ground_2m.step.values) / 1e9 / 3600)
-
-            # height_above_ground variables
-            ds_hgt_2_metre_temperature = ds_height_above_ground_2m.filter_by_attrs(
-                long_name="2 metre temperature"
+            hgt_2m_header = grib_reader.find(
+                typeOfLevel="heightAboveGround", stepType="instant", level=2
             )
-            # to get the values you can use the following...
-            # ds_hgt_2_metre_temperature.variables[list(ds_2_metre_temperature.data_vars.keys())[0]].values
-            ds_hgt_2_metre_dewpoint_temperature = (
-                ds_height_above_ground_2m.filter_by_attrs(
-                    long_name="2 metre dewpoint temperature"
-                )
+            # set up the variables map for the translate_template_item method. this way only the
+            # translation map needs to be a class variable. Better data hiding.
+            # Only the variables that the template uses are in the map and each one is decoded
+            # the first time it is used, a missing variable is None.
+            self.ds_translate_item_variables_map = GribVariableMap(
+                grib_reader,
+                self.get_template_variables(),
+                {
+                    "fcst_valid_epoch": np.uint32(hgt_2m_header["fcst_valid_epoch"]),
+                    "fcst_len": hgt_2m_header["fcst_len"],
+                    "proj_params": proj_params_dict,
+                },
             )
-            # to get the values you can use the following...
-            # ds_hgt_2_metre_dewpoint_temperature.variables[list(ds_2_metre_dewpoint_temperature.data_vars.keys())[0]].values
-            ds_hgt_2_metre_relative_humidity = (
-                ds_height_above_ground_2m.filter_by_attrs(
-                    long_name="2 metre relative humidity"
-                )
+            # reset the builders document_map for a new file
+            self.initialize_document_map()
+            # get the domain stations and their gridpoints for this projection. These are the same for
+            # every file of a model so they come from the station_grid_cache after the first file.
+            # NOTE: this is not about regions, this is about models
+            station_grid_key = self.station_grid_cache.make_key(
+                proj_string=proj_string,
+                max_x=max_x,
+                max_y=max_y,
+                spacing=spacing,
+                latitude_of_first_grid_point=latitude_of_first_grid_point_in_degrees,
+                longitude_of_first_grid_point=longitude_of_first_grid_point_in_degrees,
+                subset=self.subset,
+                number_stations=self.number_stations,
+                station_update_time=self.get_station_update_time(),
             )
-            # to get the values you can use the following...
-            # ds_hgt_2_metre_relative_humidity.variables[list(ds_2_metre_relative_humidity.data_vars.keys())[0]].values
-            ds_hgt_2_metre_specific_humidity = (
-                ds_height_above_ground_2m.filter_by_attrs(
-                    long_name="2 metre specific humidity"
+            station_grid_index = self.station_grid_cache.get(station_grid_key)
+            if station_grid_index is None:
+                # translate the projection from the grib file
+                out_proj = self.get_grid(
+                    dict(proj_params_dict),
+                    latitude_of_first_grid_point_in_degrees,
+                    longitude_of_first_grid_point_in_degrees,
                 )
-            )
-            # to get the values you can use the following...
-            # ds_hgt_2_metre_specific_humidity.variables[list(ds_hgt_2_metre_specific_humidity.data_vars.keys())[0]].values
-
-            ds_hgt_10_metre_u_component_of_wind = (
-                ds_height_above_ground_10m.filter_by_attrs(
-                    long_name="10 metre U wind component"
+                transformer = pyproj.Transformer.from_proj(
+                    proj_from=pyproj.Proj(proj="latlon"), proj_to=out_proj
                 )
-            )
-            # to get the values you can use the following...
-            # ds_10_metre_u_component_of_wind.variables[list(ds_10_metre_u_component_of_wind.data_vars.keys())[0]].values
-            ds_hgt_10_metre_v_component_of_wind = (
-                ds_height_above_ground_10m.filter_by_attrs(
-                    long_name="10 metre V wind component"
+                station_grid_index = self.build_station_grid_index(
+                    transformer, spacing, max_x, max_y
                 )
-            )
-            # to get the values you can use the following...
-            # ds_hgt_10_metre_v_component_of_wind.variables[list(ds_hgt_10_metre_v_component_of_wind.data_vars.keys())[0]].values
-
-            # ceiling variables - this one is different because it only has one variable
-            ds_cloud_ceiling = xr.open_dataset(
-                queue_element,
-                engine="cfgrib",
-                backend_kwargs={
-                    "filter_by_keys": {
-                        "typeOfLevel": "cloudCeiling",
-                        "stepType": "instant",
-                    },
-                    "indexpath": "",
-                },
-            )
-            # to get the values you can use the following...
-            # ds_cloud_ceiling.variables[list(ds_cloud_ceiling.data_vars.keys())[0]].values
-
-            # surface variables
-            ds_surface = xr.open_dataset(
-                queue_element,
-                engine="cfgrib",
-                backend_kwargs={
-                    "filter_by_keys": {"typeOfLevel": "surface", "stepType": "instant"},
-                    "read_keys": ["projString"],
-                    "indexpath": "",
-                },
-            )
-            ds_surface_pressure = ds_surface.filter_by_attrs(
-                long_name="Surface pressure"
-            )
-            # to get the values you can use the following...
-            # ds_surface_pressure.variables[list(ds_surface_pressure.data_vars.keys())[0]].values
-            ds_surface_orog = ds_surface.filter_by_attrs(long_name="Orography")
-            # to get the values you can use the following...
-            # ds_surface_orog.variables[list(ds_surface_orog.data_vars.keys())[0]].values
-            ds_surface_visibility = ds_surface.filter_by_attrs(long_name="Visibility")
-            # to get the values you can use the following...
-            # ds_surface_visibility.variables[list(ds_surface_visibility.data_vars.keys())[0]].values
-            ds_surface_vegetation_type = ds_surface.filter_by_attrs(
-                long_name="Vegetation Type"
-            )
-            # to get the values you can use the following...
-            # ds_surface_vegetation_type.variables[list(ds_surface_vegetation_type.data_vars.keys())[0]].values
-
-            # mean sea level variables
-            ds_msl = xr.open_dataset(
-                queue_element,
-                engine="cfgrib",
-                backend_kwargs={
-                    "filter_by_keys": {"typeOfLevel": "meanSea", "stepType": "instant"},
-                    "read_keys": ["projString"],
-                    "indexpath": "",
-                },
-            )
-            ds_mslp = ds_msl.filter_by_attrs(long_name="MSLP (MAPS System Reduction)")
-
-            # set up the variables map for the translate_template_item method. this way only the
-            # translation map needs to be a class variable. Better data hiding.
-            # It seems that cfgrib is graceful about missing variables, so we don't need to check
-            # for them here. But when we try to get the indexed values we will get an exception
-            # if the variable is missing. We will catch that exception and return an empty document
-            try:
-                self.ds_translate_item_variables_map = {
-                    "2 metre temperature": ds_hgt_2_metre_temperature.variables[
-                        list(ds_hgt_2_metre_temperature.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_2_metre_temperature
-                    and ds_hgt_2_metre_temperature.data_vars
-                    and len(list(ds_hgt_2_metre_temperature.data_vars.keys())) > 0
-                    else None,
-                    "2 metre dewpoint temperature": ds_hgt_2_metre_dewpoint_temperature.variables[
-                        list(ds_hgt_2_metre_dewpoint_temperature.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_2_metre_dewpoint_temperature
-                    and ds_hgt_2_metre_dewpoint_temperature.data_vars
-                    and len(list(ds_hgt_2_metre_dewpoint_temperature.data_vars.keys()))
-                    > 0
-                    else None,
-                    "2 metre relative humidity": ds_hgt_2_metre_relative_humidity.variables[
-                        list(ds_hgt_2_metre_relative_humidity.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_2_metre_relative_humidity
-                    and ds_hgt_2_metre_relative_humidity.data_vars
-                    and len(list(ds_hgt_2_metre_relative_humidity.data_vars.keys())) > 0
-                    else None,
-                    "2 metre specific humidity": ds_hgt_2_metre_specific_humidity.variables[
-                        list(ds_hgt_2_metre_specific_humidity.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_2_metre_specific_humidity
-                    and ds_hgt_2_metre_specific_humidity.data_vars
-                    and len(list(ds_hgt_2_metre_specific_humidity.data_vars.keys())) > 0
-                    else None,
-                    "10 metre U wind component": ds_hgt_10_metre_u_component_of_wind.variables[
-                        list(ds_hgt_10_metre_u_component_of_wind.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_10_metre_u_component_of_wind
-                    and ds_hgt_10_metre_u_component_of_wind.data_vars
-                    and len(list(ds_hgt_10_metre_u_component_of_wind.data_vars.keys()))
-                    > 0
-                    else None,
-                    "10 metre V wind component": ds_hgt_10_metre_v_component_of_wind.variables[
-                        list(ds_hgt_10_metre_v_component_of_wind.data_vars.keys())[0]
-                    ]
-                    if ds_hgt_10_metre_v_component_of_wind
-                    and ds_hgt_10_metre_v_component_of_wind.data_vars
-                    and len(list(ds_hgt_10_metre_v_component_of_wind.data_vars.keys()))
-                    > 0
-                    else None,
-                    "Surface pressure": ds_surface_pressure.variables[
-                        list(ds_surface_pressure.data_vars.keys())[0]
-                    ]
-                    if ds_surface_pressure
-                    and ds_surface_pressure.data_vars
-                    and len(list(ds_surface_pressure.data_vars.keys())) > 0
-                    else None,
-                    "MSLP (MAPS System Reduction)": ds_mslp.variables[
-                        list(ds_mslp.data_vars.keys())[0]
-                    ]
-                    if ds_mslp
-                    and ds_mslp.data_vars
-                    and len(list(ds_mslp.data_vars.keys())) > 0
-                    else None,
-                    "Visibility": ds_surface_visibility.variables[
-                        list(ds_surface_visibility.data_vars.keys())[0]
-                    ]
-                    if ds_surface_visibility
-                    and ds_surface_visibility.data_vars
-                    and len(list(ds_surface_visibility.data_vars.keys())) > 0
-                    else None,
-                    "Orography": ds_surface_orog.variables[
-                        list(ds_surface_orog.data_vars.keys())[0]
-                    ]
-                    if ds_surface_orog
-                    and ds_surface_orog.data_vars
-                    and len(list(ds_surface_orog.data_vars.keys())) > 0
-                    else None,
-                    "Cloud ceiling": ds_cloud_ceiling.variables[
-                        list(ds_cloud_ceiling.data_vars.keys())[0]
-                    ]
-                    if ds_cloud_ceiling
-                    and ds_cloud_ceiling.data_vars
-                    and len(list(ds_cloud_ceiling.data_vars.keys())) > 0
-                    else None,
-                    "Vegetation Type": ds_surface_vegetation_type.variables[
-                        list(ds_surface_vegetation_type.data_vars.keys())[0]
-                    ]
-                    if ds_surface_vegetation_type
-                    and ds_surface_vegetation_type.data_vars
-                    and len(list(ds_surface_vegetation_type.data_vars.keys())) > 0
-                    else None,
-                    "fcst_valid_epoch": ds_fcst_valid_epoch,
-                    "fcst_len": ds_fcst_len,
-                    "proj_params": proj_params_dict,
-                }
-            except IndexError as _e:
-                logger.exception(
-                    "%s: Exception with builder build_document retrieving grib variables: error: %s",
+                self.station_grid_cache.put(station_grid_key, station_grid_index)
+            else:
+                logger.info(
+                    "%s: build_document using cached station grid index %s",
                     self.__class__.__name__,
-                    _e,
+                    station_grid_key,
                 )
-                # remove any idx file that may have been created
-                self.delete_idx_file(queue_element)
-                # return an empty document_map
-                return {}
-            # reset the builders document_map for a new file
-            self.initialize_document_map()
-            # get stations from couchbase and filter them so
-            # that we retain only the ones for this models domain which is derived from the projection
-            # also fill in the gridpoints for each station and for each geo within each station
-            # NOTE: this is not about regions, this is about models
-            self.domain_stations = []
-            limit_clause = ";"
-            if self.number_stations != sys.maxsize:
-                limit_clause = f" limit {self.number_stations};"
-            stmnt = f"""SELECT geo, name
-                    from `{bucket}`.{scope}.{collection}
-                    where type='MD'
-                    and docType='station'
-                    and subset='{self.subset}'
-                    and version='V01'
-                    {limit_clause}"""
-            result = self.load_spec["cluster"].query(stmnt)
-            for row in result:
-                station = copy.deepcopy(row)
-                for geo_index in range(len(row["geo"])):
-                    lat = row["geo"][geo_index]["lat"]
-                    lon = row["geo"][geo_index]["lon"]
-                    if lat == -90 and lon == 180 or lat == 0 or lon == 0:
-                        # skip stations with bad lat/lon
-                        # these are probably buoys or ships or mistakes.
-                        logger.info(
-                            "%s: builder build_document skipping station with bad lat/lon: name: %s, lat: %s, lon: %s",
-                            self.__class__.__name__,
-                            row["name"],
-                            str(lat),
-                            str(lon),
-                        )
-                        continue  # don't know how to transform that station
-                    (
-                        _x,
-                        _y,
-                    ) = transformer.transform(lon, lat, radians=False)
-                    x_gridpoint = _x / spacing
-                    y_gridpoint = _y / spacing
-                    # use for debugging if you must
-                    # print (f"transform - lat: {lat}, lon: {lon}, x_gridpoint: {x_gridpoint}, y_gridpoint: {y_gridpoint}")
-                    try:
-                        if (
-                            math.floor(x_gridpoint) < 0
-                            or math.ceil(x_gridpoint) >= max_x
-                            or math.floor(y_gridpoint) < 0
-                            or math.ceil(y_gridpoint) >= max_y
-                        ):
-                            continue
-                    except Exception as _e:
-                        logger.error(
-                            "%s: Exception with builder build_document processing station: error: %s",
-                            self.__class__.__name__,
-                            str(_e),
-                        )
-                        continue
-                    # set the gridpoint for the station
-                    station["geo"][geo_index]["x_gridpoint"] = x_gridpoint
-                    station["geo"][geo_index]["y_gridpoint"] = y_gridpoint
-                # if we have gridpoints for all the geos in the station, add it to the list
-                has_gridpoints = True
-                for elem in station["geo"]:
-                    if "x_gridpoint" not in elem or "y_gridpoint" not in elem:
-                        has_gridpoints = False
-                if has_gridpoints:
-                    self.domain_stations.append(station)
+            self.station_grid_index = station_grid_index
+            self.domain_stations = station_grid_index.domain_stations
+            self.grid_interpolator = None
+            self.station_values = {}
+            # with more workers than files (see VXIngest.runit) the variables of the file are
+            # decoded and extracted in parallel
+            variable_threads = int(self.load_spec.get("variable_threads", 1))
+            if variable_threads > 1 and self.domain_stations:
+                self.prefetch_station_values(variable_threads)
             # if we have asked for profiling go ahead and do it
             if self.do_profiling:
                 with cProfile.Profile() as _pr:
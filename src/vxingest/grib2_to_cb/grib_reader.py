@@ -0,0 +1,273 @@
+"""
+Program Name: Class grib_reader.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import calendar
+import datetime as dt
+import logging
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+
+import eccodes
+import numpy as np
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+# the header keys that are read for every message while scanning the file
+INDEX_KEYS = ["typeOfLevel", "level", "stepType", "name", "shortName"]
+# the keys that are copied into the GRIB_ attrs of a decoded message (like cfgrib does)
+ATTR_KEYS = [
+    "name",
+    "shortName",
+    "units",
+    "typeOfLevel",
+    "level",
+    "stepType",
+    "gridType",
+    "Nx",
+    "Ny",
+    "DxInMetres",
+    "DyInMetres",
+    "LaDInDegrees",
+    "LoVInDegrees",
+    "Latin1InDegrees",
+    "Latin2InDegrees",
+    "latitudeOfFirstGridPointInDegrees",
+    "longitudeOfFirstGridPointInDegrees",
+    "projString",
+]
+# cfgrib represents missing values with this value and then replaces them with NaN
+MISSING_VALUE_INDICATOR = np.finfo(np.float32).max
+
+
+class GribVariable:
+    """A decoded grib message. It has the same values and attrs (GRIB_<key> and long_name)
+    that the corresponding cfgrib/xarray variable has, which is all that the builders use.
+    """
+
+    def __init__(self, values, attrs, fcst_valid_epoch, fcst_len):
+        self.values = values
+        self.attrs = attrs
+        self.fcst_valid_epoch = fcst_valid_epoch
+        self.fcst_len = fcst_len
+
+    def __repr__(self):
+        return f"GribVariable({self.attrs.get('long_name')}, shape={self.values.shape})"
+
+
+class GribReader:
+    """Reads a grib2 file with a single pass over its messages.
+    The constructor scans the message headers once (the data sections are not decoded) and builds
+    an in-memory index of (header keys, file offset) for every message. Messages are then selected
+    with the same kind of keys that cfgrib uses in filter_by_keys and only the selected messages
+    are decoded, each at most once. Different messages can be decoded by different threads at the same time.
+    With a GridCache the grids are shared with the other processes that read the same file.
+    """
+
+    def __init__(self, file_name, grid_cache=None):
+        """
+        Args:
+            file_name (string): the grib2 file
+            grid_cache (GridCache, optional): the cache of the decoded grids. Defaults to None (no cache).
+        Raises:
+            FileNotFoundError: if the file does not exist
+        """
+        self.file_name = str(file_name)
+        self.grid_cache = grid_cache
+        self.messages = []
+        self.decoded = {}
+        # offset -> the lock that makes sure the message is only decoded once
+        self.decode_locks = {}
+        self.lock = threading.Lock()
+        with Path(self.file_name).open("rb") as _f:
+            while True:
+                gid = eccodes.codes_grib_new_from_file(_f, headers_only=True)
+                if gid is None:
+                    break
+                try:
+                    header = {"offset": eccodes.codes_get(gid, "offset", int)}
+                    for key in INDEX_KEYS:
+                        header[key] = self._get_key(gid, key)
+                    header["fcst_valid_epoch"] = self._get_epoch(
+                        gid, "validityDate", "validityTime"
+                    )
+                    header["fcst_len"] = self._get_fcst_len(gid)
+                    self.messages.append(header)
+                finally:
+                    eccodes.codes_release(gid)
+        logger.debug(
+            "GribReader: indexed %d messages in %s", len(self.messages), self.file_name
+        )
+
+    @staticmethod
+    def _get_key(gid, key):
+        """get a key with its native type, None if the message does not have it"""
+        try:
+            if not eccodes.codes_is_defined(gid, key):
+                return None
+            return eccodes.codes_get(gid, key)
+        except eccodes.CodesInternalError:
+            return None
+
+    def find(self, name=None, **filter_keys):
+        """Find the first message that matches the filter keys (and the name if one is given)
+        Args:
+            name (string, optional): the message name i.e. the cfgrib long_name. Defaults to None (any name).
+            filter_keys: header keys that must match i.e. typeOfLevel="heightAboveGround", level=2
+        Returns:
+            dict: the message header (including the file offset) or None
+        """
+        for header in self.messages:
+            if name is not None and header["name"] != name:
+                continue
+            if all(header.get(key) == value for key, value in filter_keys.items()):
+                return header
+        return None
+
+    def _read_message(self, offset):
+        """read the message at offset - the caller must release the handle"""
+        with Path(self.file_name).open("rb") as _f:
+            _f.seek(offset)
+            return eccodes.codes_grib_new_from_file(_f)
+
+    def get_attrs(self, name=None, **filter_keys):
+        """Return the GRIB_ attrs of the first matching message without decoding its values
+        Args:
+            name (string, optional): the message name. Defaults to None (any name).
+            filter_keys: header keys that must match
+        Returns:
+            dict: the attrs or None if there is no matching message
+        """
+        header = self.find(name, **filter_keys)
+        if header is None:
+            return None
+        if header["offset"] in self.decoded:
+            return self.decoded[header["offset"]].attrs
+        gid = self._read_message(header["offset"])
+        try:
+            return self._build_attrs(gid)
+        finally:
+            eccodes.codes_release(gid)
+
+    def _build_attrs(self, gid):
+        attrs = {}
+        for key in ATTR_KEYS:
+            value = self._get_key(gid, key)
+            if value is not None:
+                attrs[f"GRIB_{key}"] = value
+        attrs["long_name"] = attrs.get("GRIB_name")
+        return attrs
+
+    def get_variable(self, name=None, **filter_keys):
+        """Decode the first matching message (each message is decoded only once)
+        Args:
+            name (string, optional): the message name. Defaults to None (any name).
+            filter_keys: header keys that must match
+        Returns:
+            GribVariable: the decoded variable or None if there is no matching message
+        """
+        header = self.find(name, **filter_keys)
+        if header is None:
+            return None
+        offset = header["offset"]
+        with self.lock:
+            decode_lock = self.decode_locks.setdefault(offset, threading.Lock())
+        with decode_lock:
+            if offset not in self.decoded:
+                gid = self._read_message(offset)
+                try:
+                    self.decoded[offset] = self._decode(
+                        gid, offset, header["fcst_valid_epoch"], header["fcst_len"]
+                    )
+                finally:
+                    eccodes.codes_release(gid)
+        return self.decoded[offset]
+
+    def _decode(self, gid, offset, fcst_valid_epoch, fcst_len):
+        """decode a message, the values come from the grid_cache if there is one"""
+        attrs = self._build_attrs(gid)
+        if self.grid_cache is None:
+            values = self._decode_values(gid)
+        else:
+            values = self.grid_cache.get(
+                self.file_name, offset, lambda: self._decode_values(gid)
+            )
+        return GribVariable(values, attrs, fcst_valid_epoch, fcst_len)
+
+    def _decode_values(self, gid):
+        """decode the values of a message the same way cfgrib does - float32, (Ny, Nx), missing values are NaN"""
+        # ask eccodes to return missing values as the missing value indicator
+        eccodes.codes_set(gid, "missingValue", MISSING_VALUE_INDICATOR)
+        shape = (eccodes.codes_get(gid, "Ny"), eccodes.codes_get(gid, "Nx"))
+        values = eccodes.codes_get_values(gid).astype(np.float32).reshape(shape)
+        # re-arrange if alternative row scanning
+        if self._get_key(gid, "alternativeRowScanning"):
+            values[1::2, :] = values[1::2, ::-1]
+        values[values == MISSING_VALUE_INDICATOR] = np.nan
+        return values
+
+    @staticmethod
+    def _get_epoch(gid, date_key, time_key):
+        """convert a date (YYYYMMDD) and time (HHMM) key pair to an epoch"""
+        date = eccodes.codes_get(gid, date_key)
+        hhmm = eccodes.codes_get(gid, time_key)
+        return calendar.timegm(
+            dt.datetime(
+                date // 10000, date // 100 % 100, date % 100, hhmm // 100, hhmm % 100
+            ).timetuple()
+        )
+
+    @staticmethod
+    def _get_fcst_len(gid):
+        """the forecast length in (truncated) hours"""
+        return int(
+            (
+                GribReader._get_epoch(gid, "validityDate", "validityTime")
+                - GribReader._get_epoch(gid, "dataDate", "dataTime")
+            )
+            / 3600
+        )
+
+
+class GribVariableMap(Mapping):
+    """A read only map of template variable name to GribVariable that decodes each
+    grib message on first access. Only the variables that it is given the selection keys for
+    are in the map, the values of other entries (i.e. fcst_valid_epoch) are given directly.
+    """
+
+    def __init__(self, grib_reader, variables, values=None):
+        """
+        Args:
+            grib_reader (GribReader): the reader for the file
+            variables (dict): variable name -> the keys that select its message (see GribReader.find)
+            values (dict, optional): entries that are not grib variables. Defaults to None.
+        """
+        self.grib_reader = grib_reader
+        self.variables = dict(variables)
+        self.values = dict(values or {})
+
+    def __getitem__(self, key):
+        if key in self.values:
+            return self.values[key]
+        if key in self.variables:
+            # GribReader remembers decoded messages so this only decodes once
+            return self.grib_reader.get_variable(**self.variables[key])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.values or key in self.variables
+
+    def __iter__(self):
+        yield from self.values
+        yield from (key for key in self.variables if key not in self.values)
+
+    def __len__(self):
+        return len(self.values) + len(
+            [key for key in self.variables if key not in self.values]
+        )
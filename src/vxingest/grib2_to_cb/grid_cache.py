@@ -0,0 +1,188 @@
+"""
+Program Name: Class grid_cache.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+# the grids that have not been used for this long are removed when a GridCache is created
+GRID_CACHE_MAX_AGE_SECONDS = 6 * 3600
+# a grid that is read is touched, so that prune keeps it, only when its mtime is older than this fraction of max_age
+GRID_CACHE_TOUCH_FRACTION = 0.1
+
+
+class GridCache:
+    """A cache of decoded grib grids that is shared by all the processes on a host.
+    Several ingest documents (i.e. the METAR surface and the RAOB pressure level templates)
+    read the same model files, so every builder process used to decode the same messages.
+    With a GridCache the first process that needs a (file, message) grid decodes it and saves
+    it as a .npy file in the cache_dir, the other processes memory map that file, read only,
+    so they share its pages instead of decoding and holding their own copy.
+    A lock file per grid makes the processes that want the same grid at the same time wait for
+    the one that is decoding it. The key includes the size and the mtime of the grib file, so
+    a file that is replaced gets new grids.
+    """
+
+    def __init__(self, cache_dir=None, max_age=GRID_CACHE_MAX_AGE_SECONDS):
+        """
+        Args:
+            cache_dir (str, optional): the scratch directory for the grids (a local, i.e. tmpfs, directory is best).
+                Defaults to None (the cache is disabled).
+            max_age (int, optional): the seconds after which an unused grid is removed. Defaults to GRID_CACHE_MAX_AGE_SECONDS.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_age = max_age
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.prune()
+
+    @staticmethod
+    def make_key(file_name, offset):
+        """Make the key of the grid of the message at offset in a grib file
+        Args:
+            file_name (str): the grib file
+            offset (int): the offset of the message in the file
+        Returns:
+            str: the key
+        """
+        stat = Path(file_name).stat()
+        key_string = (
+            f"{Path(file_name).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{offset}"
+        )
+        return hashlib.sha1(key_string.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        """The .npy file for a key"""
+        return self.cache_dir / f"grid_{key}.npy"
+
+    def load(self, path):
+        """memory map a grid, read only - None if it is not there"""
+        try:
+            values = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        # touch it so that prune knows it is in use, but not on every read
+        try:
+            if (
+                path.stat().st_mtime
+                < time.time() - self.max_age * GRID_CACHE_TOUCH_FRACTION
+            ):
+                os.utime(path)
+        except FileNotFoundError:
+            # it was pruned, the memory map is still good
+            pass
+        return np.asarray(values)
+
+    def get(self, file_name, offset, decode):
+        """Get the grid of a message, decode (and save) it if no process has done that yet
+        Args:
+            file_name (str): the grib file
+            offset (int): the offset of the message in the file
+            decode (Callable): returns the grid (ndarray) of the message
+        Returns:
+            ndarray: the grid, read only when it comes from the cache
+        """
+        if self.cache_dir is None:
+            return decode()
+        try:
+            path = self.get_path(self.make_key(file_name, offset))
+            values = self.load(path)
+            if values is not None:
+                return values
+            with path.with_suffix(".lock").open("a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # another process may have saved it while this one waited for the lock
+                    values = self.load(path)
+                    if values is not None:
+                        return values
+                    values = decode()
+                    # write a temporary file and rename it so that a grid is never read half written
+                    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                    with tmp_path.open("wb") as _f:
+                        np.save(_f, values)
+                    tmp_path.replace(path)
+                    return self.load(path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError as _e:
+            logger.warning(
+                "GridCache.get: cannot use the cache for %s:%s - %s",
+                file_name,
+                offset,
+                str(_e),
+            )
+            return decode()
+
+    @staticmethod
+    def is_writer_alive(tmp_path):
+        """is the process that is writing a .{pid}.tmp file still running"""
+        try:
+            os.kill(int(tmp_path.suffixes[-2][1:]), 0)
+        except (IndexError, ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            # it is running, as another user
+            return True
+        return True
+
+    def remove_grid(self, path, oldest):
+        """Remove a grid that has not been used since oldest, and its lock file.
+        A grid whose lock is held (it is being decoded) is skipped, the mtime is checked
+        again under the lock because another process may have used the grid meanwhile.
+        """
+        lock_path = path.with_suffix(".lock")
+        with lock_path.open("a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                if path.exists() and path.stat().st_mtime >= oldest:
+                    return
+                path.unlink(missing_ok=True)
+                lock_path.unlink(missing_ok=True)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def prune(self):
+        """Remove the grids (and their lock files) that have not been used for max_age seconds,
+        the lock files that are left without a grid, and the .tmp files of the processes that died
+        while writing a grid"""
+        oldest = time.time() - self.max_age
+        for path in self.cache_dir.glob("grid_*.npy"):
+            try:
+                if path.stat().st_mtime < oldest:
+                    self.remove_grid(path, oldest)
+            except OSError:
+                # it is already gone
+                pass
+        for lock_path in self.cache_dir.glob("grid_*.lock"):
+            # a lock file that was left without its grid, i.e. the decode failed
+            try:
+                path = lock_path.with_suffix(".npy")
+                if not path.exists() and lock_path.stat().st_mtime < oldest:
+                    self.remove_grid(path, oldest)
+            except OSError:
+                pass
+        for tmp_path in self.cache_dir.glob("grid_*.tmp"):
+            try:
+                if tmp_path.stat().st_mtime < oldest and not self.is_writer_alive(
+                    tmp_path
+                ):
+                    tmp_path.unlink()
+            except OSError:
+                pass
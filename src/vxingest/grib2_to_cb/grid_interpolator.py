@@ -0,0 +1,113 @@
+"""
+Program Name: Class grid_interpolator.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import logging
+
+import numpy as np
+
+from vxingest.builder_common.builder_utilities import get_geo_index
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+
+class GridInterpolator:
+    """Vectorized station extraction for a grib grid.
+    The station gridpoints are resolved once (one geo per station for the valid epoch of the file)
+    and the nearest gridpoint indexes and the four bilinear corner indexes and weights are
+    precomputed. Every variable grid is then sampled for all the stations with a single
+    numpy fancy-indexing pass instead of a python call per station.
+    The results are identical to GribBuilder.interp_grid_box, which remains the scalar reference.
+    """
+
+    def __init__(self, x_gridpoints, y_gridpoints, lons=None, elevs=None):
+        """
+        Args:
+            x_gridpoints (array like): x gridpoint (fractional) for each station
+            y_gridpoints (array like): y gridpoint (fractional) for each station
+            lons (array like, optional): longitude for each station. Defaults to None.
+            elevs (array like, optional): elevation for each station. Defaults to None.
+        """
+        self.x_gridpoints = np.asarray(x_gridpoints, dtype=np.float64)
+        self.y_gridpoints = np.asarray(y_gridpoints, dtype=np.float64)
+        self.lons = None if lons is None else np.asarray(lons, dtype=np.float64)
+        self.elevs = None if elevs is None else np.asarray(elevs, dtype=np.float64)
+        # nearest gridpoint - np.rint rounds half to even just like the builtin round
+        self.x_nearest = np.rint(self.x_gridpoints).astype(np.intp)
+        self.y_nearest = np.rint(self.y_gridpoints).astype(np.intp)
+        # bilinear corners
+        self.x_min = np.floor(self.x_gridpoints).astype(np.intp)
+        self.x_max = np.ceil(self.x_gridpoints).astype(np.intp)
+        self.y_min = np.floor(self.y_gridpoints).astype(np.intp)
+        self.y_max = np.ceil(self.y_gridpoints).astype(np.intp)
+        remainder_x = self.x_gridpoints - self.x_min
+        remainder_y = self.y_gridpoints - self.y_min
+        # bilinear weights, in the same order as the terms in interp_grid_box
+        self.weights = (
+            remainder_x * remainder_y,  # xmax_ymax
+            remainder_x * (1 - remainder_y),  # xmax_ymin
+            (1 - remainder_x) * remainder_y,  # xmin_ymax
+            (1 - remainder_x) * (1 - remainder_y),  # xmin_ymin
+        )
+
+    @classmethod
+    def from_stations(cls, stations, fcst_valid_epoch):
+        """Build an interpolator from a list of domain stations.
+        Each station must have x_gridpoint and y_gridpoint in every geo element.
+        Args:
+            stations (list): the domain_stations
+            fcst_valid_epoch (int): the valid epoch used to choose the geo for each station
+        Returns:
+            GridInterpolator: the interpolator for these stations
+        """
+        x_gridpoints = []
+        y_gridpoints = []
+        lons = []
+        elevs = []
+        for station in stations:
+            geo = station["geo"][get_geo_index(fcst_valid_epoch, station["geo"])]
+            x_gridpoints.append(geo["x_gridpoint"])
+            y_gridpoints.append(geo["y_gridpoint"])
+            lons.append(geo.get("lon", np.nan))
+            elev = geo.get("elev")
+            elevs.append(np.nan if elev is None else elev)
+        return cls(x_gridpoints, y_gridpoints, lons, elevs)
+
+    def __len__(self):
+        return len(self.x_gridpoints)
+
+    def nearest(self, values):
+        """Return the nearest gridpoint value for every station
+        Args:
+            values (ndarray): a 2d (y, x) grid of values
+        Returns:
+            ndarray: one value per station, the dtype of values is preserved
+        """
+        return np.asarray(values)[self.y_nearest, self.x_nearest]
+
+    def bilinear(self, values):
+        """Return the bilinear (nearest 4 weighted average) value for every station
+        The arithmetic is done in the same precision that interp_grid_box
+        uses for a scalar python float weight times a grid value (i.e. float32 grids stay float32)
+        so that the results are bit for bit the same.
+        Args:
+            values (ndarray): a 2d (y, x) grid of values
+        Returns:
+            ndarray: one interpolated value per station
+        """
+        values = np.asarray(values)
+        dtype = np.result_type(values.dtype, 1.0)
+        w_max_max, w_max_min, w_min_max, w_min_min = (
+            _w.astype(dtype) for _w in self.weights
+        )
+        return (
+            (w_max_max * values[self.y_max, self.x_max])
+            + (w_max_min * values[self.y_min, self.x_max])
+            + (w_min_max * values[self.y_max, self.x_min])
+            + (w_min_min * values[self.y_min, self.x_min])
+        )
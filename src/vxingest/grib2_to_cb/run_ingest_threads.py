@@ -57,6 +57,7 @@ from datetime import datetime, timedelta
 from multiprocessing import JoinableQueue, Queue, set_start_method
 from pathlib import Path
 
+from vxingest.builder_common.file_manifest import FileManifest
 from vxingest.builder_common.vx_ingest import CommonVxIngest
 from vxingest.grib2_to_cb.vx_ingest_manager import VxIngestManager
 from vxingest.log_config import configure_logging, worker_log_configurer
@@ -146,6 +147,8 @@ class VXIngest(CommonVxIngest):
         self.thread_count = ""
         self.path = None
         self.fmask = None
+        self.manifest_path = None
+        self.worker_pool = None
         self.file_pattern = None
         self.output_dir = None
         # optional: used to limit the number of stations processed
@@ -172,11 +175,13 @@ class VXIngest(CommonVxIngest):
 
         self.credentials_file = config.get("credentials_file", None)
         self.thread_count = config.get("threads", 1)
+        self.worker_pool = config.get("worker_pool", None)
         self.output_dir = config.get("output_dir", "/tmp").strip()
         self.file_pattern = config.get("file_pattern", "*").strip()
         self.ingest_document_ids = config.get("ingest_document_ids", None)
         self.fmask = config.get("file_mask", None)
         self.input_data_path = config.get("input_data_path", None)
+        self.manifest_path = config.get("manifest_path", None)
 
         if "start_epoch" in config and "end_epoch" in config:
             self.first_last_params = {
@@ -213,6 +218,11 @@ class VXIngest(CommonVxIngest):
                 ).content_as[dict]
             self.load_spec["fmask"] = self.fmask
             self.load_spec["input_data_path"] = self.input_data_path
+            # the format and compression of the output files, see DocumentFileWriter
+            self.load_spec["output_format"] = config.get("output_format", "list")
+            self.load_spec["output_compression"] = config.get(
+                "output_compression", "none"
+            )
             # stash the load_job in the load_spec
             self.load_spec["load_job_doc"] = self.build_load_job_doc(
                 self.load_spec["cb_connection"]["collection"]
@@ -237,6 +247,12 @@ class VXIngest(CommonVxIngest):
         subset = self.load_spec["ingest_documents"][
             self.load_spec["ingest_document_ids"][0]
         ]["subset"]
+        # with a manifest only the DF records since the last run are needed
+        manifest = None
+        watermark_condition = ""
+        if self.manifest_path:
+            manifest = FileManifest(self.manifest_path)
+            watermark_condition = manifest.get_df_condition()
         file_query = f"""
             SELECT url, mtime
             FROM `{bucket}`.{scope}.{collection}
@@ -245,6 +261,7 @@ class VXIngest(CommonVxIngest):
             AND type='DF'
             AND fileType='grib2'
             AND originType='{model}'
+            {watermark_condition}
             order by url;
             """
         # walk the directory structure, if there is one, and get the files that match
@@ -256,35 +273,61 @@ class VXIngest(CommonVxIngest):
             self.file_pattern,
             self.fmask,
             self.first_last_params,
+            manifest,
         )
+        if manifest is not None:
+            manifest.close()
         if len(file_names) == 0:
             logger.info("No files to process...exiting")
             return
         logger.info("Number of files to be processed: %s", str(len(file_names)))
-        for _f in file_names:
-            _q.put(_f)
+        # the largest files are started first so that they do not make a long tail
+        file_names = self.sort_by_file_size(file_names)
+        # the thread budget is divided, not multiplied - with fewer files than threads only one
+        # process per file is started and the rest of the budget is used by the builders to
+        # decode and extract the variables of a file in parallel
+        process_count = min(int(self.thread_count), len(file_names))
+        self.load_spec["variable_threads"] = max(
+            1, int(self.thread_count) // process_count
+        )
 
-        # instantiate ingest_manager pool - each ingest_manager is a process
-        # thread that uses builders to process one file at a time from the queue
-        # Make the Pool of ingest_managers
-        ingest_manager_list = []
-        for thread_count in range(int(self.thread_count)):
-            try:
-                ingest_manager_thread = VxIngestManager(
-                    "VxIngestManager-" + str(thread_count),
-                    self.load_spec,
-                    _q,
-                    self.output_dir,
-                    logging_queue=log_queue,  # Queue to pass logging messages back to the main process on
-                    logging_configurer=log_configurer,  # Config function to set up the logger in the multiprocess Process
-                    number_stations=self.number_stations,
-                )
-                ingest_manager_list.append(ingest_manager_thread)
-                ingest_manager_thread.start()
-            except Exception as _e:
-                logger.error("*** Error in VXIngest %s***", str(_e))
-        # be sure to join all the threads to wait on them
-        finished = [proc.join() for proc in ingest_manager_list]
+        if self.worker_pool is not None:
+            # the long lived worker processes of main process the elements, see WorkerPool,
+            # the job gets one file per worker so it uses at most process_count of them
+            finished = self.worker_pool.run(
+                VxIngestManager,
+                self.load_spec,
+                self.output_dir,
+                file_names,
+                number_stations=self.number_stations,
+            )
+        else:
+            # the queue ends with an END_OF_QUEUE for each ingest manager, and each
+            # ingest manager reports back on _results when it is finished
+            self.fill_queue(_q, file_names, process_count)
+            _results = Queue()
+            # instantiate ingest_manager pool - each ingest_manager is a process
+            # thread that uses builders to process one file at a time from the queue
+            # Make the Pool of ingest_managers
+            ingest_manager_list = []
+            for thread_count in range(process_count):
+                try:
+                    ingest_manager_thread = VxIngestManager(
+                        "VxIngestManager-" + str(thread_count),
+                        self.load_spec,
+                        _q,
+                        self.output_dir,
+                        logging_queue=log_queue,  # Queue to pass logging messages back to the main process on
+                        logging_configurer=log_configurer,  # Config function to set up the logger in the multiprocess Process
+                        number_stations=self.number_stations,
+                    )
+                    ingest_manager_thread.result_queue = _results
+                    ingest_manager_list.append(ingest_manager_thread)
+                    ingest_manager_thread.start()
+                except Exception as _e:
+                    logger.error("*** Error in VXIngest %s***", str(_e))
+            # wait for the completion message of every ingest manager and join them
+            finished = self.wait_for_ingest_managers(ingest_manager_list, _results)
         self.write_load_job_to_files()
         logger.info("finished starting threads")
         load_time_end = time.perf_counter()
@@ -293,6 +336,7 @@ class VXIngest(CommonVxIngest):
         logger.info("    >>> Total load a_time: %s", str(load_time))
         logger.info("End a_time: %s", str(datetime.now()))
         logger.info("--- *** --- End  --- *** ---")
+        self.exit_if_failed(finished)
 
     def main(self):
         """
@@ -0,0 +1,310 @@
+"""
+Program Name: Class station_grid_index.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import hashlib
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from vxingest.grib2_to_cb.grid_interpolator import GridInterpolator
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+
+def _to_number(value, number_type):
+    """convert a numpy value to a python int or float, NaN (i.e. a missing value) becomes None"""
+    return None if np.isnan(value) else number_type(value)
+
+
+class StationGridIndex:
+    """The domain stations of a model grid and their gridpoints.
+    Every file of a model shares the same projection, so the station query and the
+    reprojection of every station geo only need to happen once. This index keeps the
+    station geos as flat numpy arrays (one row per geo), can be saved to and loaded from
+    a compact .npz file, and provides a GridInterpolator (nearest and bilinear corner
+    indexes and weights) for any fcst_valid_epoch.
+    """
+
+    # the number of interpolators to remember - they only differ when a station has multiple geos
+    max_interpolators = 8
+
+    def __init__(
+        self,
+        names,
+        geo_station,
+        lat,
+        lon,
+        elev,
+        first_time,
+        last_time,
+        x_gridpoint,
+        y_gridpoint,
+    ):
+        """
+        Args:
+            names (array like): station names, in domain_stations order
+            geo_station (array like): for each geo the index of its station in names (geos are in station order)
+            lat, lon, elev (array like): the geo location
+            first_time, last_time (array like): the geo valid interval
+            x_gridpoint, y_gridpoint (array like): the (fractional) gridpoints of the geo
+        """
+        self.names = np.asarray(names, dtype=str)
+        self.geo_station = np.asarray(geo_station, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.elev = np.asarray(elev, dtype=np.float64)
+        self.first_time = np.asarray(first_time, dtype=np.float64)
+        self.last_time = np.asarray(last_time, dtype=np.float64)
+        self.x_gridpoint = np.asarray(x_gridpoint, dtype=np.float64)
+        self.y_gridpoint = np.asarray(y_gridpoint, dtype=np.float64)
+        # the position of each geo within its station's geo list
+        n_stations = len(self.names)
+        geo_counts = np.bincount(self.geo_station, minlength=n_stations)
+        geo_starts = np.concatenate(([0], np.cumsum(geo_counts)[:-1]))
+        self.geo_position = np.arange(len(self.geo_station)) - np.repeat(
+            geo_starts, geo_counts
+        )
+        self.max_geos = int(geo_counts.max()) if n_stations > 0 else 0
+        self._domain_stations = None
+        self._interpolators = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_stations(cls, stations):
+        """Build an index from a list of domain stations (each geo must have gridpoints)
+        Args:
+            stations (list): station dicts with a name and a geo list
+        Returns:
+            StationGridIndex: the index
+        """
+        columns = {
+            "geo_station": [],
+            "lat": [],
+            "lon": [],
+            "elev": [],
+            "firstTime": [],
+            "lastTime": [],
+            "x_gridpoint": [],
+            "y_gridpoint": [],
+        }
+        for station_index, station in enumerate(stations):
+            for geo in station["geo"]:
+                columns["geo_station"].append(station_index)
+                for key in list(columns)[1:]:
+                    value = geo.get(key)
+                    columns[key].append(np.nan if value is None else value)
+        return cls(
+            [station["name"] for station in stations],
+            columns["geo_station"],
+            columns["lat"],
+            columns["lon"],
+            columns["elev"],
+            columns["firstTime"],
+            columns["lastTime"],
+            columns["x_gridpoint"],
+            columns["y_gridpoint"],
+        )
+
+    @property
+    def domain_stations(self):
+        """The index as a list of station dicts, like the ones the builders use.
+        The list is built once and shared, so it must be treated as read only.
+        """
+        if self._domain_stations is None:
+            stations = [{"name": str(name), "geo": []} for name in self.names]
+            for i, station_index in enumerate(self.geo_station.tolist()):
+                geo = {
+                    "lat": float(self.lat[i]),
+                    "lon": float(self.lon[i]),
+                    "elev": _to_number(self.elev[i], float),
+                    "firstTime": _to_number(self.first_time[i], int),
+                    "lastTime": _to_number(self.last_time[i], int),
+                    "x_gridpoint": float(self.x_gridpoint[i]),
+                    "y_gridpoint": float(self.y_gridpoint[i]),
+                }
+                stations[station_index]["geo"].append(geo)
+            self._domain_stations = stations
+        return self._domain_stations
+
+    def get_geo_indexes(self, fcst_valid_epoch):
+        """The vectorized form of builder_utilities.get_geo_index for every station.
+        The first geo whose interval contains the epoch is chosen, otherwise the first
+        geo with the latest lastTime (or the first geo if no lastTime is positive).
+        Args:
+            fcst_valid_epoch (int): an epoch in seconds
+        Returns:
+            ndarray: the index, into this index's geo arrays, of the chosen geo of each station
+        """
+        n_stations = len(self.names)
+        shape = (n_stations, self.max_geos)
+        in_range = np.zeros(shape, dtype=bool)
+        in_range[self.geo_station, self.geo_position] = (
+            self.first_time <= fcst_valid_epoch
+        ) & (fcst_valid_epoch <= self.last_time)
+        last_times = np.full(shape, -np.inf)
+        last_times[self.geo_station, self.geo_position] = self.last_time
+        latest_position = np.where(
+            last_times.max(axis=1, initial=-np.inf) > 0, last_times.argmax(axis=1), 0
+        )
+        position = np.where(
+            in_range.any(axis=1), in_range.argmax(axis=1), latest_position
+        )
+        geo_starts = np.searchsorted(self.geo_station, np.arange(n_stations))
+        return geo_starts + position
+
+    def get_interpolator(self, fcst_valid_epoch):
+        """Get the interpolator for the station geos that are valid at fcst_valid_epoch.
+        Interpolators are remembered by the geos that were chosen, so the corner
+        indexes and weights are computed once for all the files that share them.
+        Args:
+            fcst_valid_epoch (int): an epoch in seconds
+        Returns:
+            GridInterpolator: the interpolator
+        """
+        geo_indexes = self.get_geo_indexes(fcst_valid_epoch)
+        key = hashlib.sha1(geo_indexes.tobytes()).hexdigest()
+        interpolator = self._interpolators.get(key)
+        if interpolator is None:
+            if len(self._interpolators) >= self.max_interpolators:
+                self._interpolators.pop(next(iter(self._interpolators)))
+            interpolator = GridInterpolator(
+                self.x_gridpoint[geo_indexes],
+                self.y_gridpoint[geo_indexes],
+                self.lon[geo_indexes],
+                self.elev[geo_indexes],
+            )
+            self._interpolators[key] = interpolator
+        return interpolator
+
+    def save(self, path):
+        """Save the index to a compressed .npz file
+        Args:
+            path (Path): the file name
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file of this writer and rename it so that other processes never
+        # see a partial file, the processes that miss the cache at the same time all save the index
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+            try:
+                np.savez_compressed(
+                    tmp_file,
+                    names=self.names,
+                    geo_station=self.geo_station,
+                    lat=self.lat,
+                    lon=self.lon,
+                    elev=self.elev,
+                    first_time=self.first_time,
+                    last_time=self.last_time,
+                    x_gridpoint=self.x_gridpoint,
+                    y_gridpoint=self.y_gridpoint,
+                )
+            except Exception:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index that was saved with save
+        Args:
+            path (Path): the file name
+        Returns:
+            StationGridIndex: the index
+        """
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(
+                npz["names"],
+                npz["geo_station"],
+                npz["lat"],
+                npz["lon"],
+                npz["elev"],
+                npz["first_time"],
+                npz["last_time"],
+                npz["x_gridpoint"],
+                npz["y_gridpoint"],
+            )
+
+
+class StationGridIndexCache:
+    """An in memory (and optionally on disk) cache of StationGridIndex objects,
+    keyed by a hash of the grid projection parameters and the station set.
+    A builder owns one of these for the life of its VxIngestManager.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        Args:
+            cache_dir (str, optional): a directory to persist the indexes in as .npz files. Defaults to None (memory only).
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.indexes = {}
+
+    @staticmethod
+    def make_key(**params):
+        """Make a cache key from the projection parameters and the station set identity
+        Args:
+            params: any json serializable values i.e. proj_string, nx, ny, dx, first gridpoint, subset, station update time
+        Returns:
+            str: the key
+        """
+        key_string = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(key_string.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        """The .npz file for a key (None if there is no cache_dir)"""
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"station_grid_index_{key}.npz"
+
+    def get(self, key):
+        """Get an index from memory, or from the cache_dir
+        Args:
+            key (str): the cache key
+        Returns:
+            StationGridIndex: the index or None if it isn't cached
+        """
+        index = self.indexes.get(key)
+        if index is not None:
+            return index
+        path = self.get_path(key)
+        if path is not None and path.exists():
+            try:
+                index = StationGridIndex.load(path)
+                self.indexes[key] = index
+                return index
+            except Exception as _e:
+                logger.warning(
+                    "StationGridIndexCache.get: cannot load %s - %s", path, str(_e)
+                )
+        return None
+
+    def put(self, key, index):
+        """Add an index to the cache (and the cache_dir, if there is one)
+        Args:
+            key (str): the cache key
+            index (StationGridIndex): the index
+        """
+        self.indexes[key] = index
+        path = self.get_path(key)
+        if path is not None:
+            try:
+                index.save(path)
+            except OSError as _e:
+                logger.warning(
+                    "StationGridIndexCache.put: cannot save %s - %s", path, str(_e)
+                )
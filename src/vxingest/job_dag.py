@@ -0,0 +1,271 @@
+"""
+JobDAG - runs ingest jobs in dependency order, each job starts as soon as the jobs it depends on have finished.
+
+The dependencies come from the RUNTIME job (JS) documents: a job document can list the
+job ids that it depends on in a "dependsOn" field. A MODEL job without dependent job documents
+gets the CTC and SUMS jobs of its model, as in run_ingest.sh. Both depend only on the MODEL job,
+the SUMS builder reads the MODEL and OBS documents and not the CTC documents, so a failed CTC job
+does not skip the SUMS job (run_ingest.sh runs the jobs one after the other and stops the jobs of
+a model at the first one that fails).
+"""
+
+import logging
+import sys
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from couchbase.cluster import Cluster  # type: ignore
+from couchbase.options import QueryOptions  # type: ignore
+
+from vxingest.builder_common.document_file_writer import iter_document_file
+from vxingest.builder_common.document_writer import DocumentWriter
+
+logger = logging.getLogger(__name__)
+
+# the jobs that are derived from a MODEL job that does not have dependent job documents
+DERIVED_JOB_ID_TEMPLATES = [
+    "JS:METAR:CTC:{model}:schedule:job:V01",
+    "JS:METAR:SUMS:{model}:schedule:job:V01",
+]
+# the output files that are imported
+OUTPUT_FILE_PATTERNS = ["*.json", "*.json.gz", "*.json.zst"]
+# an imported output file is renamed with this suffix, so the import of the transfer archive
+# (run_ingest.sh only imports the *.json, *.json.gz and *.json.zst files) does not import it again
+IMPORTED_SUFFIX = ".imported"
+# the most documents that are read from an output file before they are upserted
+IMPORT_BATCH_DOCUMENTS = 10000
+
+
+def get_dependent_job_ids(cluster: Cluster, bucket: str, job_id: str) -> list[str]:
+    """
+    Returns the ids of the jobs that depend on a job
+
+    Args:
+        cluster (Cluster): The Couchbase cluster
+        bucket (str): The bucket of the RUNTIME collection
+        job_id (str): The job document id
+
+    Returns:
+        list[str]: the ids of the job documents that list job_id in their dependsOn field,
+        or for a MODEL job without any, the ids of its CTC and SUMS jobs
+    """
+    query = f"""
+        SELECT RAW meta().id
+        FROM {bucket}._default.RUNTIME
+        WHERE type = 'JS'
+            AND version = 'V01'
+            AND ANY upstream IN dependsOn SATISFIES upstream = $job_id END
+        ORDER BY meta().id"""
+    dependent_job_ids = list(
+        cluster.query(
+            query, QueryOptions(read_only=True, named_parameters={"job_id": job_id})
+        )
+    )
+    if not dependent_job_ids and ":MODEL:" in job_id:
+        model = job_id.split(":")[3]
+        dependent_job_ids = [
+            template.format(model=model) for template in DERIVED_JOB_ID_TEMPLATES
+        ]
+    return dependent_job_ids
+
+
+def import_output_dir(collection, output_dir: Path) -> dict:
+    """
+    Upserts the documents of the output files of a proc, so that the jobs that depend
+    on the proc can read them without waiting for the import of the transfer archive.
+    The files that were all written are renamed with the IMPORTED_SUFFIX so that they are
+    not imported a second time from the transfer archive.
+
+    Args:
+        collection (Collection): The collection that the documents are imported into
+        output_dir (Path): The output directory of the proc
+
+    Returns:
+        dict: documents, failed (the number of documents that were not written) and
+        first_epoch and last_epoch, the range of the fcstValidEpochs of the documents (None if there are none)
+    """
+    stats = {"documents": 0, "failed": 0, "first_epoch": None, "last_epoch": None}
+    writer = DocumentWriter(collection)
+
+    def upsert(document_map: dict) -> int:
+        write_stats = writer.upsert(document_map)
+        stats["documents"] += write_stats["documents"]
+        stats["failed"] += len(write_stats["failed"])
+        return len(write_stats["failed"])
+
+    paths = sorted(
+        path
+        for pattern in OUTPUT_FILE_PATTERNS
+        for path in Path(output_dir).glob(pattern)
+    )
+    for path in paths:
+        failed = 0
+        document_map = {}
+        # the documents are streamed, only IMPORT_BATCH_DOCUMENTS of them are held at a time
+        for document in iter_document_file(path):
+            document_map[document["id"]] = document
+            epoch = document.get("fcstValidEpoch")
+            if isinstance(epoch, int):
+                if stats["first_epoch"] is None:
+                    stats["first_epoch"] = stats["last_epoch"] = epoch
+                stats["first_epoch"] = min(stats["first_epoch"], epoch)
+                stats["last_epoch"] = max(stats["last_epoch"], epoch)
+            if len(document_map) >= IMPORT_BATCH_DOCUMENTS:
+                failed += upsert(document_map)
+                document_map = {}
+        if document_map:
+            failed += upsert(document_map)
+        if failed == 0:
+            # a file that was not all written is left for the import of the transfer archive
+            path.rename(path.with_name(path.name + IMPORTED_SUFFIX))
+    logger.info(f"Imported {stats['documents']} documents from {output_dir}: {stats}")
+    return stats
+
+
+def get_epoch_range(upstream_results: dict[str, dict]) -> tuple[int, int] | None:
+    """
+    Returns the range of the fcstValidEpochs that the upstream jobs wrote
+
+    Returns:
+        tuple[int, int] | None: the first and last epochs, None if the upstream jobs did not write any
+    """
+    first_epoch = sys.maxsize
+    last_epoch = -1
+    for result in upstream_results.values():
+        if result.get("first_epoch") is not None:
+            first_epoch = min(first_epoch, result["first_epoch"])
+            last_epoch = max(last_epoch, result["last_epoch"])
+    if last_epoch < 0:
+        return None
+    return first_epoch, last_epoch
+
+
+class JobDAG:
+    """A graph of jobs and the jobs that they depend on.
+    run() runs every job once all of the jobs it depends on have succeeded, the jobs that are
+    ready at the same time run concurrently. A job that depends on a job that failed (or was
+    skipped) is skipped.
+    """
+
+    def __init__(self):
+        # job_id -> the job ids it depends on
+        self.dependencies: dict[str, set[str]] = {}
+
+    def add_job(self, job_id: str, depends_on: list[str] | None = None) -> None:
+        """Add a job, and the edges from the jobs that it depends on (which are added too)"""
+        self.dependencies.setdefault(job_id, set())
+        for upstream_job_id in depends_on or []:
+            self.dependencies.setdefault(upstream_job_id, set())
+            self.dependencies[job_id].add(upstream_job_id)
+
+    def get_dependents(self, job_id: str) -> list[str]:
+        """Returns the jobs that depend on a job"""
+        return [
+            dependent_id
+            for dependent_id, upstream_ids in self.dependencies.items()
+            if job_id in upstream_ids
+        ]
+
+    def add_dependent_jobs(self, get_dependent_ids: Callable[[str], list[str]]) -> None:
+        """Add the jobs that depend on the jobs in the graph, and the jobs that depend on those, and so on
+        Args:
+            get_dependent_ids (Callable): returns the ids of the jobs that depend on a job id
+        """
+        pending = list(self.dependencies)
+        visited = set()
+        while pending:
+            job_id = pending.pop(0)
+            if job_id in visited:
+                continue
+            visited.add(job_id)
+            for dependent_id in get_dependent_ids(job_id):
+                self.add_job(dependent_id, [job_id])
+                pending.append(dependent_id)
+
+    def get_order(self) -> list[str]:
+        """
+        Returns the jobs in an order in which every job comes after the jobs it depends on
+
+        Raises:
+            ValueError: if the dependencies have a cycle
+        """
+        order = []
+        remaining = {
+            job_id: set(upstream_ids)
+            for job_id, upstream_ids in self.dependencies.items()
+        }
+        while remaining:
+            ready = [
+                job_id for job_id, upstream_ids in remaining.items() if not upstream_ids
+            ]
+            if not ready:
+                raise ValueError(
+                    f"The job dependencies have a cycle: {sorted(remaining)}"
+                )
+            for job_id in ready:
+                order.append(job_id)
+                del remaining[job_id]
+            for upstream_ids in remaining.values():
+                upstream_ids.difference_update(ready)
+        return order
+
+    def run(
+        self,
+        run_job: Callable[[str, dict[str, dict]], dict],
+        max_workers: int = 1,
+    ) -> dict[str, dict]:
+        """
+        Runs the jobs in dependency order
+
+        Args:
+            run_job (Callable): runs a job, it is called with the job id and the results of the jobs
+                that it depends on and returns a result dict with a "succeeded" bool
+            max_workers (int): the most jobs that run at the same time
+
+        Returns:
+            dict[str, dict]: job id -> result, a skipped job has the result {"succeeded": False, "skipped": True}
+        """
+        order = self.get_order()
+        results: dict[str, dict] = {}
+        running = {}
+        with ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="JobDAG"
+        ) as executor:
+            while len(results) < len(order):
+                for job_id in order:
+                    if job_id in results or job_id in running.values():
+                        continue
+                    upstream_ids = self.dependencies[job_id]
+                    if not upstream_ids.issubset(results):
+                        continue
+                    upstream_results = {
+                        upstream_id: results[upstream_id]
+                        for upstream_id in upstream_ids
+                    }
+                    failed = [
+                        upstream_id
+                        for upstream_id, result in upstream_results.items()
+                        if not result["succeeded"]
+                    ]
+                    if failed:
+                        logger.warning(
+                            f"Skipping job {job_id}, {failed} did not succeed"
+                        )
+                        results[job_id] = {"succeeded": False, "skipped": True}
+                        continue
+                    logger.info(f"Starting job {job_id}")
+                    running[executor.submit(run_job, job_id, upstream_results)] = job_id
+                if not running:
+                    # skipping a job can make the jobs after it ready to be skipped
+                    continue
+                done, _not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        results[job_id] = future.result()
+                    except Exception:
+                        logger.exception(f"Error running job {job_id}")
+                        results[job_id] = {"succeeded": False}
+                    logger.info(f"Finished job {job_id}: {results[job_id]}")
+        return results
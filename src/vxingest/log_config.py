@@ -1,6 +1,7 @@
 import logging
 import logging.handlers
 import os
+import threading
 from multiprocessing import Queue
 from pathlib import Path
 
@@ -47,10 +48,45 @@ def get_loglevel() -> int:
     return logging.INFO
 
 
+class ProcLogFilter(logging.Filter):
+    """Passes only the log records of one proc, for the logfile of a proc that runs at the same
+    time as other procs. Those are the records of the main process thread that runs the proc,
+    and the records that the proc's worker processes tag with its name (see worker_log_configurer).
+
+    Has to be made in the thread that runs the proc"""
+
+    def __init__(self, proc_name: str):
+        super().__init__()
+        self.proc_name = proc_name
+        self.process = os.getpid()
+        self.thread = threading.get_ident()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if hasattr(record, "proc_name"):
+            return record.proc_name == self.proc_name
+        return record.process == self.process and record.thread == self.thread
+
+
+class ProcNameFilter(logging.Filter):
+    """Tags every log record with the name of a proc, no records are tagged while proc_name is None"""
+
+    def __init__(self, proc_name: str | None):
+        super().__init__()
+        self.proc_name = proc_name
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.proc_name is not None:
+            record.proc_name = self.proc_name
+        return True
+
+
 def add_logfile(
-    ql: logging.handlers.QueueListener, logpath: Path
+    ql: logging.handlers.QueueListener,
+    logpath: Path,
+    log_filter: logging.Filter | None = None,
 ) -> logging.FileHandler:
     """Adds a new logfile to the root logger, and updates the given QueueListener to log to it
+    The optional log_filter selects the records that are written to the logfile.
 
     returns a FileHandler so that it can be removed if desired"""
     # Add a logging file handler with a unique name for just this job
@@ -61,6 +97,8 @@ def add_logfile(
     f_handler = logging.FileHandler(logpath)
     f_handler.setLevel(level)
     f_handler.setFormatter(log_format)
+    if log_filter is not None:
+        f_handler.addFilter(log_filter)
     root_logger.addHandler(f_handler)
     ql.handlers = ql.handlers + (f_handler,)
     return f_handler
@@ -131,11 +169,14 @@ def configure_logging(
     return ql
 
 
-def worker_log_configurer(queue):
+def worker_log_configurer(queue, proc_name: str | None = None):
     """Configures logging for multiprocess workers
+    The records are tagged with the proc_name, if one is given, for the ProcLogFilter of the proc's logfile
 
     Needs to be called at the start of the worker's Process.Run() method"""
     h = logging.handlers.QueueHandler(queue)  # Just the one handler needed
+    if proc_name is not None:
+        h.addFilter(ProcNameFilter(proc_name))
     root = logging.getLogger()
     root.addHandler(h)
     root.setLevel(
@@ -3,6 +3,8 @@
 
 import argparse
 import contextlib
+import copy
+import functools
 import logging
 import os
 import shutil
@@ -10,6 +12,7 @@ import sys
 import tarfile
 import time
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from multiprocessing import Queue, set_start_method
 from pathlib import Path
@@ -26,9 +29,22 @@ from couchbase.options import (  # type: ignore
 )
 from prometheus_client import CollectorRegistry, Counter, Gauge, write_to_textfile
 
+from vxingest.builder_common.document_file_writer import (
+    OUTPUT_COMPRESSIONS,
+    OUTPUT_FORMATS,
+)
+from vxingest.builder_common.worker_pool import WorkerPool
 from vxingest.ctc_to_cb.run_ingest_threads import VXIngest as CTCIngest
+from vxingest.derived_to_cb.run_ingest_threads import VXIngest as DerivedIngest
 from vxingest.grib2_to_cb.run_ingest_threads import VXIngest as GRIBIngest
+from vxingest.job_dag import (
+    JobDAG,
+    get_dependent_job_ids,
+    get_epoch_range,
+    import_output_dir,
+)
 from vxingest.log_config import (
+    ProcLogFilter,
     add_logfile,
     configure_logging,
     remove_logfile,
@@ -79,6 +95,18 @@ prom_last_success = Gauge(
     "Last time a batch job successfully finished",
     registry=prom_registry,
 )
+prom_archive_size = Gauge(
+    "run_ingest_archive_size_bytes",
+    "The size of the output archive of a job, in bytes",
+    ["job"],
+    registry=prom_registry,
+)
+prom_archive_duration = Gauge(
+    "run_ingest_archive_duration",
+    "The duration of the creation of the output archive of a job, in seconds",
+    ["job"],
+    registry=prom_registry,
+)
 
 
 def process_cli():
@@ -94,6 +122,13 @@ def process_cli():
     -e - end epoch (optional)
     -f - file_pattern (optional)
     -t - threads (optional)
+    -i - incremental file discovery (optional)
+    --output_format - list or lines (optional)
+    --output_compression - none, gzip or zstd (optional)
+    --archive_workers - the number of output archives that are made at the same time (optional)
+    --worker_pool - reuse one pool of worker processes for all the procs (optional)
+    --concurrent_procs - the number of procs that run at the same time (optional)
+    --dag - also run the jobs that depend on the given jobs, as soon as their data is written (optional)
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -172,6 +207,52 @@ def process_cli():
         default=determine_num_processes(),
         help=f"The number of threads to use. Default is {determine_num_processes()}.",
     )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Keep a file manifest in the metrics directory so that GRIB & NetCDF jobs only look for the files that are new since their last run.",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        required=False,
+        choices=OUTPUT_FORMATS,
+        default="list",
+        help="The format of the output files, a json list of documents (cbimport -f list) or one document per line (cbimport -f lines).",
+    )
+    parser.add_argument(
+        "--output_compression",
+        type=str,
+        required=False,
+        choices=list(OUTPUT_COMPRESSIONS),
+        default="none",
+        help="Compress the output files while they are written. The tarfile is then only lightly compressed.",
+    )
+    parser.add_argument(
+        "--archive_workers",
+        type=int,
+        required=False,
+        default=1,
+        help="The number of background threads that archive the job output directories. Default is 1.",
+    )
+    parser.add_argument(
+        "--worker_pool",
+        action="store_true",
+        help="Start the worker processes (--threads of them) once and reuse them, and their couchbase connections, for every proc instead of starting new processes for each proc.",
+    )
+    parser.add_argument(
+        "--concurrent_procs",
+        type=int,
+        required=False,
+        default=1,
+        help="The number of procs that run at the same time, in run_priority order. The --threads workers are shared between them. Default is 1, the procs run one at a time in the order of the jobs.",
+    )
+    parser.add_argument(
+        "--dag",
+        action="store_true",
+        help="Also run the jobs that depend on the given jobs (i.e. the CTC and SUMS jobs of a MODEL job). The output of a job that has dependent jobs is imported into couchbase as soon as each of its procs finishes and the dependent jobs start as soon as their upstream jobs are imported, for the fcstValidEpochs that those wrote.",
+    )
     # get the command line arguments
     args = parser.parse_args()
     return args
@@ -272,6 +353,7 @@ def get_runtime_job_criteria(
         subType,
         subset,
         processSpecIds,
+        run_priority,
         status
         FROM {creds["cb_bucket"]}._default.RUNTIME
         WHERE id='{job_id}'
@@ -345,81 +427,190 @@ def determine_num_processes() -> int:
     return cpus
 
 
-def make_tarfile(output_tarfile: Path, source_dir: Path):
-    """Create a tarfile, with the source_dir as the root of the tarfile contents"""
-    with tarfile.open(output_tarfile, "w:gz") as tar:
-        tar.add(source_dir, arcname=Path(source_dir).name)
+def make_tarfile(
+    output_tarfile: Path,
+    source_dir: Path,
+    compresslevel: int = 9,
+    arcname: str | None = None,
+):
+    """Create a tarfile, with the source_dir (or arcname) as the root of the tarfile contents
+    The compresslevel can be lowered when the files are already compressed."""
+    with tarfile.open(output_tarfile, "w:gz", compresslevel=compresslevel) as tar:
+        tar.add(source_dir, arcname=arcname or Path(source_dir).name)
+
+
+def remove_dir(directory: Path) -> None:
+    """Remove a directory tree, retrying a couple of times (i.e. for slow network file systems)"""
+    logger.info(f"Removing: {directory}")
+    retry = 0
+    ignore = False
+    while retry < 3:
+        try:
+            if retry == 2:
+                ignore = True  # On the last retry, ignore errors and just log them
+            shutil.rmtree(directory, ignore_errors=ignore, onerror=None)
+            break
+        except Exception as e:
+            logger.debug(f"Error removing {directory}: {e} - retrying ({retry + 1}/3)")
+            retry += 1
+            time.sleep(1)
 
 
-# docs are processSpecification docs
-# represented by processSpecId. The criterion has an id and some other fields.
-def process_run_configurations(
-    cluster: Cluster,
-    job_run_criteria: list[JobRunCriterion],
+class Archiver:
+    """Archives the output directories of the procs in background threads so that the
+    compression of one proc's output overlaps the ingest of the next proc.
+    More than one worker compresses several archives at the same time (zlib releases the GIL).
+    The size and the duration of each archive are recorded in the prometheus metrics.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="Archiver"
+        )
+        self.futures = []
+
+    def submit(
+        self,
+        output_tarfile: Path,
+        source_dir: Path,
+        arcname: str,
+        metric_name: str,
+        compresslevel: int = 9,
+    ) -> None:
+        """Archive the source_dir into the output_tarfile and remove the source_dir, in the background"""
+        self.futures.append(
+            self.executor.submit(
+                self.archive,
+                output_tarfile,
+                source_dir,
+                arcname,
+                metric_name,
+                compresslevel,
+            )
+        )
+
+    def archive(
+        self,
+        output_tarfile: Path,
+        source_dir: Path,
+        arcname: str,
+        metric_name: str,
+        compresslevel: int,
+    ) -> None:
+        start_time = time.perf_counter()
+        make_tarfile(output_tarfile, source_dir, compresslevel, arcname)
+        duration = time.perf_counter() - start_time
+        size = output_tarfile.stat().st_size
+        prom_archive_size.labels(job=metric_name).set(size)
+        prom_archive_duration.labels(job=metric_name).set(duration)
+        logger.info(
+            f"Created tarfile at: {output_tarfile} ({size} bytes in {duration:.2f} seconds)"
+        )
+        remove_dir(source_dir)
+
+    def wait(self) -> None:
+        """Wait for all the submitted archives, the failures are logged"""
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Error creating an archive")
+        self.futures = []
+
+
+def get_run_priority(job: JobRunCriterion) -> int:
+    """The run_priority of a proc, lower priorities run first and procs without one run last"""
+    run_priority = job.get("run_priority")
+    return sys.maxsize if run_priority is None else run_priority
+
+
+def process_proc(
+    runtime_collection,
+    job: JobRunCriterion,
     startime: datetime,
     args,
     log_configurer: Callable,
     log_queue: Queue,
     ql,
-) -> None:
+    archiver: Archiver,
+    worker_pool=None,
+    threads: int = 1,
+    separate_logs: bool = False,
+    after_proc: Callable | None = None,
+) -> bool:
     """
-    Parses the given job docs.
-    Example runtime job_run_criteria:
-    ['PS:METAR:NETCDF:OBS:MADIS-TEST:V01']
+    Runs one proc and submits its output to the archiver.
+    Args:
+        runtime_collection (Collection): the RUNTIME collection
+        job (JobRunCriterion): the proc to run
+        threads (int): the number of worker processes of the proc
+        separate_logs (bool): filter the proc's log file to the proc's own records, for procs that run at the same time
+        after_proc (Callable, optional): called with the output directory of a proc that succeeded, before it is archived
+    Returns:
+        bool: True if the proc succeeded
     """
-    logger.info("Processing the job docs")
-    success_count = 0
-    fail_count = 0
-    runtime_collection = (
-        cluster.bucket("vxdata").scope("_default").collection("RUNTIME")
+    logger.info(f"Processing job: {job}")
+    proc = runtime_collection.get(job["id"]).content_as[dict]
+    job["sub_type"] = proc.get("subType")
+    # get config values from the runtime document heirachy for this process
+    ingest_document_ids = proc.get("ingestDocumentIds")
+    data_source_id = proc.get("dataSourceId")
+    data_source_spec = runtime_collection.get(data_source_id).content_as[dict]
+    input_data_path = data_source_spec.get("sourceDataUri")
+    file_mask = data_source_spec.get("fileMask", "")
+    file_pattern = data_source_spec.get("filePattern", "*")
+    collection = data_source_spec.get("subset")
+    name = proc["id"].replace("_", "__").replace(":", "_")
+    # override file_pattern if given on command line
+    if getattr(args, "file_pattern", None):
+        file_pattern = args.file_pattern
+    # Add a logging file handler with a unique name for just this proc
+    logpath = args.log_dir / f"{name}-{startime.strftime('%Y-%m-%dT%H:%M:%S%z')}.log"
+    # when procs run at the same time each log file only gets the records of its own proc
+    f_handler = add_logfile(ql, logpath, ProcLogFilter(name) if separate_logs else None)
+    if separate_logs:
+        log_configurer = functools.partial(log_configurer, proc_name=name)
+
+    metric_name = f"{name}"
+    logger.info(f"metric_name {metric_name}")
+
+    # create an output directory with the time this proc was started.
+    # The output of the procs of a subType is archived under the same directory name, but each
+    # proc writes into its own directory so that procs can run at the same time.
+    archive_name = startime.strftime("%Y%m%d%H%M%S")
+    output_dir = (
+        Path(args.output_dir)
+        / f"{proc['subType']}_to_cb"
+        / "output"
+        / f"{archive_name}-{name}"
     )
-    for job in job_run_criteria:
-        logger.info(f"Processing job: {job}")
-        proc = runtime_collection.get(job["id"]).content_as[dict]
-        job["sub_type"] = proc.get("subType")
-        # get config values from the runtime document heirachy for this process
-        ingest_document_ids = proc.get("ingestDocumentIds")
-        data_source_id = proc.get("dataSourceId")
-        data_source_spec = runtime_collection.get(data_source_id).content_as[dict]
-        input_data_path = data_source_spec.get("sourceDataUri")
-        file_mask = data_source_spec.get("fileMask", "")
-        file_pattern = data_source_spec.get("filePattern", "*")
-        collection = data_source_spec.get("subset")
-        name = proc["id"].replace("_", "__").replace(":", "_")
-        # override file_pattern if given on command line
-        if getattr(args, "file_pattern", None):
-            file_pattern = args.file_pattern
-        # Add a logging file handler with a unique name for just this proc
-        logpath = (
-            args.log_dir / f"{name}-{startime.strftime('%Y-%m-%dT%H:%M:%S%z')}.log"
-        )
-        f_handler = add_logfile(ql, logpath)
-
-        metric_name = f"{name}"
-        logger.info(f"metric_name {metric_name}")
-
-        # create an output directory with the time this proc was started.
-        output_dir = (
-            Path(args.output_dir)
-            / f"{proc['subType']}_to_cb"
-            / "output"
-            / f"{startime.strftime('%Y%m%d%H%M%S')}"
-        )
-        create_dirs([output_dir])
-        # Create the config dictionary for this job
-        config = {
-            "credentials_file": str(args.credentials_file),
-            "collection": collection,
-            "file_mask": file_mask,
-            "file_pattern": file_pattern,
-            "input_data_path": input_data_path,
-            "ingest_document_ids": ingest_document_ids,
-            "output_dir": str(output_dir),
-            "threads": args.threads,
-            "start_epoch": args.start_epoch,
-            "end_epoch": args.end_epoch,
-        }
-        proc_succeeded = False
+    create_dirs([output_dir])
+    # Create the config dictionary for this job
+    config = {
+        "credentials_file": str(args.credentials_file),
+        "collection": collection,
+        "file_mask": file_mask,
+        "file_pattern": file_pattern,
+        "input_data_path": input_data_path,
+        "ingest_document_ids": ingest_document_ids,
+        "output_dir": str(output_dir),
+        "threads": threads,
+        "start_epoch": args.start_epoch,
+        "end_epoch": args.end_epoch,
+        "output_format": getattr(args, "output_format", "list"),
+        "output_compression": getattr(args, "output_compression", "none"),
+        # the procs that run at the same time share the pool, each with its threads
+        "worker_pool": (
+            worker_pool.for_proc(threads, name if separate_logs else None)
+            if worker_pool
+            else None
+        ),
+    }
+    # the manifest has to outlive the output directory, which is removed after every run
+    if getattr(args, "incremental", False):
+        config["manifest_path"] = str(args.metrics_dir / f"{name}-manifest.sqlite")
+    proc_succeeded = False
+    try:
         match proc["subType"]:
             case "GRIB2" | "GRIB2-TEST":
                 try:
@@ -477,6 +668,21 @@ def process_run_configurations(
                         proc_succeeded = True
                 else:
                     proc_succeeded = True
+            case "DERIVED" | "DERIVED-TEST":
+                # CTC and PARTIAL_SUMS ingest documents derived in one pass over the model and obs
+                try:
+                    derived_ingest = DerivedIngest()
+                    derived_ingest.runit(
+                        config,
+                        log_queue,
+                        log_configurer,
+                    )
+                except SystemExit as e:
+                    if e.code == 0:
+                        # Job succeeded
+                        proc_succeeded = True
+                else:
+                    proc_succeeded = True
             # case "PREPBUFR" | "PREPBUFR-TEST":
             #     try:
             #         prepbufr_ingest = PrepbufrIngest()
@@ -494,13 +700,22 @@ def process_run_configurations(
             case _:
                 logger.error(f"No ingest method for {proc['subType']}")
                 proc_succeeded = False
+        if proc_succeeded and after_proc is not None:
+            try:
+                after_proc(output_dir)
+            except Exception:
+                logger.exception(f"Error after processing proc: {proc['id']}")
+                proc_succeeded = False
+    except Exception:
+        # a runit that raises fails its proc, the next proc still gets a clean log
+        logger.exception(f"Error processing proc: {proc['id']}")
+        proc_succeeded = False
+    finally:
         if proc_succeeded:
-            success_count += 1
             # Update prometheus metrics
             prom_successes.inc()
             prom_last_success.set_to_current_time()
         else:
-            fail_count += 1
             # Update prometheus metrics
             prom_failures.inc()
         logger.info(f"Done processing  proc: {proc}")
@@ -511,26 +726,172 @@ def process_run_configurations(
         logpath.rename(
             output_dir / f"{name}-{startime.strftime('%Y-%m-%dT%H:%M:%S%z')}.log"
         )
-        # Create a tarfile and delete the output directory contents
+        # Create a tarfile and delete the output directory contents in the background.
         tar_filename = f"{metric_name}_{startime.strftime('%s')}.tar.gz"
-        make_tarfile(args.transfer_dir / tar_filename, output_dir)
-        logger.info(f"Created tarfile at: {args.transfer_dir / tar_filename}")
-        logger.info(f"Removing: {output_dir}")
-        retry = 0
-        ignore = False
-        while retry < 3:
-            try:
-                if retry == 2:
-                    ignore = True  # On the last retry, ignore errors and just log them
-                shutil.rmtree(output_dir, ignore_errors=ignore, onerror=None)
-                break
-            except Exception as e:
-                logger.debug(
-                    f"Error removing {output_dir}: {e} - retrying ({retry + 1}/3)"
+        archiver.submit(
+            args.transfer_dir / tar_filename,
+            output_dir,
+            archive_name,
+            metric_name,
+            # the output files that are compressed as they are written are not compressed again
+            compresslevel=0 if config["output_compression"] != "none" else 9,
+        )
+    return proc_succeeded
+
+
+def process_run_configurations(
+    cluster: Cluster,
+    job_run_criteria: list[JobRunCriterion],
+    startime: datetime,
+    args,
+    log_configurer: Callable,
+    log_queue: Queue,
+    ql,
+    archiver=None,
+    worker_pool=None,
+    after_proc: Callable | None = None,
+) -> bool:
+    """
+    Parses the given job docs.
+    Example runtime job_run_criteria:
+    ['PS:METAR:NETCDF:OBS:MADIS-TEST:V01']
+    The procs run one after the other in the given order. With args.concurrent_procs > 1 they are
+    started in run_priority order, up to args.concurrent_procs of them run at the same time and
+    they share the args.threads worker processes between them.
+    The output of each proc is archived by the archiver while the next proc runs, without an
+    archiver one is made and waited for before returning.
+    With a worker_pool the procs use its worker processes instead of starting their own.
+    The after_proc is called with the output directory of every proc that succeeded.
+    Returns True if all the procs succeeded.
+    """
+    own_archiver = archiver is None
+    if own_archiver:
+        archiver = Archiver(getattr(args, "archive_workers", 1))
+    logger.info("Processing the job docs")
+    runtime_collection = (
+        cluster.bucket("vxdata").scope("_default").collection("RUNTIME")
+    )
+    concurrent_procs = max(1, getattr(args, "concurrent_procs", 1))
+    # the worker budget is shared by the procs that run at the same time
+    threads = max(1, args.threads // concurrent_procs)
+    proc_args = (startime, args, log_configurer, log_queue, ql, archiver, worker_pool)
+    if concurrent_procs == 1:
+        results = [
+            process_proc(
+                runtime_collection, job, *proc_args, threads, after_proc=after_proc
+            )
+            for job in job_run_criteria
+        ]
+    else:
+        ordered_criteria = sorted(job_run_criteria, key=get_run_priority)
+        logger.info(
+            f"Running up to {concurrent_procs} procs at the same time with {threads} threads each"
+        )
+        with ThreadPoolExecutor(
+            max_workers=concurrent_procs, thread_name_prefix="Proc"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    process_proc,
+                    runtime_collection,
+                    job,
+                    *proc_args,
+                    threads,
+                    True,
+                    after_proc,
                 )
-                retry += 1
-                time.sleep(1)
+                for job in ordered_criteria
+            ]
+        results = [future.result() for future in futures]
+    success_count = results.count(True)
+    fail_count = len(results) - success_count
+    if own_archiver:
+        archiver.wait()
     logger.info(f"Success: {success_count}, Fail: {fail_count}")
+    return fail_count == 0
+
+
+def run_job_dag(
+    cluster: Cluster,
+    creds: dict[str, str],
+    startime: datetime,
+    args,
+    log_configurer: Callable,
+    log_queue: Queue,
+    ql,
+    archiver: Archiver,
+    worker_pool=None,
+) -> dict[str, dict]:
+    """
+    Runs the args.job_id jobs and the jobs that depend on them in dependency order, see JobDAG.
+    The output of every proc of a job that other jobs depend on is imported into the
+    cb_collection of the credentials as soon as the proc finishes, and a dependent job starts
+    when all its upstream jobs are imported, with its end epoch limited to the last
+    fcstValidEpoch that they wrote. Up to args.concurrent_procs jobs run at the same time, they share the
+    args.threads worker budget.
+
+    Returns a dict of job id -> result
+    """
+    dag = JobDAG()
+    for job_id in args.job_id:
+        dag.add_job(job_id)
+    dag.add_dependent_jobs(
+        lambda job_id: get_dependent_job_ids(cluster, creds["cb_bucket"], job_id)
+    )
+    logger.info(f"Job dependencies: {dag.dependencies}")
+    collection = (
+        cluster.bucket(creds["cb_bucket"])
+        .scope(creds["cb_scope"])
+        .collection(creds["cb_collection"])
+    )
+    concurrent_jobs = max(1, getattr(args, "concurrent_procs", 1))
+
+    def run_job(job_id: str, upstream_results: dict[str, dict]) -> dict:
+        rt_job_doc = get_runtime_job_criteria(cluster, creds, job_id)
+        if not rt_job_doc:
+            logger.warning(f"No runtime job document found for job_id: {job_id}")
+            return {"succeeded": False}
+        run_criteria = [
+            {"id": proc_id, "run_priority": rt_job_doc.get("run_priority")}
+            for proc_id in rt_job_doc["processSpecIds"]
+        ]
+        job_args = copy.copy(args)
+        job_args.threads = max(1, args.threads // concurrent_jobs)
+        job_args.concurrent_procs = 1
+        epoch_range = get_epoch_range(upstream_results)
+        if epoch_range is not None:
+            # only the end is limited, the CTC and SUMS builders start after their latest
+            # document, so they also build the earlier epochs whose obs came in late
+            job_args.end_epoch = min(args.end_epoch, epoch_range[1] + 1)
+            logger.info(
+                f"Job {job_id} is limited to the epochs before {job_args.end_epoch}"
+            )
+        imports = []
+
+        def import_output(output_dir: Path) -> None:
+            imports.append(import_output_dir(collection, output_dir))
+
+        succeeded = process_run_configurations(
+            cluster,
+            run_criteria,
+            startime,
+            job_args,
+            log_configurer,
+            log_queue,
+            ql,
+            archiver,
+            worker_pool,
+            after_proc=import_output if dag.get_dependents(job_id) else None,
+        )
+        result = {
+            "succeeded": succeeded and all(stats["failed"] == 0 for stats in imports)
+        }
+        epoch_range = get_epoch_range(dict(enumerate(imports)))
+        if epoch_range is not None:
+            result["first_epoch"], result["last_epoch"] = epoch_range
+        return result
+
+    return dag.run(run_job, concurrent_jobs)
 
 
 def run_ingest() -> None:
@@ -573,30 +934,74 @@ def run_ingest() -> None:
             f"Error connecting to Couchbase server at: {creds['cb_host']}."
         ) from None
 
-    for job_id in args.job_id:
-        logger.info(f"Processing job_id: {job_id}")
-        # Get the runtime job document for this job_id
-        rt_job_doc = get_runtime_job_criteria(cluster, creds, job_id)
-        if not rt_job_doc:
-            logger.warning(f"No runtime job document found for job_id: {job_id}")
-            continue
-        run_criteria = [{"id": proc_id} for proc_id in rt_job_doc["processSpecIds"]]
-        if not run_criteria:
-            logger.info(f"No proc docs found for job_id: {job_id}")
-            continue
-        logger.info(f"Found {len(run_criteria)} proc docs for job_id: {job_id}")
-        logger.debug(f"Job docs to process: {run_criteria}")
-
-        logger.info(f"Processing proc docs for job_id: {job_id}")
-        process_run_configurations(
+    # the output of every job is archived in the background while the following jobs run
+    archiver = Archiver(args.archive_workers)
+    # the worker processes (and their couchbase connections) are kept for all the procs
+    worker_pool = (
+        WorkerPool(args.threads, log_queue, worker_log_configurer)
+        if args.worker_pool
+        else None
+    )
+    if args.dag:
+        run_job_dag(
             cluster,
-            run_criteria,
+            creds,
             runtime,
             args,
             worker_log_configurer,
             log_queue,
             log_queue_listener,
+            archiver,
+            worker_pool,
         )
+    else:
+        # the procs of each job, in the order of the jobs
+        jobs_criteria = []
+        for job_id in args.job_id:
+            logger.info(f"Processing job_id: {job_id}")
+            # Get the runtime job document for this job_id
+            rt_job_doc = get_runtime_job_criteria(cluster, creds, job_id)
+            if not rt_job_doc:
+                logger.warning(f"No runtime job document found for job_id: {job_id}")
+                continue
+            job_criteria = [
+                {"id": proc_id, "run_priority": rt_job_doc.get("run_priority")}
+                for proc_id in rt_job_doc["processSpecIds"]
+            ]
+            if not job_criteria:
+                logger.info(f"No proc docs found for job_id: {job_id}")
+                continue
+            logger.info(f"Found {len(job_criteria)} proc docs for job_id: {job_id}")
+            logger.debug(f"Job docs to process: {job_criteria}")
+            jobs_criteria.append(job_criteria)
+
+        if getattr(args, "concurrent_procs", 1) > 1:
+            # the procs of all the jobs are scheduled together, so that the independent procs can run at the same time
+            run_criteria = []
+            for job_criteria in jobs_criteria:
+                scheduled = {criterion["id"] for criterion in run_criteria}
+                for criterion in job_criteria:
+                    if criterion["id"] in scheduled:
+                        logger.info(f"proc {criterion['id']} is already scheduled")
+                        continue
+                    run_criteria.append(criterion)
+            jobs_criteria = [run_criteria]
+        for run_criteria in jobs_criteria:
+            logger.info(f"Processing {len(run_criteria)} proc docs")
+            process_run_configurations(
+                cluster,
+                run_criteria,
+                runtime,
+                args,
+                worker_log_configurer,
+                log_queue,
+                log_queue_listener,
+                archiver,
+                worker_pool,
+            )
+    if worker_pool is not None:
+        worker_pool.close()
+    archiver.wait()
     endtime = datetime.now()
     logger.info("Done processing proc docs")
     # Write prometheus metrics
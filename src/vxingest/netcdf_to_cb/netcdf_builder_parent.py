@@ -31,6 +31,7 @@ from vxingest.builder_common.builder_utilities import (
     convert_to_iso,
     initialize_data_array,
 )
+from vxingest.builder_common.template_plan import TemplateItem
 
 # Get a logger with this module's name to help with debugging
 logger = logging.getLogger(__name__)
@@ -54,6 +55,13 @@ class NetcdfBuilder(Builder):
         self.stations = []
         self.file_name = None
         self.standard_levels = None
+        # columnar mode - read each variable once per file instead of once per record
+        self.columnar = False
+        self.ncdf_columns = {}
+        self.ncdf_string_columns = {}
+        # columns that a builder derives from other columns i.e. the metar ceiling
+        self.ncdf_derived_columns = {}
+        self.ncdf_columns_data_set = None
 
         # self.do_profiling = False  - in super
         # set to True to enable build_document profiling
@@ -67,6 +75,86 @@ class NetcdfBuilder(Builder):
         self.file_name = Path(queue_element).name
         return bucket, scope, collection, common_collection
 
+    def check_columns(self):
+        """discard the columns that were read from a previous data set"""
+        if self.ncdf_columns_data_set is not self.ncdf_data_set:
+            self.ncdf_columns = {}
+            self.ncdf_string_columns = {}
+            self.ncdf_derived_columns = {}
+            self.ncdf_columns_data_set = self.ncdf_data_set
+
+    def get_column(self, variable):
+        """Read a whole netcdf variable once for the current data set (columnar mode).
+        The columns are discarded when a different data set is opened.
+        Args:
+            variable (str): the netcdf variable name
+        Returns:
+            tuple: (data, mask, fill_value) - the mask is a full boolean array
+        """
+        self.check_columns()
+        column = self.ncdf_columns.get(variable)
+        if column is None:
+            values = self.ncdf_data_set[variable][:]
+            column = (
+                ma.getdata(values),
+                ma.getmaskarray(values),
+                values.fill_value if ma.isMaskedArray(values) else None,
+            )
+            self.ncdf_columns[variable] = column
+        return column
+
+    def get_record(self, variable, base_var_index):
+        """Get the value of a netcdf variable for one record.
+        In columnar mode the value is indexed from the in-memory column, otherwise it is read from the file.
+        Either way it is the masked array that netCDF4 returns for variable[base_var_index],
+        i.e. the mask is nomask when none of the values are masked.
+        Args:
+            variable (str): the netcdf variable name
+            base_var_index (int): the record index
+        Returns:
+            MaskedArray: the record value(s)
+        """
+        if not self.columnar:
+            return self.ncdf_data_set[variable][base_var_index]
+        data, mask, fill_value = self.get_column(variable)
+        record_mask = mask[base_var_index]
+        if not record_mask.any():
+            return ma.masked_array(data[base_var_index, ...])
+        if record_mask.ndim == 0:
+            # netCDF4 returns the masked constant for a single masked value
+            return ma.masked
+        return ma.masked_array(
+            data[base_var_index], mask=record_mask, fill_value=fill_value
+        )
+
+    def get_record_string(self, variable, base_var_index):
+        """Get nc.chartostring of a character variable for one record.
+        In columnar mode chartostring is applied once to the whole variable.
+        Args:
+            variable (str): the netcdf character variable name
+            base_var_index (int): the record index
+        Returns:
+            ndarray: the string(s) for the record
+        """
+        if not self.columnar:
+            return nc.chartostring(self.ncdf_data_set[variable][base_var_index])
+        # index with ... so that a single string is a 0-d array like chartostring returns for a record
+        return self.get_string_column(variable)[base_var_index, ...]
+
+    def get_string_column(self, variable):
+        """Apply nc.chartostring once to a whole character variable of the current data set
+        Args:
+            variable (str): the netcdf character variable name
+        Returns:
+            ndarray: the strings, with one less dimension than the character variable
+        """
+        self.check_columns()
+        strings = self.ncdf_string_columns.get(variable)
+        if strings is None:
+            strings = nc.chartostring(self.ncdf_data_set[variable][:])
+            self.ncdf_string_columns[variable] = strings
+        return strings
+
     def build_document_map(
         self, queue_element: str, base_var_name: str, origin_type: str = None
     ) -> dict:
@@ -228,16 +316,18 @@ class NetcdfBuilder(Builder):
         try:
             template_id = kwargs["template_id"]
             base_var_index = kwargs["base_var_index"]
-            parts = template_id.split(":")
             new_parts = []
-            for part in parts:
-                if part.startswith("&"):
-                    value = str(self.handle_named_function(part, base_var_index))
+            # the id parts are parsed once, in the template plan
+            for part in self.get_template_plan().get_id_parts(template_id):
+                if part.kind == TemplateItem.FUNCTION:
+                    value = str(self.handle_named_function(part.text, base_var_index))
                 else:
-                    if part.startswith("*"):
-                        value = str(self.translate_template_item(part, base_var_index))
+                    if part.text.startswith("*"):
+                        value = str(
+                            self.translate_template_item(part.text, base_var_index)
+                        )
                     else:
-                        value = str(part)
+                        value = str(part.text)
                 new_parts.append(value)
             new_id = ":".join(new_parts)
             return new_id
@@ -263,8 +353,8 @@ class NetcdfBuilder(Builder):
         replacements = []
 
         try:
-            if isinstance(variable, str):
-                replacements = variable.split("*")[1:]
+            # the replacements are parsed once, in the template plan
+            replacements = self.get_template_plan().get_replacements(variable)
             if len(replacements) == 0:
                 # it is a literal, not a replacement (doesn't start with *)
                 return variable
@@ -291,14 +381,12 @@ class NetcdfBuilder(Builder):
                             # for these we have to convert the character array AND convert to ISO (it is probably a string date)
                             value = convert_to_iso(
                                 "*{ISO}"
-                                + nc.chartostring(
-                                    self.ncdf_data_set[variable][base_var_index]
-                                )
+                                + self.get_record_string(variable, base_var_index)
                             )
                         else:
                             # for these we have to convert convert to ISO (it is probably an epoch)
                             value = convert_to_iso(
-                                "*{ISO}" + self.ncdf_data_set[variable][base_var_index]
+                                "*{ISO}" + self.get_record(variable, base_var_index)
                             )
                     else:
                         variable = value.replace("*", "")
@@ -308,9 +396,7 @@ class NetcdfBuilder(Builder):
                                 value = value.replace(
                                     "*" + _ri,
                                     str(
-                                        nc.chartostring(
-                                            self.ncdf_data_set[variable][base_var_index]
-                                        )
+                                        self.get_record_string(variable, base_var_index)
                                     ),
                                 )
                                 if ma.isMaskedArray(value):
@@ -323,9 +409,7 @@ class NetcdfBuilder(Builder):
                                 return value
                             else:
                                 # it is probably a number
-                                value = str(
-                                    self.ncdf_data_set[variable][base_var_index]
-                                )
+                                value = str(self.get_record(variable, base_var_index))
                                 if ma.isMaskedArray(value):
                                     # it is a masked array
                                     if value.size == 1:
@@ -336,7 +420,7 @@ class NetcdfBuilder(Builder):
                                 return value
                         else:
                             # it doesn't need to be a string
-                            value = self.ncdf_data_set[variable][base_var_index]
+                            value = self.get_record(variable, base_var_index)
                             if ma.isMaskedArray(value):
                                 # it is a masked array
                                 if value.size == 1:
@@ -713,7 +797,8 @@ class NetcdfBuilder(Builder):
             - The method assumes that the parameters (e.g., field1, field2, field3) are valid variable names
               and translates them into corresponding values (e.g., value1, value2, value3) using the
               `translate_template_item` method.
-            - The named function is dynamically called using `getattr` on the current instance.
+            - The named function is parsed (and its handler resolved on the current instance) once,
+              by the builder's TemplatePlan.
             - If the function name or parameters are not valid, an exception is logged."""
 
         # Type checks
@@ -727,21 +812,21 @@ class NetcdfBuilder(Builder):
             )
         # Split the named function definition into function name and parameters
         func = None
+        params = []
+        replace_with = None
         try:
-            func = named_function_def.split("|")[0].replace("&", "")
-            params = named_function_def.split("|")[1].split(",")
+            # the named function and its params are parsed once, in the template plan
+            named_function = self.get_template_plan().get_function(named_function_def)
+            func = named_function.name
+            params = [param.text for _key, param in named_function.params]
             dict_params = {"base_var_index": base_var_index}
-            for _p in params:
-                # be sure to slice the * off of the front of the param - if it is there
-                if _p.startswith("*"):
-                    # this is a template item
-                    dict_params[_p[1:]] = self.translate_template_item(
-                        _p, base_var_index
-                    )
-                else:
-                    dict_params[_p] = self.translate_template_item(_p, base_var_index)
-            # call the named function using getattr
-            replace_with = getattr(self, func)(dict_params)
+            for key, param in named_function.params:
+                # the key is the param without the * on the front - if it is there
+                dict_params[key] = self.translate_template_item(
+                    param.text, base_var_index
+                )
+            # call the named function (resolved when the plan was compiled)
+            replace_with = named_function(dict_params)
         except Exception as _e:
             logger.exception(
                 "%s handle_named_function: %s params %s: Exception instantiating builder:",
@@ -1031,7 +1116,7 @@ class NetcdfBuilder(Builder):
             for key in params_dict:
                 if key != "base_var_index":
                     break
-            nc_value = self.ncdf_data_set[key][base_var_index]
+            nc_value = self.get_record(key, base_var_index)
             if not ma.getmask(nc_value):
                 value = ma.compressed(nc_value)[0]
                 return float(value)
@@ -13,6 +13,7 @@ import time
 import traceback
 
 import netCDF4 as nc
+import numpy as np
 import numpy.ma as ma
 
 from vxingest.builder_common.builder_utilities import truncate_round
@@ -21,6 +22,13 @@ from vxingest.netcdf_to_cb.netcdf_builder_parent import NetcdfBuilder
 # Get a logger with this module's name to help with debugging
 logger = logging.getLogger(__name__)
 
+# skyCover values that are a ceiling - broken, overcast, vertical visibility
+CEILING_SKY_COVERS = ["BKN", "OVC", "VV"]
+# skyCover values that are clear (coded as 60,000 ft)
+CLEAR_SKY_COVERS = ["CLR", "SKC", "NSC", "FEW", "SCT"]
+# meters to feet
+FEET_PER_METER = 3.281
+
 
 # Concrete builders
 class NetcdfMetarObsBuilderV01(NetcdfBuilder):
@@ -52,6 +60,13 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
         self.cadence = ingest_document["validTimeInterval"]
         self.template = ingest_document["template"]
         self.subset = self.template["subset"]
+        # read each netcdf variable once per file and index the records in memory
+        self.columnar = True
+        # station name -> index in self.stations and (station index) -> {(lat, lon, elev): geo index}
+        self.station_index = {}
+        self.station_geo_index = {}
+        self.station_index_source = None
+        self.indexed_stations = 0
         # self.do_profiling = True  # set to True to enable build_document profiling
         self.do_profiling = False  # set to True to enable build_document profiling
 
@@ -87,9 +102,7 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
             if rec_num_var_data_size == 0:
                 return
             for _rec_num in range(rec_num_var_data_size):
-                _station_name = str(
-                    nc.chartostring(self.ncdf_data_set["stationName"][_rec_num])
-                )
+                _station_name = str(self.get_record_string("stationName", _rec_num))
                 self.handle_station(
                     {"base_var_index": _rec_num, "stationName": _station_name}
                 )
@@ -113,11 +126,22 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
 
     def ceiling_transform(self, params_dict):
         """retrieves skyCover and skyLayerBase data and transforms it into a Ceiling value
+        In columnar mode the ceiling is derived for all the records at once, see get_ceiling_column.
         Args:
             params_dict (dict): named function parameters
         Returns:
             [type]: [description]
         """
+        if self.columnar:
+            try:
+                return self.get_ceiling_column()[params_dict["base_var_index"]]
+            except Exception as _e:
+                logger.error(
+                    "%s ceiling_transform: Exception in named function ceiling_transform:  error: %s",
+                    self.__class__.__name__,
+                    str(_e),
+                )
+                return None
         try:
             skyCover = params_dict["skyCover"]
             skyLayerBase = params_dict["skyLayerBase"]
@@ -133,9 +157,9 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
             # by the time we get here the skyLayerBase and skyCover arrays have been processed
             # to remove the masked values (replaced with fill values from translate_template_item)
             # but I need the mask here so I need to retrieve it from the netcdf again
-            mask_array = self.ncdf_data_set["skyLayerBase"][
-                params_dict["base_var_index"]
-            ].mask.tolist()
+            mask_array = self.get_record(
+                "skyLayerBase", params_dict["base_var_index"]
+            ).mask.tolist()
             if not mask_array:
                 return None
             # mask_array = ma.getmaskarray(skyLayerBase)
@@ -185,6 +209,54 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
             logger.error("ceiling_transform stacktrace %s", str(traceback.format_exc()))
             return None
 
+    def get_ceiling_column(self):
+        """Derive the ceiling for every record of the current data set at once from the whole
+        skyCover (character) and skyLayerBase (masked) matrices, with the same rules as the
+        per record ceiling_transform:
+        - a record with no masked skyLayerBase values has no ceiling (None)
+        - the first unmasked layer with a BKN, OVC, or VV skyCover is the ceiling (converted to feet)
+        - otherwise 60000 if any skyCover (masked or not) is CLR, SKC, NSC, FEW, or SCT
+        - otherwise None
+        Returns:
+            list: the ceiling (int or None) for each record
+        """
+        self.check_columns()
+        ceilings = self.ncdf_derived_columns.get("Ceiling")
+        if ceilings is not None:
+            return ceilings
+        sky_cover = self.get_string_column("skyCover")
+        sky_layer_base, mask, _fill_value = self.get_column("skyLayerBase")
+        ceiling_layers = np.zeros(sky_cover.shape, dtype=bool)
+        for cover in CEILING_SKY_COVERS:
+            ceiling_layers |= np.char.find(sky_cover, cover) >= 0
+        clear_layers = np.zeros(sky_cover.shape, dtype=bool)
+        for cover in CLEAR_SKY_COVERS:
+            clear_layers |= np.char.find(sky_cover, cover) >= 0
+        ceiling_layers &= ~mask
+        # the first unmasked ceiling layer of each record
+        first_layer = ceiling_layers.argmax(axis=1)
+        with np.errstate(invalid="ignore", over="ignore"):
+            ceiling_feet = np.floor(
+                sky_layer_base[np.arange(len(first_layer)), first_layer].astype(
+                    np.float64
+                )
+                * FEET_PER_METER
+            )
+        ceilings = np.full(len(first_layer), None, dtype=object)
+        ceilings[clear_layers.any(axis=1)] = 60000
+        has_ceiling = ceiling_layers.any(axis=1)
+        is_number = np.isfinite(ceiling_feet)
+        ceilings[has_ceiling & is_number] = [
+            int(feet) for feet in ceiling_feet[has_ceiling & is_number]
+        ]
+        # a ceiling layer that is not a number (the per record rule fails) or a record
+        # without any masked layers has no ceiling
+        ceilings[has_ceiling & ~is_number] = None
+        ceilings[~mask.any(axis=1)] = None
+        ceilings = ceilings.tolist()
+        self.ncdf_derived_columns["Ceiling"] = ceilings
+        return ceilings
+
     def handle_visibility(self, params_dict):
         """Retrieves a visibility value and performs data transformations
         Args:
@@ -212,31 +284,16 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
         records from the database.
         """
         netcdf = {}
-        if not ma.getmask(self.ncdf_data_set["latitude"][base_var_index]):
-            netcdf["latitude"] = ma.compressed(
-                self.ncdf_data_set["latitude"][base_var_index]
-            )[0]
-        else:
-            netcdf["latitude"] = None
-        if not ma.getmask(self.ncdf_data_set["longitude"][base_var_index]):
-            netcdf["longitude"] = ma.compressed(
-                self.ncdf_data_set["longitude"][base_var_index]
-            )[0]
-        else:
-            netcdf["longitude"] = None
-        if not ma.getmask(self.ncdf_data_set["elevation"][base_var_index]):
-            netcdf["elevation"] = ma.compressed(
-                self.ncdf_data_set["elevation"][base_var_index]
-            )[0]
-        else:
-            netcdf["elevation"] = None
-
+        for variable in ["latitude", "longitude", "elevation"]:
+            nc_value = self.get_record(variable, base_var_index)
+            if not ma.getmask(nc_value):
+                netcdf[variable] = ma.compressed(nc_value)[0]
+            else:
+                netcdf[variable] = None
         netcdf["description"] = str(
-            nc.chartostring(self.ncdf_data_set["locationName"][base_var_index])
-        )
-        netcdf["name"] = str(
-            nc.chartostring(self.ncdf_data_set["stationName"][base_var_index])
+            self.get_record_string("locationName", base_var_index)
         )
+        netcdf["name"] = str(self.get_record_string("stationName", base_var_index))
         return netcdf
 
     def handle_station(self, params_dict):
@@ -267,15 +324,8 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
             elev = truncate_round(float(netcdf["elevation"]), 5)
             lat = truncate_round(float(netcdf["latitude"]), 5)
             lon = truncate_round(float(netcdf["longitude"]), 5)
-            station = None
-            station_index = None
-            for idx, a_station in enumerate(self.stations):
-                if a_station["name"] == station_name:
-                    station = a_station
-                    station_index = idx
-                    break
-
-            if station is None:
+            station_index = self.get_station_index(station_name)
+            if station_index is None:
                 # get the netcdf fields for comparing or adding new
                 an_id = "MD:V01:METAR:station:" + netcdf["name"]
                 new_station = self.get_new_station(
@@ -289,14 +339,9 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
                 # station does exist but is there a matching geo?
                 # if there is not a matching geo create a new geo
                 # if there is a matching geo then update the matching geo time range
-                matching_location = False
                 requires_new_geo = False
-                for geo_index in range(len(self.stations[station_index]["geo"])):
-                    geo = self.stations[station_index]["geo"][geo_index]
-                    if geo["lat"] == lat and geo["lon"] == lon and geo["elev"] == elev:
-                        matching_location = True
-                        break
-                if matching_location:
+                geo_index = self.get_geo_index(station_index, lat, lon, elev)
+                if geo_index is not None:
                     if (
                         fcst_valid_epoch
                         <= self.stations[station_index]["geo"][geo_index]["firstTime"]
@@ -334,6 +379,52 @@ class NetcdfMetarObsBuilderV01(NetcdfBuilder):
             )
             return ""
 
+    def get_station_index(self, station_name):
+        """Find the first station in self.stations with this name.
+        The name index is rebuilt if self.stations is replaced and stations that have been
+        appended since the last lookup are added to it, so it always matches a scan of the list.
+        Args:
+            station_name (str): the station name
+        Returns:
+            int: the index of the station in self.stations or None
+        """
+        if self.station_index_source is not self.stations:
+            self.station_index = {}
+            self.station_geo_index = {}
+            self.station_index_source = self.stations
+            self.indexed_stations = 0
+        for idx in range(self.indexed_stations, len(self.stations)):
+            # the first station with a name wins, like the scan did
+            self.station_index.setdefault(self.stations[idx]["name"], idx)
+        self.indexed_stations = len(self.stations)
+        return self.station_index.get(station_name)
+
+    def get_geo_index(self, station_index, lat, lon, elev):
+        """Find the first geo of a station that has exactly this (lat, lon, elev).
+        The geo index of a station is extended with any geos appended since the last lookup.
+        Args:
+            station_index (int): the index of the station in self.stations
+            lat (float): the (rounded) latitude
+            lon (float): the (rounded) longitude
+            elev (float): the (rounded) elevation
+        Returns:
+            int: the index of the matching geo in the station geo list or None
+        """
+        geos = self.stations[station_index]["geo"]
+        # [the indexed geo list, the number of geos indexed, {(lat, lon, elev): geo index}]
+        geo_index = self.station_geo_index.get(station_index)
+        if geo_index is None or geo_index[0] is not geos:
+            geo_index = [geos, 0, {}]
+            self.station_geo_index[station_index] = geo_index
+        locations = geo_index[2]
+        for idx in range(geo_index[1], len(geos)):
+            # the first matching geo wins, like the scan did
+            locations.setdefault(
+                (geos[idx]["lat"], geos[idx]["lon"], geos[idx]["elev"]), idx
+            )
+        geo_index[1] = len(geos)
+        return locations.get((lat, lon, elev))
+
     def get_new_station(
         self,
         an_id: str,
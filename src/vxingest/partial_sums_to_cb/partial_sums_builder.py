@@ -9,7 +9,6 @@ Colorado, NOAA/OAR/ESRL/GSL
 import copy
 import cProfile
 import datetime as dt
-import json
 import logging
 import re
 from pathlib import Path
@@ -17,15 +16,16 @@ from pstats import Stats
 
 from couchbase.exceptions import DocumentNotFoundException
 from couchbase.search import GeoBoundingBoxQuery, SearchOptions
-from metpy.calc import relative_humidity_from_dewpoint, wind_components
-from metpy.units import units
 
 from vxingest.builder_common.builder import Builder
 from vxingest.builder_common.builder_utilities import (
     convert_to_iso,
-    get_geo_index,
     initialize_data_array,
 )
+from vxingest.builder_common.document_prefetcher import DocumentPrefetcher
+from vxingest.builder_common.region_stations import RegionStationCache
+from vxingest.builder_common.template_plan import TemplateItem
+from vxingest.partial_sums_to_cb.station_sums import StationSums
 
 # Get a logger with this module's name to help with debugging
 logger = logging.getLogger(__name__)
@@ -149,6 +149,7 @@ class PartialSumsBuilder(Builder):
         self.bucket = None
         self.scope = None
         self.collection = None
+        self.region_station_cache = None
 
     def derive_id(self, **kwargs):
         """
@@ -164,16 +165,16 @@ class PartialSumsBuilder(Builder):
         """
         try:
             template_id = kwargs["template_id"]
-            parts = template_id.split(":")
             new_parts = []
-            for part in parts:
-                if part.startswith("&"):
-                    value = str(self.handle_named_function(part))
+            # the id parts are parsed once, in the template plan
+            for part in self.get_template_plan().get_id_parts(template_id):
+                if part.kind == TemplateItem.FUNCTION:
+                    value = str(self.handle_named_function(part.text))
                 else:
-                    if part.startswith("*"):
-                        value = str(self.translate_template_item(part))
+                    if part.text.startswith("*"):
+                        value = str(self.translate_template_item(part.text))
                     else:
-                        value = str(part)
+                        value = str(part.text)
                 new_parts.append(value)
             new_id = ":".join(new_parts)
             return new_id
@@ -191,8 +192,8 @@ class PartialSumsBuilder(Builder):
         """
         replacements = []
         try:
-            if isinstance(variable, str):
-                replacements = variable.split("*")[1:]
+            # the replacements are parsed once, in the template plan
+            replacements = self.get_template_plan().get_replacements(variable)
             # this is a literal, doesn't need to be returned
             if len(replacements) == 0:
                 return variable
@@ -314,32 +315,24 @@ class PartialSumsBuilder(Builder):
             [string]: processed template item
         """
         func = None
+        params = []
         replace_with = None
         try:
-            parts = named_function_def.split("|")
-            func = parts[0].replace("&", "")
-            params = []
-            if len(parts) > 1:
-                if parts[1][0] == "{":
-                    params = json.loads(
-                        parts[1].replace("'", '"')
-                    )  # json loads requires double quotes around key/val strings
-                else:
-                    params = parts[1].split(",")
-            if isinstance(params, dict):
-                dict_params = params
+            # the named function and its params (a list or a json dict) are parsed once, in the template plan
+            named_function = self.get_template_plan().get_function(named_function_def)
+            func = named_function.name
+            if named_function.json_params is not None:
+                params = named_function.json_params
+                # a copy so that a handler cannot change the plan
+                dict_params = dict(named_function.json_params)
             else:
+                params = [param.text for _key, param in named_function.params]
                 dict_params = {}
-                for _p in params:
-                    # be sure to slice the * off of the front of the param
-                    # translate_template_item returns an array of tuples - value,interp_value, one for each station
-                    # ordered by domain_stations.
-                    if _p[0] == "&" or _p[0] == "*":
-                        dict_params[_p[1:]] = self.translate_template_item(_p)
-                    else:
-                        dict_params[_p] = self.translate_template_item(_p)
-            # call the named function using getattr
-            replace_with = getattr(self, func)(dict_params)
+                for key, param in named_function.params:
+                    # the key is the param without the * or & on the front
+                    dict_params[key] = self.translate_template_item(param.text)
+            # call the named function (resolved when the plan was compiled)
+            replace_with = named_function(dict_params)
         except Exception as _e:
             logger.exception(
                 "%s handle_named_function: %s params %s: Exception instantiating builder:",
@@ -349,6 +342,18 @@ class PartialSumsBuilder(Builder):
             )
         return replace_with
 
+    def get_obs_id(self, fve):
+        """the id of the obs document for a model fcstValidEpoch element
+        Args:
+            fve (dict): a {fcstValidEpoch, fcstLen, id} model element
+        Returns:
+            str: the obs document id
+        """
+        # remove the fcstLen part
+        obs_id = re.sub(":" + str(fve["fcstLen"]) + "$", "", fve["id"])
+        # substitute the model part for obs
+        return re.sub(self.model, "obs", obs_id)
+
     def handle_fcstValidEpochs(self):
         """iterate through all the fcstValidEpochs for which we have both model data and observation data.
         For each entry in the data section, i.e for each station build a data element that
@@ -356,113 +361,101 @@ class PartialSumsBuilder(Builder):
         """
         try:
             _obs_data = {}
+            # read the model and obs documents in batches, ahead of the loop that uses them
+            prefetch_ids = []
             for fve in self.model_elements_by_fcstValid_epoch:
-                try:
-                    self.obs_data = {}
-                    self.obs_station_names = []
+                prefetch_ids.append(fve["id"])
+                prefetch_ids.append(self.get_obs_id(fve))
+            with DocumentPrefetcher(
+                self.load_spec["collection"], prefetch_ids
+            ) as prefetcher:
+                for fve in self.model_elements_by_fcstValid_epoch:
                     try:
-                        # get_stations_for_region_by_geosearch is broken for geo losts untill late 2022
-                        # full_station_name_list = self.get_stations_for_region_by_geosearch(self.region, fve)
-                        full_station_name_list = self.get_stations_for_region_by_sort(
-                            self.region, fve["fcstValidEpoch"]
-                        )
-                        self.domain_stations = full_station_name_list
-                    except Exception as _e:
-                        logger.error(
-                            "%s: Exception with builder build_document: error: %s",
-                            self.__class__.__name__,
-                            str(_e),
-                        )
+                        self.obs_data = {}
+                        self.obs_station_names = []
+                        try:
+                            # get_stations_for_region_by_geosearch is broken for geo losts untill late 2022
+                            # full_station_name_list = self.get_stations_for_region_by_geosearch(self.region, fve)
+                            full_station_name_list = (
+                                self.get_stations_for_region_by_sort(
+                                    self.region, fve["fcstValidEpoch"]
+                                )
+                            )
+                            self.domain_stations = full_station_name_list
+                        except Exception as _e:
+                            logger.error(
+                                "%s: Exception with builder build_document: error: %s",
+                                self.__class__.__name__,
+                                str(_e),
+                            )
 
-                    # get the models and obs for this fve
-                    # remove the fcstLen part
-                    obs_id = re.sub(":" + str(fve["fcstLen"]) + "$", "", fve["id"])
-                    # substitute the model part for obs
-                    obs_id = re.sub(self.model, "obs", obs_id)
-                    logger.debug("Looking up model document: %s", fve["id"])
-                    try:
-                        # Use a singleton to avoid redundant gets for the same model doc
-                        if (
-                            not hasattr(self, "_model_doc_singleton")
-                            or self._model_doc_singleton.get("id") != fve["id"]
-                        ):
-                            _model_doc = self.load_spec["collection"].get(fve["id"])
-                            self._model_doc_singleton = {
-                                "id": fve["id"],
-                                "doc": _model_doc,
-                            }
-                        else:
-                            _model_doc = self._model_doc_singleton["doc"]
-                        self.model_data = _model_doc.content_as[dict]
-                        if not self.model_data["data"]:
+                        # get the models and obs for this fve
+                        obs_id = self.get_obs_id(fve)
+                        logger.debug("Looking up model document: %s", fve["id"])
+                        try:
+                            # the prefetcher has usually already read the model doc
+                            _model_doc = prefetcher.get(fve["id"])
+                            self.model_data = _model_doc.content_as[dict]
+                            if not self.model_data["data"]:
+                                logger.info(
+                                    "%s handle_fcstValidEpochs: model document %s has no data! ",
+                                    self.__class__.__name__,
+                                    fve["id"],
+                                )
+                                continue
+                        except DocumentNotFoundException:
                             logger.info(
-                                "%s handle_fcstValidEpochs: model document %s has no data! ",
+                                "%s handle_fcstValidEpochs: model document %s was not found! ",
                                 self.__class__.__name__,
                                 fve["id"],
                             )
-                            continue
-                    except DocumentNotFoundException:
-                        logger.info(
-                            "%s handle_fcstValidEpochs: model document %s was not found! ",
-                            self.__class__.__name__,
-                            fve["id"],
-                        )
-                    except Exception as _e:
-                        logger.error(
-                            "%s Error getting model document: %s",
-                            self.__class__.__name__,
-                            str(_e),
-                        )
+                        except Exception as _e:
+                            logger.error(
+                                "%s Error getting model document: %s",
+                                self.__class__.__name__,
+                                str(_e),
+                            )
 
-                    logger.debug("Looking up observation document: %s", obs_id)
-                    try:
-                        # I don't really know how I can get here with _obs_data AND
-                        # _obs_data['id'] != obs_id and still no self.obs_data
-                        # but it does happen and it results in documents
-                        # that have 0 hits, misses, false_alarms etc
-                        # It might be from duplicate ids but it must be handled
-                        # so  "or not self.obs_data"
-                        if (
-                            not _obs_data
-                            or (_obs_data["id"] != obs_id)
-                            or not self.obs_data
-                        ):
+                        logger.debug("Looking up observation document: %s", obs_id)
+                        try:
+                            # I don't really know how I can get here with _obs_data AND
+                            # _obs_data['id'] != obs_id and still no self.obs_data
+                            # but it does happen and it results in documents
+                            # that have 0 hits, misses, false_alarms etc
+                            # It might be from duplicate ids but it must be handled
+                            # so  "or not self.obs_data"
                             if (
-                                not hasattr(self, "_obs_doc_singleton")
-                                or self._obs_doc_singleton.get("id") != obs_id
+                                not _obs_data
+                                or (_obs_data["id"] != obs_id)
+                                or not self.obs_data
                             ):
-                                _obs_doc = self.load_spec["collection"].get(obs_id)
-                                self._obs_doc_singleton = {
-                                    "id": obs_id,
-                                    "doc": _obs_doc,
-                                }
-                            else:
-                                _obs_doc = self._obs_doc_singleton["doc"]
-                            _obs_data = _obs_doc.content_as[dict]
-                            if not _obs_data["data"]:
-                                logger.info(
-                                    "%s handle_fcstValidEpochs: obs document %s has no data! ",
-                                    self.__class__.__name__,
-                                    obs_id,
-                                )
-                                continue
-                            for key in _obs_data["data"]:
-                                self.obs_data[key] = _obs_data["data"][key]
-                                self.obs_station_names.append(key)
-                            self.obs_station_names.sort()
-                        self.handle_document()
-                    except DocumentNotFoundException:
-                        logger.info(
-                            "%s handle_fcstValidEpochs: obs document %s was not found! ",
+                                # obs docs are shared by the fcstLens, the prefetcher keeps the recent ones
+                                _obs_doc = prefetcher.get(obs_id)
+                                _obs_data = _obs_doc.content_as[dict]
+                                if not _obs_data["data"]:
+                                    logger.info(
+                                        "%s handle_fcstValidEpochs: obs document %s has no data! ",
+                                        self.__class__.__name__,
+                                        obs_id,
+                                    )
+                                    continue
+                                for key in _obs_data["data"]:
+                                    self.obs_data[key] = _obs_data["data"][key]
+                                    self.obs_station_names.append(key)
+                                self.obs_station_names.sort()
+                            self.handle_document()
+                        except DocumentNotFoundException:
+                            logger.info(
+                                "%s handle_fcstValidEpochs: obs document %s was not found! ",
+                                self.__class__.__name__,
+                                fve["id"],
+                            )
+                    except Exception as _e:
+                        logger.exception(
+                            "%s problem getting obs document: %s",
                             self.__class__.__name__,
-                            fve["id"],
+                            str(_e),
                         )
-                except Exception as _e:
-                    logger.exception(
-                        "%s problem getting obs document: %s",
-                        self.__class__.__name__,
-                        str(_e),
-                    )
 
         except Exception as _e:
             logger.error(
@@ -496,242 +489,25 @@ class PartialSumsBuilder(Builder):
         """
 
         try:
-            # reset the builders document_map for a new file
-            self.initialize_document_map()
-            self.not_found_station_count = 0
-            # PARTIALSUMS builder specific
-            self.domain_stations = []
-            # queue_element is an ingest document id
-            # get the ingest document
-
-            self.ingest_document = self.load_spec["ingest_documents"][queue_element]
-            self.model = self.ingest_document["model"]
-            self.region = self.ingest_document["region"]
-            self.sub_doc_type = self.ingest_document["subDocType"]
-            self.variable = self.ingest_document["subDocType"].lower()
-            self.subset = self.ingest_document["subset"]
-            self.template = self.ingest_document["template"]
-            self.bucket = self.load_spec["cb_connection"]["bucket"]
-            self.scope = self.load_spec["cb_connection"]["scope"]
-            self.collection = self.load_spec["cb_connection"]["collection"]
-            logger.info(
-                "%s.build_document queue_element:%s model:%s region:%s variable:%s subset:%s",
-                self.__class__.__name__,
-                queue_element,
-                self.model,
-                self.region,
-                self.variable,
-                self.subset,
-            )
-
-            # get the first and last fcstValidEpoch for the METAR OBS.
-            # This qualifies the allowed range of fcstValidEpochs that will be processed.
-            stmnt = f"""select MAX(METAR.fcstValidEpoch) maxObsEpoch, MIN(METAR.fcstValidEpoch) minObsEpoch
-                        FROM `{self.bucket}`.{self.scope}.{self.collection}
-                        WHERE type="DD"
-                        AND subset='{self.subset}'
-                        AND version="V01"
-                        AND docType="obs"
-                        AND dataVersion = "1.0.1"
-            """
-            try:
-                result = list(self.load_spec["cluster"].query(stmnt, read_only=True))
-            except Exception as e:
-                logger.info(
-                    "%s.build_document Exception: %s, query: %s",
-                    self.__class__.__name__,
-                    e,
-                    stmnt,
-                )
-                return self.get_document_map()
-            if not result:
-                logger.info(
-                    "%s.build_document no obs epoch rows returned for model:%s subset:%s",
-                    self.__class__.__name__,
-                    self.model,
-                    self.subset,
-                )
-                return self.get_document_map()
-            minObs_fcst_valid_epochs = result[0]["minObsEpoch"]
-            maxObs_fcst_valid_epochs = result[0]["maxObsEpoch"]
-            if minObs_fcst_valid_epochs is None or maxObs_fcst_valid_epochs is None:
-                logger.info(
-                    "%s.build_document no obs epoch bounds available for model:%s subset:%s",
-                    self.__class__.__name__,
-                    self.model,
-                    self.subset,
-                )
-                return self.get_document_map()
-
-            # get the first and last fcstValidEpoch for the model for which this SUMS will be derived.
-            stmnt = f"""SELECT MAX(METAR.fcstValidEpoch) maxModelEpoch, MIN(METAR.fcstValidEpoch) minModelEpoch
-                        FROM `{self.bucket}`.{self.scope}.{self.collection}
-                        WHERE type="DD"
-                        AND subset='{self.subset}'
-                        AND version="V01"
-                        AND docType="model"
-                        AND model= '{self.model}'
-                """
-            try:
-                result = list(self.load_spec["cluster"].query(stmnt, read_only=True))
-            except Exception as e:
-                logger.info(
-                    "%s.build_document Exception: %s, query: %s",
-                    self.__class__.__name__,
-                    e,
-                    stmnt,
-                )
-                return self.get_document_map()
-            if not result:
-                logger.info(
-                    "%s.build_document no model epoch rows returned for model:%s subset:%s",
-                    self.__class__.__name__,
-                    self.model,
-                    self.subset,
-                )
+            self.set_ingest_document(queue_element)
+            valid_epochs = self.get_valid_epoch_range()
+            if valid_epochs is None:
                 return self.get_document_map()
-            minModel_fcst_valid_epochs = result[0]["minModelEpoch"]
-            maxModel_fcst_valid_epochs = result[0]["maxModelEpoch"]
-            if minModel_fcst_valid_epochs is None or maxModel_fcst_valid_epochs is None:
-                logger.info(
-                    "%s.build_document no model epoch bounds available for model:%s subset:%s",
-                    self.__class__.__name__,
-                    self.model,
-                    self.subset,
-                )
-                return self.get_document_map()
-
-            # determine the minimum and maximum fcstValidEpochs that can be processed.
-            # This is the earliest and latest fcstValidEpoch for which there are both obs and model data for this model.
-            minAllowed_fcst_valid_epochs = max(
-                minObs_fcst_valid_epochs,
-                minModel_fcst_valid_epochs,
-            )
-            maxAllowed_fcst_valid_epochs = min(
-                maxObs_fcst_valid_epochs, maxModel_fcst_valid_epochs
-            )
-            # If there is a minimum and maximum fcstValidEpoch specified in the ingest_document
-            # then allow those values to override the range of fcstValidEpochs derived from the database
-            # that will be processed.
-            if (
-                "first_last_params" in self.load_spec
-                and "first_epoch" in self.load_spec["first_last_params"]
-                and "last_epoch" in self.load_spec["first_last_params"]
-            ):
-                min_valid_epochs = max(
-                    minAllowed_fcst_valid_epochs,
-                    self.load_spec["first_last_params"]["first_epoch"],
-                )
-                max_valid_epochs = min(
-                    maxAllowed_fcst_valid_epochs,
-                    self.load_spec["first_last_params"]["last_epoch"],
-                )
-            else:
-                min_valid_epochs = minAllowed_fcst_valid_epochs
-                max_valid_epochs = maxAllowed_fcst_valid_epochs
-
-            if min_valid_epochs > max_valid_epochs:
-                logger.info(
-                    "%s.build_document no overlapping epoch range for model:%s region:%s subset:%s",
-                    self.__class__.__name__,
-                    self.model,
-                    self.region,
-                    self.subset,
-                )
-                return self.get_document_map()
-
+            min_valid_epochs, max_valid_epochs = valid_epochs
             # Get the latest fcstValidEpoch for SUMS currently in the database for this model and region.
             # bounded by the min_valid_epochs and max_valid_epochs derived above.
             # If there are no SUMS for this model and region in the database it will be min_valid_epochs.
-            stmnt = f"""SELECT RAW MAX(METAR.fcstValidEpoch)
-                    FROM `{self.bucket}`.{self.scope}.{self.collection}
-                    WHERE type='DD'
-                    AND docType='SUMS'
-                    AND subDocType='{self.sub_doc_type}'
-                    AND model='{self.model}'
-                    AND region='{self.region}'
-                    AND version='V01'
-                    AND subset='{self.subset}'
-                    AND fcstValidEpoch >= {min_valid_epochs}
-                    AND fcstValidEpoch <= {max_valid_epochs}"""
-            try:
-                max_partialsums_fcst_valid_epochs_result = list(
-                    self.load_spec["cluster"].query(stmnt, read_only=True)
-                )
-            except Exception as e:
-                logger.info(
-                    "%s.build_document Exception: %s, query: %s",
-                    self.__class__.__name__,
-                    e,
-                    stmnt,
-                )
-                return self.get_document_map()
-            # if there are SUMS for this model and region then get the max epoch from the query
-            max_partialsums_fcst_valid_epochs = (
-                max_partialsums_fcst_valid_epochs_result[0]
-                if max_partialsums_fcst_valid_epochs_result
-                and max_partialsums_fcst_valid_epochs_result[0] is not None
-                else min_valid_epochs
+            max_partialsums_fcst_valid_epochs = self.get_latest_epoch(
+                min_valid_epochs, max_valid_epochs
             )
-            # Get the intersection of the model fcstValidEpochs that correspond for this
-            # model and the obs for all fcstValidEpochs greater than the max_ctc_fcst_valid_epochs ctc
-            # and less than the max_valid_epochs.
-            # This could be done with implicit join but this seems to be faster with two queries when the results are large.
-            # get the model fcstValidEpochs (models don't have regions) that are > the last ctc epoch
-            # for the lower boundary use the max_ctc_fcst_valid_epochs derived above.
-            _tmp_model_fve = []
-            try:
-                stmnt = f"""SELECT fve.fcstValidEpoch, fve.fcstLen, meta().id
-                        FROM `{self.bucket}`.{self.scope}.{self.collection} fve
-                        WHERE fve.type='DD'
-                            AND fve.docType='model'
-                            AND fve.model='{self.model}'
-                            AND fve.version='V01'
-                            AND fve.subset='{self.subset}'
-                            AND fve.fcstValidEpoch > {max_partialsums_fcst_valid_epochs}
-                            AND fve.fcstValidEpoch <= {max_valid_epochs}
-                        ORDER BY fve.fcstValidEpoch, fve.fcstLen"""
-                result = self.load_spec["cluster"].query(stmnt, read_only=True)
-                _tmp_model_fve = list(result)
-            except Exception as e:
-                logger.info(
-                    "%s.build_document Exception: %s, query: %s",
-                    self.__class__.__name__,
-                    e,
-                    stmnt,
-                )
-
-            # get the obs fcstValidEpochs (obs don't have regions) that are > the last partialsums epoch
-            _tmp_obs_fve = []
-            try:
-                stmnt = f"""SELECT raw obs.fcstValidEpoch
-                            FROM `{self.bucket}`.{self.scope}.{self.collection} obs
-                            WHERE obs.type='DD'
-                                AND obs.docType='obs'
-                                AND obs.version='V01'
-                                AND obs.subset='{self.subset}'
-                                AND obs.fcstValidEpoch > {max_partialsums_fcst_valid_epochs}
-                                AND obs.fcstValidEpoch <= {max_valid_epochs}
-                        ORDER BY obs.fcstValidEpoch"""
-                logger.debug("build_document start query %s", stmnt)
-                result1 = self.load_spec["cluster"].query(stmnt, read_only=True)
-                _tmp_obs_fve = list(result1)
-                logger.debug("build_document finished query %s", stmnt)
-            except Exception as e:
-                logger.info(
-                    "%s.build_document Exception: %s, query: %s",
-                    self.__class__.__name__,
-                    e,
-                    stmnt,
-                )
-
+            if max_partialsums_fcst_valid_epochs is None:
+                return self.get_document_map()
             # this will give us a list of {fcstValidEpoch:fve, fcslLen:fl, id:an_id}
             # where we know that each entry has a corresponding valid observation
-            for fve in _tmp_model_fve:
-                if (
-                    fve["fcstValidEpoch"] in _tmp_obs_fve
-                    and fve not in self.model_elements_by_fcstValid_epoch
-                ):
+            for fve in self.get_model_obs_fves(
+                max_partialsums_fcst_valid_epochs, max_valid_epochs
+            ):
+                if fve not in self.model_elements_by_fcstValid_epoch:
                     self.model_elements_by_fcstValid_epoch.append(fve)
 
             # if we have asked for profiling go ahead and do it
@@ -766,6 +542,264 @@ class PartialSumsBuilder(Builder):
             )
             return {}
 
+    def set_ingest_document(self, queue_element):
+        """Reset the document map and set the model, region, variable etc. from an ingest document
+        Args:
+            queue_element (str): the ingest document id
+        """
+        # reset the builders document_map for a new file
+        self.initialize_document_map()
+        self.not_found_station_count = 0
+        # PARTIALSUMS builder specific
+        self.domain_stations = []
+        # queue_element is an ingest document id
+        # get the ingest document
+
+        self.ingest_document = self.load_spec["ingest_documents"][queue_element]
+        self.model = self.ingest_document["model"]
+        self.region = self.ingest_document["region"]
+        self.sub_doc_type = self.ingest_document["subDocType"]
+        self.variable = self.ingest_document["subDocType"].lower()
+        self.subset = self.ingest_document["subset"]
+        self.template = self.ingest_document["template"]
+        self.bucket = self.load_spec["cb_connection"]["bucket"]
+        self.scope = self.load_spec["cb_connection"]["scope"]
+        self.collection = self.load_spec["cb_connection"]["collection"]
+        logger.info(
+            "%s.build_document queue_element:%s model:%s region:%s variable:%s subset:%s",
+            self.__class__.__name__,
+            queue_element,
+            self.model,
+            self.region,
+            self.variable,
+            self.subset,
+        )
+
+    def get_valid_epoch_range(self):
+        """Return the range of fcstValidEpochs for which there are both obs and model documents,
+        limited by the first_last_params of the load_spec (if there are any).
+        Returns:
+            (int, int): the min and max valid epochs, or None if there is no range
+        """
+        # get the first and last fcstValidEpoch for the METAR OBS.
+        # This qualifies the allowed range of fcstValidEpochs that will be processed.
+        stmnt = f"""select MAX(METAR.fcstValidEpoch) maxObsEpoch, MIN(METAR.fcstValidEpoch) minObsEpoch
+                    FROM `{self.bucket}`.{self.scope}.{self.collection}
+                    WHERE type="DD"
+                    AND subset='{self.subset}'
+                    AND version="V01"
+                    AND docType="obs"
+                    AND dataVersion = "1.0.1"
+        """
+        try:
+            result = list(self.load_spec["cluster"].query(stmnt, read_only=True))
+        except Exception as e:
+            logger.info(
+                "%s.build_document Exception: %s, query: %s",
+                self.__class__.__name__,
+                e,
+                stmnt,
+            )
+            return None
+        if not result:
+            logger.info(
+                "%s.build_document no obs epoch rows returned for model:%s subset:%s",
+                self.__class__.__name__,
+                self.model,
+                self.subset,
+            )
+            return None
+        minObs_fcst_valid_epochs = result[0]["minObsEpoch"]
+        maxObs_fcst_valid_epochs = result[0]["maxObsEpoch"]
+        if minObs_fcst_valid_epochs is None or maxObs_fcst_valid_epochs is None:
+            logger.info(
+                "%s.build_document no obs epoch bounds available for model:%s subset:%s",
+                self.__class__.__name__,
+                self.model,
+                self.subset,
+            )
+            return None
+
+        # get the first and last fcstValidEpoch for the model for which this SUMS will be derived.
+        stmnt = f"""SELECT MAX(METAR.fcstValidEpoch) maxModelEpoch, MIN(METAR.fcstValidEpoch) minModelEpoch
+                    FROM `{self.bucket}`.{self.scope}.{self.collection}
+                    WHERE type="DD"
+                    AND subset='{self.subset}'
+                    AND version="V01"
+                    AND docType="model"
+                    AND model= '{self.model}'
+            """
+        try:
+            result = list(self.load_spec["cluster"].query(stmnt, read_only=True))
+        except Exception as e:
+            logger.info(
+                "%s.build_document Exception: %s, query: %s",
+                self.__class__.__name__,
+                e,
+                stmnt,
+            )
+            return None
+        if not result:
+            logger.info(
+                "%s.build_document no model epoch rows returned for model:%s subset:%s",
+                self.__class__.__name__,
+                self.model,
+                self.subset,
+            )
+            return None
+        minModel_fcst_valid_epochs = result[0]["minModelEpoch"]
+        maxModel_fcst_valid_epochs = result[0]["maxModelEpoch"]
+        if minModel_fcst_valid_epochs is None or maxModel_fcst_valid_epochs is None:
+            logger.info(
+                "%s.build_document no model epoch bounds available for model:%s subset:%s",
+                self.__class__.__name__,
+                self.model,
+                self.subset,
+            )
+            return None
+
+        # determine the minimum and maximum fcstValidEpochs that can be processed.
+        # This is the earliest and latest fcstValidEpoch for which there are both obs and model data for this model.
+        minAllowed_fcst_valid_epochs = max(
+            minObs_fcst_valid_epochs,
+            minModel_fcst_valid_epochs,
+        )
+        maxAllowed_fcst_valid_epochs = min(
+            maxObs_fcst_valid_epochs, maxModel_fcst_valid_epochs
+        )
+        # If there is a minimum and maximum fcstValidEpoch specified in the ingest_document
+        # then allow those values to override the range of fcstValidEpochs derived from the database
+        # that will be processed.
+        if (
+            "first_last_params" in self.load_spec
+            and "first_epoch" in self.load_spec["first_last_params"]
+            and "last_epoch" in self.load_spec["first_last_params"]
+        ):
+            min_valid_epochs = max(
+                minAllowed_fcst_valid_epochs,
+                self.load_spec["first_last_params"]["first_epoch"],
+            )
+            max_valid_epochs = min(
+                maxAllowed_fcst_valid_epochs,
+                self.load_spec["first_last_params"]["last_epoch"],
+            )
+        else:
+            min_valid_epochs = minAllowed_fcst_valid_epochs
+            max_valid_epochs = maxAllowed_fcst_valid_epochs
+
+        if min_valid_epochs > max_valid_epochs:
+            logger.info(
+                "%s.build_document no overlapping epoch range for model:%s region:%s subset:%s",
+                self.__class__.__name__,
+                self.model,
+                self.region,
+                self.subset,
+            )
+            return None
+        return min_valid_epochs, max_valid_epochs
+
+    def get_latest_epoch(self, min_valid_epochs, max_valid_epochs):
+        """Return the latest fcstValidEpoch of the SUMS documents that are already in the database
+        for this model and region, within the valid epochs (min_valid_epochs if there are none).
+        Args:
+            min_valid_epochs (int): the first valid epoch
+            max_valid_epochs (int): the last valid epoch
+        Returns:
+            int: the latest epoch, or None if the query failed
+        """
+        stmnt = f"""SELECT RAW MAX(METAR.fcstValidEpoch)
+                FROM `{self.bucket}`.{self.scope}.{self.collection}
+                WHERE type='DD'
+                AND docType='SUMS'
+                AND subDocType='{self.sub_doc_type}'
+                AND model='{self.model}'
+                AND region='{self.region}'
+                AND version='V01'
+                AND subset='{self.subset}'
+                AND fcstValidEpoch >= {min_valid_epochs}
+                AND fcstValidEpoch <= {max_valid_epochs}"""
+        try:
+            max_partialsums_fcst_valid_epochs_result = list(
+                self.load_spec["cluster"].query(stmnt, read_only=True)
+            )
+        except Exception as e:
+            logger.info(
+                "%s.build_document Exception: %s, query: %s",
+                self.__class__.__name__,
+                e,
+                stmnt,
+            )
+            return None
+        # if there are SUMS for this model and region then get the max epoch from the query
+        max_partialsums_fcst_valid_epochs = (
+            max_partialsums_fcst_valid_epochs_result[0]
+            if max_partialsums_fcst_valid_epochs_result
+            and max_partialsums_fcst_valid_epochs_result[0] is not None
+            else min_valid_epochs
+        )
+        return max_partialsums_fcst_valid_epochs
+
+    def get_model_obs_fves(self, after_epoch, max_valid_epochs):
+        """Return the model fcstValidEpoch, fcstLen and id rows that have an obs document
+        Args:
+            after_epoch (int): only fcstValidEpochs after this epoch
+            max_valid_epochs (int): the last fcstValidEpoch
+        Returns:
+            list: the {fcstValidEpoch:fve, fcstLen:fl, id:an_id} rows, ordered by fcstValidEpoch and fcstLen
+        """
+        # Get the intersection of the model fcstValidEpochs that correspond for this
+        # model and the obs for all fcstValidEpochs greater than the after_epoch
+        # and less than the max_valid_epochs.
+        # This could be done with implicit join but this seems to be faster with two queries when the results are large.
+        # get the model fcstValidEpochs (models don't have regions) that are > the after_epoch
+        _tmp_model_fve = []
+        try:
+            stmnt = f"""SELECT fve.fcstValidEpoch, fve.fcstLen, meta().id
+                    FROM `{self.bucket}`.{self.scope}.{self.collection} fve
+                    WHERE fve.type='DD'
+                        AND fve.docType='model'
+                        AND fve.model='{self.model}'
+                        AND fve.version='V01'
+                        AND fve.subset='{self.subset}'
+                        AND fve.fcstValidEpoch > {after_epoch}
+                        AND fve.fcstValidEpoch <= {max_valid_epochs}
+                    ORDER BY fve.fcstValidEpoch, fve.fcstLen"""
+            result = self.load_spec["cluster"].query(stmnt, read_only=True)
+            _tmp_model_fve = list(result)
+        except Exception as e:
+            logger.info(
+                "%s.build_document Exception: %s, query: %s",
+                self.__class__.__name__,
+                e,
+                stmnt,
+            )
+
+        # get the obs fcstValidEpochs (obs don't have regions) that are > the last partialsums epoch
+        _tmp_obs_fve = []
+        try:
+            stmnt = f"""SELECT raw obs.fcstValidEpoch
+                        FROM `{self.bucket}`.{self.scope}.{self.collection} obs
+                        WHERE obs.type='DD'
+                            AND obs.docType='obs'
+                            AND obs.version='V01'
+                            AND obs.subset='{self.subset}'
+                            AND obs.fcstValidEpoch > {after_epoch}
+                            AND obs.fcstValidEpoch <= {max_valid_epochs}
+                    ORDER BY obs.fcstValidEpoch"""
+            logger.debug("build_document start query %s", stmnt)
+            result1 = self.load_spec["cluster"].query(stmnt, read_only=True)
+            _tmp_obs_fve = list(result1)
+            logger.debug("build_document finished query %s", stmnt)
+        except Exception as e:
+            logger.info(
+                "%s.build_document Exception: %s, query: %s",
+                self.__class__.__name__,
+                e,
+                stmnt,
+            )
+        obs_epochs = set(_tmp_obs_fve)
+        return [fve for fve in _tmp_model_fve if fve["fcstValidEpoch"] in obs_epochs]
+
     def get_stations_for_region_by_geosearch(self, region_name, valid_epoch):
         # NOTE: this is currently broken because we have to modify this query to
         # work woth the data model that has data elements as a MAP indexed by station name
@@ -839,74 +873,17 @@ class PartialSumsBuilder(Builder):
             because the partialsums builders may need to calculate normalized pressure
             from elevation and temperature and if we have stations with no elevation
             we can't properly calculate normalized pressure.
+        The region bounding box and the station documents are queried once per builder,
+        see RegionStationCache.
         Args:
             region_name (string): the name of the region.
         Returns:
             list: the list of stations within this region
         """
-        # get the bounding box for this region
         try:
-            stmnt = f"""SELECT  geo.bottom_right.lat as br_lat,
-                    geo.bottom_right.lon as br_lon,
-                    geo.top_left.lat as tl_lat,
-                    geo.top_left.lon as tl_lon
-                    FROM `{self.bucket}`.{self.scope}.{self.collection}
-                    WHERE type='MD'
-                    and docType='region'
-                    and subset='COMMON'
-                    and version='V01'
-                    and name='{region_name}'"""
-            result = self.load_spec["cluster"].query(stmnt, read_only=True)
-            _boundingbox = list(result)[0]
-            _domain_stations = []
-            # get the stations that are within this boundingbox
-            stmnt = f"""SELECT
-                    geo, name
-                    from `{self.bucket}`.{self.scope}.{self.collection}
-                    where type='MD'
-                    and docType='station'
-                    and subset='{self.subset}'
-                    and version='V01'"""
-            result = self.load_spec["cluster"].query(stmnt, read_only=True)
-            for row in result:
-                geo_index = get_geo_index(valid_epoch, row["geo"])
-                rlat = row["geo"][geo_index]["lat"]
-                bb_br_lat = _boundingbox["br_lat"]
-                bb_tl_lat = _boundingbox["tl_lat"]
-
-                rlon = (
-                    row["geo"][geo_index]["lon"]
-                    if row["geo"][geo_index]["lon"] <= 180
-                    else row["geo"][geo_index]["lon"] - 360
-                )
-                bb_br_lon = (
-                    _boundingbox["br_lon"]
-                    if _boundingbox["br_lon"] <= 180
-                    else _boundingbox["br_lon"] - 360
-                )
-                bb_tl_lon = (
-                    _boundingbox["tl_lon"]
-                    if _boundingbox["tl_lon"] <= 180
-                    else _boundingbox["tl_lon"] - 360
-                )
-                # check that the station is within the bounding box and has a valid elevation
-                # If there is an invalid elevation we won't be able to calculate normalized pressure
-                # and that will cause the partialsums to be inaccurate, so we have to filter out
-                # stations with invalid elevation here.
-                if (
-                    rlat >= bb_br_lat
-                    and rlat <= bb_tl_lat
-                    and rlon >= bb_tl_lon
-                    and rlon <= bb_br_lon
-                    and "elev" in row["geo"][geo_index]
-                    and row["geo"][geo_index]["elev"] is not None
-                    and row["geo"][geo_index]["elev"] != 9999
-                ):
-                    _domain_stations.append(row["name"])
-                else:
-                    continue
-            _domain_stations.sort()
-            return _domain_stations
+            return self.get_region_station_cache().get_stations(
+                region_name, self.subset, valid_epoch
+            )
         except Exception as _e:
             logger.error(
                 "%s: Exception with builder: error: %s",
@@ -915,6 +892,36 @@ class PartialSumsBuilder(Builder):
             )
             return None
 
+    def get_region_masks(self, region_names, valid_epoch):
+        """Return the regions that each station is in as a bitmask (bit i for region_names[i]),
+        see RegionStationCache.get_region_masks.
+        Args:
+            region_names (list): the names of the regions
+            valid_epoch (int): the fcstValidEpoch
+        Returns:
+            dict: station name -> region bitmask
+        """
+        return self.get_region_station_cache().get_region_masks(
+            region_names, self.subset, valid_epoch
+        )
+
+    def get_region_station_cache(self):
+        """the RegionStationCache for the current cluster, bucket, scope and collection"""
+        if self.region_station_cache is None or (
+            self.region_station_cache.cluster,
+            self.region_station_cache.bucket,
+            self.region_station_cache.scope,
+            self.region_station_cache.collection,
+        ) != (self.load_spec["cluster"], self.bucket, self.scope, self.collection):
+            self.region_station_cache = RegionStationCache(
+                self.load_spec["cluster"],
+                self.bucket,
+                self.scope,
+                self.collection,
+                require_elevation=True,
+            )
+        return self.region_station_cache
+
 
 # Concrete builders
 class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
@@ -958,6 +965,10 @@ class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
         self.region = None
         self.sub_doc_type = None
         self.variable = None
+        # the aligned station values for the document that handle_data is building,
+        # the DerivedStatisticsBuilder sets StationSums that are shared by the regions and the region bit
+        self.aligned_stations = None
+        self.region_index = None
 
         # self.do_profiling = True  # set to True to enable build_document profiling
         self.do_profiling = False  # set to True to enable build_document profiling
@@ -994,84 +1005,14 @@ class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
             else:
                 obs_var_name = model_var_name
 
-            obs_vals = []
-            model_vals = []
-            diff_vals = []
-            diff_vals_squared = []
-            abs_diff_vals = []
-
-            for name in self.domain_stations:
-                if name in self.obs_data and name in self.model_data["data"]:
-                    obs_elem = self.obs_data[name]
-                    model_elem = self.model_data["data"][name]
-                    if obs_var_name == "RH" or model_var_name == "RH":
-                        if (
-                            "RH" not in obs_elem
-                            and obs_elem["DewPoint"] is not None
-                            and obs_elem["Temperature"] is not None
-                        ):
-                            obs_elem["RH"] = (
-                                relative_humidity_from_dewpoint(
-                                    obs_elem["Temperature"] * units.degF,
-                                    obs_elem["DewPoint"] * units.degF,
-                                ).magnitude
-                            ) * 100
-                        if (
-                            "RH" not in model_elem
-                            and model_elem["DewPoint"] is not None
-                            and model_elem["Temperature"] is not None
-                        ):
-                            model_elem["RH"] = (
-                                relative_humidity_from_dewpoint(
-                                    model_elem["Temperature"] * units.degF,
-                                    model_elem["DewPoint"] * units.degF,
-                                ).magnitude
-                            ) * 100
-                    if (obs_var_name == "UW" or model_var_name == "UW") or (
-                        obs_var_name == "VW" or model_var_name == "VW"
-                    ):
-                        # wind direction in the data is from 0 to 360 and we need it from -180 to 180
-                        if (
-                            ("UW" not in obs_elem or "VW" not in obs_elem)
-                            and obs_elem["WS"] is not None
-                            and obs_elem["WD"] is not None
-                        ):
-                            wind_components_t = wind_components(
-                                obs_elem["WS"] * units.mph,
-                                (obs_elem["WD"] - 180) * units.deg,
-                            )
-                            obs_elem["UW"] = wind_components_t[0].magnitude
-                            obs_elem["VW"] = wind_components_t[1].magnitude
-                        if (
-                            ("UW" not in model_elem or "VW" not in model_elem)
-                            and model_elem["WS"] is not None
-                            and model_elem["WD"] is not None
-                        ):
-                            wind_components_t = wind_components(
-                                model_elem["WS"] * units.mph,
-                                (model_elem["WD"] - 180) * units.deg,
-                            )
-                            model_elem["UW"] = wind_components_t[0].magnitude
-                            model_elem["VW"] = wind_components_t[1].magnitude
-                    obs_var = obs_elem.get(obs_var_name)
-                    model_var = model_elem.get(model_var_name)
-                    # If there is no observation or model data for this variable for this station, skip it
-                    if obs_var is not None and model_var is not None:
-                        obs_vals.append(obs_var)
-                        model_vals.append(model_var)
-                        _diff = model_var - obs_var
-                        diff_vals.append(_diff)
-                        diff_vals_squared.append(_diff * _diff)
-                        abs_diff_vals.append(abs(_diff))
-            sum_elem = {
-                "num_recs": len(obs_vals) if obs_vals else None,
-                "sum_obs": sum(obs_vals) if obs_vals else None,
-                "sum_model": sum(model_vals) if model_vals else None,
-                "sum_diff": sum(diff_vals) if diff_vals else None,
-                "sum2_diff": sum(diff_vals_squared) if diff_vals_squared else None,
-                "sum_abs": sum(abs_diff_vals) if abs_diff_vals else None,
-            }
-            return sum_elem
+            station_sums = self.aligned_stations
+            region_index = self.region_index
+            if station_sums is None:
+                station_sums = StationSums(
+                    self.domain_stations, self.obs_data, self.model_data["data"]
+                )
+                region_index = None
+            return station_sums.get_sums(model_var_name, obs_var_name, region_index)
         except Exception as _e:
             logger.error(
                 "%s handle_sum: Exception :  error: %s",
@@ -1080,6 +1021,22 @@ class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
             )
             return None
 
+    def align_regions(self, region_names, valid_epoch):
+        """Align the current model and obs elements once for the stations of all the regions.
+        Args:
+            region_names (list): the names of the regions (region i is bit i)
+            valid_epoch (int): the fcstValidEpoch
+        Returns:
+            StationSums: the aligned stations, for aligned_stations
+        """
+        station_regions = self.get_region_masks(region_names, valid_epoch)
+        return StationSums(
+            sorted(station_regions),
+            self.obs_data,
+            self.model_data["data"],
+            station_regions,
+        )
+
     def handle_data(self, **kwargs):
         """
         This routine processes the partialsums data element. The data elements are
@@ -1108,6 +1065,12 @@ class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
             doc = kwargs["doc"]
             template_data = self.template["data"]
             data_elem = {}
+            # the stations are aligned once for all the sums of this fcstValidEpoch and fcstLen
+            if self.aligned_stations is None:
+                self.aligned_stations = StationSums(
+                    self.domain_stations, self.obs_data, self.model_data["data"]
+                )
+                self.region_index = None
             # it is expected that the template data section be comprised of named functions
             for variable in template_data:
                 data_elem[variable] = self.handle_named_function(
@@ -1121,6 +1084,9 @@ class PartialSumsSurfaceModelObsBuilderV01(PartialSumsBuilder):
                 self.__class__.__name__,
                 str(_e),
             )
+        finally:
+            self.aligned_stations = None
+            self.region_index = None
         return doc
 
     def handle_time(self, params_dict):
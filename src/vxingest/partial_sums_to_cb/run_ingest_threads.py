@@ -144,6 +144,7 @@ class VXIngest(CommonVxIngest):
         logger.info("Begin a_time: %s", begin_time)
         self.credentials_file = config["credentials_file"].strip()
         self.thread_count = config["threads"]
+        self.worker_pool = config.get("worker_pool", None)
         _output_dir = config["output_dir"]
         if _output_dir is not None:
             self.output_dir = _output_dir.strip()
@@ -188,6 +189,11 @@ class VXIngest(CommonVxIngest):
                 ).content_as[dict]
             self.load_spec["fmask"] = config["file_mask"]
             self.load_spec["input_data_path"] = config["input_data_path"]
+            # the format and compression of the output files, see DocumentFileWriter
+            self.load_spec["output_format"] = config.get("output_format", "list")
+            self.load_spec["output_compression"] = config.get(
+                "output_compression", "none"
+            )
             # stash the load_job in the load_spec
             self.load_spec["load_job_doc"] = self.build_load_job_doc(
                 self.load_spec["cb_connection"]["collection"]
@@ -203,34 +209,48 @@ class VXIngest(CommonVxIngest):
         # load the my_queue with
         # Constructor for an infinite size  FIFO my_queue
         _q = JoinableQueue()
-        for _f in self.load_spec["ingest_document_ids"]:
-            _q.put(_f)
-        # instantiate data_type_manager pool - each data_type_manager is a
-        # thread that uses builders to process a file
-        # Make the Pool of data_type_managers
-        ingest_manager_list = []
-        logger.info(
-            f"The ingest documents in the queue are: {self.load_spec['ingest_document_ids']}"
-        )
-        logger.info(f"Starting {self.thread_count} processes")
-        for thread_count in range(int(self.thread_count)):
-            try:
-                ingest_manager_thread = VxIngestManager(
-                    f"VxIngestManager-{thread_count + 1}",  # Processes are 1 indexed in the logger
-                    self.load_spec,
-                    _q,
-                    self.output_dir,
-                    log_queue,  # Queue to pass logging messages back to the main process on
-                    log_configurer,  # Config function to set up the logger in the multiprocess Process
-                )
-                ingest_manager_list.append(ingest_manager_thread)
-                ingest_manager_thread.start()  # This calls a .run() method in the class
-                logger.info(f"Started thread: VxIngestManager-{thread_count + 1}")
-            except Exception as _e:
-                logger.error("*** Error in VXIngest %s***", str(_e))
-                raise _e
-        # be sure to join all the threads to wait on them
-        finished = [proc.join() for proc in ingest_manager_list]
+        if self.worker_pool is not None:
+            # the long lived worker processes of main process the elements, see WorkerPool
+            finished = self.worker_pool.run(
+                VxIngestManager,
+                self.load_spec,
+                self.output_dir,
+                self.load_spec["ingest_document_ids"],
+            )
+        else:
+            # the queue ends with an END_OF_QUEUE for each ingest manager, and each
+            # ingest manager reports back on _results when it is finished
+            self.fill_queue(
+                _q, self.load_spec["ingest_document_ids"], self.thread_count
+            )
+            _results = Queue()
+            # instantiate data_type_manager pool - each data_type_manager is a
+            # thread that uses builders to process a file
+            # Make the Pool of data_type_managers
+            ingest_manager_list = []
+            logger.info(
+                f"The ingest documents in the queue are: {self.load_spec['ingest_document_ids']}"
+            )
+            logger.info(f"Starting {self.thread_count} processes")
+            for thread_count in range(int(self.thread_count)):
+                try:
+                    ingest_manager_thread = VxIngestManager(
+                        f"VxIngestManager-{thread_count + 1}",  # Processes are 1 indexed in the logger
+                        self.load_spec,
+                        _q,
+                        self.output_dir,
+                        log_queue,  # Queue to pass logging messages back to the main process on
+                        log_configurer,  # Config function to set up the logger in the multiprocess Process
+                    )
+                    ingest_manager_thread.result_queue = _results
+                    ingest_manager_list.append(ingest_manager_thread)
+                    ingest_manager_thread.start()  # This calls a .run() method in the class
+                    logger.info(f"Started thread: VxIngestManager-{thread_count + 1}")
+                except Exception as _e:
+                    logger.error("*** Error in VXIngest %s***", str(_e))
+                    raise _e
+            # wait for the completion message of every ingest manager and join them
+            finished = self.wait_for_ingest_managers(ingest_manager_list, _results)
         logger.info("Finished processes")
         self.write_load_job_to_files()
         logger.info("Finished writing files")
@@ -240,6 +260,7 @@ class VXIngest(CommonVxIngest):
         logger.info("    >>> Total load a_time: %s", str(load_time))
         logger.info("End a_time: %s", str(datetime.now()))
         logger.info("--- *** --- End  --- *** ---")
+        self.exit_if_failed(finished)
         return
 
     def main(self):
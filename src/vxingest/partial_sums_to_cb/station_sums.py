@@ -0,0 +1,173 @@
+"""
+Program Name: station_sums.py
+Contact(s): Randy Pierce
+History Log:  Initial version
+Copyright 2019 UCAR/NCAR/RAL, CSU/CIRES, Regents of the University of
+Colorado, NOAA/OAR/ESRL/GSL
+"""
+
+import logging
+
+import numpy as np
+from metpy.calc import relative_humidity_from_dewpoint, wind_components
+from metpy.units import units
+
+# Get a logger with this module's name to help with debugging
+logger = logging.getLogger(__name__)
+
+SUM_KEYS = ["num_recs", "sum_obs", "sum_model", "sum_diff", "sum2_diff", "sum_abs"]
+
+
+class StationSums:
+    """The model and obs values of the stations of one fcstValidEpoch and fcstLen as aligned arrays.
+    The stations are the domain stations that have both an obs and a model element. A column
+    (the values of one variable for all those stations) is extracted once and reused by every
+    partial sum that needs it. The derived variables RH (from Temperature and DewPoint) and
+    UW/VW (from WS and WD) are calculated for all the stations with one metpy call.
+    """
+
+    def __init__(self, domain_stations, obs_data, model_data, station_regions=None):
+        """
+        Args:
+            domain_stations (list): the station names in the region (or in any of the regions)
+            obs_data (dict): station name -> obs element
+            model_data (dict): station name -> model element (the model document's data section)
+            station_regions (dict, optional): station name -> bitmask of the regions that the
+                station is in (bit i for region i), for the sums of more than one region
+        """
+        stations = [
+            name for name in domain_stations if name in obs_data and name in model_data
+        ]
+        self.elements = {
+            "obs": [obs_data[name] for name in stations],
+            "model": [model_data[name] for name in stations],
+        }
+        self.region_masks = None
+        if station_regions is not None:
+            self.region_masks = np.array(
+                [station_regions.get(name, 0) for name in stations], dtype=np.uint64
+            )
+        # (side, variable) -> (float64 values, valid mask)
+        self.columns = {}
+
+    def get_column(self, side, variable):
+        """Return the values of a variable for the stations and a mask of the ones that are not None
+        Args:
+            side (str): "obs" or "model"
+            variable (str): the variable name
+        Returns:
+            (ndarray, ndarray): the float64 values (nan where missing) and the valid (bool) mask
+        """
+        key = (side, variable)
+        if key not in self.columns:
+            if variable == "RH":
+                self.derive_relative_humidity(side)
+            elif variable in ("UW", "VW"):
+                self.derive_wind_components(side)
+            else:
+                self.columns[key] = to_column(
+                    [element.get(variable) for element in self.elements[side]]
+                )
+        return self.columns[key]
+
+    def derive_relative_humidity(self, side):
+        """RH in percent from Temperature and DewPoint (degF) for the elements that do not have one"""
+        elements = self.elements[side]
+        values = [element.get("RH") for element in elements]
+        indexes = [
+            index
+            for index, element in enumerate(elements)
+            if "RH" not in element
+            and element.get("DewPoint") is not None
+            and element.get("Temperature") is not None
+        ]
+        if indexes:
+            temperature = np.array(
+                [elements[index]["Temperature"] for index in indexes], dtype=np.float64
+            )
+            dew_point = np.array(
+                [elements[index]["DewPoint"] for index in indexes], dtype=np.float64
+            )
+            relative_humidity = (
+                relative_humidity_from_dewpoint(
+                    temperature * units.degF, dew_point * units.degF
+                ).magnitude
+                * 100
+            )
+            for index, value in zip(indexes, relative_humidity.tolist(), strict=True):
+                values[index] = value
+        self.columns[(side, "RH")] = to_column(values)
+
+    def derive_wind_components(self, side):
+        """UW and VW from WS (mph) and WD (degrees) for the elements that do not have both"""
+        elements = self.elements[side]
+        u_values = [element.get("UW") for element in elements]
+        v_values = [element.get("VW") for element in elements]
+        indexes = [
+            index
+            for index, element in enumerate(elements)
+            if ("UW" not in element or "VW" not in element)
+            and element.get("WS") is not None
+            and element.get("WD") is not None
+        ]
+        if indexes:
+            speed = np.array(
+                [elements[index]["WS"] for index in indexes], dtype=np.float64
+            )
+            direction = np.array(
+                [elements[index]["WD"] for index in indexes], dtype=np.float64
+            )
+            # wind direction in the data is from 0 to 360 and we need it from -180 to 180
+            u_wind, v_wind = wind_components(
+                speed * units.mph, (direction - 180) * units.deg
+            )
+            for index, u_value, v_value in zip(
+                indexes,
+                u_wind.magnitude.tolist(),
+                v_wind.magnitude.tolist(),
+                strict=True,
+            ):
+                u_values[index] = u_value
+                v_values[index] = v_value
+        self.columns[(side, "UW")] = to_column(u_values)
+        self.columns[(side, "VW")] = to_column(v_values)
+
+    def get_sums(self, model_var_name, obs_var_name, region_index=None):
+        """Calculate the partial sums of the stations that have both a model and an obs value
+        Args:
+            model_var_name (str): the model variable
+            obs_var_name (str): the obs variable
+            region_index (int, optional): only the stations in this region (see station_regions)
+        Returns:
+            dict: num_recs, sum_obs, sum_model, sum_diff, sum2_diff and sum_abs (all None without any pairs)
+        """
+        obs_values, obs_valid = self.get_column("obs", obs_var_name)
+        model_values, model_valid = self.get_column("model", model_var_name)
+        valid = obs_valid & model_valid
+        if region_index is not None:
+            valid &= (self.region_masks & np.uint64(1 << region_index)) != 0
+        num_recs = int(np.count_nonzero(valid))
+        if num_recs == 0:
+            return dict.fromkeys(SUM_KEYS)
+        obs_values = obs_values[valid]
+        model_values = model_values[valid]
+        diff = model_values - obs_values
+        return {
+            "num_recs": num_recs,
+            "sum_obs": np.sum(obs_values).item(),
+            "sum_model": np.sum(model_values).item(),
+            "sum_diff": np.sum(diff).item(),
+            "sum2_diff": np.sum(diff * diff).item(),
+            "sum_abs": np.sum(np.abs(diff)).item(),
+        }
+
+
+def to_column(values):
+    """float64 values (nan for None) and the mask of the values that are not None"""
+    valid = np.fromiter(
+        (value is not None for value in values), dtype=bool, count=len(values)
+    )
+    column = np.array(
+        [np.nan if value is None else value for value in values], dtype=np.float64
+    )
+    return column, valid
@@ -0,0 +1,118 @@
+import gzip
+import json
+
+import pytest
+
+from vxingest.builder_common import document_file_writer
+from vxingest.builder_common.document_file_writer import (
+    DocumentFileWriter,
+    iter_document_file,
+    read_document_file,
+)
+from vxingest.builder_common.ingest_manager import CommonVxIngestManager
+
+DOCUMENTS = {
+    f"DD:V01:METAR:obs:{index}": {
+        "id": f"DD:V01:METAR:obs:{index}",
+        "type": "DD",
+        "data": {"KDEN": {"Temperature": 50.5 + index, "name": "Denver µ"}},
+    }
+    for index in range(3)
+}
+
+
+def write(path, output_format, compression, documents=DOCUMENTS):
+    with DocumentFileWriter(path, output_format, compression) as writer:
+        for document in documents.values():
+            writer.write(document)
+    return writer.path
+
+
+def test_list_is_the_same_as_one_dumps(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_file_writer, "orjson", None)
+    path = write(tmp_path / "out", "list", "none")
+    assert path == tmp_path / "out.json"
+    assert path.read_text(encoding="utf-8") == json.dumps(list(DOCUMENTS.values()))
+    assert write(tmp_path / "empty", "list", "none", {}).read_text() == "[]"
+
+
+def test_orjson_decodes_to_the_same_documents(tmp_path, monkeypatch):
+    pytest.importorskip("orjson")
+    orjson_path = write(tmp_path / "orjson", "list", "none")
+    monkeypatch.setattr(document_file_writer, "orjson", None)
+    json_path = write(tmp_path / "json", "list", "none")
+    assert json.loads(orjson_path.read_bytes()) == json.loads(json_path.read_bytes())
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_lines(tmp_path, compression):
+    path = write(tmp_path / "out", "lines", compression)
+    if compression == "gzip":
+        assert path == tmp_path / "out.json.gz"
+        text = gzip.decompress(path.read_bytes()).decode("utf-8")
+    else:
+        text = path.read_text(encoding="utf-8")
+    assert [json.loads(line) for line in text.splitlines()] == list(DOCUMENTS.values())
+
+
+def test_gzip_list(tmp_path):
+    path = write(tmp_path / "out", "list", "gzip")
+    assert json.loads(gzip.decompress(path.read_bytes())) == list(DOCUMENTS.values())
+
+
+def test_zstd_falls_back_to_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_file_writer, "zstd", None)
+    path = write(tmp_path / "out", "lines", "zstd")
+    assert path == tmp_path / "out.json.gz"
+
+
+def test_unknown_options(tmp_path):
+    with pytest.raises(ValueError, match="format"):
+        DocumentFileWriter(tmp_path / "out", "csv")
+    with pytest.raises(ValueError, match="compression"):
+        DocumentFileWriter(tmp_path / "out", "list", "bz2")
+
+
+class IngestManager(CommonVxIngestManager):
+    """the subclasses set the cb_credentials before the CommonVxIngestManager constructor"""
+
+    cb_credentials = None
+
+
+def test_write_document_to_files(tmp_path):
+    manager = IngestManager(
+        "VxIngestManager-1",
+        {"output_format": "lines", "output_compression": "gzip"},
+        None,
+        str(tmp_path),
+        None,
+        None,
+    )
+    manager.write_document_to_files("/data/madis/20240101_0000", DOCUMENTS)
+    path = tmp_path / "__data__madis__20240101_0000.json.gz"
+    lines = gzip.decompress(path.read_bytes()).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == list(DOCUMENTS.values())
+
+
+@pytest.mark.parametrize(
+    ("output_format", "compression"),
+    [("list", "none"), ("list", "gzip"), ("lines", "none"), ("lines", "gzip")],
+)
+def test_read_document_file(tmp_path, output_format, compression):
+    path = write(tmp_path / "out", output_format, compression)
+    assert read_document_file(path) == list(DOCUMENTS.values())
+
+
+@pytest.mark.parametrize("output_format", ["list", "lines"])
+def test_iter_document_file_reads_in_chunks(tmp_path, monkeypatch, output_format):
+    # the documents are split across the chunks
+    monkeypatch.setattr(document_file_writer, "READ_CHUNK_CHARS", 7)
+    path = write(tmp_path / "out", output_format, "gzip")
+    assert list(iter_document_file(path)) == list(DOCUMENTS.values())
+    assert (
+        list(iter_document_file(write(tmp_path / "empty", output_format, "none", {})))
+        == []
+    )
+    (tmp_path / "bad.json").write_text('[{"id": "DD:1"}, {"id": ')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_document_file(tmp_path / "bad.json"))
@@ -0,0 +1,70 @@
+import pytest
+from couchbase.exceptions import DocumentNotFoundException
+
+from vxingest.builder_common.document_prefetcher import DocumentPrefetcher
+
+
+def model_and_obs_ids(epochs, fcst_lens):
+    ids = []
+    for epoch in epochs:
+        for fcst_len in fcst_lens:
+            ids.append(f"DD:V01:METAR:HRRR:{epoch}:{fcst_len}")
+            ids.append(f"DD:V01:METAR:obs:{epoch}")
+    return ids
+
+
+def test_prefetch_in_batches(fake_collection):
+    ids = model_and_obs_ids(range(10), range(3))
+    collection = fake_collection({an_id: {"id": an_id} for an_id in ids})
+    with DocumentPrefetcher(collection, ids, batch_size=8) as prefetcher:
+        for an_id in ids:
+            assert prefetcher.get(an_id).content_as[dict] == {"id": an_id}
+    # every unique id is read once, by a get_multi, and nothing is read one at a time
+    unique_ids = list(dict.fromkeys(ids))
+    assert [an_id for batch in collection.get_multis for an_id in batch] == unique_ids
+    assert all(len(batch) <= 8 for batch in collection.get_multis)
+    assert collection.gets == []
+
+
+def test_prefetch_missing_documents(fake_collection):
+    ids = model_and_obs_ids(range(2), range(2))
+    missing = "DD:V01:METAR:obs:1"
+    collection = fake_collection({an_id: {} for an_id in ids if an_id != missing})
+    with DocumentPrefetcher(collection, ids) as prefetcher:
+        prefetcher.get("DD:V01:METAR:HRRR:1:0")
+        with pytest.raises(DocumentNotFoundException):
+            prefetcher.get(missing)
+        # a missing document is asked for again, like collection.get would be
+        with pytest.raises(DocumentNotFoundException):
+            prefetcher.get(missing)
+        assert collection.gets == [missing]
+        # an id that was not given up front
+        with pytest.raises(DocumentNotFoundException):
+            prefetcher.get("not_an_id")
+
+
+def test_prefetch_lru(fake_collection):
+    ids = [f"id{index}" for index in range(6)]
+    collection = fake_collection({an_id: {} for an_id in ids})
+    with DocumentPrefetcher(collection, ids, batch_size=2, cache_size=2) as prefetcher:
+        for an_id in ids:
+            prefetcher.get(an_id)
+        assert list(prefetcher.cache) == ["id4", "id5"]
+        # recently used documents are not read again, evicted ones are
+        prefetcher.get("id5")
+        assert collection.gets == []
+        prefetcher.get("id0")
+        assert collection.gets == ["id0"]
+
+
+def test_prefetch_get_multi_failure(fake_collection):
+    ids = ["id0", "id1"]
+    collection = fake_collection({an_id: {} for an_id in ids})
+
+    def failing_get_multi(batch):
+        raise TimeoutError("timed out")
+
+    collection.get_multi = failing_get_multi
+    with DocumentPrefetcher(collection, ids) as prefetcher:
+        assert prefetcher.get("id1").id == "id1"
+    assert collection.gets == ["id1"]
@@ -0,0 +1,97 @@
+from couchbase.exceptions import (
+    AmbiguousTimeoutException,
+    DocumentExistsException,
+    TemporaryFailException,
+)
+
+from vxingest.builder_common.document_writer import DocumentWriter
+
+
+def make_documents(count, size=10):
+    return {
+        f"DD:{index:04d}": {"id": f"DD:{index:04d}", "data": "x" * size}
+        for index in range(count)
+    }
+
+
+def test_batches_by_count_and_bytes(fake_collection):
+    documents = make_documents(25)
+    collection = fake_collection()
+    stats = DocumentWriter(collection, batch_size=10).upsert(documents)
+    assert collection.documents == documents
+    assert stats["batches"] == 3
+    assert sorted(len(batch) for batch in collection.batches) == [5, 10, 10]
+    assert stats["failed"] == {}
+    # each document is 36 json bytes
+    writer = DocumentWriter(fake_collection(), batch_bytes=100)
+    batches = list(writer.get_batches(documents))
+    assert [len(batch) for batch, _bytes in batches] == [2] * 12 + [1]
+    assert sum(batch_bytes for _batch, batch_bytes in batches) == 25 * 36
+    # a document larger than batch_bytes is a batch of its own
+    writer = DocumentWriter(fake_collection(), batch_bytes=10)
+    assert [len(batch) for batch, _bytes in writer.get_batches(documents)] == [1] * 25
+
+
+def test_only_failed_documents_are_retried(fake_collection):
+    documents = make_documents(20)
+    collection = fake_collection(
+        failures={
+            "DD:0003": [AmbiguousTimeoutException(), TemporaryFailException()],
+            "DD:0011": [TemporaryFailException()],
+        }
+    )
+    stats = DocumentWriter(collection, batch_size=10, backoff_seconds=0).upsert(
+        documents
+    )
+    assert collection.documents == documents
+    assert stats["failed"] == {}
+    assert stats["retries"] == 3
+    # the retries only upsert the documents that failed
+    assert sorted(batch for batch in collection.batches if len(batch) == 1) == [
+        ["DD:0003"],
+        ["DD:0003"],
+        ["DD:0011"],
+    ]
+
+
+def test_failed_documents_are_reported(fake_collection):
+    documents = make_documents(5)
+    collection = fake_collection(
+        failures={
+            "DD:0001": [DocumentExistsException()],
+            "DD:0002": [TemporaryFailException()] * 10,
+        }
+    )
+    stats = DocumentWriter(collection, max_retries=2, backoff_seconds=0).upsert(
+        documents
+    )
+    assert set(stats["failed"]) == {"DD:0001", "DD:0002"}
+    # a permanent error is not retried
+    assert sum(batch.count("DD:0001") for batch in collection.batches) == 1
+    assert sum(batch.count("DD:0002") for batch in collection.batches) == 3
+    assert set(collection.documents) == set(documents) - {"DD:0001", "DD:0002"}
+
+
+def test_a_failed_upsert_multi_is_retried(fake_collection):
+    class FlakyCollection(fake_collection):
+        def upsert_multi(self, batch):
+            if not self.batches:
+                self.batches.append([])
+                raise AmbiguousTimeoutException()
+            return super().upsert_multi(batch)
+
+    documents = make_documents(5)
+    collection = FlakyCollection()
+    stats = DocumentWriter(collection, backoff_seconds=0).upsert(documents)
+    assert collection.documents == documents
+    assert stats["retries"] == 5
+
+
+def test_bounded_concurrency(fake_collection):
+    collection = fake_collection(delay=0.01)
+    stats = DocumentWriter(collection, batch_size=2, concurrency=3).upsert(
+        make_documents(40)
+    )
+    assert stats["batches"] == 20
+    assert len(collection.documents) == 40
+    assert 1 < collection.max_running <= 3
@@ -0,0 +1,132 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from vxingest.builder_common.file_manifest import FileManifest
+from vxingest.builder_common.vx_ingest import CommonVxIngest
+
+
+class FakeCluster:
+    """a cluster that answers the DataFile query with the given rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, stmnt):
+        return iter(self.rows)
+
+
+def make_vx_ingest(rows):
+    vx_ingest = CommonVxIngest()
+    vx_ingest.cluster = FakeCluster(rows)
+    return vx_ingest
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    # the mtimes are not in name order so the sorting can be checked
+    mtimes = {
+        "1820013010000": 1000,
+        "1820013020000": 3000,
+        "1820013030000": 5000,
+        "1820013040000": 2000,
+        "1820014010000": 4000,
+        "not_a_date": 500,
+    }
+    for name, mtime in mtimes.items():
+        path = tmp_path / name
+        path.write_text("test")
+        os.utime(path, (mtime, mtime))
+    # a file in a sub directory is not matched by a pattern without a path
+    (tmp_path / ".prev").mkdir()
+    (tmp_path / ".prev" / "1820017010000").write_text("test")
+    return tmp_path
+
+
+def test_get_file_list_sorted_by_mtime(data_dir):
+    vx_ingest = make_vx_ingest(
+        [
+            # older than the file, it is ingested again
+            {"url": str(data_dir / "1820013010000"), "mtime": 999},
+            # as new as the file, it is not ingested again
+            {"url": str(data_dir / "1820013020000"), "mtime": 3000},
+            {"url": str(data_dir / "gone"), "mtime": 1},
+        ]
+    )
+    files = vx_ingest.get_file_list("query", data_dir, "18200*", "%y%j%H%f")
+    assert files == [
+        str(data_dir / "1820013010000"),
+        str(data_dir / "1820013040000"),
+        str(data_dir / "1820014010000"),
+        str(data_dir / "1820013030000"),
+    ]
+
+
+def test_get_file_list_without_mask(data_dir):
+    vx_ingest = make_vx_ingest([{"url": str(data_dir / "not_a_date"), "mtime": 500}])
+    files = vx_ingest.get_file_list("query", f"file://{data_dir}", "[1n]*", None)
+    assert files == sorted(
+        str(data_dir / name)
+        for name in [
+            "1820013010000",
+            "1820013020000",
+            "1820013030000",
+            "1820013040000",
+            "1820014010000",
+        ]
+    )
+
+
+def test_get_file_list_epoch_range(data_dir):
+    vx_ingest = make_vx_ingest([])
+    # only the files of 2018 day 200 hour 13
+    first_epoch = int(datetime(2018, 7, 19, 13).timestamp())
+    files = vx_ingest.get_file_list(
+        "query",
+        data_dir,
+        "18200*",
+        "%y%j%H%f",
+        {"first_epoch": first_epoch, "last_epoch": first_epoch + 3599},
+    )
+    assert files == [
+        str(data_dir / "1820013010000"),
+        str(data_dir / "1820013040000"),
+        str(data_dir / "1820013020000"),
+        str(data_dir / "1820013030000"),
+    ]
+
+
+def test_scan_directory_matches_glob(data_dir):
+    vx_ingest = make_vx_ingest([])
+    for pattern in ["*", "18200?3*", ".*/*", "**/18200*", "[!1]*"]:
+        files = vx_ingest.scan_directory(data_dir, pattern)
+        assert sorted(files) == sorted(
+            (str(path), path.stat().st_mtime) for path in Path(data_dir).glob(pattern)
+        ), pattern
+
+
+def test_get_file_list_incremental(data_dir):
+    manifest = FileManifest(data_dir / ".manifest.sqlite")
+    vx_ingest = make_vx_ingest(
+        [{"url": str(data_dir / "1820013010000"), "mtime": 1000}]
+    )
+    files = vx_ingest.get_file_list(
+        "query", data_dir, "18200*", "%y%j%H%f", None, manifest
+    )
+    assert files == [
+        str(data_dir / "1820013040000"),
+        str(data_dir / "1820013020000"),
+        str(data_dir / "1820014010000"),
+        str(data_dir / "1820013030000"),
+    ]
+    assert manifest.get_df_watermark() == 1000
+    # the queued files are not handed out again, only the new file is
+    (data_dir / "1820015010000").write_text("test")
+    vx_ingest = make_vx_ingest([])
+    files = vx_ingest.get_file_list(
+        "query", data_dir, "18200*", "%y%j%H%f", None, manifest
+    )
+    assert files == [str(data_dir / "1820015010000")]
+    manifest.close()
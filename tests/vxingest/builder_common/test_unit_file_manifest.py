@@ -0,0 +1,77 @@
+import json
+import re
+import time
+
+from vxingest.builder_common.file_manifest import FileManifest
+
+
+def test_watermark_and_known_files(tmp_path):
+    manifest = FileManifest(tmp_path / "manifest.sqlite")
+    assert manifest.get_df_watermark() == 0
+    assert manifest.get_known_files() == set()
+    assert (
+        manifest.update_ingested(
+            [{"url": "/data/a", "mtime": 100}, {"url": "/data/b", "mtime": 300}]
+        )
+        == 2
+    )
+    assert manifest.get_df_watermark() == 300
+    # an older DF record does not move the watermark back
+    manifest.update_ingested([{"url": "/data/c", "mtime": 200}])
+    assert manifest.get_df_watermark() == 300
+    manifest.add_queued({"/data/d": 400})
+    assert manifest.get_known_files() == {"/data/a", "/data/b", "/data/c", "/data/d"}
+    manifest.close()
+    # the manifest is kept between runs
+    manifest = FileManifest(tmp_path / "manifest.sqlite")
+    assert manifest.get_df_watermark() == 300
+    assert "/data/d" in manifest.get_known_files()
+    manifest.close()
+
+
+def test_queued_files_are_retried(tmp_path):
+    manifest = FileManifest(tmp_path / "manifest.sqlite", retry_seconds=60)
+    manifest.add_queued({"/data/a": 100, "/data/b": 100})
+    manifest.connection.execute(
+        "UPDATE files SET queued_time=? WHERE url='/data/a'", (time.time() - 120,)
+    )
+    # /data/a never got a DF record
+    assert manifest.get_known_files() == {"/data/b"}
+    # a DF record makes it known for good
+    manifest.update_ingested([{"url": "/data/a", "mtime": 100}])
+    assert manifest.get_known_files() == {"/data/a", "/data/b"}
+    manifest.close()
+
+
+class FakeDataFiles:
+    """the DF records, selected with a get_df_condition condition"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, condition):
+        watermark = float(re.search(r"mtime >= ([\d.]+)", condition).group(1))
+        match = re.search(r"url IN (\[.*\])", condition)
+        urls = json.loads(match.group(1)) if match else []
+        return [
+            row for row in self.rows if row["mtime"] >= watermark or row["url"] in urls
+        ]
+
+
+def test_late_file_below_the_watermark(tmp_path):
+    manifest = FileManifest(tmp_path / "manifest.sqlite")
+    data_files = FakeDataFiles([{"url": "/data/a", "mtime": 300}])
+    manifest.update_ingested(data_files.query(manifest.get_df_condition()))
+    assert manifest.get_df_condition() == "AND mtime >= 300.0"
+    # a file that arrived late - its mtime (and the mtime of its DF) is older than the watermark
+    manifest.add_queued({"/data/late": 100})
+    assert manifest.get_pending_files() == ["/data/late"]
+    data_files.rows.append({"url": "/data/late", "mtime": 100})
+    condition = manifest.get_df_condition()
+    assert condition == 'AND (mtime >= 300.0 OR url IN ["/data/late"])'
+    manifest.update_ingested(data_files.query(condition))
+    # its DF record was merged, so it is not queued again
+    assert manifest.get_pending_files() == []
+    assert "/data/late" in manifest.get_known_files()
+    assert manifest.get_df_watermark() == 300
+    manifest.close()
@@ -0,0 +1,162 @@
+import multiprocessing
+import queue
+import time
+from types import SimpleNamespace
+
+import pytest
+from couchbase.exceptions import DocumentExistsException
+
+from vxingest.builder_common import vx_ingest
+from vxingest.builder_common.ingest_manager import END_OF_QUEUE, CommonVxIngestManager
+from vxingest.builder_common.vx_ingest import CommonVxIngest
+
+
+class IngestManager(CommonVxIngestManager):
+    """records the processed elements, fails for the element "fail" """
+
+    cb_credentials = None
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.processed = []
+
+    def connect_cb(self, cluster=None):
+        pass
+
+    def process_queue_element(self, queue_element):
+        if queue_element == "fail":
+            raise ValueError("fail")
+        self.processed.append(queue_element)
+
+
+class WritingIngestManager(IngestManager):
+    """writes a data and a DF document for each element"""
+
+    def process_queue_element(self, queue_element):
+        self.write_document_to_cb(
+            queue_element,
+            {
+                f"DD:{queue_element}": {"id": f"DD:{queue_element}"},
+                f"DF:{queue_element}": {"id": f"DF:{queue_element}"},
+            },
+        )
+
+
+def configure_nothing(logging_queue):
+    pass
+
+
+def test_sort_by_file_size(tmp_path):
+    for name, size in [("small", 1), ("big", 100), ("medium", 10)]:
+        (tmp_path / name).write_bytes(b"x" * size)
+    file_names = [
+        str(tmp_path / name) for name in ["small", "missing", "big", "medium"]
+    ]
+    assert CommonVxIngest().sort_by_file_size(file_names) == [
+        str(tmp_path / name) for name in ["big", "medium", "small", "missing"]
+    ]
+
+
+def test_run_stops_at_the_end_of_queue(tmp_path):
+    element_queue = multiprocessing.JoinableQueue()
+    result_queue = multiprocessing.Queue()
+    CommonVxIngest().fill_queue(element_queue, ["a", "fail", "b"], 2)
+    manager = IngestManager(
+        "VxIngestManager-1",
+        {"cb_connection": {}},
+        element_queue,
+        str(tmp_path),
+        None,
+        configure_nothing,
+    )
+    manager.result_queue = result_queue
+    start = time.perf_counter()
+    manager.run()
+    # there is no waiting for an empty queue
+    assert time.perf_counter() - start < 1
+    assert manager.processed == ["a", "b"]
+    assert result_queue.get(timeout=5) == ("VxIngestManager-1", 2, ["fail"], None)
+    # the END_OF_QUEUE of the other manager is left
+    assert element_queue.get(timeout=5) is END_OF_QUEUE
+
+
+class FakeProcess:
+    def __init__(self, thread_name, alive=True):
+        self.thread_name = thread_name
+        self.pid = 1
+        self.alive = alive
+        self.exitcode = None if alive else -9
+        self.joined = False
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self):
+        self.joined = True
+
+
+def test_wait_for_ingest_managers(monkeypatch, caplog):
+    monkeypatch.setattr(vx_ingest, "MANAGER_POLL_SECONDS", 0.1)
+    result_queue = queue.Queue()
+    managers = [
+        FakeProcess("VxIngestManager-1", alive=False),
+        FakeProcess("VxIngestManager-2", alive=False),
+        FakeProcess("VxIngestManager-3", alive=False),
+        SimpleNamespace(thread_name="VxIngestManager-4", pid=None),
+    ]
+    result_queue.put(("VxIngestManager-1", 3, ["fail"], None))
+    result_queue.put(("VxIngestManager-2", 0, [], "no connection"))
+    failed = CommonVxIngest().wait_for_ingest_managers(managers, result_queue)
+    assert failed == ["fail"]
+    assert all(manager.joined for manager in managers[:3])
+    assert "no connection" in caplog.text
+    assert "VxIngestManager-3 exited (exitcode -9) without finishing" in caplog.text
+
+
+def test_exit_if_failed(caplog):
+    CommonVxIngest().exit_if_failed([])
+    with pytest.raises(SystemExit) as exit_info:
+        CommonVxIngest().exit_if_failed(["a.grib2"])
+    assert exit_info.value.code == 1
+    assert "1 elements failed: ['a.grib2']" in caplog.text
+
+
+def test_documents_that_were_not_written_fail_the_element(fake_collection, tmp_path):
+    element_queue = multiprocessing.JoinableQueue()
+    result_queue = multiprocessing.Queue()
+    CommonVxIngest().fill_queue(element_queue, ["a", "b"], 1)
+    manager = WritingIngestManager(
+        "VxIngestManager-1",
+        {"cb_connection": {}},
+        element_queue,
+        str(tmp_path),
+        None,
+        configure_nothing,
+    )
+    manager.collection = fake_collection(
+        failures={"DD:b": [DocumentExistsException("exists")]}
+    )
+    manager.result_queue = result_queue
+    manager.run()
+    assert result_queue.get(timeout=5) == ("VxIngestManager-1", 1, ["b"], None)
+    # the DF of the failed element is not written, so it is ingested again
+    assert sorted(manager.collection.documents) == ["DD:a", "DF:a"]
+
+
+def test_set_job_keeps_the_builders(tmp_path):
+    manager = IngestManager(
+        "VxIngestManager-1",
+        {"cb_connection": {"host": "a"}},
+        None,
+        str(tmp_path),
+        None,
+        configure_nothing,
+    )
+    builder = SimpleNamespace(load_spec=manager.load_spec)
+    manager.builder_map["builder"] = builder
+    load_spec = {"cb_connection": {"host": "b"}}
+    manager.set_job(load_spec, str(tmp_path / "next"))
+    assert manager.builder_map == {"builder": builder}
+    assert builder.load_spec is load_spec
+    assert manager.cb_credentials == {"host": "b"}
+    assert manager.output_dir == str(tmp_path / "next")
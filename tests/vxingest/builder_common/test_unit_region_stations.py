@@ -0,0 +1,144 @@
+import random
+
+import pytest
+
+from vxingest.builder_common.builder_utilities import get_geo_index
+from vxingest.builder_common.region_stations import RegionStationCache
+from vxingest.partial_sums_to_cb.partial_sums_builder import (
+    PartialSumsSurfaceModelObsBuilderV01,
+)
+
+BOUNDING_BOXES = {
+    "ALL_HRRR": {
+        "br_lat": 21.7692,
+        "br_lon": -61.7802,
+        "tl_lat": 52.3516,
+        "tl_lon": 233.4505,
+    },
+    "E_US": {"br_lat": 24.0, "br_lon": -65.0, "tl_lat": 50.0, "tl_lon": -100.0},
+}
+
+
+class FakeCluster:
+    """a cluster that answers the region and station queries and counts them"""
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.queries = []
+
+    def query(self, stmnt, read_only=False):
+        self.queries.append(stmnt)
+        if "docType='region'" in stmnt:
+            name = stmnt.split("name='")[1].split("'")[0]
+            return [BOUNDING_BOXES[name]]
+        return list(self.stations)
+
+
+@pytest.fixture
+def stations():
+    rng = random.Random(7)
+    stations = []
+    for index in range(300):
+        geo = []
+        first_time = rng.randrange(0, 5000)
+        for _move in range(rng.randrange(1, 4)):
+            last_time = first_time + rng.randrange(0, 3000)
+            geo.append(
+                {
+                    "firstTime": first_time,
+                    "lastTime": last_time,
+                    "lat": rng.uniform(15, 60),
+                    "lon": rng.uniform(-140, -55),
+                    "elev": rng.choice([1000.0, 9999, None]),
+                }
+            )
+            first_time = last_time + rng.randrange(1, 500)
+        stations.append({"name": f"K{index:03d}", "geo": geo})
+    return stations
+
+
+def stations_by_scan(stations, bounding_box, valid_epoch, require_elevation):
+    """the station filter the way the builders did it for every epoch"""
+    names = []
+    for row in stations:
+        geo = row["geo"][get_geo_index(valid_epoch, row["geo"])]
+        rlon = geo["lon"] if geo["lon"] <= 180 else geo["lon"] - 360
+        br_lon = bounding_box["br_lon"]
+        br_lon = br_lon if br_lon <= 180 else br_lon - 360
+        tl_lon = bounding_box["tl_lon"]
+        tl_lon = tl_lon if tl_lon <= 180 else tl_lon - 360
+        if (
+            bounding_box["br_lat"] <= geo["lat"] <= bounding_box["tl_lat"]
+            and tl_lon <= rlon <= br_lon
+            and (
+                not require_elevation
+                or ("elev" in geo and geo["elev"] is not None and geo["elev"] != 9999)
+            )
+        ):
+            names.append(row["name"])
+    return sorted(names)
+
+
+@pytest.mark.parametrize("require_elevation", [False, True])
+def test_region_stations_match_scan(stations, require_elevation):
+    cluster = FakeCluster(stations)
+    cache = RegionStationCache(
+        cluster, "vxdata", "_default", "METAR", require_elevation=require_elevation
+    )
+    boundaries = sorted(
+        {
+            geo[key] + delta
+            for row in stations
+            for geo in row["geo"]
+            for key in ["firstTime", "lastTime"]
+            for delta in [-1, 0, 1]
+        }
+    )
+    epochs = boundaries[::7] + [-10, 0, 20000]
+    for region_name, bounding_box in BOUNDING_BOXES.items():
+        for epoch in epochs:
+            assert cache.get_stations(region_name, "METAR", epoch) == stations_by_scan(
+                stations, bounding_box, epoch, require_elevation
+            ), f"{region_name} {epoch}"
+    # one station query and one query per region
+    assert len(cluster.queries) == 3
+
+
+def test_region_stations_are_reused(stations):
+    cache = RegionStationCache(FakeCluster(stations), "vxdata", "_default", "METAR")
+    first = cache.get_stations("E_US", "METAR", 100000)
+    assert len(cache.region_stations) == 1
+    # every epoch after the last boundary is the same interval
+    assert cache.get_stations("E_US", "METAR", 200000) == first
+    assert len(cache.region_stations) == 1
+    # callers get their own list
+    first.append("extra")
+    assert "extra" not in cache.get_stations("E_US", "METAR", 100000)
+
+
+def test_builder_uses_cache(stations):
+    builder = PartialSumsSurfaceModelObsBuilderV01(
+        {"cluster": FakeCluster(stations)}, {"template": ""}
+    )
+    builder.subset = "METAR"
+    builder.bucket = "vxdata"
+    builder.scope = "_default"
+    builder.collection = "METAR"
+    for epoch in range(0, 8000, 300):
+        assert builder.get_stations_for_region_by_sort(
+            "E_US", epoch
+        ) == stations_by_scan(stations, BOUNDING_BOXES["E_US"], epoch, True)
+    assert len(builder.load_spec["cluster"].queries) == 2
+
+
+def test_region_masks(stations):
+    cache = RegionStationCache(FakeCluster(stations), "vxdata", "_default", "METAR")
+    region_names = ["ALL_HRRR", "E_US"]
+    for epoch in [100, 2500, 7000]:
+        masks = cache.get_region_masks(region_names, "METAR", epoch)
+        for index, region_name in enumerate(region_names):
+            assert sorted(
+                name for name, mask in masks.items() if mask & (1 << index)
+            ) == cache.get_stations(region_name, "METAR", epoch)
+        assert all(masks.values())
+        assert cache.get_region_masks(region_names, "METAR", epoch) is masks
@@ -0,0 +1,136 @@
+import pytest
+
+from vxingest.builder_common.template_plan import TemplateItem, TemplatePlan
+from vxingest.partial_sums_to_cb.partial_sums_builder import (
+    PartialSumsSurfaceModelObsBuilderV01,
+)
+
+
+class StubBuilder:
+    def __init__(self):
+        self.calls = []
+
+    def handle_time(self, params_dict):
+        self.calls.append(params_dict)
+        return 1234
+
+
+@pytest.fixture
+def template():
+    return {
+        "id": "DD:V01:*subset:*model:&handle_time:*fcstLen",
+        "subset": "METAR",
+        "model": "HRRR",
+        "fcstValidEpoch": "&handle_time",
+        "data": {
+            "*name": {
+                "Temperature": "&handle_temp|*2 metre temperature",
+                "WS": "&handle_wind_speed|*10 metre U wind component,*10 metre V wind component",
+                "name": "*name",
+            }
+        },
+        "units": {"Temperature": "F"},
+    }
+
+
+def test_items_match_split(template):
+    """The compiled replacements are the same as parsing the string every time"""
+    plan = TemplatePlan(template, StubBuilder())
+    for text in [
+        "*subset",
+        "DD:V01:*subset:*model",
+        "&handle_wind_speed|*10 metre U wind component,*10 metre V wind component",
+        "METAR",
+        "not in the template*x",
+        "",
+    ]:
+        assert plan.get_replacements(text) == tuple(text.split("*")[1:])
+    assert plan.get_replacements(None) == ()
+    assert plan.get_replacements(12) == ()
+    assert plan.get_item("*subset") is plan.get_item("*subset")
+    assert plan.get_item("METAR").kind == TemplateItem.CONSTANT
+    assert plan.get_item("*name").kind == TemplateItem.REPLACEMENT
+    assert plan.get_item("&handle_time").kind == TemplateItem.FUNCTION
+
+
+def test_replacements(template):
+    plan = TemplatePlan(template, StubBuilder())
+    assert plan.replacements == {
+        "subset",
+        "model",
+        "fcstLen",
+        "name",
+        "2 metre temperature",
+        "10 metre U wind component",
+        "10 metre V wind component",
+    }
+
+
+def test_id_parts(template):
+    plan = TemplatePlan(template, StubBuilder())
+    parts = plan.get_id_parts(template["id"])
+    assert [part.text for part in parts] == template["id"].split(":")
+    assert parts is plan.get_id_parts(template["id"])
+    assert [part.kind for part in parts] == [
+        TemplateItem.CONSTANT,
+        TemplateItem.CONSTANT,
+        TemplateItem.REPLACEMENT,
+        TemplateItem.REPLACEMENT,
+        TemplateItem.FUNCTION,
+        TemplateItem.REPLACEMENT,
+    ]
+
+
+def test_named_functions(template):
+    builder = StubBuilder()
+    plan = TemplatePlan(template, builder)
+    function = plan.get_function(
+        "&handle_wind_speed|*10 metre U wind component,*10 metre V wind component"
+    )
+    assert function.name == "handle_wind_speed"
+    assert [key for key, _param in function.params] == [
+        "10 metre U wind component",
+        "10 metre V wind component",
+    ]
+    # the stub has no handle_wind_speed
+    with pytest.raises(AttributeError):
+        function({})
+    handle_time = plan.get_function("&handle_time")
+    assert handle_time.params == ()
+    assert handle_time({"a": 1}) == 1234
+    assert builder.calls == [{"a": 1}]
+
+
+def test_json_params():
+    plan = TemplatePlan({}, StubBuilder())
+    function = plan.get_function("&handle_sum|{'variable': 'Temperature'}")
+    assert function.json_params == {"variable": "Temperature"}
+    bad_function = plan.get_function("&handle_sum|{'variable': }")
+    with pytest.raises(ValueError, match="Expecting value"):
+        bad_function({})
+
+
+def test_builder_plan_follows_template():
+    """builders that set their template in build_document get a new plan"""
+    builder = PartialSumsSurfaceModelObsBuilderV01("load_spec", {"template": ""})
+    builder.template = {"id": "SUMS:*subset", "subset": "METAR"}
+    plan = builder.get_template_plan()
+    assert plan is builder.get_template_plan()
+    builder.template = {"id": "SUMS:*model", "model": "HRRR"}
+    assert builder.get_template_plan() is not plan
+    builder.model_data = {"model": "HRRR"}
+    assert builder.derive_id(template_id="SUMS:*model") == "SUMS:HRRR"
+
+
+def test_partial_sums_json_named_function():
+    builder = PartialSumsSurfaceModelObsBuilderV01("load_spec", {"template": ""})
+    builder.template = {"data": {"Temperature": "&handle_test|{'a': 'b'}"}}
+    received = []
+    builder.handle_test = lambda params: received.append(params) or "ok"
+    assert builder.handle_named_function("&handle_test|{'a': 'b'}") == "ok"
+    assert received == [{"a": "b"}]
+    # the handler gets a copy of the plan's params
+    received[0]["a"] = "changed"
+    assert builder.get_template_plan().get_function(
+        "&handle_test|{'a': 'b'}"
+    ).json_params == {"a": "b"}
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from vxingest.builder_common import worker_pool
+from vxingest.builder_common.worker_pool import WorkerPool
+from vxingest.log_config import worker_log_configurer
+
+
+def configure_nothing(logging_queue):
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+
+class FakeCluster:
+    def close(self):
+        pass
+
+
+class FakeManager:
+    """records each element in a file named for the element: the pid, whether the cluster was reused
+    and the number of managers that the process has made"""
+
+    made = 0
+
+    def __init__(
+        self,
+        name,
+        load_spec,
+        element_queue,
+        output_dir,
+        logging_queue,
+        logging_configurer,
+        suffix="",
+    ):
+        self.output_dir = output_dir
+        self.suffix = suffix
+        self.cluster = None
+        self.reused = False
+        FakeManager.made += 1
+
+    def set_job(self, load_spec, output_dir):
+        self.output_dir = output_dir
+
+    def connect_cb(self, cluster=None):
+        self.reused = cluster is not None
+        self.cluster = cluster if cluster is not None else FakeCluster()
+
+    def process_queue_element(self, queue_element):
+        if queue_element == "fail":
+            raise ValueError("fail")
+        if queue_element == "crash":
+            os._exit(1)
+        logging.getLogger(__name__).warning("processing %s", queue_element)
+        if queue_element.startswith("sleep"):
+            start = time.time()
+            time.sleep(0.3)
+            (Path(self.output_dir) / queue_element).write_text(f"{start} {time.time()}")
+            return
+        (Path(self.output_dir) / f"{queue_element}{self.suffix}").write_text(
+            f"{os.getpid()} {self.reused} {FakeManager.made}"
+        )
+
+
+def test_worker_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_pool, "WORKER_POLL_SECONDS", 0.5)
+    load_spec = {"cb_connection": {"host": "localhost", "user": "user"}}
+    pool = WorkerPool(2, worker_pool.SPAWN_CONTEXT.Queue(), configure_nothing)
+    try:
+        failed = pool.run(
+            FakeManager, load_spec, str(tmp_path), ["a", "fail", "b", "crash", "c"]
+        )
+        assert sorted(failed) == ["crash", "fail"]
+        first_pids = {
+            int((tmp_path / element).read_text().split()[0])
+            for element in ["a", "b", "c"]
+        }
+        # the dead worker was replaced
+        assert len(pool.workers) == 2
+        assert all(worker.is_alive() for worker in pool.workers)
+        pids = {worker.pid for worker in pool.workers}
+        # the next job uses the same processes and their clusters
+        failed = pool.run(
+            FakeManager, load_spec, str(tmp_path), ["a", "b", "c", "d"], suffix=".2"
+        )
+        assert failed == []
+        made = {}
+        for element in ["a", "b", "c", "d"]:
+            pid, reused, count = (tmp_path / f"{element}.2").read_text().split()
+            assert int(pid) in pids
+            if int(pid) in first_pids:
+                assert reused == "True"
+            made[int(pid)] = max(made.get(int(pid), 0), int(count))
+        # a job with the same ingest documents and arguments reuses the managers (and their builders)
+        (tmp_path / "next").mkdir()
+        failed = pool.run(
+            FakeManager, load_spec, str(tmp_path / "next"), ["a", "b"], suffix=".2"
+        )
+        assert failed == []
+        for element in ["a", "b"]:
+            pid, _reused, count = (
+                (tmp_path / "next" / f"{element}.2").read_text().split()
+            )
+            assert int(count) == made[int(pid)]
+    finally:
+        pool.close()
+    assert pool.workers == []
+
+
+def test_jobs_share_the_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_pool, "WORKER_POLL_SECONDS", 0.5)
+    load_spec = {"cb_connection": {"host": "localhost", "user": "user"}}
+    pool = WorkerPool(2, worker_pool.SPAWN_CONTEXT.Queue(), configure_nothing)
+    results = {}
+
+    def run_job(name):
+        results[name] = pool.for_proc(1).run(
+            FakeManager,
+            load_spec,
+            str(tmp_path),
+            [f"sleep-{name}-{index}" for index in range(3)],
+        )
+
+    try:
+        threads = [
+            threading.Thread(target=run_job, args=(name,)) for name in ["a", "b"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        pool.close()
+    assert results == {"a": [], "b": []}
+    times = {
+        name: [
+            tuple(map(float, (tmp_path / f"sleep-{name}-{index}").read_text().split()))
+            for index in range(3)
+        ]
+        for name in ["a", "b"]
+    }
+    for name in ["a", "b"]:
+        # a job uses at most max_workers (1) workers, so its elements do not overlap
+        spans = sorted(times[name])
+        assert all(
+            end <= next_start
+            for (_, end), (next_start, _) in zip(spans, spans[1:], strict=False)
+        )
+    # the two jobs ran at the same time
+    assert min(end for _, end in times["a"]) > min(start for start, _ in times["b"])
+    assert min(end for _, end in times["b"]) > min(start for start, _ in times["a"])
+
+
+def test_records_are_tagged_with_the_proc(tmp_path):
+    load_spec = {"cb_connection": {"host": "localhost", "user": "user"}}
+    logging_queue = worker_pool.SPAWN_CONTEXT.Queue()
+    pool = WorkerPool(1, logging_queue, worker_log_configurer)
+    try:
+        assert (
+            pool.for_proc(1, "P_A").run(FakeManager, load_spec, str(tmp_path), ["a"])
+            == []
+        )
+        assert pool.run(FakeManager, load_spec, str(tmp_path), ["b"]) == []
+    finally:
+        pool.close()
+    records = {}
+    while len(records) < 2:
+        record = logging_queue.get(timeout=10)
+        if record.getMessage().startswith("processing"):
+            records[record.getMessage()] = getattr(record, "proc_name", None)
+    assert records == {"processing a": "P_A", "processing b": None}
@@ -0,0 +1,86 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from couchbase.exceptions import DocumentNotFoundException
+
+
+class FakeCollection:
+    """A couchbase collection for the unit tests that keeps its documents in a dict.
+    get and get_multi read the documents (a missing one is a DocumentNotFoundException),
+    upsert_multi writes them and reports the exceptions of the ids in failures.
+    The calls are recorded in gets, get_multis, reads (id -> the number of reads) and batches,
+    max_running is the most upsert_multi calls that ran at the same time.
+    """
+
+    def __init__(self, documents=None, failures=None, delay=0):
+        """
+        Args:
+            documents (dict, optional): id -> document. Defaults to None (no documents).
+            failures (dict, optional): id -> the exceptions of its next upserts. Defaults to None.
+            delay (float, optional): the seconds that each upsert_multi takes. Defaults to 0.
+        """
+        self.documents = documents if documents is not None else {}
+        self.failures = failures or {}
+        self.delay = delay
+        self.gets = []
+        self.get_multis = []
+        self.reads = {}
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def read(self, an_id):
+        """the get result of a document, None if it is missing"""
+        with self.lock:
+            self.reads[an_id] = self.reads.get(an_id, 0) + 1
+        if an_id not in self.documents:
+            return None
+        return SimpleNamespace(id=an_id, content_as={dict: self.documents[an_id]})
+
+    def get(self, an_id):
+        with self.lock:
+            self.gets.append(an_id)
+        result = self.read(an_id)
+        if result is None:
+            raise DocumentNotFoundException(f"{an_id} not found")
+        return result
+
+    def get_multi(self, ids):
+        with self.lock:
+            self.get_multis.append(list(ids))
+        results = {}
+        exceptions = {}
+        for an_id in ids:
+            result = self.read(an_id)
+            if result is None:
+                exceptions[an_id] = DocumentNotFoundException(f"{an_id} not found")
+            else:
+                results[an_id] = result
+        return SimpleNamespace(results=results, exceptions=exceptions)
+
+    def upsert_multi(self, batch):
+        with self.lock:
+            self.batches.append(list(batch))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        exceptions = {}
+        with self.lock:
+            self.running -= 1
+            for an_id, document in batch.items():
+                if self.failures.get(an_id):
+                    exceptions[an_id] = self.failures[an_id].pop(0)
+                else:
+                    self.documents[an_id] = document
+        return SimpleNamespace(
+            all_ok=not exceptions, exceptions=exceptions, results=dict(batch)
+        )
+
+
+@pytest.fixture
+def fake_collection():
+    """The FakeCollection class, call it with the documents, failures and delay of a test"""
+    return FakeCollection
@@ -0,0 +1,147 @@
+import random
+
+import pytest
+
+from vxingest.ctc_to_cb.contingency_table import StationPairs, contingency_counts
+from vxingest.ctc_to_cb.ctc_builder import CTCModelObsBuilderV01
+
+THRESHOLDS = [500.0, 1000.0, 1500.0, 3000.0, 60000.0]
+
+
+def handle_data_by_loop(builder):
+    """the contingency tables computed station by station, threshold by threshold,
+    the way handle_data used to"""
+    data_elem = {}
+    not_found_station_count = 0
+    variable = builder.variable.capitalize()
+    for threshold in builder.thresholds:
+        counts = dict.fromkeys(
+            ["hits", "false_alarms", "misses", "correct_negatives", "none_count"], 0
+        )
+        for name, model_station in builder.model_data["data"].items():
+            try:
+                if name not in builder.domain_stations:
+                    continue
+                if name not in builder.obs_station_names:
+                    not_found_station_count += 1
+                    continue
+                model_value = model_station[variable]
+                obs_value = builder.obs_data[name][variable]
+                if model_value is None or obs_value is None:
+                    counts["none_count"] += 1
+                    continue
+                if model_value < threshold and obs_value < threshold:
+                    counts["hits"] += 1
+                if model_value < threshold and not obs_value < threshold:
+                    counts["false_alarms"] += 1
+                if not model_value < threshold and obs_value < threshold:
+                    counts["misses"] += 1
+                if not model_value < threshold and not obs_value < threshold:
+                    counts["correct_negatives"] += 1
+            except Exception:
+                pass
+        data_elem[threshold] = counts
+    return data_elem, not_found_station_count
+
+
+def random_value(rng):
+    return rng.choice(
+        [
+            None,
+            float("nan"),
+            rng.randrange(0, 5000),
+            rng.uniform(0, 70000),
+            60000,
+            1000.0,
+            rng.uniform(0, 70000),
+        ]
+    )
+
+
+def make_builder(rng, station_count=400):
+    builder = CTCModelObsBuilderV01({}, {"template": {}})
+    builder.variable = "ceiling"
+    builder.thresholds = THRESHOLDS
+    names = [f"K{index:03d}" for index in range(station_count)]
+    builder.model_data = {
+        "data": {name: {"Ceiling": random_value(rng)} for name in names}
+    }
+    obs_names = [name for name in names if rng.random() < 0.9]
+    builder.obs_data = {name: {"Ceiling": random_value(rng)} for name in obs_names}
+    builder.obs_station_names = sorted(obs_names)
+    builder.domain_stations = sorted(name for name in names if rng.random() < 0.8)
+    return builder
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_handle_data_matches_loop(seed):
+    builder = make_builder(random.Random(seed))
+    # some values that are not numbers, the scalar rules still apply to them
+    builder.model_data["data"]["K001"] = {}
+    builder.model_data["data"]["K002"]["Ceiling"] = "bad"
+    builder.obs_data["K003"] = {"Ceiling": True}
+    for name in ["K001", "K002", "K003"]:
+        builder.obs_station_names = sorted({*builder.obs_station_names, name})
+        builder.obs_data.setdefault(name, {"Ceiling": 100})
+        builder.domain_stations.append(name)
+    expected, not_found_station_count = handle_data_by_loop(builder)
+    doc = builder.handle_data(doc={})
+    assert doc["data"] == expected
+    assert list(doc["data"]) == THRESHOLDS
+    for counts in doc["data"].values():
+        assert list(counts) == [
+            "hits",
+            "false_alarms",
+            "misses",
+            "correct_negatives",
+            "none_count",
+        ]
+        assert all(type(count) is int for count in counts.values())
+    assert builder.not_found_station_count == not_found_station_count
+
+
+def test_contingency_counts():
+    counts = contingency_counts(
+        [100, 2000, 100, 2000], [100, 100, 2000, 2000], [1000.0]
+    )
+    assert counts == {
+        1000.0: {"hits": 1, "false_alarms": 1, "misses": 1, "correct_negatives": 1}
+    }
+    # a value equal to the threshold is not an event
+    assert contingency_counts([1000.0], [999.0], [1000.0])[1000.0]["misses"] == 1
+    assert contingency_counts([], [], [1.0, 2.0]) == {
+        1.0: {"hits": 0, "false_alarms": 0, "misses": 0, "correct_negatives": 0},
+        2.0: {"hits": 0, "false_alarms": 0, "misses": 0, "correct_negatives": 0},
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_aligned_regions_match_loop(seed):
+    rng = random.Random(seed)
+    builder = make_builder(rng)
+    names = list(builder.model_data["data"])
+    regions = {
+        region_name: sorted(name for name in names if rng.random() < 0.5)
+        for region_name in ["E_US", "W_US", "ALL_HRRR"]
+    }
+    region_names = list(regions)
+    station_regions = {}
+    for index, region_name in enumerate(region_names):
+        for name in regions[region_name]:
+            station_regions[name] = station_regions.get(name, 0) | (1 << index)
+    aligned_stations = StationPairs(
+        builder.model_data["data"],
+        builder.obs_data,
+        set(builder.obs_station_names),
+        "Ceiling",
+        station_regions,
+    )
+    for region_name, domain_stations in regions.items():
+        builder.domain_stations = domain_stations
+        builder.not_found_station_count = 0
+        expected, not_found_station_count = handle_data_by_loop(builder)
+        builder.aligned_stations = aligned_stations
+        builder.region_index = region_names.index(region_name)
+        doc = builder.handle_data(doc={})
+        assert doc["data"] == expected, region_name
+        assert builder.not_found_station_count == not_found_station_count
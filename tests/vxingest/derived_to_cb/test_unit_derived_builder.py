@@ -0,0 +1,329 @@
+import argparse
+import random
+import sys
+import unittest.mock
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import vxingest.main
+from vxingest.ctc_to_cb.ctc_builder import CTCModelObsBuilderV01
+from vxingest.derived_to_cb.derived_builder import (
+    DerivedStatisticsBuilder,
+    group_ingest_documents,
+)
+from vxingest.log_config import worker_log_configurer
+from vxingest.main import run_job_dag
+from vxingest.partial_sums_to_cb.partial_sums_builder import (
+    PartialSumsSurfaceModelObsBuilderV01,
+)
+
+MODEL = "HRRR_OPS"
+EPOCHS = [3600 * hour for hour in range(1, 9)]
+FCST_LENS = [0, 1, 3]
+# the CTCs are already in the database up to the third epoch, the SUMS up to the fifth
+LATEST = {"CTC": EPOCHS[2], "SUMS": EPOCHS[4]}
+
+
+def ctc_ingest_document(sub_doc_type, region="E_US"):
+    return {
+        "builderType": "CTCModelObsBuilderV01",
+        "subType": "CTC",
+        "subset": "METAR",
+        "model": MODEL,
+        "region": region,
+        "subDocType": sub_doc_type,
+        "template": {
+            "id": f"DD:V01:METAR:{MODEL}:{region}:CTC:{sub_doc_type}:&handle_time:&handle_fcst_len",
+            "type": "DD",
+            "docType": "CTC",
+            "fcstValidEpoch": "&handle_time",
+            "fcstLen": "&handle_fcst_len",
+            "data": {},
+        },
+    }
+
+
+def sums_ingest_document(region="ALL_HRRR"):
+    return {
+        "builderType": "PartialSumsSurfaceModelObsBuilderV01",
+        "subType": "SUMS",
+        "subset": "METAR",
+        "model": MODEL,
+        "region": region,
+        "subDocType": "SURFACE",
+        "template": {
+            "id": f"DD:V01:METAR:{MODEL}:{region}:SUMS:SURFACE:&handle_time:&handle_fcst_len",
+            "type": "DD",
+            "docType": "SUMS",
+            "fcstValidEpoch": "&handle_time",
+            "fcstLen": "&handle_fcst_len",
+            "data": {
+                "Temperature": '&handle_sum|{"Temperature": "Temperature"}',
+                "RH": '&handle_sum|{"RH": "RH"}',
+                "UW": '&handle_sum|{"UW": "UW"}',
+            },
+        },
+    }
+
+
+INGEST_DOCUMENTS = {
+    f"IS:METAR:CTC:{sub_doc_type}:HRRR_OPS:{region}:ingest:V01": ctc_ingest_document(
+        sub_doc_type, region
+    )
+    for sub_doc_type in ["CEILING", "VISIBILITY"]
+    for region in ["E_US", "ALL_HRRR", "W_US"]
+} | {
+    f"IS:METAR:SUMS:SURFACE:HRRR_OPS:{region}:ingest:V01": sums_ingest_document(region)
+    for region in ["ALL_HRRR", "E_US"]
+}
+BOUNDING_BOXES = {
+    "E_US": {"br_lat": 24, "br_lon": -65, "tl_lat": 50, "tl_lon": -100},
+    "W_US": {"br_lat": 24, "br_lon": -100, "tl_lat": 50, "tl_lon": -125},
+    "ALL_HRRR": {"br_lat": 20, "br_lon": -60, "tl_lat": 55, "tl_lon": -130},
+}
+
+
+class FakeCluster:
+    """a cluster that answers the CTC and SUMS builder queries"""
+
+    def __init__(self, stations):
+        self.stations = stations
+
+    def query(self, stmnt, read_only=True):
+        if "maxObsEpoch" in stmnt:
+            return [{"minObsEpoch": EPOCHS[0], "maxObsEpoch": EPOCHS[-1]}]
+        if "maxModelEpoch" in stmnt:
+            return [{"minModelEpoch": EPOCHS[0], "maxModelEpoch": EPOCHS[-1]}]
+        if "RAW MAX" in stmnt:
+            latest = LATEST["CTC" if "docType='CTC'" in stmnt else "SUMS"]
+            first = int(stmnt.split("fcstValidEpoch >= ")[1].split()[0])
+            return [latest if latest >= first else None]
+        if "fve.fcstLen" in stmnt:
+            after = int(stmnt.split("fve.fcstValidEpoch > ")[1].split()[0])
+            last = int(stmnt.split("fve.fcstValidEpoch <= ")[1].split()[0])
+            return [
+                {
+                    "fcstValidEpoch": epoch,
+                    "fcstLen": fcst_len,
+                    "id": f"DD:V01:METAR:{MODEL}:{epoch}:{fcst_len}",
+                }
+                for epoch in EPOCHS
+                if after < epoch <= last
+                for fcst_len in FCST_LENS
+            ]
+        if "raw obs.fcstValidEpoch" in stmnt:
+            after = int(stmnt.split("obs.fcstValidEpoch > ")[1].split()[0])
+            last = int(stmnt.split("obs.fcstValidEpoch <= ")[1].split()[0])
+            return [epoch for epoch in EPOCHS if after < epoch <= last]
+        if "thresholdDescriptions" in stmnt:
+            return [
+                {
+                    "ceiling": {"500": "500 ft", "3000": "3000 ft"},
+                    "visibility": {"1": "1 mi", "3": "3 mi", "5": "5 mi"},
+                }
+            ]
+        if "docType='region'" in stmnt:
+            return [BOUNDING_BOXES[stmnt.split("name='")[1].split("'")[0]]]
+        if "docType='station'" in stmnt:
+            return self.stations
+        raise ValueError(stmnt)
+
+
+def station_values(rng):
+    temperature = rng.uniform(0, 90)
+    return {
+        "Ceiling": rng.choice([None, rng.uniform(0, 5000), 60000]),
+        "Visibility": rng.choice([None, rng.uniform(0, 10), 10]),
+        "Temperature": temperature,
+        "DewPoint": temperature - rng.uniform(0, 20),
+        "WS": rng.uniform(0, 30),
+        "WD": rng.uniform(0, 360),
+    }
+
+
+@pytest.fixture
+def load_spec(fake_collection):
+    rng = random.Random(3)
+    names = [f"K{index:03d}" for index in range(120)]
+    stations = [
+        {
+            "name": name,
+            "geo": [
+                {
+                    "firstTime": 0,
+                    "lastTime": 10**10,
+                    "lat": rng.uniform(20, 55),
+                    "lon": rng.uniform(-130, -60),
+                    "elev": rng.choice([100, 100, 9999]),
+                }
+            ],
+        }
+        for name in names
+    ]
+    documents = {}
+    for epoch in EPOCHS:
+        documents[f"DD:V01:METAR:obs:{epoch}"] = {
+            "id": f"DD:V01:METAR:obs:{epoch}",
+            "data": {name: station_values(rng) for name in names[5:]},
+        }
+        for fcst_len in FCST_LENS:
+            an_id = f"DD:V01:METAR:{MODEL}:{epoch}:{fcst_len}"
+            documents[an_id] = {
+                "id": an_id,
+                "fcstValidEpoch": epoch,
+                "fcstLen": fcst_len,
+                "data": {name: station_values(rng) for name in names[:-5]},
+            }
+    return {
+        "cluster": FakeCluster(stations),
+        "collection": fake_collection(documents),
+        "cb_connection": {
+            "bucket": "vxdata",
+            "scope": "_default",
+            "collection": "METAR",
+        },
+        "ingest_documents": INGEST_DOCUMENTS,
+        "derived_groups": group_ingest_documents(INGEST_DOCUMENTS),
+    }
+
+
+def test_group_ingest_documents():
+    ingest_documents = dict(INGEST_DOCUMENTS)
+    ingest_documents["IS:METAR:CTC:CEILING:RRFS:E_US:ingest:V01"] = dict(
+        ctc_ingest_document("CEILING"), model="RRFS"
+    )
+    assert group_ingest_documents(ingest_documents) == {
+        "DERIVED:METAR:HRRR_OPS": list(INGEST_DOCUMENTS),
+        "DERIVED:METAR:RRFS": ["IS:METAR:CTC:CEILING:RRFS:E_US:ingest:V01"],
+    }
+
+
+def test_derived_documents_match_separate_builders(load_spec):
+    # the documents the CTC and SUMS jobs build separately
+    expected = {}
+    for ingest_document_id, ingest_document in INGEST_DOCUMENTS.items():
+        builder_class = (
+            CTCModelObsBuilderV01
+            if ingest_document["subType"] == "CTC"
+            else PartialSumsSurfaceModelObsBuilderV01
+        )
+        builder = builder_class(load_spec, ingest_document)
+        expected.update(builder.build_document(ingest_document_id))
+    separate_reads = dict(load_spec["collection"].reads)
+    load_spec["collection"].reads = {}
+
+    builder = DerivedStatisticsBuilder(load_spec)
+    document_map = builder.build_document("DERIVED:METAR:HRRR_OPS")
+    assert document_map == expected
+    # every region of every variable has documents
+    assert {tuple(an_id.split(":")[4:7]) for an_id in document_map} == {
+        (doc["region"], doc["subType"], doc["subDocType"])
+        for doc in INGEST_DOCUMENTS.values()
+    }
+    # each builder only builds the fcstValidEpochs after its latest document
+    ctc_epochs = {
+        doc["fcstValidEpoch"]
+        for doc in document_map.values()
+        if doc["docType"] == "CTC"
+    }
+    sums_epochs = {
+        doc["fcstValidEpoch"]
+        for doc in document_map.values()
+        if doc["docType"] == "SUMS"
+    }
+    assert ctc_epochs == {epoch for epoch in EPOCHS if epoch > LATEST["CTC"]}
+    assert sums_epochs == {epoch for epoch in EPOCHS if epoch > LATEST["SUMS"]}
+    # every model and obs document is read once
+    reads = load_spec["collection"].reads
+    assert set(reads.values()) == {1}
+    assert sum(reads.values()) < sum(separate_reads.values())
+
+
+def test_get_region_groups(load_spec):
+    builder = DerivedStatisticsBuilder(load_spec)
+    builders = []
+    for ingest_document_id in INGEST_DOCUMENTS:
+        builders.append(builder.get_builder(ingest_document_id))
+        builders[-1].set_ingest_document(ingest_document_id)
+    groups = builder.get_region_groups(builders)
+    # CEILING and VISIBILITY CTCs with three regions each, SURFACE SUMS with two
+    assert sorted(len(group) for group in groups) == [2, 3, 3]
+    for group in groups:
+        assert len({region_builder.variable for region_builder in group}) == 1
+
+
+def test_ctc_job_after_the_model_job(load_spec, monkeypatch):
+    # the model job writes the fifth and sixth epochs, the obs of the fourth came in late
+    ingest_document_id = "IS:METAR:CTC:CEILING:HRRR_OPS:E_US:ingest:V01"
+    document_map = {}
+
+    def fake_process_run_configurations(
+        cluster, criteria, startime, args, *other_args, after_proc=None
+    ):
+        [criterion] = criteria
+        if criterion["id"] == "P:JS:CTC":
+            # the first_last_params of the CTC runit
+            first_last_params = {
+                "first_epoch": args.start_epoch,
+                "last_epoch": args.end_epoch,
+            }
+            builder = CTCModelObsBuilderV01(
+                load_spec | {"first_last_params": first_last_params},
+                INGEST_DOCUMENTS[ingest_document_id],
+            )
+            document_map.update(builder.build_document(ingest_document_id))
+        if after_proc is not None:
+            after_proc(Path(criterion["id"]))
+        return True
+
+    monkeypatch.setattr(
+        vxingest.main,
+        "get_dependent_job_ids",
+        lambda cluster, bucket, job_id: ["JS:CTC"] if job_id == "JS:MODEL" else [],
+    )
+    monkeypatch.setattr(
+        vxingest.main,
+        "get_runtime_job_criteria",
+        lambda cluster, creds, job_id: {"processSpecIds": [f"P:{job_id}"]},
+    )
+    monkeypatch.setattr(
+        vxingest.main, "process_run_configurations", fake_process_run_configurations
+    )
+    monkeypatch.setattr(
+        vxingest.main,
+        "import_output_dir",
+        lambda collection, output_dir: {
+            "documents": 2 * len(FCST_LENS),
+            "failed": 0,
+            "first_epoch": EPOCHS[4],
+            "last_epoch": EPOCHS[5],
+        },
+    )
+    args = argparse.Namespace(
+        job_id=["JS:MODEL"],
+        threads=2,
+        start_epoch=0,
+        end_epoch=sys.maxsize,
+        concurrent_procs=1,
+    )
+    creds = {"cb_bucket": "vxdata", "cb_scope": "_default", "cb_collection": "METAR"}
+    results = run_job_dag(
+        unittest.mock.Mock(),
+        creds,
+        datetime(2024, 1, 1),
+        args,
+        worker_log_configurer,
+        None,
+        None,
+        None,
+    )
+    assert results["JS:CTC"]["succeeded"]
+    # the CTCs start after the latest one in the database, so the late epoch and the first
+    # epoch of the model job are built too, and they end with the last epoch of the model job
+    assert {doc["fcstValidEpoch"] for doc in document_map.values()} == {
+        EPOCHS[3],
+        EPOCHS[4],
+        EPOCHS[5],
+    }
@@ -101,3 +101,60 @@ def test_handle_normalized_surface_pressure_bad_station_elev(
     norm_pressure_list = builder.handle_normalized_surface_pressure(params_dict=None)
 
     assert norm_pressure_list == [None]
+
+
+def make_builder(data_template):
+    ingest_doc = {
+        "template": {
+            "id": "DD:*version:*subset:*model:*{ISO}fcstValidEpoch:*fcstLen",
+            "subset": "METAR",
+            "version": "V01",
+            "model": "HRRR",
+            "fcstValidEpoch": "&handle_time",
+            "fcstLen": "&handle_fcst_len",
+            "data": {"&handle_station_name": data_template},
+        },
+        "validTimeDelta": "",
+        "validTimeInterval": "",
+    }
+    return GribModelBuilderV01(load_spec="", ingest_document=ingest_doc)
+
+
+def test_get_template_variables_lean_template():
+    """A temperature only template must not select any other grib variable"""
+    builder = make_builder(
+        {
+            "name": "&handle_station_name",
+            "Temperature": "&handle_temp|*2 metre temperature",
+        }
+    )
+    assert list(builder.get_template_variables()) == ["2 metre temperature"]
+    # it is only computed once
+    assert builder.get_template_variables() is builder.get_template_variables()
+
+
+def test_get_template_variables_handler_variables():
+    """Handlers that read variables directly add their handler_variables"""
+    builder = make_builder(
+        {
+            "Ceiling": "&handle_ceiling",
+            "WS": "&handle_wind_speed|*10 metre U wind component,*10 metre V wind component",
+            "Visibility": "&handle_visibility|*Visibility",
+        }
+    )
+    assert set(builder.get_template_variables()) == {
+        "Orography",
+        "Cloud ceiling",
+        "10 metre U wind component",
+        "10 metre V wind component",
+        "Visibility",
+    }
+
+
+def test_get_wind_thetas_unsupported_projection(empty_builder, caplog, capsys):
+    thetas = empty_builder.get_wind_thetas(
+        {"proj": "merc"}, 25.0, 265.0, np.array([-100.0, 260.0])
+    )
+    np.testing.assert_array_equal(thetas, [0.0, 0.0])
+    assert "Projection merc not yet supported" in caplog.text
+    assert capsys.readouterr().out == ""
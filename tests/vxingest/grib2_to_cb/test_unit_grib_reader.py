@@ -0,0 +1,134 @@
+"""Unit tests for the single pass GribReader.
+
+The reader must select the same messages and return the same values and
+attrs as the cfgrib/xarray datasets that build_document used to open,
+using the synthetic GRIB2 file from the ``synthetic_grib2`` fixture.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from vxingest.grib2_to_cb.grib_builder_parent import GribBuilder
+from vxingest.grib2_to_cb.grib_reader import GribReader, GribVariableMap
+
+
+def open_cfgrib_variable(grib_file, filter_keys):
+    """open the variable the way build_document used to - one dataset per level type"""
+    filter_keys = dict(filter_keys)
+    name = filter_keys.pop("name", None)
+    ds = xr.open_dataset(
+        grib_file,
+        engine="cfgrib",
+        backend_kwargs={
+            "filter_by_keys": filter_keys,
+            "read_keys": ["projString"],
+            "indexpath": "",
+        },
+    )
+    if name is not None:
+        ds = ds.filter_by_attrs(long_name=name)
+    if len(ds.data_vars) == 0:
+        return ds, None
+    return ds, ds.variables[list(ds.data_vars.keys())[0]]
+
+
+def test_reader_indexes_every_message(synthetic_grib2: Path, grib_constants):
+    reader = GribReader(synthetic_grib2)
+    assert len(reader.messages) == len(grib_constants.MESSAGES)
+    assert [(header["typeOfLevel"], header["level"]) for header in reader.messages] == [
+        (type_of_level, level) for type_of_level, level, _ in grib_constants.MESSAGES
+    ]
+
+
+@pytest.mark.parametrize("variable", list(GribBuilder.grib_variables))
+def test_reader_matches_cfgrib(synthetic_grib2: Path, variable):
+    filter_keys = GribBuilder.grib_variables[variable]
+    reader = GribReader(synthetic_grib2)
+    grib_variable = reader.get_variable(**filter_keys)
+    ds, cfgrib_variable = open_cfgrib_variable(synthetic_grib2, filter_keys)
+    if cfgrib_variable is None:
+        # some of the synthetic messages have no name that cfgrib knows
+        assert grib_variable is None
+        return
+    assert grib_variable.values.dtype == cfgrib_variable.values.dtype
+    np.testing.assert_array_equal(grib_variable.values, cfgrib_variable.values)
+    for key in [
+        "long_name",
+        "GRIB_projString",
+        "GRIB_Nx",
+        "GRIB_Ny",
+        "GRIB_DxInMetres",
+        "GRIB_latitudeOfFirstGridPointInDegrees",
+        "GRIB_longitudeOfFirstGridPointInDegrees",
+    ]:
+        assert grib_variable.attrs[key] == cfgrib_variable.attrs[key]
+    cfgrib_epoch = (ds.valid_time.values.astype("uint64") / 10**9).astype("uint32")
+    assert grib_variable.fcst_valid_epoch == cfgrib_epoch
+    assert grib_variable.fcst_len == int(ds.step.values / 1e9 / 3600)
+
+
+def test_reader_decodes_once(synthetic_grib2: Path):
+    reader = GribReader(synthetic_grib2)
+    first = reader.get_variable(
+        name="2 metre temperature", typeOfLevel="heightAboveGround", level=2
+    )
+    second = reader.get_variable(
+        name="2 metre temperature", typeOfLevel="heightAboveGround", level=2
+    )
+    assert first is second
+    assert len(reader.decoded) == 1
+
+
+def test_reader_missing_variable(synthetic_grib2: Path):
+    reader = GribReader(synthetic_grib2)
+    assert reader.get_variable(name="Total Precipitation") is None
+    assert reader.get_attrs(typeOfLevel="isobaricInhPa") is None
+
+
+def test_reader_file_not_found(tmp_path: Path):
+    with pytest.raises(FileNotFoundError):
+        GribReader(tmp_path / "missing.grib2")
+
+
+def test_variable_map_is_lazy(synthetic_grib2: Path):
+    reader = GribReader(synthetic_grib2)
+    variables = {
+        name: GribBuilder.grib_variables[name]
+        for name in ["2 metre temperature", "Visibility"]
+    }
+    variable_map = GribVariableMap(reader, variables, {"fcst_len": 6})
+    assert len(reader.decoded) == 0
+    assert "2 metre temperature" in variable_map
+    assert "Cloud ceiling" not in variable_map
+    assert variable_map["fcst_len"] == 6
+    assert len(reader.decoded) == 0
+    temperature = variable_map["2 metre temperature"]
+    assert temperature.attrs["long_name"] == "2 metre temperature"
+    assert variable_map["2 metre temperature"] is temperature
+    assert len(reader.decoded) == 1
+    assert sorted(variable_map) == sorted(["fcst_len", *variables])
+    with pytest.raises(KeyError):
+        variable_map["Cloud ceiling"]
+
+
+def test_reader_decodes_once_with_threads(synthetic_grib2: Path):
+    reader = GribReader(synthetic_grib2)
+    names = ["2 metre temperature", "Visibility", "2 metre temperature", "Orography"]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        variables = list(
+            executor.map(
+                lambda name: reader.get_variable(**GribBuilder.grib_variables[name]),
+                names,
+            )
+        )
+    assert variables[0] is variables[2]
+    assert len(reader.decoded) == 3
+    for name, variable in zip(names, variables, strict=True):
+        expected = GribReader(synthetic_grib2).get_variable(
+            **GribBuilder.grib_variables[name]
+        )
+        np.testing.assert_array_equal(variable.values, expected.values)
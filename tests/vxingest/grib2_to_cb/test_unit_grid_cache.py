@@ -0,0 +1,129 @@
+import fcntl
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from vxingest.grib2_to_cb.grib_builder_parent import GribBuilder
+from vxingest.grib2_to_cb.grib_reader import GribReader
+from vxingest.grib2_to_cb.grid_cache import GridCache
+
+
+class Decoder:
+    """counts the decodes, each one is slow so that the other callers have to wait for it"""
+
+    def __init__(self, values):
+        self.values = values
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        time.sleep(0.2)
+        return self.values.copy()
+
+
+@pytest.fixture
+def grib_file(tmp_path):
+    path = tmp_path / "file.grib2"
+    path.write_bytes(b"GRIB")
+    return path
+
+
+def test_grid_is_decoded_once(tmp_path, grib_file):
+    decoder = Decoder(np.arange(12, dtype=np.float32).reshape(3, 4))
+    # a cache for each "process"
+    caches = [GridCache(tmp_path / "cache") for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        grids = list(
+            executor.map(lambda cache: cache.get(grib_file, 100, decoder), caches)
+        )
+    assert decoder.count == 1
+    for grid in grids:
+        np.testing.assert_array_equal(grid, decoder.values)
+        assert grid.dtype == np.float32
+        assert not grid.flags.writeable
+    # another message is another grid
+    caches[0].get(grib_file, 200, decoder)
+    assert decoder.count == 2
+
+
+def test_changed_file_is_decoded_again(tmp_path, grib_file):
+    decoder = Decoder(np.zeros((2, 2)))
+    cache = GridCache(tmp_path / "cache")
+    cache.get(grib_file, 0, decoder)
+    grib_file.write_bytes(b"GRIB2")
+    cache.get(grib_file, 0, decoder)
+    assert decoder.count == 2
+
+
+def test_disabled_cache(grib_file):
+    decoder = Decoder(np.zeros((2, 2)))
+    cache = GridCache(None)
+    cache.get(grib_file, 0, decoder)
+    cache.get(grib_file, 0, decoder)
+    assert decoder.count == 2
+
+
+def test_prune(tmp_path, grib_file):
+    cache_dir = tmp_path / "cache"
+    GridCache(cache_dir).get(grib_file, 0, Decoder(np.zeros((2, 2))))
+    GridCache(cache_dir).get(grib_file, 1, Decoder(np.zeros((2, 2))))
+    old = time.time() - 3600
+    for path in cache_dir.glob(f"grid_{GridCache.make_key(grib_file, 0)}.*"):
+        os.utime(path, (old, old))
+    GridCache(cache_dir, max_age=60)
+    assert sorted(path.suffix for path in cache_dir.iterdir()) == [".lock", ".npy"]
+
+
+def test_prune_skips_the_grids_in_use(tmp_path, grib_file):
+    cache_dir = tmp_path / "cache"
+    cache = GridCache(cache_dir)
+    cache.get(grib_file, 0, Decoder(np.zeros((2, 2))))
+    cache.get(grib_file, 1, Decoder(np.zeros((2, 2))))
+    held = cache.get_path(GridCache.make_key(grib_file, 0))
+    # the .tmp files of a running and of a dead process
+    running_tmp = cache_dir / f"grid_running.{os.getpid()}.tmp"
+    dead_tmp = cache_dir / "grid_dead.999999999.tmp"
+    # a lock file without a grid
+    orphan_lock = cache_dir / "grid_orphan.lock"
+    for path in [running_tmp, dead_tmp, orphan_lock]:
+        path.write_bytes(b"")
+    old = time.time() - 3600
+    for path in cache_dir.iterdir():
+        os.utime(path, (old, old))
+    # another process is decoding the grid
+    with held.with_suffix(".lock").open("a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        GridCache(cache_dir, max_age=60)
+    assert sorted(path.name for path in cache_dir.iterdir()) == sorted(
+        [held.name, held.with_suffix(".lock").name, running_tmp.name]
+    )
+
+
+def test_load_touches_only_old_grids(tmp_path, grib_file):
+    cache = GridCache(tmp_path / "cache", max_age=1000)
+    cache.get(grib_file, 0, Decoder(np.zeros((2, 2))))
+    path = cache.get_path(GridCache.make_key(grib_file, 0))
+    recent = time.time() - 10
+    os.utime(path, (recent, recent))
+    cache.load(path)
+    assert path.stat().st_mtime == pytest.approx(recent)
+    old = time.time() - 500
+    os.utime(path, (old, old))
+    cache.load(path)
+    assert path.stat().st_mtime > recent
+
+
+def test_reader_with_grid_cache(tmp_path, synthetic_grib2: Path):
+    filter_keys = GribBuilder.grib_variables["2 metre temperature"]
+    expected = GribReader(synthetic_grib2).get_variable(**filter_keys)
+    for _ in range(2):
+        variable = GribReader(
+            synthetic_grib2, GridCache(tmp_path / "cache")
+        ).get_variable(**filter_keys)
+        np.testing.assert_array_equal(variable.values, expected.values)
+        assert variable.attrs == expected.attrs
+    assert len(list((tmp_path / "cache").glob("*.npy"))) == 1
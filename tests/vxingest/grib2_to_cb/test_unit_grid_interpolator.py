@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+from vxingest.grib2_to_cb.grib_builder import GribModelBuilderV01
+from vxingest.grib2_to_cb.grid_interpolator import GridInterpolator
+
+
+@pytest.fixture
+def empty_builder():
+    ingest_doc = {
+        "template": {
+            "subset": "",
+        },
+        "validTimeDelta": "",
+        "validTimeInterval": "",
+    }
+    return GribModelBuilderV01(load_spec="", ingest_document=ingest_doc)
+
+
+@pytest.fixture
+def stations():
+    """A set of stations with fractional, integral and half gridpoints"""
+    rng = np.random.default_rng(42)
+    points = [(0.5, 0.5), (2.0, 3.0), (1.5, 2.5), (3.0, 0.0)]
+    points += [tuple(rng.uniform(0, 3, 2)) for _ in range(50)]
+    return [
+        {
+            "name": f"STA{i}",
+            "geo": [
+                {
+                    "x_gridpoint": float(_x),
+                    "y_gridpoint": float(_y),
+                    "lon": -100.0,
+                    "elev": 100,
+                    "firstTime": 0,
+                    "lastTime": 999999999,
+                }
+            ],
+        }
+        for i, (_x, _y) in enumerate(points)
+    ]
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int64])
+def test_bilinear_matches_interp_grid_box(empty_builder, stations, dtype):
+    """The vectorized interpolation must be bit for bit the same as the scalar interp_grid_box"""
+    values = (np.random.default_rng(0).uniform(200, 300, (4, 4))).astype(dtype)
+    interpolator = GridInterpolator.from_stations(stations, 1234)
+    bilinear = interpolator.bilinear(values)
+    for i, station in enumerate(stations):
+        geo = station["geo"][0]
+        expected = empty_builder.interp_grid_box(
+            values, geo["y_gridpoint"], geo["x_gridpoint"]
+        )
+        assert bilinear[i] == expected
+        assert str(bilinear[i]) == str(expected)
+
+
+def test_nearest_matches_round(stations):
+    """Nearest values use the same (round half to even) rounding as the builtin round"""
+    values = np.arange(16, dtype=np.float32).reshape(4, 4)
+    nearest = GridInterpolator.from_stations(stations, 1234).nearest(values)
+    for i, station in enumerate(stations):
+        geo = station["geo"][0]
+        assert (
+            nearest[i] == values[round(geo["y_gridpoint"]), round(geo["x_gridpoint"])]
+        )
+
+
+def test_translate_template_item(empty_builder, stations):
+    """translate_template_item returns a (value, interpolated value) tuple per station"""
+
+    class VarObj:
+        def __init__(self, values):
+            self.values = values
+
+    values = np.random.default_rng(1).uniform(200, 300, (4, 4)).astype(np.float32)
+    empty_builder.domain_stations = stations
+    empty_builder.ds_translate_item_variables_map = {
+        "2 metre temperature": VarObj(values),
+        "fcst_valid_epoch": 1234,
+    }
+    result = empty_builder.translate_template_item("*2 metre temperature")
+    assert len(result) == len(stations)
+    for (station_value, interpolated_value), station in zip(
+        result, stations, strict=True
+    ):
+        geo = station["geo"][0]
+        assert station_value == str(
+            values[round(geo["y_gridpoint"]), round(geo["x_gridpoint"])]
+        )
+        assert interpolated_value == str(
+            empty_builder.interp_grid_box(
+                values, geo["y_gridpoint"], geo["x_gridpoint"]
+            )
+        )
+
+
+def test_prefetch_station_values(stations):
+    """The station values that are extracted by the threads are the ones translate_template_item uses"""
+
+    class VarObj:
+        def __init__(self, values):
+            self.values = values
+
+    ingest_doc = {
+        "template": {
+            "subset": "METAR",
+            "data": {
+                "&handle_station_name": {
+                    "Temperature": "&handle_temp|*2 metre temperature",
+                    "Visibility": "&handle_visibility|*Visibility",
+                    "Ceiling": "&handle_ceiling",
+                }
+            },
+        },
+        "validTimeDelta": "",
+        "validTimeInterval": "",
+    }
+    rng = np.random.default_rng(2)
+    variables = {
+        name: VarObj(rng.uniform(0, 300, (4, 4)).astype(np.float32))
+        for name in ["2 metre temperature", "Visibility", "Orography", "Cloud ceiling"]
+    }
+    builders = []
+    for variable_threads in [0, 4]:
+        builder = GribModelBuilderV01(load_spec="", ingest_document=ingest_doc)
+        builder.domain_stations = stations
+        builder.ds_translate_item_variables_map = {
+            **variables,
+            "fcst_valid_epoch": 1234,
+        }
+        if variable_threads:
+            builder.prefetch_station_values(variable_threads)
+            # only the variables that are template replacements have station values
+            assert sorted(builder.station_values) == [
+                "2 metre temperature",
+                "Visibility",
+            ]
+        builders.append(builder)
+    for name in ["*2 metre temperature", "*Visibility"]:
+        assert builders[0].translate_template_item(name) == builders[
+            1
+        ].translate_template_item(name)
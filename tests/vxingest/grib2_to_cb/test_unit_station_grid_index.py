@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from vxingest.builder_common.builder_utilities import get_geo_index
+from vxingest.grib2_to_cb.grib_builder import GribModelBuilderV01
+from vxingest.grib2_to_cb.station_grid_index import (
+    StationGridIndex,
+    StationGridIndexCache,
+)
+
+
+@pytest.fixture
+def stations():
+    """stations with one to three geos and overlapping, missing, and expired intervals"""
+    rng = np.random.default_rng(7)
+    stations = []
+    for i in range(200):
+        geos = []
+        for _g in range(rng.integers(1, 4)):
+            first_time = int(rng.integers(0, 2000))
+            geos.append(
+                {
+                    "lat": float(rng.uniform(20, 50)),
+                    "lon": float(rng.uniform(-130, -60)),
+                    "elev": float(rng.uniform(0, 3000)),
+                    "firstTime": first_time,
+                    "lastTime": first_time + int(rng.integers(-100, 1000)),
+                    "x_gridpoint": float(rng.uniform(0, 10)),
+                    "y_gridpoint": float(rng.uniform(0, 10)),
+                }
+            )
+        stations.append({"name": f"STA{i}", "geo": geos})
+    return stations
+
+
+def test_geo_indexes_match_get_geo_index(stations):
+    """The vectorized geo selection must match get_geo_index for every station"""
+    index = StationGridIndex.from_stations(stations)
+    for epoch in [-5, 0, 500, 1500, 2500, 5000]:
+        geo_indexes = index.get_geo_indexes(epoch)
+        for i, station in enumerate(stations):
+            geo = station["geo"][get_geo_index(epoch, station["geo"])]
+            assert index.x_gridpoint[geo_indexes[i]] == geo["x_gridpoint"]
+            assert index.y_gridpoint[geo_indexes[i]] == geo["y_gridpoint"]
+
+
+def test_save_and_load(stations, tmp_path):
+    """An index round trips through an npz file"""
+    index = StationGridIndex.from_stations(stations)
+    index.save(tmp_path / "index.npz")
+    loaded = StationGridIndex.load(tmp_path / "index.npz")
+    assert loaded.domain_stations == stations
+    np.testing.assert_array_equal(
+        loaded.get_interpolator(1000).x_nearest,
+        index.get_interpolator(1000).x_nearest,
+    )
+
+
+def test_concurrent_saves(stations, tmp_path):
+    """Writers that save the same index at the same time do not share a temporary file"""
+    index = StationGridIndex.from_stations(stations)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _i: index.save(tmp_path / "index.npz"), range(16)))
+    assert [path.name for path in tmp_path.iterdir()] == ["index.npz"]
+    assert StationGridIndex.load(tmp_path / "index.npz").domain_stations == stations
+
+
+def test_cache_persists_to_cache_dir(stations, tmp_path):
+    """A second cache with the same cache_dir finds the index without rebuilding it"""
+    key = StationGridIndexCache.make_key(proj_string="+proj=lcc", max_x=10, max_y=10)
+    assert key != StationGridIndexCache.make_key(
+        proj_string="+proj=lcc", max_x=10, max_y=11
+    )
+    cache = StationGridIndexCache(tmp_path)
+    assert cache.get(key) is None
+    cache.put(key, StationGridIndex.from_stations(stations))
+    assert StationGridIndexCache(tmp_path).get(key).domain_stations == stations
+    assert StationGridIndexCache(None).get(key) is None
+
+
+def test_build_station_grid_index():
+    """Stations with a bad lat/lon or with a geo outside of the grid are not domain stations"""
+
+    class StubCluster:
+        def __init__(self, rows):
+            self.rows = rows
+            self.statements = []
+
+        def query(self, statement):
+            self.statements.append(statement)
+            return iter(self.rows)
+
+    class StubTransformer:
+        """lat/lon are already meters"""
+
+        def transform(self, lons, lats, radians=False):
+            return lons, lats
+
+    rows = [
+        {"name": "IN", "geo": [{"lat": 3000, "lon": 6000, "elev": 10}]},
+        {"name": "BAD", "geo": [{"lat": 0, "lon": 6000, "elev": 10}]},
+        {
+            "name": "PARTLY_OUT",
+            "geo": [
+                {"lat": 3000, "lon": 6000, "elev": 10},
+                {"lat": 3000, "lon": 9500, "elev": 10},
+            ],
+        },
+        {"name": "ALSO_IN", "geo": [{"lat": 6000, "lon": 7500, "elev": 10}]},
+    ]
+    builder = GribModelBuilderV01(
+        load_spec={
+            "cb_connection": {"bucket": "b", "scope": "s", "collection": "c"},
+            "cluster": StubCluster(rows),
+        },
+        ingest_document={
+            "template": {"subset": "METAR"},
+            "validTimeDelta": "",
+            "validTimeInterval": "",
+        },
+    )
+    index = builder.build_station_grid_index(
+        StubTransformer(), spacing=3000, max_x=4, max_y=4
+    )
+    assert [station["name"] for station in index.domain_stations] == ["IN", "ALSO_IN"]
+    assert index.domain_stations[1]["geo"][0]["x_gridpoint"] == 2.5
+    assert index.domain_stations[1]["geo"][0]["y_gridpoint"] == 2.0
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+import numpy.ma as ma
+import pytest
+
+FILL = np.float32(3.4028235e38)
+
+
+def write_chars(variable, strings):
+    chars = np.zeros((len(strings), variable.shape[1]), "S1")
+    for index, string in enumerate(strings):
+        for position, char in enumerate(string.encode()):
+            chars[index][position] = bytes([char])
+    variable[:] = chars
+
+
+@pytest.fixture
+def madis_file(tmp_path: Path) -> Path:
+    """a small madis-like file with masked values"""
+    file_name = tmp_path / "20211108_0000"
+    with nc.Dataset(file_name, "w") as ds:
+        ds.createDimension("recNum", None)
+        ds.createDimension("maxStaNamLen", 5)
+        ds.createDimension("maxLocationLen", 12)
+        ds.createDimension("maxSkyCover", 3)
+        ds.createDimension("maxSkyLen", 4)
+        write_chars(
+            ds.createVariable("stationName", "S1", ("recNum", "maxStaNamLen")),
+            ["KDEN", "KBOU", "KDEN", "KAPA"],
+        )
+        write_chars(
+            ds.createVariable("locationName", "S1", ("recNum", "maxLocationLen")),
+            ["Denver", "Boulder", "Denver", "Centennial"],
+        )
+        for name, values in [
+            ("latitude", [39.85, 40.01, 39.85, 39.57]),
+            ("longitude", [-104.65, -105.25, -104.65, -104.85]),
+            ("elevation", [1656.0, 1612.0, 1656.0, 1793.0]),
+            ("temperature", [280.1, 275.3, 281.4, 279.9]),
+        ]:
+            variable = ds.createVariable(name, "f4", ("recNum",), fill_value=FILL)
+            variable[:] = ma.array(values, mask=[False, True, False, False])
+        sky_layer_base = ds.createVariable(
+            "skyLayerBase", "f4", ("recNum", "maxSkyCover"), fill_value=FILL
+        )
+        sky_layer_base[:] = ma.array(
+            [[300, 900, 1500], [600, 0, 0], [0, 0, 0], [1200, 2400, 3600]],
+            mask=[
+                [False, False, False],
+                [False, True, True],
+                [True, True, True],
+                [False, False, True],
+            ],
+        )
+        sky_cover = ds.createVariable(
+            "skyCover", "S1", ("recNum", "maxSkyCover", "maxSkyLen")
+        )
+        chars = np.zeros((4, 3, 4), "S1")
+        for index, covers in enumerate(
+            [["FEW", "BKN", "OVC"], ["SCT"], [], ["FEW", "OVC"]]
+        ):
+            for layer, cover in enumerate(covers):
+                for position, char in enumerate(cover.encode()):
+                    chars[index][layer][position] = bytes([char])
+        sky_cover[:] = chars
+    return file_name
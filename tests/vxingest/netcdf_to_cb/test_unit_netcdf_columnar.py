@@ -0,0 +1,83 @@
+"""Unit tests for the columnar read mode of the netcdf builders.
+
+The columnar mode must give the same record values (including the masks) and
+the same translated template items as reading the netcdf variables one record
+at a time.
+"""
+
+import netCDF4 as nc
+import numpy.ma as ma
+
+from vxingest.netcdf_to_cb.netcdf_metar_obs_builder import NetcdfMetarObsBuilderV01
+
+
+def make_builder(file_name, columnar):
+    ingest_document = {
+        "template": {"subset": "METAR", "id": "DD:V01:METAR:obs"},
+        "validTimeDelta": 1800,
+        "validTimeInterval": 3600,
+    }
+    builder = NetcdfMetarObsBuilderV01({"fmask": "%Y%m%d_%H%M"}, ingest_document)
+    builder.columnar = columnar
+    builder.ncdf_data_set = nc.Dataset(file_name)
+    return builder
+
+
+def test_columnar_records_match(madis_file):
+    per_record = make_builder(madis_file, columnar=False)
+    columnar = make_builder(madis_file, columnar=True)
+    for index in range(4):
+        for variable in ["latitude", "temperature", "skyLayerBase"]:
+            expected = per_record.get_record(variable, index)
+            value = columnar.get_record(variable, index)
+            assert repr(value) == repr(expected)
+            assert repr(ma.getmask(value)) == repr(ma.getmask(expected))
+            assert columnar.translate_template_item(
+                "*" + variable, index
+            ) == per_record.translate_template_item("*" + variable, index)
+        for variable in ["stationName", "locationName", "skyCover"]:
+            assert repr(columnar.get_record_string(variable, index)) == repr(
+                per_record.get_record_string(variable, index)
+            )
+            assert columnar.translate_template_item(
+                "*" + variable, index
+            ) == per_record.translate_template_item("*" + variable, index)
+        assert columnar.fill_from_netcdf(index, {}) == per_record.fill_from_netcdf(
+            index, {}
+        )
+        for builder in [per_record, columnar]:
+            builder.ceiling = builder.ceiling_transform(
+                {
+                    "base_var_index": index,
+                    "skyCover": builder.translate_template_item("*skyCover", index),
+                    "skyLayerBase": builder.translate_template_item(
+                        "*skyLayerBase", index
+                    ),
+                }
+            )
+        assert columnar.ceiling == per_record.ceiling
+
+
+def test_columns_are_read_once(madis_file):
+    builder = make_builder(madis_file, columnar=True)
+    for index in range(4):
+        builder.get_record("temperature", index)
+        builder.get_record_string("stationName", index)
+    assert list(builder.ncdf_columns) == ["temperature"]
+    assert list(builder.ncdf_string_columns) == ["stationName"]
+    assert builder.get_record("temperature", 1) is ma.masked
+    assert str(builder.get_record_string("stationName", 3)) == "KAPA"
+    # a new data set discards the columns
+    builder.ncdf_data_set = nc.Dataset(madis_file)
+    builder.get_record("latitude", 0)
+    assert list(builder.ncdf_columns) == ["latitude"]
+    assert builder.ncdf_string_columns == {}
+
+
+def test_ceiling_column(madis_file):
+    builder = make_builder(madis_file, columnar=True)
+    # record 0 has no masked layers, record 1 is clear, record 2 has no sky cover,
+    # and the first unmasked ceiling layer of record 3 is OVC at 2400 m
+    assert builder.get_ceiling_column() == [None, 60000, None, 7874]
+    assert builder.get_ceiling_column() is builder.ncdf_derived_columns["Ceiling"]
+    assert builder.ceiling_transform({"base_var_index": 3}) == 7874
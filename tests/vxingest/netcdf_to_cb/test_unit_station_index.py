@@ -0,0 +1,112 @@
+"""Unit tests for the station name and geo indexes used by handle_station"""
+
+import netCDF4 as nc
+import numpy as np
+
+from vxingest.builder_common.builder_utilities import truncate_round
+from vxingest.netcdf_to_cb.netcdf_metar_obs_builder import NetcdfMetarObsBuilderV01
+
+FCST_VALID_EPOCH = 1636329600  # 20211108_0000
+
+
+def rounded(value):
+    """the value the way handle_station rounds the float32 netcdf value"""
+    return truncate_round(float(np.float32(value)), 5)
+
+
+def make_station(name, lat, lon, elev):
+    return {
+        "id": "MD:V01:METAR:station:" + name,
+        "name": name,
+        "geo": [
+            {
+                "firstTime": FCST_VALID_EPOCH + 3600,
+                "lastTime": FCST_VALID_EPOCH + 3600,
+                "lat": lat,
+                "lon": lon,
+                "elev": elev,
+            }
+        ],
+    }
+
+
+def make_builder(file_name):
+    ingest_document = {
+        "template": {"subset": "METAR", "id": "DD:V01:METAR:obs"},
+        "validTimeDelta": 1800,
+        "validTimeInterval": 3600,
+    }
+    builder = NetcdfMetarObsBuilderV01({"fmask": "%Y%m%d_%H%M"}, ingest_document)
+    builder.ncdf_data_set = nc.Dataset(file_name)
+    builder.file_name = file_name.name
+    builder.initialize_document_map()
+    return builder
+
+
+def test_get_station_index():
+    builder = NetcdfMetarObsBuilderV01(
+        {},
+        {"template": {"subset": "METAR"}, "validTimeDelta": 0, "validTimeInterval": 0},
+    )
+    builder.stations = [
+        make_station("KDEN", 1.0, 2.0, 3.0),
+        make_station("KBOU", 1.0, 2.0, 3.0),
+        make_station("KDEN", 4.0, 5.0, 6.0),
+    ]
+    # the first station with the name, like a scan of the list
+    assert builder.get_station_index("KDEN") == 0
+    assert builder.get_station_index("KAPA") is None
+    builder.stations.append(make_station("KAPA", 1.0, 2.0, 3.0))
+    assert builder.get_station_index("KAPA") == 3
+    # replacing the station list rebuilds the index
+    builder.stations = [make_station("KAPA", 1.0, 2.0, 3.0)]
+    assert builder.get_station_index("KAPA") == 0
+    assert builder.get_station_index("KDEN") is None
+
+
+def test_get_geo_index():
+    builder = NetcdfMetarObsBuilderV01(
+        {},
+        {"template": {"subset": "METAR"}, "validTimeDelta": 0, "validTimeInterval": 0},
+    )
+    builder.stations = [make_station("KDEN", 1.0, 2.0, 3.0)]
+    station_index = builder.get_station_index("KDEN")
+    assert builder.get_geo_index(station_index, 1.0, 2.0, 3.0) == 0
+    assert builder.get_geo_index(station_index, 1.0, 2.0, 4.0) is None
+    builder.stations[0]["geo"].append(
+        {"firstTime": 0, "lastTime": 0, "lat": 1.0, "lon": 2.0, "elev": 4.0}
+    )
+    assert builder.get_geo_index(station_index, 1.0, 2.0, 4.0) == 1
+
+
+def test_handle_station(madis_file):
+    builder = make_builder(madis_file)
+    kden = make_station("KDEN", rounded(39.85), rounded(-104.65), rounded(1656.0))
+    kbou = make_station("KBOU", 40.0, -105.0, 1600.0)
+    builder.stations = [kbou, kden]
+    # an existing station at an existing location updates the time range of that geo
+    assert (
+        builder.handle_station({"base_var_index": 0, "stationName": "KDEN"}) == "KDEN"
+    )
+    assert kden["geo"][0]["firstTime"] == FCST_VALID_EPOCH
+    assert builder.document_map[kden["id"]] is kden
+    # a new station is created and indexed
+    assert (
+        builder.handle_station({"base_var_index": 3, "stationName": "KAPA"}) == "KAPA"
+    )
+    kapa = builder.document_map["MD:V01:METAR:station:KAPA"]
+    assert builder.stations[-1] is kapa
+    assert builder.get_station_index("KAPA") == 2
+    assert (
+        builder.handle_station({"base_var_index": 3, "stationName": "KAPA"}) == "KAPA"
+    )
+    assert len(builder.stations) == 3
+    assert len(kapa["geo"]) == 1
+    # a station that has moved gets a new geo, which is then found
+    builder.handle_station({"base_var_index": 0, "stationName": "KBOU"})
+    assert len(kbou["geo"]) == 2
+    assert kbou["geo"][1]["elev"] == rounded(1656.0)
+    builder.handle_station({"base_var_index": 2, "stationName": "KBOU"})
+    assert len(kbou["geo"]) == 2
+    # the netcdf latitude of record 1 is masked
+    assert builder.handle_station({"base_var_index": 1, "stationName": "KBOU"}) == ""
@@ -0,0 +1,150 @@
+import copy
+import random
+
+import pytest
+from metpy.calc import relative_humidity_from_dewpoint, wind_components
+from metpy.units import units
+
+from vxingest.partial_sums_to_cb.partial_sums_builder import (
+    PartialSumsSurfaceModelObsBuilderV01,
+)
+from vxingest.partial_sums_to_cb.station_sums import SUM_KEYS, StationSums
+
+TEMPLATE_DATA = {
+    "Temperature": '&handle_sum|{"Temperature": "Temperature"}',
+    "DewPoint": '&handle_sum|{"DewPoint": "DewPoint"}',
+    "RH": '&handle_sum|{"RH": "RH"}',
+    "UW": '&handle_sum|{"UW": "UW"}',
+    "VW": '&handle_sum|{"VW": "VW"}',
+    "WS": '&handle_sum|{"WS": "WS"}',
+    "Surface Pressure": '&handle_sum|{"model": "Surface Pressure", "obs": "Surface Pressure"}',
+}
+
+
+def derive_by_station(elem):
+    """the RH and wind components the way handle_sum derived them for each station"""
+    if (
+        "RH" not in elem
+        and elem["DewPoint"] is not None
+        and elem["Temperature"] is not None
+    ):
+        elem["RH"] = (
+            relative_humidity_from_dewpoint(
+                elem["Temperature"] * units.degF, elem["DewPoint"] * units.degF
+            ).magnitude
+        ) * 100
+    if (
+        ("UW" not in elem or "VW" not in elem)
+        and elem["WS"] is not None
+        and elem["WD"] is not None
+    ):
+        wind_components_t = wind_components(
+            elem["WS"] * units.mph, (elem["WD"] - 180) * units.deg
+        )
+        elem["UW"] = wind_components_t[0].magnitude
+        elem["VW"] = wind_components_t[1].magnitude
+
+
+def sums_by_station(domain_stations, obs_data, model_data, model_var, obs_var):
+    """the partial sums the way handle_sum calculated them, station by station
+    (on copies, handle_sum added the derived variables to the elements)"""
+    obs_data = copy.deepcopy(obs_data)
+    model_data = copy.deepcopy(model_data)
+    obs_vals = []
+    model_vals = []
+    for name in domain_stations:
+        if name in obs_data and name in model_data:
+            derive_by_station(obs_data[name])
+            derive_by_station(model_data[name])
+            obs_value = obs_data[name].get(obs_var)
+            model_value = model_data[name].get(model_var)
+            if obs_value is not None and model_value is not None:
+                obs_vals.append(obs_value)
+                model_vals.append(model_value)
+    if not obs_vals:
+        return dict.fromkeys(SUM_KEYS)
+    diffs = [model - obs for model, obs in zip(model_vals, obs_vals, strict=True)]
+    return {
+        "num_recs": len(obs_vals),
+        "sum_obs": sum(obs_vals),
+        "sum_model": sum(model_vals),
+        "sum_diff": sum(diffs),
+        "sum2_diff": sum(diff * diff for diff in diffs),
+        "sum_abs": sum(abs(diff) for diff in diffs),
+    }
+
+
+def random_element(rng):
+    def value(low, high):
+        return None if rng.random() < 0.1 else rng.uniform(low, high)
+
+    temperature = value(-20, 100)
+    elem = {
+        "Temperature": temperature,
+        "DewPoint": None if temperature is None else temperature - rng.uniform(0, 30),
+        "WS": value(0, 40),
+        "WD": value(0, 360),
+        "Surface Pressure": value(900, 1050),
+    }
+    if rng.random() < 0.05:
+        elem["RH"] = rng.uniform(0, 100)
+    if rng.random() < 0.05:
+        elem["UW"] = rng.uniform(-10, 10)
+        elem["VW"] = rng.uniform(-10, 10)
+    return elem
+
+
+@pytest.fixture
+def station_data():
+    rng = random.Random(11)
+    names = [f"K{index:03d}" for index in range(500)]
+    obs_data = {name: random_element(rng) for name in names if rng.random() < 0.9}
+    model_data = {name: random_element(rng) for name in names if rng.random() < 0.9}
+    domain_stations = [name for name in names if rng.random() < 0.8]
+    return domain_stations, obs_data, model_data
+
+
+def assert_same_sums(sums, expected):
+    assert list(sums) == SUM_KEYS
+    assert sums["num_recs"] == expected["num_recs"]
+    for key in SUM_KEYS[1:]:
+        assert sums[key] == pytest.approx(expected[key], rel=1e-12), key
+
+
+def test_station_sums_match_station_loop(station_data):
+    domain_stations, obs_data, model_data = station_data
+    station_sums = StationSums(domain_stations, obs_data, model_data)
+    for variable in ["Temperature", "RH", "UW", "VW", "WS", "Surface Pressure"]:
+        expected = sums_by_station(
+            domain_stations, obs_data, model_data, variable, variable
+        )
+        assert_same_sums(station_sums.get_sums(variable, variable), expected)
+    expected = sums_by_station(
+        domain_stations, obs_data, model_data, "Temperature", "DewPoint"
+    )
+    assert_same_sums(station_sums.get_sums("Temperature", "DewPoint"), expected)
+
+
+def test_station_sums_without_pairs():
+    station_sums = StationSums(["KAAA"], {"KAAA": {"Temperature": None}}, {})
+    assert station_sums.get_sums("Temperature", "Temperature") == dict.fromkeys(
+        SUM_KEYS
+    )
+
+
+def test_handle_data(station_data):
+    domain_stations, obs_data, model_data = station_data
+    builder = PartialSumsSurfaceModelObsBuilderV01({}, {"template": ""})
+    builder.template = {"data": TEMPLATE_DATA}
+    builder.domain_stations = domain_stations
+    builder.obs_data = obs_data
+    builder.model_data = {"data": model_data}
+    doc = builder.handle_data(doc={})
+    assert list(doc["data"]) == list(TEMPLATE_DATA)
+    for variable in TEMPLATE_DATA:
+        expected = sums_by_station(
+            domain_stations, obs_data, model_data, variable, variable
+        )
+        assert_same_sums(doc["data"][variable], expected)
+    # the aligned stations are not kept after the document
+    assert builder.aligned_stations is None
@@ -0,0 +1,151 @@
+import threading
+import time
+import unittest.mock
+
+import pytest
+from couchbase.exceptions import DocumentExistsException
+
+from vxingest import job_dag
+from vxingest.builder_common.document_file_writer import DocumentFileWriter
+from vxingest.job_dag import (
+    JobDAG,
+    get_dependent_job_ids,
+    get_epoch_range,
+    import_output_dir,
+)
+
+
+def make_dag():
+    dag = JobDAG()
+    dag.add_job("MODEL")
+    dag.add_job("OBS")
+    dag.add_job("CTC", ["MODEL", "OBS"])
+    dag.add_job("SUMS", ["MODEL", "OBS"])
+    dag.add_job("DERIVED", ["SUMS"])
+    return dag
+
+
+def test_get_order():
+    dag = make_dag()
+    order = dag.get_order()
+    assert order.index("CTC") > order.index("MODEL")
+    assert order.index("CTC") > order.index("OBS")
+    assert order.index("DERIVED") > order.index("SUMS")
+    assert dag.get_dependents("MODEL") == ["CTC", "SUMS"]
+    dag.add_job("MODEL", ["DERIVED"])
+    with pytest.raises(ValueError, match="cycle"):
+        dag.get_order()
+
+
+def test_run_passes_upstream_results_and_runs_concurrently():
+    dag = make_dag()
+    lock = threading.Lock()
+    running = []
+    max_running = 0
+    upstream = {}
+
+    def run_job(job_id, upstream_results):
+        nonlocal max_running
+        with lock:
+            running.append(job_id)
+            max_running = max(max_running, len(running))
+        upstream[job_id] = sorted(upstream_results)
+        time.sleep(0.1)
+        with lock:
+            running.remove(job_id)
+        return {"succeeded": True, "first_epoch": 10, "last_epoch": 20}
+
+    results = dag.run(run_job, max_workers=2)
+    assert all(result["succeeded"] for result in results.values())
+    assert max_running == 2
+    assert upstream["CTC"] == ["MODEL", "OBS"]
+    assert upstream["DERIVED"] == ["SUMS"]
+    assert get_epoch_range(results) == (10, 20)
+    assert get_epoch_range({"OBS": {"succeeded": True}}) is None
+
+
+def test_run_skips_the_dependents_of_a_failed_job():
+    dag = make_dag()
+    started = []
+
+    def run_job(job_id, upstream_results):
+        started.append(job_id)
+        if job_id == "SUMS":
+            raise RuntimeError("SUMS failed")
+        return {"succeeded": True}
+
+    results = dag.run(run_job)
+    assert results["SUMS"] == {"succeeded": False}
+    assert results["DERIVED"] == {"succeeded": False, "skipped": True}
+    assert "DERIVED" not in started
+    assert results["CTC"]["succeeded"]
+
+
+def test_add_dependent_jobs():
+    cluster = unittest.mock.Mock()
+    cluster.query.side_effect = lambda query, options: (
+        ["JS:DERIVED:job"]
+        if "JS:METAR:SUMS:HRRR_OPS:schedule:job:V01" in str(options)
+        else []
+    )
+    dag = JobDAG()
+    dag.add_job("JS:METAR:MODEL:HRRR_OPS:schedule:job:V01")
+    dag.add_dependent_jobs(
+        lambda job_id: get_dependent_job_ids(cluster, "vxdata", job_id)
+    )
+    # a MODEL job without dependent job documents gets the CTC and SUMS jobs of its model
+    assert dag.dependencies == {
+        "JS:METAR:MODEL:HRRR_OPS:schedule:job:V01": set(),
+        "JS:METAR:CTC:HRRR_OPS:schedule:job:V01": {
+            "JS:METAR:MODEL:HRRR_OPS:schedule:job:V01"
+        },
+        "JS:METAR:SUMS:HRRR_OPS:schedule:job:V01": {
+            "JS:METAR:MODEL:HRRR_OPS:schedule:job:V01"
+        },
+        "JS:DERIVED:job": {"JS:METAR:SUMS:HRRR_OPS:schedule:job:V01"},
+    }
+
+
+def test_import_output_dir(fake_collection, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_dag, "IMPORT_BATCH_DOCUMENTS", 1)
+    documents = [
+        {"id": f"DD:V01:METAR:HRRR_OPS:{epoch}", "fcstValidEpoch": epoch}
+        for epoch in [3600, 7200, 1800]
+    ]
+    with DocumentFileWriter(tmp_path / "a", "list", "gzip") as writer:
+        writer.write(documents[0])
+    with DocumentFileWriter(tmp_path / "b", "lines") as writer:
+        for document in documents[1:]:
+            writer.write(document)
+    (tmp_path / "a.log").write_text("not a document")
+    collection = fake_collection()
+    stats = import_output_dir(collection, tmp_path)
+    assert stats == {
+        "documents": 3,
+        "failed": 0,
+        "first_epoch": 1800,
+        "last_epoch": 7200,
+    }
+    assert sorted(collection.documents) == sorted(doc["id"] for doc in documents)
+    # the documents were upserted as they were read
+    assert len(collection.batches) == 3
+    # the imported files are not imported again (i.e. from the transfer archive)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "a.json.gz.imported",
+        "a.log",
+        "b.json.imported",
+    ]
+    assert import_output_dir(fake_collection(), tmp_path)["documents"] == 0
+
+
+def test_import_output_dir_keeps_a_failed_file(fake_collection, tmp_path):
+    with DocumentFileWriter(tmp_path / "a", "list") as writer:
+        writer.write({"id": "DD:1"})
+        writer.write({"id": "DD:2"})
+    stats = import_output_dir(
+        fake_collection(failures={"DD:2": [DocumentExistsException("exists")]}),
+        tmp_path,
+    )
+    assert stats["failed"] == 1
+    # it is imported again from the transfer archive
+    assert (tmp_path / "a.json").exists()
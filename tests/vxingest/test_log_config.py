@@ -1,8 +1,15 @@
 import logging
+import threading
 
 import pytest
 
-from vxingest.log_config import LOG_LEVEL_ENV_VAR, get_loglevel, parse_loglevel
+from vxingest.log_config import (
+    LOG_LEVEL_ENV_VAR,
+    ProcLogFilter,
+    ProcNameFilter,
+    get_loglevel,
+    parse_loglevel,
+)
 
 
 def test_get_loglevel_defaults_to_info(monkeypatch):
@@ -38,3 +45,30 @@ def test_get_loglevel_uses_log_level_env_var(monkeypatch, loglevel, expected):
 def test_parse_loglevel_rejects_unknown_loglevel():
     with pytest.raises(ValueError, match=LOG_LEVEL_ENV_VAR):
         parse_loglevel("VERBOSE")
+
+
+def make_record(**attributes):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", None, None)
+    record.__dict__.update(attributes)
+    return record
+
+
+def test_proc_log_filter():
+    log_filter = ProcLogFilter("proc_a")
+    # the records of the thread that runs the proc
+    assert log_filter.filter(make_record())
+    # the records of the proc's worker processes
+    assert log_filter.filter(make_record(proc_name="proc_a", process=1, thread=1))
+    # the records of other procs
+    assert not log_filter.filter(make_record(proc_name="proc_b"))
+    records = []
+    thread = threading.Thread(target=lambda: records.append(make_record()))
+    thread.start()
+    thread.join()
+    assert not log_filter.filter(records[0])
+
+
+def test_proc_name_filter():
+    record = make_record()
+    assert ProcNameFilter("proc_a").filter(record)
+    assert record.proc_name == "proc_a"
@@ -1,16 +1,31 @@
+import argparse
+import logging
+import logging.handlers
+import queue
+import sys
 import tarfile
-import unittest
+import threading
+import time
+import unittest.mock
+from datetime import datetime
 from pathlib import Path
 
 import pytest
 import yaml
 from couchbase.cluster import Cluster
 
+import vxingest.main
+from vxingest.log_config import worker_log_configurer
 from vxingest.main import (
+    Archiver,
     create_dirs,
     determine_num_processes,
     get_credentials,
     make_tarfile,
+    process_run_configurations,
+    prom_archive_duration,
+    prom_archive_size,
+    run_job_dag,
 )
 
 
@@ -102,3 +117,230 @@ def test_make_tarfile(tmp_path: Path):
         assert f"{tmp_path.name}/file0.txt" in names
         assert f"{tmp_path.name}/file1.txt" in names
         assert f"{tmp_path.name}/file2.txt" in names
+
+
+def test_archiver(tmp_path: Path):
+    transfer_dir = tmp_path / "transfer"
+    transfer_dir.mkdir()
+    archiver = Archiver(2)
+    for job in range(3):
+        # each job's output is moved to its own directory before it is archived
+        source_dir = tmp_path / f".20240101000000-job{job}"
+        source_dir.mkdir()
+        (source_dir / f"job{job}.json").write_text("[]")
+        archiver.submit(
+            transfer_dir / f"job{job}.tar.gz",
+            source_dir,
+            "20240101000000",
+            f"job{job}",
+            compresslevel=0 if job else 9,
+        )
+    archiver.wait()
+    for job in range(3):
+        assert not (tmp_path / f".20240101000000-job{job}").exists()
+        with tarfile.open(transfer_dir / f"job{job}.tar.gz", "r:gz") as tar:
+            assert tar.getnames() == ["20240101000000", f"20240101000000/job{job}.json"]
+        assert prom_archive_size.labels(job=f"job{job}")._value.get() == (
+            (transfer_dir / f"job{job}.tar.gz").stat().st_size
+        )
+        assert prom_archive_duration.labels(job=f"job{job}")._value.get() > 0
+
+
+def test_archiver_logs_failures(tmp_path: Path, caplog):
+    archiver = Archiver()
+    archiver.submit(tmp_path / "out.tar.gz", tmp_path / "missing", "missing", "job")
+    archiver.wait()
+    assert "Error creating an archive" in caplog.text
+
+
+class FakeIngest:
+    """a runit that records the procs that run at the same time"""
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+    started = []
+
+    def runit(self, config, log_queue, log_configurer):
+        with FakeIngest.lock:
+            FakeIngest.running += 1
+            FakeIngest.max_running = max(FakeIngest.max_running, FakeIngest.running)
+            FakeIngest.started.append((config["input_data_path"], config["threads"]))
+        logging.getLogger(__name__).info("ingesting %s", config["input_data_path"])
+        time.sleep(0.2)
+        (Path(config["output_dir"]) / "documents.json").write_text("[]")
+        with FakeIngest.lock:
+            FakeIngest.running -= 1
+
+
+@pytest.fixture
+def run_procs(tmp_path, monkeypatch, caplog, fake_collection):
+    caplog.set_level(logging.INFO)
+    monkeypatch.setattr(vxingest.main, "GRIBIngest", FakeIngest)
+    monkeypatch.setattr(FakeIngest, "max_running", 0)
+    monkeypatch.setattr(FakeIngest, "started", [])
+    documents = {}
+    criteria = []
+    for proc, run_priority in [("A", 3), ("B", 1), ("C", None), ("D", 2)]:
+        documents[f"P:{proc}"] = {
+            "id": f"P:{proc}",
+            "subType": "GRIB2",
+            "ingestDocumentIds": [],
+            "dataSourceId": f"DS:{proc}",
+        }
+        documents[f"DS:{proc}"] = {"sourceDataUri": proc, "subset": "METAR"}
+        criteria.append({"id": f"P:{proc}", "run_priority": run_priority})
+    cluster = unittest.mock.Mock()
+    cluster.bucket.return_value.scope.return_value.collection.return_value = (
+        fake_collection(documents)
+    )
+    dirs = {name: tmp_path / name for name in ["logs", "output", "transfer", "metrics"]}
+    create_dirs(list(dirs.values()))
+
+    def run(concurrent_procs):
+        args = argparse.Namespace(
+            credentials_file="config.yaml",
+            log_dir=dirs["logs"],
+            output_dir=dirs["output"],
+            transfer_dir=dirs["transfer"],
+            metrics_dir=dirs["metrics"],
+            threads=4,
+            start_epoch=0,
+            end_epoch=sys.maxsize,
+            concurrent_procs=concurrent_procs,
+        )
+        process_run_configurations(
+            cluster,
+            criteria,
+            datetime(2024, 1, 1),
+            args,
+            worker_log_configurer,
+            None,
+            logging.handlers.QueueListener(queue.Queue()),
+        )
+        return dirs["transfer"]
+
+    return run
+
+
+def test_process_run_configurations_in_order(run_procs):
+    run_procs(1)
+    assert FakeIngest.max_running == 1
+    # one at a time the procs keep their order
+    assert FakeIngest.started == [("A", 4), ("B", 4), ("C", 4), ("D", 4)]
+
+
+def test_process_run_configurations_concurrent(run_procs):
+    transfer_dir = run_procs(2)
+    assert FakeIngest.max_running == 2
+    # the procs are started by run_priority
+    started = [proc for proc, _threads in FakeIngest.started]
+    assert set(started[:2]) == {"B", "D"}
+    assert set(started[2:]) == {"A", "C"}
+    # the threads are shared by the procs that run at the same time
+    assert [threads for _proc, threads in FakeIngest.started] == [2, 2, 2, 2]
+    for proc in "ABCD":
+        [tar_path] = transfer_dir.glob(f"P_{proc}_*.tar.gz")
+        with tarfile.open(tar_path, "r:gz") as tar:
+            names = tar.getnames()
+            assert "20240101000000/documents.json" in names
+            [log_name] = [name for name in names if name.endswith(".log")]
+            log = tar.extractfile(log_name).read().decode()
+        # each log only has the records of its own proc
+        assert f"ingesting {proc}" in log
+        for other in set("ABCD") - {proc}:
+            assert f"ingesting {other}" not in log
+
+
+def test_process_run_configurations_runit_raises(run_procs, monkeypatch, caplog):
+    runit = FakeIngest.runit
+
+    def raising_runit(self, config, log_queue, log_configurer):
+        if config["input_data_path"] == "B":
+            raise RuntimeError("B is broken")
+        runit(self, config, log_queue, log_configurer)
+
+    monkeypatch.setattr(FakeIngest, "runit", raising_runit)
+    handlers = list(logging.getLogger().handlers)
+    transfer_dir = run_procs(1)
+    # the other procs still run
+    assert [proc for proc, _threads in FakeIngest.started] == ["A", "C", "D"]
+    assert "Error processing proc: P:B" in caplog.text
+    assert "exit_code:1" in caplog.text
+    # the log handler of the failed proc is removed
+    assert logging.getLogger().handlers == handlers
+    # and its log is archived
+    [tar_path] = transfer_dir.glob("P_B_*.tar.gz")
+    with tarfile.open(tar_path, "r:gz") as tar:
+        [log_name] = [name for name in tar.getnames() if name.endswith(".log")]
+        assert "B is broken" in tar.extractfile(log_name).read().decode()
+
+
+def test_run_job_dag(monkeypatch):
+    dependents = {"JS:MODEL": ["JS:CTC", "JS:SUMS"], "JS:SUMS": ["JS:MISSING"]}
+    runs = {}
+
+    def fake_process_run_configurations(
+        cluster, criteria, startime, args, *other_args, after_proc=None
+    ):
+        [criterion] = criteria
+        runs[criterion["id"]] = (args.start_epoch, args.end_epoch, args.threads)
+        if after_proc is not None:
+            after_proc(Path(criterion["id"]))
+        return True
+
+    monkeypatch.setattr(
+        vxingest.main,
+        "get_dependent_job_ids",
+        lambda cluster, bucket, job_id: dependents.get(job_id, []),
+    )
+    monkeypatch.setattr(
+        vxingest.main,
+        "get_runtime_job_criteria",
+        lambda cluster, creds, job_id: (
+            None if job_id == "JS:MISSING" else {"processSpecIds": [f"P:{job_id}"]}
+        ),
+    )
+    monkeypatch.setattr(
+        vxingest.main, "process_run_configurations", fake_process_run_configurations
+    )
+    monkeypatch.setattr(
+        vxingest.main,
+        "import_output_dir",
+        lambda collection, output_dir: {
+            "documents": 2,
+            "failed": 0,
+            "first_epoch": 3600,
+            "last_epoch": 7200,
+        },
+    )
+    args = argparse.Namespace(
+        job_id=["JS:MODEL"],
+        threads=4,
+        start_epoch=0,
+        end_epoch=sys.maxsize,
+        concurrent_procs=2,
+    )
+    creds = {"cb_bucket": "vxdata", "cb_scope": "_default", "cb_collection": "METAR"}
+    results = run_job_dag(
+        unittest.mock.Mock(),
+        creds,
+        datetime(2024, 1, 1),
+        args,
+        worker_log_configurer,
+        None,
+        None,
+        None,
+    )
+    assert results["JS:MODEL"] == {
+        "succeeded": True,
+        "first_epoch": 3600,
+        "last_epoch": 7200,
+    }
+    assert results["JS:MISSING"] == {"succeeded": False}
+    # the MODEL job has the whole range, its dependent jobs end after the epochs that it wrote
+    assert runs == {
+        "P:JS:MODEL": (0, sys.maxsize, 2),
+        "P:JS:CTC": (0, 7201, 2),
+        "P:JS:SUMS": (0, 7201, 2),
+    }